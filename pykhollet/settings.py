@@ -172,3 +172,17 @@ PYKOL_UAI_DEFAUT = None
 # Emplacement de stockage privé, afin de stocker des données qui ne sont
 # pas accessibles depuis un client web.
 PYKOL_PRIVATE_MEDIA_ROOT = 'filestore/'
+
+# Nombre de processus utilisés pour produire les lots d'attestations
+# ECTS. La valeur None utilise autant de processus que de processeurs,
+# la valeur 0 produit les attestations dans le fil d'exécution de la
+# tâche de fond, sans créer de processus. Un seul lot à la fois utilise
+# ces processus, les autres lots attendent leur tour.
+PYKOL_ATTESTATIONS_PROCESSUS = None
+
+# Délai, en secondes, au-delà duquel une tâche de fond (import SIECLE/STS
+# ou lot d'attestations ECTS) qui n'a plus donné signe de vie est
+# considérée comme interrompue, par exemple par le redémarrage du
+# processus qui l'exécutait. Elle est alors marquée en erreur et peut
+# être relancée.
+PYKOL_TACHES_DELAI_ABANDON = 10 * 60
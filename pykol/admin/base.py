@@ -17,6 +17,9 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from django import forms
+from django.conf import settings
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
 from django.utils.translation import gettext, gettext_lazy as _
 from django.utils.text import capfirst
 from django.contrib import admin
@@ -26,7 +29,9 @@ from django.contrib.auth.admin import UserAdmin
 from pykol.models.base import User, Professeur, Etudiant, JetonAcces, \
 		Academie, Annee, Vacances, Etablissement, Matiere, Classe, \
 		Enseignement, Service, Groupe, OptionEtudiant, \
-		ModuleElementaireFormation, ImportBeeLog, MEFMatiere
+		ModuleElementaireFormation, ImportBeeLog, MEFMatiere, \
+		ImportBee, ImportBeeEtape
+from pykol.lib.vacances import CalendrierOfficiel, enregistrer_vacances
 
 class PykolAdminSite(admin.AdminSite):
 	site_header = 'Administration de pyKol'
@@ -143,9 +148,57 @@ admin_site.register(Etablissement)
 
 class VacancesInline(admin.TabularInline):
 	model = Vacances
+class CalendrierScolaireForm(forms.Form):
+	fichier = forms.FileField(label="Calendrier scolaire",
+		help_text="Export CSV ou JSON du jeu de données "
+			"fr-en-calendrier-scolaire de data.education.gouv.fr")
+	academie = forms.ModelChoiceField(queryset=Academie.objects.all(),
+		label="Académie")
+
+	def clean_fichier(self):
+		try:
+			return CalendrierOfficiel.lire(self.cleaned_data['fichier'])
+		except ValueError as e:
+			raise forms.ValidationError(str(e))
+
 @register(Annee)
 class AnneeAdmin(admin.ModelAdmin):
 	inlines = [VacancesInline,]
+	actions = ['charger_vacances']
+
+	def charger_vacances(self, request, queryset):
+		"""
+		Charge les vacances des années sélectionnées depuis un export du
+		calendrier scolaire officiel, après avoir demandé le fichier sur
+		une page intermédiaire.
+		"""
+		if 'appliquer' in request.POST:
+			form = CalendrierScolaireForm(request.POST, request.FILES)
+			if form.is_valid():
+				creees, modifiees, supprimees = enregistrer_vacances(
+					form.cleaned_data['fichier'],
+					form.cleaned_data['academie'], queryset)
+				self.message_user(request, "Vacances chargées : "
+					"{} créée(s), {} modifiée(s), {} supprimée(s).".format(
+						creees, modifiees, supprimees))
+				return None
+		else:
+			academie = Etablissement.objects.filter(
+				pk=settings.PYKOL_UAI_DEFAUT).values_list('academie',
+					flat=True).first()
+			form = CalendrierScolaireForm(initial={'academie': academie})
+
+		return TemplateResponse(request,
+			'admin/pykol/annee/charger_vacances.html', context={
+				**self.admin_site.each_context(request),
+				'title': "Charger les vacances scolaires",
+				'opts': self.model._meta,
+				'annees': queryset,
+				'form': form,
+				'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+			})
+	charger_vacances.short_description = "Charger les vacances depuis " \
+			"un fichier du calendrier scolaire"
 
 admin_site.register(Academie)
 
@@ -204,3 +257,13 @@ class OptionEtudiantAdmin(admin.ModelAdmin):
 	list_filter = ('classe', 'matiere')
 
 admin_site.register(ImportBeeLog)
+
+class ImportBeeEtapeInline(admin.TabularInline):
+	model = ImportBeeEtape
+	extra = 0
+
+@register(ImportBee)
+class ImportBeeAdmin(admin.ModelAdmin):
+	inlines = [ImportBeeEtapeInline,]
+	list_display = ('date_creation', 'etat', 'etape', 'utilisateur')
+	list_filter = ('etat',)
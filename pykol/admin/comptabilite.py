@@ -18,14 +18,14 @@
 
 from datetime import timedelta
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from mptt.admin import DraggableMPTTAdmin, TreeRelatedFieldListFilter
 
 from pykol.admin.base import register, admin_site
 
 from pykol.models.base import Annee
 from pykol.models.comptabilite import Compte, Mouvement, \
-		MouvementLigne, Lettrage
+		MouvementLigne, Lettrage, MouvementNonEquilibre, CompteDecouvert
 
 @register(Compte)
 class CompteAdmin(DraggableMPTTAdmin):
@@ -38,20 +38,92 @@ class CompteAdmin(DraggableMPTTAdmin):
 		return "{:.2f}h".format(duree.total_seconds() / 3600)
 	admin_solde.short_description = "Solde d'heures"
 
+def _mouvement_modifiable(mouvement):
+	"""
+	Les soldes des comptes sont mis à jour lors de la validation d'un
+	mouvement : un mouvement validé et ses lignes ne peuvent donc plus
+	être modifiés ni supprimés. Pour annuler un mouvement validé, il
+	faut passer par un virement retour.
+	"""
+	return mouvement is None or mouvement.etat != Mouvement.ETAT_VALIDE
+
 class MouvementLigneInline(admin.TabularInline):
 	model = MouvementLigne
 	extra = 0
 
+	def has_add_permission(self, request, obj=None):
+		return _mouvement_modifiable(obj) and \
+			super().has_add_permission(request, obj)
+
+	def has_change_permission(self, request, obj=None):
+		return _mouvement_modifiable(obj) and \
+			super().has_change_permission(request, obj)
+
+	def has_delete_permission(self, request, obj=None):
+		return _mouvement_modifiable(obj) and \
+			super().has_delete_permission(request, obj)
+
+class LettrageLigneInline(admin.TabularInline):
+	model = MouvementLigne
+	extra = 0
+	can_delete = False
+	readonly_fields = ('compte', 'mouvement', 'taux', 'duree',
+			'duree_interrogation')
+
+	def has_add_permission(self, request, obj=None):
+		return False
+
 @register(Mouvement)
 class MouvementAdmin(admin.ModelAdmin):
 	autocomplete_fields = ('colle',)
 	inlines = (MouvementLigneInline,)
+	readonly_fields = ('etat',)
+	actions = ['valider_mouvements']
+
+	def has_change_permission(self, request, obj=None):
+		return _mouvement_modifiable(obj) and \
+			super().has_change_permission(request, obj)
+
+	def has_delete_permission(self, request, obj=None):
+		return _mouvement_modifiable(obj) and \
+			super().has_delete_permission(request, obj)
+
+	def valider_mouvements(self, request, queryset):
+		try:
+			Mouvement.objects.valider_lot(queryset)
+		except MouvementNonEquilibre as e:
+			self.message_user(request, "Le mouvement {} n'est pas "
+				"équilibré.".format(e.mouvement), messages.ERROR)
+		except CompteDecouvert as e:
+			self.message_user(request, "Le mouvement {} dépasse le "
+				"découvert autorisé du compte {}.".format(
+					e.ligne.mouvement, e.ligne.compte), messages.ERROR)
+		else:
+			self.message_user(request, "Mouvements validés.")
+	valider_mouvements.short_description = "Valider les mouvements " \
+		"sélectionnés"
 
 @register(MouvementLigne)
 class MouvementLigneAdmin(admin.ModelAdmin):
 	list_display = ('pk', 'compte', 'duree', 'duree_interrogation')
 	list_filter = (('compte', TreeRelatedFieldListFilter),)
 
+	def has_change_permission(self, request, obj=None):
+		return (obj is None or _mouvement_modifiable(obj.mouvement)) and \
+			super().has_change_permission(request, obj)
+
+	def has_delete_permission(self, request, obj=None):
+		return (obj is None or _mouvement_modifiable(obj.mouvement)) and \
+			super().has_delete_permission(request, obj)
+
+	def formfield_for_foreignkey(self, db_field, request, **kwargs):
+		# On ne peut ajouter des lignes qu'aux mouvements en brouillon.
+		if db_field.name == 'mouvement':
+			kwargs['queryset'] = Mouvement.objects.filter(
+				etat=Mouvement.ETAT_BROUILLON)
+		return super().formfield_for_foreignkey(db_field, request,
+			**kwargs)
+
 @register(Lettrage)
 class LettrageAdmin(admin.ModelAdmin):
-	inlines= (MouvementLigneInline,)
+	inlines= (LettrageLigneInline,)
@@ -20,3 +20,6 @@ from django.apps import AppConfig
 
 class PykolConfig(AppConfig):
     name = 'pykol'
+
+    def ready(self):
+        from pykol import signals
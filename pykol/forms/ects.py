@@ -17,12 +17,62 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from django import forms
+from django.core.exceptions import ValidationError
 from django.forms import inlineformset_factory, RadioSelect, \
-		modelformset_factory, HiddenInput
+		modelformset_factory, HiddenInput, BaseInlineFormSet
 
 from pykol.models.ects import Jury, Mention
 
+class MentionChoiceField(forms.ModelChoiceField):
+	"""
+	Champ de clé primaire des formulaires de mentions, qui retrouve la
+	mention parmi celles déjà chargées au lieu d'interroger la base de
+	données pour chaque formulaire.
+	"""
+	def __init__(self, mentions, *args, **kwargs):
+		self.mentions = mentions
+		super().__init__(*args, **kwargs)
+
+	def to_python(self, value):
+		if value in self.empty_values:
+			return None
+		try:
+			return self.mentions[int(value)]
+		except (KeyError, ValueError, TypeError):
+			raise ValidationError(self.error_messages['invalid_choice'],
+					code='invalid_choice')
+
+class BaseMentionFormSet(BaseInlineFormSet):
+	"""
+	Formulaires de saisie des mentions d'un jury.
+
+	Lorsque le paramètre mentions est fourni, les formulaires sont liés
+	à cette liste de mentions déjà chargée (par exemple avec
+	select_related), sans relire les mentions depuis la base de
+	données.
+	"""
+	def __init__(self, *args, mentions=None, **kwargs):
+		self.mentions = mentions
+		if mentions is not None:
+			self.mentions_pk = {mention.pk: mention for mention in mentions}
+		super().__init__(*args, **kwargs)
+
+	def get_queryset(self):
+		if self.mentions is None:
+			return super().get_queryset()
+		return self.mentions
+
+	def add_fields(self, form, index):
+		super().add_fields(form, index)
+		if self.mentions is not None:
+			nom_pk = self.model._meta.pk.name
+			champ = form.fields[nom_pk]
+			form.fields[nom_pk] = MentionChoiceField(self.mentions_pk,
+					champ.queryset, initial=champ.initial,
+					required=False, widget=champ.widget)
+
 MentionFormSet = inlineformset_factory(Jury, Mention,
+		formset=BaseMentionFormSet,
 		fields=('mention',), can_delete=False, extra=0,
 		widgets={
 			'mention': RadioSelect(),
@@ -19,6 +19,7 @@
 from django import forms
 
 from pykol.models.base import Annee
+from pykol.lib.bee import verifier_xml
 
 class ZipXmlFileInput(forms.ClearableFileInput):
 	def __init__(self, *args, **kwargs):
@@ -30,3 +31,49 @@ class ImportBEEForm(forms.Form):
 	structure = forms.FileField(required=False, widget=ZipXmlFileInput())
 	eleves = forms.FileField(required=False, widget=ZipXmlFileInput())
 	stsemp = forms.FileField(required=False, widget=ZipXmlFileInput())
+	forcer = forms.BooleanField(required=False,
+			label="Importer aussi les fichiers inchangés",
+			help_text="Par défaut, les étapes dont les fichiers sont "
+			"identiques à ceux du dernier import sont ignorées.")
+
+	# Balises racines acceptées pour chacun des fichiers
+	balises_racines = {
+		'nomenclature': ('BEE_NOMENCLATURES',),
+		'structure': ('BEE_STRUCTURES',),
+		'eleves': ('BEE_ELEVES',),
+		'stsemp': ('STS_EDT', 'EDT_STS'),
+	}
+
+	def _clean_fichier(self, champ):
+		"""
+		Vérifie que le fichier envoyé est lisible et qu'il s'agit bien
+		de l'export attendu, pour ne pas lancer un import qui échouerait
+		dès la lecture des fichiers.
+		"""
+		fichier = self.cleaned_data[champ]
+		if not fichier:
+			return fichier
+
+		try:
+			balise = verifier_xml(fichier)
+		except ValueError:
+			raise forms.ValidationError("Ce fichier n'est pas un "
+					"fichier XML valide.", code='xml-invalide')
+
+		if balise not in self.balises_racines[champ]:
+			raise forms.ValidationError("Ce fichier ne correspond pas "
+					"à l'export attendu.", code='type-inconnu')
+
+		return fichier
+
+	def clean_nomenclature(self):
+		return self._clean_fichier('nomenclature')
+
+	def clean_structure(self):
+		return self._clean_fichier('structure')
+
+	def clean_eleves(self):
+		return self._clean_fichier('eleves')
+
+	def clean_stsemp(self):
+		return self._clean_fichier('stsemp')
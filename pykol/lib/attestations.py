@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2019 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Production des attestations ECTS à partir des modèles OpenDocument.
+
+Les lots d'attestations de tout un jury sont produits en tâche de fond :
+un fil d'exécution du serveur répartit les étudiants entre plusieurs
+processus, qui produisent chacun le code XML des attestations d'une
+partie des étudiants. Le fil rassemble ensuite ces copies dans un
+unique document, stocké dans l'espace de stockage privé.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+from django.utils.text import slugify
+
+from pykol.models.ects import Jury, Mention, GrilleGroupeLignes, \
+		AttestationsLot, AttestationEtudiant
+from pykol.models.base import Etudiant
+from pykol.lib.odftools import OdtTemplate
+from pykol.lib.taches import battement, marquer_abandonnees
+
+logger = logging.getLogger(__name__)
+
+# Champs utilisateurs des modèles d'attestations remplis par pyKol
+CHAMPS_ATTESTATION = ('pykol.date_naissance_etudiant', 'pykol.ine_etudiant',
+	'pykol.nom_formation', 'pykol.domaines_etude', 'pykol.nom_etudiant',
+	'pykol.nom_etudiant_civilite', 'pykol.date_attestation',
+	'pykol.nom_signataire', 'pykol.nom_lycee', 'pykol.statut_lycee',
+	'pykol.ville_lycee', 'pykol.nom_academie', 'pykol.annee_academique',
+	'pykol.ne_accord', 'pykol.mention_globale', 'pykol.total_ects')
+
+# Modèle utilisé pour chaque type de lot, et présence du tableau des
+# mentions dans ce modèle.
+MODELES_LOTS = {
+	AttestationsLot.TYPE_RESULTATS: ('ects_modele_resultats', True),
+	AttestationsLot.TYPE_PARCOURS:
+		('ects_modele_attestation_de_parcours', False),
+}
+
+def nom_formation(jury):
+	return "{libelle} − {niveau}".format(
+		libelle=jury.classe.mef.libelle_ects,
+		niveau=jury.classe.get_niveau_display())
+
+def champs_jury(jury):
+	"""
+	Renvoie la partie des champs utilisateurs qui ne dépend que du
+	jury, et qui est donc commune à toutes les attestations.
+	"""
+	etablissement = jury.classe.etablissement
+	return {
+		'pykol.nom_formation': nom_formation(jury),
+		'pykol.domaines_etude': jury.classe.mef.domaines_etude,
+		'pykol.date_attestation': jury.date.strftime("%d/%m/%Y"),
+		'pykol.nom_signataire': etablissement.chef_etablissement.name_civilite(),
+		'pykol.nom_lycee': etablissement.appellation,
+		'pykol.statut_lycee': etablissement.get_nature_uai_display(),
+		'pykol.ville_lycee': etablissement.ville,
+		'pykol.nom_academie': etablissement.academie.nom_complet,
+		'pykol.annee_academique': "{annee_debut}/{annee_fin}".format(
+			annee_debut=jury.classe.annee.debut.year,
+			annee_fin=jury.classe.annee.fin.year),
+	}
+
+def champs_etudiant(etudiant):
+	"""
+	Renvoie la partie des champs utilisateurs qui décrit l'état civil
+	de l'étudiant.
+	"""
+	return {
+		'pykol.date_naissance_etudiant': etudiant.birth_date.strftime("%d/%m/%Y"),
+		'pykol.ine_etudiant': etudiant.ine,
+		'pykol.nom_etudiant': str(etudiant),
+		'pykol.nom_etudiant_civilite': etudiant.name_civilite(),
+		'pykol.ne_accord': "né" if etudiant.sexe == etudiant.SEXE_HOMME \
+				else "née",
+	}
+
+def champs_attestation(etudiant, jury, champs_communs=None):
+	"""
+	Renvoie le dictionnaire qui associe aux champs utilisateurs des
+	modèles d'attestations les données de l'étudiant.
+
+	Le paramètre champs_communs permet de fournir le résultat de
+	champs_jury lorsque l'on produit les attestations de plusieurs
+	étudiants.
+	"""
+	if champs_communs is None:
+		champs_communs = champs_jury(jury)
+	remplacement = dict(champs_communs)
+	remplacement.update(champs_etudiant(etudiant))
+
+	mention_globale = jury.mention_set.filter(etudiant=etudiant,
+			globale=True).first()
+	if mention_globale:
+		remplacement['pykol.mention_globale'] = mention_globale.get_mention_display()
+		remplacement['pykol.total_ects'] = mention_globale.credits
+	else:
+		remplacement['pykol.mention_globale'] = "Aucune"
+		remplacement['pykol.total_ects'] = "−"
+
+	return remplacement
+
+def ligne_tableau(*cellules):
+	"""
+	Renvoie le code XML d'une ligne du tableau des enseignements. Chaque
+	cellule est un triplet (texte, style de la case, style du
+	paragraphe), éventuellement complété par le nombre de colonnes
+	fusionnées.
+	"""
+	xml = ['<table:table-row>']
+	for texte, style_case, style_par, *fusion in cellules:
+		colonnes = fusion[0] if fusion else 1
+		xml.append('<table:table-cell table:style-name={}{}>'
+			'<text:p text:style-name={}>{}</text:p>'
+			'</table:table-cell>'.format(quoteattr(style_case),
+				' table:number-columns-spanned="{}"'.format(colonnes)
+					if colonnes > 1 else '',
+				quoteattr(style_par), escape(str(texte))))
+		if colonnes > 1:
+			xml.append('<table:covered-table-cell '
+				'table:number-columns-repeated="{}"/>'.format(colonnes - 1))
+	xml.append('</table:table-row>')
+	return ''.join(xml)
+
+def lignes_mentions(etudiant, jury):
+	"""
+	Renvoie le code XML des lignes du tableau des résultats de
+	l'étudiant, à ajouter au tableau enseignements du modèle.
+	"""
+	# On trie les mentions par ordre inverse de position car, plus bas,
+	# chaque ligne est placée immédiatement après l'intitulé de son
+	# groupe. Par conséquent, les lignes placées en bas doivent être
+	# ajoutées en premier.
+	mentions = Mention.objects.filter(etudiant=etudiant,
+			jury=jury).annotate(position=Min('grille_lignes__position')
+			).order_by('-position')
+	groupes_mentions = GrilleGroupeLignes.objects.filter(
+			lignes__mention__etudiant=etudiant,
+			lignes__mention__jury=jury).order_by('position',
+					'libelle').values_list('libelle', flat=True).distinct()
+
+	# Insertion de la ligne donnant le titre de la formation
+	lignes = [ligne_tableau((nom_formation(jury), 'enseignements.C1',
+		'Filière_20_ECTS', 3))]
+
+	# On prépare les en-têtes des groupes de lignes. À chaque groupe
+	# est associée la liste des lignes qui le suivent.
+	odf_groupes = OrderedDict()
+	for groupe in groupes_mentions:
+		# On évite les doublons éventuels sur les libellés (qui
+		# pourraient intervenir car le queryset groupes_mentions
+		# peut renvoyer le même libellé pour des champs position
+		# distincts).
+		if groupe in odf_groupes:
+			continue
+
+		odf_groupes[groupe] = [ligne_tableau((groupe, 'enseignements.C1',
+			'Groupe_20_ECTS', 3))]
+
+	# Lorsqu'il existe des mentions présentes dans des groupes et
+	# d'autres hors groupes, on prévoit un pour ces dernières un
+	# intitulé générique associé au groupe de clé "None".
+	if odf_groupes and mentions.filter(grille_lignes__groupe__isnull=True,
+			globale=False):
+		odf_groupes[None] = [ligne_tableau(("Autres", 'enseignements.C1',
+			'Groupe_20_ECTS', 3))]
+
+	# Lignes placées à la fin du tableau
+	lignes_fin = []
+
+	# On ajoute les mentions au tableau
+	mention_globale = None
+	for mention in mentions:
+		if mention.globale:
+			mention_globale = mention
+			continue
+		if mention.mention is None or \
+			Mention.mention == Mention.MENTION_INSUFFISANT:
+			continue
+
+		ligne = ligne_tableau(
+			(mention.get_libelle_attestation(), 'enseignements.A1',
+				'Matière_20_ECTS'),
+			(mention.credits if mention.credits > 0 else "−",
+				'enseignements.A1', 'Crédits_20_ECTS'),
+			((mention.get_mention_display() or "").capitalize(),
+				'enseignements.C1', 'Mention_20_ECTS'))
+
+		# Si la ligne possède un groupe, elle est positionnée juste
+		# après la ligne d'intitulé de ce groupe.
+		try:
+			groupe = mention.grille_lignes.first().groupe
+			cle_groupe = groupe.libelle if groupe is not None else None
+			odf_groupes[cle_groupe].insert(1, ligne)
+		except Exception as e:
+			lignes_fin.append(ligne)
+
+	for lignes_groupe in odf_groupes.values():
+		lignes.extend(lignes_groupe)
+	lignes.extend(lignes_fin)
+
+	# Insertion de la mention globale
+	if mention_globale is not None:
+		lignes.append(ligne_tableau(
+			("Mention globale", 'enseignements.A1',
+				'Mention_20_globale_20_ECTS'),
+			(mention_globale.credits, 'enseignements.A1',
+				'Crédits_20_ECTS'),
+			((mention_globale.get_mention_display() or "").capitalize(),
+				'enseignements.C1', 'Mention_20_ECTS')))
+
+	return ''.join(lignes)
+
+def signature_attestation(attestation, jury):
+	"""
+	Ajoute la signature du chef d'établissement et le tampon de
+	l'établissement sur les attestations passées en argument.
+
+	Les images ne sont ajoutées qu'une seule fois dans le fichier, même
+	si plusieurs attestations sont présentes dans le document.
+	"""
+	# Substitution des images (signature du chef et tampon du lycée)
+	remplacement_images = {
+		'signature_proviseur':
+			jury.classe.etablissement.chef_etablissement.signature,
+		'tampon_lycee':
+			jury.classe.etablissement.tampon_etablissement,
+		}
+
+	for cadre, image in remplacement_images.items():
+		if image:
+			attestation.add_picture(cadre, image.path)
+
+def chemin_modele(nom):
+	return os.path.join(settings.BASE_DIR,
+		'pykol/templates/pykol/ects/{}.odt'.format(nom))
+
+def modele_attestation(nom):
+	"""
+	Renvoie le modèle compilé d'attestation de nom donné.
+	"""
+	return OdtTemplate.load(chemin_modele(nom),
+		fields=CHAMPS_ATTESTATION, tables=('enseignements',),
+		frames=('signature_proviseur', 'tampon_lycee'))
+
+def document_lot(jury, type_attestation):
+	"""
+	Renvoie un document vierge, muni des signatures, pour un lot
+	d'attestations du type donné.
+	"""
+	nom_modele, _ = MODELES_LOTS[type_attestation]
+	document = modele_attestation(nom_modele).new_document()
+	signature_attestation(document, jury)
+	return document
+
+def etudiants_jury(jury):
+	return Etudiant.objects.filter(mention__jury=jury).distinct().order_by(
+			'last_name', 'first_name')
+
+def empreintes_attestations(jury, type_attestation, etudiants, document):
+	"""
+	Renvoie un dictionnaire qui associe à la clé primaire de chaque
+	étudiant l'empreinte des données de son attestation.
+
+	L'empreinte tient compte des mentions de l'étudiant (et des lignes
+	de grilles associées), de son état civil, ainsi que des données
+	communes à tout le lot (champs du jury, images et version du
+	modèle). Les mentions sont lues en deux requêtes pour tout le jury.
+	"""
+	nom_modele, _ = MODELES_LOTS[type_attestation]
+	contexte = repr((sorted(champs_jury(jury).items()),
+		sorted(document.frames.items()),
+		os.stat(chemin_modele(nom_modele)).st_mtime_ns))
+
+	mentions = {}
+	for etudiant_id, *mention in Mention.objects.filter(jury=jury).order_by(
+			'etudiant', 'pk').values_list('etudiant_id', 'pk',
+				'enseignement_id', 'mention', 'credits', 'globale'):
+		mentions.setdefault(etudiant_id, []).append(tuple(mention))
+
+	lignes = {}
+	for etudiant_id, *ligne in Mention.grille_lignes.through.objects.filter(
+			mention__jury=jury).order_by('mention__etudiant', 'mention',
+				'grilleligne').values_list('mention__etudiant_id',
+				'mention_id', 'grilleligne__libelle',
+				'grilleligne__position', 'grilleligne__groupe__libelle'):
+		lignes.setdefault(etudiant_id, []).append(tuple(ligne))
+
+	empreintes = {}
+	for etudiant in etudiants:
+		donnees = repr((contexte,
+			sorted(champs_etudiant(etudiant).items()),
+			mentions.get(etudiant.pk, []),
+			lignes.get(etudiant.pk, [])))
+		empreintes[etudiant.pk] = hashlib.sha256(
+			donnees.encode('utf-8')).hexdigest()
+	return empreintes
+
+def produire_attestations(jury_pk, type_attestation, etudiants_pks):
+	"""
+	Produit le code XML des attestations des étudiants donnés. Cette
+	fonction est exécutée dans les processus de travail et renvoie une
+	liste de couples (clé primaire de l'étudiant, code XML).
+	"""
+	jury = Jury.objects.select_related('classe__mef', 'classe__annee',
+		'classe__etablissement__chef_etablissement',
+		'classe__etablissement__academie').get(pk=jury_pk)
+	_, avec_tableau = MODELES_LOTS[type_attestation]
+	document = document_lot(jury, type_attestation)
+	communs = champs_jury(jury)
+
+	copies = []
+	for etudiant in Etudiant.objects.filter(pk__in=etudiants_pks):
+		tables = None
+		if avec_tableau:
+			tables = {'enseignements': lignes_mentions(etudiant, jury)}
+		copies.append((etudiant.pk, document.render_copy(
+			fields=champs_attestation(etudiant, jury, communs),
+			tables=tables)))
+	return copies
+
+def _enregistrer_copies(lot, empreintes, copies):
+	AttestationEtudiant.objects.bulk_create([
+		AttestationEtudiant(lot=lot, etudiant_id=etudiant_pk,
+			empreinte=empreintes[etudiant_pk], contenu=contenu)
+		for etudiant_pk, contenu in copies])
+	AttestationsLot.objects.filter(pk=lot.pk).update(
+		nb_traites=F('nb_traites') + len(copies))
+
+# Un seul lot à la fois utilise des processus de travail dans ce
+# processus : les lots lancés simultanément attendent que le précédent
+# ait libéré les siens, au lieu d'en démarrer chacun autant qu'il y a
+# de processeurs.
+_verrou_processus = threading.Lock()
+
+def nombre_processus():
+	processus = settings.PYKOL_ATTESTATIONS_PROCESSUS
+	if processus is None:
+		processus = os.cpu_count() or 1
+	return processus
+
+def generer_lot(lot_pk):
+	"""
+	Produit le fichier d'un lot d'attestations.
+
+	Les attestations dont l'empreinte n'a pas changé depuis le dernier
+	lot terminé du même type pour ce jury sont reprises telles quelles.
+	Les autres étudiants sont répartis entre les processus de travail.
+	"""
+	lot = AttestationsLot.objects.select_related('jury__classe').get(
+			pk=lot_pk)
+	try:
+		with battement(AttestationsLot, lot_pk):
+			_generer_lot(lot)
+
+	except Exception as e:
+		logger.exception("Erreur lors de la production du lot "
+			"d'attestations %d", lot_pk)
+		AttestationsLot.objects.filter(pk=lot_pk).update(
+			etat=AttestationsLot.ETAT_ERREUR, date_fin=timezone.now(),
+			erreur=str(e))
+
+	return lot
+
+def _generer_lot(lot):
+	jury = lot.jury
+	document = document_lot(jury, lot.type_attestation)
+	etudiants = list(etudiants_jury(jury))
+	empreintes = empreintes_attestations(jury, lot.type_attestation,
+			etudiants, document)
+
+	# Lors de la reprise d'un lot interrompu, les attestations déjà
+	# produites et toujours à jour sont conservées. Les autres sont
+	# supprimées pour être produites à nouveau.
+	produites = set()
+	obsoletes = []
+	for attestation_pk, etudiant_pk, empreinte in lot.attestations.values_list(
+			'pk', 'etudiant_id', 'empreinte'):
+		if empreintes.get(etudiant_pk) == empreinte:
+			produites.add(etudiant_pk)
+		else:
+			obsoletes.append(attestation_pk)
+	if obsoletes:
+		AttestationEtudiant.objects.filter(pk__in=obsoletes).delete()
+
+	lot.etat = AttestationsLot.ETAT_EN_COURS
+	lot.erreur = ''
+	lot.date_fin = None
+	lot.nb_etudiants = len(etudiants)
+	lot.nb_traites = len(produites)
+	lot.save(update_fields=('etat', 'erreur', 'date_fin', 'nb_etudiants',
+		'nb_traites'))
+
+	# Reprise des attestations inchangées du lot précédent
+	precedent = AttestationsLot.objects.filter(jury=jury,
+		type_attestation=lot.type_attestation,
+		etat=AttestationsLot.ETAT_TERMINE).exclude(pk=lot.pk).first()
+	if precedent is not None:
+		reprises = [(a.etudiant_id, a.contenu)
+			for a in precedent.attestations.exclude(
+				etudiant_id__in=produites)
+			if empreintes.get(a.etudiant_id) == a.empreinte]
+		_enregistrer_copies(lot, empreintes, reprises)
+		produites.update(etudiant_pk for etudiant_pk, _ in reprises)
+
+	a_produire = [e.pk for e in etudiants if e.pk not in produites]
+
+	processus = nombre_processus()
+	if a_produire and processus > 0:
+		# On découpe le travail en plus de morceaux qu'il n'y a
+		# de processus, afin de mettre à jour régulièrement
+		# l'avancement du lot.
+		taille = math.ceil(len(a_produire) / (4 * processus))
+		morceaux = [a_produire[i:i+taille]
+			for i in range(0, len(a_produire), taille)]
+
+		# Ce fil s'exécute dans un serveur qui compte d'autres fils,
+		# dont un fork pourrait hériter des verrous. Les processus de
+		# travail sont donc démarrés par spawn, et configurent Django
+		# eux-mêmes.
+		with _verrou_processus, ProcessPoolExecutor(max_workers=processus,
+				mp_context=multiprocessing.get_context('spawn'),
+				initializer=django.setup) as executor:
+			travaux = [executor.submit(produire_attestations,
+				jury.pk, lot.type_attestation, morceau)
+				for morceau in morceaux]
+			for travail in as_completed(travaux):
+				_enregistrer_copies(lot, empreintes, travail.result())
+	elif a_produire:
+		_enregistrer_copies(lot, empreintes, produire_attestations(
+			jury.pk, lot.type_attestation, a_produire))
+
+	# Assemblage du document final, dans l'ordre alphabétique des
+	# étudiants.
+	for attestation in lot.attestations.order_by(
+			'etudiant__last_name', 'etudiant__first_name'):
+		document.add_rendered_copy(attestation.contenu)
+
+	contenu = io.BytesIO()
+	document.save(contenu)
+	nom_modele, _ = MODELES_LOTS[lot.type_attestation]
+	lot.fichier.save("{modele}-{classe}-{jury}.odt".format(
+			modele=nom_modele, classe=slugify(str(jury.classe)),
+			jury=jury.pk),
+		ContentFile(contenu.getvalue()), save=False)
+
+	with transaction.atomic():
+		lot.etat = AttestationsLot.ETAT_TERMINE
+		lot.date_fin = timezone.now()
+		lot.nb_traites = lot.nb_etudiants
+		lot.save()
+
+		# Les lots précédents ne servent plus
+		for ancien in AttestationsLot.objects.filter(jury=jury,
+				type_attestation=lot.type_attestation,
+				date_creation__lt=lot.date_creation).exclude(
+				etat__in=(AttestationsLot.ETAT_ATTENTE,
+					AttestationsLot.ETAT_EN_COURS)):
+			ancien.fichier.delete(save=False)
+			ancien.delete()
+
+def _executer_lot(lot_pk):
+	try:
+		generer_lot(lot_pk)
+	finally:
+		connections.close_all()
+
+def lancer_lot(jury, type_attestation):
+	"""
+	Crée un lot d'attestations pour le jury et lance sa production dans
+	un fil d'exécution séparé, après la validation de la transaction
+	en cours. Si un lot du même type est déjà en cours pour ce jury,
+	c'est ce lot qui est renvoyé, sauf s'il a été abandonné (il est
+	alors marqué en erreur et un nouveau lot est créé).
+	"""
+	marquer_abandonnees(AttestationsLot.objects.filter(jury=jury,
+		type_attestation=type_attestation))
+	lot = AttestationsLot.objects.filter(jury=jury,
+		type_attestation=type_attestation,
+		etat__in=(AttestationsLot.ETAT_ATTENTE,
+			AttestationsLot.ETAT_EN_COURS)).first()
+	if lot is not None:
+		return lot
+
+	lot = AttestationsLot.objects.create(jury=jury,
+			type_attestation=type_attestation)
+	transaction.on_commit(lambda: threading.Thread(target=_executer_lot,
+		args=(lot.pk,), daemon=True).start())
+	return lot
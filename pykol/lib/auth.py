@@ -20,6 +20,7 @@
 
 from collections import namedtuple
 
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import F, Q
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.decorators import user_passes_test
@@ -60,6 +61,79 @@ def perm_colloscope(professeur, classe, matiere=None):
 	return perm_colloscope_qs(professeur, classe, matiere).filter(
 			droit__codename='change_colloscope').exists()
 
+# Génération des permissions sur les objets. Les permissions mémorisées
+# sur un utilisateur ne sont utilisées que si elles ont été calculées
+# durant la génération courante.
+_generation = 0
+
+def invalider_permissions():
+	"""
+	Invalide toutes les permissions sur les objets mémorisées par
+	PykolBackend. Cette fonction est appelée lorsque les données dont
+	dépendent ces permissions sont modifiées.
+	"""
+	global _generation
+	_generation += 1
+
+def _permissions_memorisees(user_obj):
+	"""
+	Renvoie le dictionnaire des permissions sur les objets mémorisées
+	sur l'utilisateur, en le vidant s'il date d'une génération
+	antérieure.
+
+	Comme le cache des permissions globales de ModelBackend, ce
+	dictionnaire est stocké sur l'objet utilisateur, qui est recréé à
+	chaque requête : il ne dure donc que le temps d'une requête.
+	"""
+	memoire = getattr(user_obj, '_pykol_perm_cache', None)
+	if memoire is None or memoire[0] != _generation:
+		memoire = user_obj._pykol_perm_cache = (_generation, {})
+	return memoire[1]
+
+def _cle_permissions(obj):
+	return (obj._meta.label_lower, obj.pk)
+
+def _colleur_id(colle):
+	"""
+	Renvoie la clé primaire du colleur de la colle, ou None si la colle
+	n'a pas de détails actifs.
+	"""
+	try:
+		return colle.details.colleur_id
+	except ObjectDoesNotExist:
+		return None
+
+def _permissions_colle(gestion_colloscope, colleur, professeur_matiere):
+	"""
+	Renvoie l'ensemble des permissions sur une colle, selon que
+	l'utilisateur gère le colloscope de la classe pour la matière de la
+	colle, qu'il est le colleur de la colle ou qu'il enseigne la matière
+	de la colle dans la classe.
+
+	Ces règles sont partagées par PykolBackend et par
+	precalculer_permissions_colles.
+	"""
+	perms = set()
+
+	# Droits de modification du colloscope de la classe
+	if gestion_colloscope:
+		perms.update(('pykol.add_colle', 'pykol.change_colle',
+			'pykol.delete_colle', 'pykol.add_colledetails',
+			'pykol.view_colle'))
+
+	# Le colleur peut apporter des modifications à ses colles et les
+	# noter.
+	if colleur:
+		perms.update(('pykol.change_colle', 'pykol.view_colle',
+			'pykol.add_collenote', 'pykol.add_colledetails'))
+
+	# Le professeur de la classe peut voir et modifier les colles de
+	# ses propres matières.
+	if professeur_matiere:
+		perms.update(('pykol.change_colle', 'pykol.view_colle'))
+
+	return perms
+
 class PykolBackend(ModelBackend):
 	def get_user_permissions(self, user_obj, obj=None):
 		return super().get_user_permissions(user_obj, obj)
@@ -74,6 +148,24 @@ class PykolBackend(ModelBackend):
 		if obj is None:
 			return super().get_all_permissions(user_obj, obj)
 
+		# Les objets pas encore enregistrés n'ont pas de clé et ne
+		# peuvent pas être mémorisés.
+		if obj.pk is None:
+			return self.calculer_permissions(user_obj, obj)
+
+		memoire = _permissions_memorisees(user_obj)
+		cle = _cle_permissions(obj)
+		try:
+			return memoire[cle]
+		except KeyError:
+			perms = memoire[cle] = self.calculer_permissions(user_obj, obj)
+			return perms
+
+	def calculer_permissions(self, user_obj, obj):
+		"""
+		Calcule l'ensemble des permissions de l'utilisateur sur l'objet
+		donné, sans passer par les permissions mémorisées.
+		"""
 		# Permissions relatives au colloscope sur une classe complète
 		if isinstance(obj, Classe):
 			perms_qs = perm_colloscope_qs(professeur=user_obj,
@@ -110,50 +202,24 @@ class PykolBackend(ModelBackend):
 
 			# Le professeur de la classe peut voir et modifier les
 			# périodes de notation des colles dans ses propres matières.
-			try:
-				if user_obj.professeur in obj.classe.profs_de(obj.matiere):
-					perms.update(('pykol.add_periodenotation',
-						'pykol.change_periodenotation',
-						'pykol.delete_periodenotation'))
-			except:
-				pass
+			if hasattr(user_obj, 'professeur') and \
+					obj.classe.profs_de(obj.matiere).filter(
+						pk=user_obj.pk).exists():
+				perms.update(('pykol.add_periodenotation',
+					'pykol.change_periodenotation',
+					'pykol.delete_periodenotation'))
 
 			return perms
 
 		# Permissions pour chaque colle
 		if isinstance(obj, Colle):
-			perms = set()
-			classe = obj.classe
-			matiere_colle = obj.matiere
-
-			# On regarde si l'utilisateur a les droits de modification
-			# du colloscope de la classe
-			if perm_colloscope(professeur=user_obj,
-					matiere=matiere_colle, classe=classe):
-				perms.update(('pykol.add_colle', 'pykol.change_colle',
-					'pykol.delete_colle', 'pykol.add_colledetails',
-					'pykol.view_colle'))
-
-			# Le colleur peut apporter des modifications à ses colles et
-			# les noter.
-			try:
-				if user_obj == obj.colleur.user_ptr:
-					perms.update(('pykol.change_colle',
-						'pykol.view_colle', 'pykol.add_collenote',
-						'pykol.add_colledetails'))
-			except:
-				pass
-
-			# Le professeur de la classe peut voir et modifier les
-			# colles de ses propres matières.
-			try:
-				if user_obj.professeur in obj.classe.profs_de(obj.matiere):
-					perms.update(('pykol.change_colle',
-						'pykol.view_colle'))
-			except:
-				pass
-
-			return perms
+			return _permissions_colle(
+				gestion_colloscope=perm_colloscope(professeur=user_obj,
+					matiere=obj.matiere, classe=obj.classe),
+				colleur=_colleur_id(obj) == user_obj.pk,
+				professeur_matiere=hasattr(user_obj, 'professeur') and
+					obj.classe.profs_de(obj.matiere).filter(
+						pk=user_obj.pk).exists())
 
 		# Permissions sur la notation des colles
 		if isinstance(obj, ColleNote):
@@ -201,6 +267,48 @@ class PykolBackend(ModelBackend):
 
 		return set()
 
+def precalculer_permissions_colles(user_obj, colles):
+	"""
+	Calcule en un nombre fixe de requêtes les permissions de
+	l'utilisateur sur une liste de colles affichées sur une même page,
+	et les mémorise pour les appels suivants à has_perm.
+
+	Les colles doivent avoir été chargées avec with_details, afin de
+	connaître leur colleur et leur matière sans requête supplémentaire.
+	Le résultat est identique à celui de PykolBackend.
+	"""
+	if not user_obj.is_active or user_obj.is_anonymous:
+		return
+
+	colles = [colle for colle in colles if colle.pk is not None]
+	classes = {colle.classe_id for colle in colles}
+	if not classes:
+		return
+
+	# Droits de gestion du colloscope, éventuellement restreints aux
+	# matières enseignées par l'utilisateur.
+	droits_colloscope = set(ColloscopePermission.objects.filter(
+		user=user_obj, classe__in=classes,
+		droit__content_type__app_label='pykol',
+		droit__codename='change_colloscope').values_list('classe_id',
+			'matiere_seulement'))
+	matieres_enseignees = set(Enseignement.objects.filter(
+		classe__in=classes, professeurs=user_obj).values_list('classe_id',
+			'matiere_id'))
+
+	est_professeur = hasattr(user_obj, 'professeur')
+
+	memoire = _permissions_memorisees(user_obj)
+	for colle in colles:
+		matiere = (colle.classe_id, colle.enseignement.matiere_id)
+		memoire[_cle_permissions(colle)] = _permissions_colle(
+			gestion_colloscope=(colle.classe_id, False) in droits_colloscope
+				or ((colle.classe_id, True) in droits_colloscope and
+					matiere in matieres_enseignees),
+			colleur=_colleur_id(colle) == user_obj.pk,
+			professeur_matiere=est_professeur and
+				matiere in matieres_enseignees)
+
 user_est_professeur = user_passes_test(lambda user: hasattr(user, 'professeur'))
 
 def professeur_dans(user, classe):
@@ -208,10 +316,10 @@ def professeur_dans(user, classe):
 	Teste si un utilisateur est un professeur et s'il enseigne dans la
 	classe.
 	"""
-	try:
-		return classe in user.professeur.mes_classes()
-	except:
+	if user.pk is None or classe is None:
 		return False
+	return Classe.objects.filter(pk=classe.pk,
+			appartenances__user=user).exists()
 
 
 # Résumé des permissions accordées à un utilisateur sur une colle donnée
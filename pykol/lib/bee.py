@@ -22,20 +22,30 @@ Ce module fournit des fonctions pour importer les données exportées au
 format XML depuis l'application SIECLE afin de peupler la base de
 données de pyKol avec les listes des étudiants, des classes et des
 options choisies par les étudiants.
+
+Les imports lancés depuis l'interface web sont exécutés en tâche de
+fond par executer_import, étape par étape : un import interrompu
+reprend à l'étape qui a échoué.
 """
 
 from itertools import chain
 import xml.etree.ElementTree as ET
 import datetime
+import hashlib
+import logging
+import os
 import re
+import threading
+import zipfile
 from collections import defaultdict, namedtuple
 
+from django.conf import settings
 from django.utils.text import slugify
 from django.utils import timezone
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
-from django.db import transaction
+from django.db import connections, models, transaction
 
 import isodate
 import pytz
@@ -45,10 +55,16 @@ from pykol.models.base import User, Etudiant, Professeur, \
 		Groupe, Matiere, Enseignement, Service, \
 		ModuleElementaireFormation, MEFMatiere, \
 		GroupeEffectif, \
-		Discipline, OptionEtudiant
+		Discipline, OptionEtudiant, AppartenanceClasse
 from pykol.models.comptabilite import Compte
 from pykol.models.colles import CollesEnseignement
-from pykol.models.base import ImportBeeLog
+from pykol.models.base import ImportBeeLog, ImportBee, ImportBeeEtape, \
+		ETAPES_IMPORT_BEE
+from pykol.lib.cache import invalider, TOUS
+from pykol.lib.auth import invalider_permissions
+from pykol.lib.taches import battement
+
+logger = logging.getLogger(__name__)
 
 class CodeMEF:
 	"""
@@ -164,6 +180,489 @@ def appartenance_mef_cpge(mef_appartenance_et):
 
 	return None
 
+# Enregistrements compacts extraits des fichiers XML. Seules les
+# informations utiles aux étapes de l'import sont conservées.
+ServiceXML = namedtuple('ServiceXML', ('code_matiere', 'enseignants'))
+DivisionXML = namedtuple('DivisionXML', ('code', 'code_mef', 'libelle',
+	'services'))
+GroupeXML = namedtuple('GroupeXML', ('code', 'effectif', 'divisions',
+	'services'))
+MefXML = namedtuple('MefXML', ('code', 'libelle'))
+MatiereXML = namedtuple('MatiereXML', ('code', 'libelle'))
+ProgrammeXML = namedtuple('ProgrammeXML', ('code_mef', 'code_matiere',
+	'code_modalite'))
+OptionObligatoireXML = namedtuple('OptionObligatoireXML', ('code_mef',
+	'code_matiere', 'rang'))
+EleveXML = namedtuple('EleveXML', ('elenoet', 'date_entree',
+	'date_sortie', 'email', 'sexe', 'prenom', 'nom', 'date_naissance',
+	'ine'))
+StructuresEleveXML = namedtuple('StructuresEleveXML', ('elenoet',
+	'divisions'))
+OptionsEleveXML = namedtuple('OptionsEleveXML', ('elenoet', 'options'))
+IndividuXML = namedtuple('IndividuXML', ('id', 'nom', 'prenom', 'sexe',
+	'fonction', 'grade', 'disciplines'))
+DisciplineXML = namedtuple('DisciplineXML', ('code', 'libelle',
+	'nb_heures'))
+ColleXML = namedtuple('ColleXML', ('id', 'mefs', 'matieres', 'duree',
+	'periode', 'nom', 'frequence', 'mode_defaut'))
+
+def _texte(elem, chemin):
+	"""
+	Renvoie le texte de la balise désignée par chemin sous elem, ou
+	None si cette balise est absente.
+	"""
+	fils = elem.find(chemin)
+	if fils is None:
+		return None
+	return fils.text
+
+def _est_code_cpge(code):
+	try:
+		return CodeMEF(code).est_superieur()
+	except (TypeError, ValueError):
+		return False
+
+def _parametres_siecle(elem):
+	return {
+		'annee': _texte(elem, 'ANNEE_SCOLAIRE'),
+		'uaj': _texte(elem, 'UAJ'),
+		'horodatage': _texte(elem, 'HORODATAGE'),
+	}
+
+def _parametres_sts(elem):
+	parametres = {'horodatage': _texte(elem, 'HORODATAGE')}
+
+	annee_et = elem.find('ANNEE_SCOLAIRE')
+	if annee_et is not None:
+		parametres.update({
+			'annee': annee_et.attrib.get('ANNEE'),
+			'annee_debut': _texte(annee_et, 'DATE_DEBUT'),
+			'annee_fin': _texte(annee_et, 'DATE_FIN'),
+		})
+
+	uaj_et = elem.find('UAJ')
+	if uaj_et is not None:
+		parametres.update({
+			'uaj': uaj_et.attrib.get('CODE'),
+			'academie': _texte(uaj_et, 'ACADEMIE/CODE'),
+			'denomination': " ".join(filter(None, (
+				_texte(uaj_et, 'DENOM_PRINC'),
+				_texte(uaj_et, 'DENOM_COMPL')))),
+		})
+
+	return parametres
+
+def _services(elem):
+	"""
+	Extrait les services d'enseignement d'une division ou d'un groupe
+	STS. Seuls les cours généraux sont conservés : pour l'instant, pyKol
+	ne se préoccupe pas des autres modalités de cours.
+	"""
+	return tuple(ServiceXML(
+			code_matiere=service_et.attrib['CODE_MATIERE'],
+			enseignants=tuple(x.attrib['ID'] for x in
+				service_et.findall('ENSEIGNANTS/ENSEIGNANT')))
+		for service_et in elem.findall('SERVICES/SERVICE')
+		if service_et.attrib.get('CODE_MOD_COURS') == 'CG')
+
+def _division(elem):
+	"""
+	Extrait une division de SIECLE Structures, de STS-EMP ou d'EDT-STS.
+
+	Les divisions qui déclarent leurs MEFs sans qu'aucun ne soit celui
+	d'une CPGE sont ignorées. Le champ code_mef vaut None lorsque le
+	fichier ne donne aucun MEF pour la division.
+	"""
+	mefs_et = elem.find('MEFS_APPARTENANCE')
+	if mefs_et is None:
+		code_mef = None
+	else:
+		code_mef = appartenance_mef_cpge(mefs_et)
+		if code_mef is None:
+			return None
+
+	# Le code_structure est l'identifiant unique de la classe dans
+	# la base élèves.
+	if 'CODE_STRUCTURE' in elem.attrib: # Version SIECLE
+		code = elem.attrib['CODE_STRUCTURE']
+	elif 'CODE' in elem.attrib: # Version STS
+		code = elem.attrib['CODE']
+	else:
+		return None # Curieux, pas de code pour la classe ?
+
+	return DivisionXML(code=code, code_mef=code_mef,
+		libelle=_texte(elem, 'LIBELLE_LONG'),
+		services=_services(elem))
+
+def _groupe(elem):
+	"""
+	Extrait un groupe de SIECLE Structures, de STS-EMP ou d'EDT-STS,
+	avec la liste des couples (code de division, effectif) des
+	divisions auxquelles il appartient.
+	"""
+	if 'CODE_STRUCTURE' in elem.attrib: # Version SIECLE Structures.xml
+		code = elem.attrib['CODE_STRUCTURE']
+	elif 'CODE' in elem.attrib: # Version STS-EMP
+		code = elem.attrib['CODE']
+	else:
+		return None
+
+	divisions = []
+	for division_et in elem.findall(
+			'DIVISIONS_APPARTENANCE/DIVISION_APPARTENANCE'):
+		code_div = division_et.attrib.get('CODE', # Version STS
+			division_et.attrib.get('CODE_STRUCTURE',
+				_texte(division_et, 'CODE_STRUCTURE'))) # Version SIECLE
+		try:
+			effectif_div = int(division_et.find('EFFECTIF_PREVU').text)
+		except:
+			effectif_div = None
+		divisions.append((code_div, effectif_div))
+
+	if not divisions:
+		return None
+
+	try:
+		effectif = int(elem.find('EFFECTIF_PREVU').text)
+	except:
+		effectif = None
+
+	return GroupeXML(code=code, effectif=effectif,
+		divisions=tuple(divisions), services=_services(elem))
+
+def _mef(elem):
+	if 'CODE_MEF' in elem.attrib:
+		code = elem.attrib['CODE_MEF']
+	elif 'CODE' in elem.attrib:
+		code = elem.attrib['CODE']
+	else:
+		return None
+
+	if not _est_code_cpge(code):
+		return None
+
+	# La version SIECLE ne possède pas toujours le tag LIBELLE_EDITION
+	# mais comporte plus souvent un LIBELLE_LONG.
+	libelle = _texte(elem, 'LIBELLE_EDITION')
+	if libelle is None:
+		libelle = _texte(elem, 'LIBELLE_LONG')
+
+	return MefXML(code=code, libelle=libelle)
+
+def _matiere(elem):
+	if 'CODE_MATIERE' in elem.attrib:
+		code = elem.attrib['CODE_MATIERE']
+	elif 'CODE' in elem.attrib:
+		code = elem.attrib['CODE']
+	else:
+		return None
+	return MatiereXML(code=code, libelle=_texte(elem, 'LIBELLE_EDITION'))
+
+def _programme(elem):
+	code_mef = _texte(elem, 'CODE_MEF')
+	if not _est_code_cpge(code_mef):
+		return None
+	return ProgrammeXML(code_mef=code_mef,
+		code_matiere=_texte(elem, 'CODE_MATIERE'),
+		code_modalite=_texte(elem, 'CODE_MODALITE_ELECT'))
+
+def _option_obligatoire(elem):
+	code_mef = _texte(elem, 'CODE_MEF')
+	if not _est_code_cpge(code_mef):
+		return None
+	return OptionObligatoireXML(code_mef=code_mef,
+		code_matiere=_texte(elem, 'CODE_MATIERE'),
+		rang=int(_texte(elem, 'RANG_OPTION')))
+
+def _eleve(elem):
+	ine = _texte(elem, 'ID_NATIONAL')
+	if elem.find('ID_NATIONAL') is None:
+		ine = _texte(elem, 'INE_RNIE')
+
+	return EleveXML(elenoet=elem.attrib['ELENOET'],
+		date_entree=_texte(elem, 'DATE_ENTREE'),
+		date_sortie=_texte(elem, 'DATE_SORTIE'),
+		email=_texte(elem, 'MEL'),
+		sexe=_texte(elem, 'CODE_SEXE'),
+		prenom=_texte(elem, 'PRENOM'),
+		nom=_texte(elem, 'NOM_DE_FAMILLE'),
+		date_naissance=_texte(elem, 'DATE_NAISS'),
+		ine=ine)
+
+def _structures_eleve(elem):
+	# Dans la balise, on trouve une liste de <STRUCTURE> dont certaines
+	# sont des divisions et d'autres des groupes. On ne garde que les
+	# divisions.
+	return StructuresEleveXML(elenoet=elem.attrib['ELENOET'],
+		divisions=tuple(_texte(structure_et, 'CODE_STRUCTURE')
+			for structure_et in elem.findall('STRUCTURE')
+			if _texte(structure_et, 'TYPE_STRUCTURE') == 'D'))
+
+def _options_eleve(elem):
+	return OptionsEleveXML(elenoet=elem.attrib['ELENOET'],
+		options=tuple((_texte(option_et, 'NUM_OPTION'),
+				_texte(option_et, 'CODE_MODALITE_ELECT'),
+				_texte(option_et, 'CODE_MATIERE'))
+			for option_et in elem.findall('OPTIONS_ELEVE')))
+
+def _individu(elem):
+	fonction = _texte(elem, 'FONCTION')
+	# Seuls les enseignants et les personnels de direction sont
+	# importés.
+	if fonction not in ('ENS', 'DIR'):
+		return None
+
+	return IndividuXML(id=elem.attrib['ID'],
+		nom=_texte(elem, 'NOM_USAGE'),
+		prenom=_texte(elem, 'PRENOM'),
+		sexe=_texte(elem, 'SEXE'),
+		fonction=fonction,
+		grade=_texte(elem, 'GRADE'),
+		disciplines=tuple(DisciplineXML(
+				code=discipline_et.attrib['CODE'],
+				libelle=_texte(discipline_et, 'LIBELLE_COURT'),
+				nb_heures=float(_texte(discipline_et, 'NB_HEURES')))
+			for discipline_et in elem.findall('DISCIPLINES/DISCIPLINE')))
+
+def _colle(elem):
+	return ColleXML(id=elem.attrib['id'],
+		mefs=tuple(x.text for x in elem.findall('codes_mefs/code_mef')),
+		matieres=tuple(x.text for x in
+			elem.findall('codes_matieres/code_matiere')),
+		duree=_texte(elem, 'duree'),
+		periode=_texte(elem, 'periode'),
+		nom=_texte(elem, 'nom'),
+		frequence=_texte(elem, 'frequence'),
+		mode_defaut=_texte(elem, 'mode_defaut'))
+
+# Description des fichiers gérés. À chaque balise racine, on associe le
+# nom de l'attribut de BEEImporter qui reçoit les données du fichier,
+# ainsi que le dictionnaire qui à chaque chemin de balise (relatif à la
+# racine) associe le nom de la liste d'enregistrements et la fonction
+# qui extrait un enregistrement de la balise. Le nom 'parametres' est
+# réservé au dictionnaire des paramètres du fichier.
+FORMATS_XML = {
+	# Testé en version 2.0
+	'BEE_STRUCTURES': ('structures', {
+		'PARAMETRES': ('parametres', _parametres_siecle),
+		'DONNEES/DIVISIONS/DIVISION': ('divisions', _division),
+		'DONNEES/GROUPES/GROUPE': ('groupes', _groupe),
+	}),
+	# Testé en version 3.1
+	'BEE_NOMENCLATURES': ('nomenclatures', {
+		'PARAMETRES': ('parametres', _parametres_siecle),
+		'DONNEES/MEFS/MEF': ('mefs', _mef),
+		'DONNEES/MATIERES/MATIERE': ('matieres', _matiere),
+		'DONNEES/OPTIONS_OBLIGATOIRES/OPTION_OBLIGATOIRE':
+			('options_obligatoires', _option_obligatoire),
+		'DONNEES/PROGRAMMES/PROGRAMME': ('programmes', _programme),
+	}),
+	# Testé en version 3.0
+	'BEE_ELEVES': ('eleves', {
+		'PARAMETRES': ('parametres', _parametres_siecle),
+		'DONNEES/ELEVES/ELEVE': ('eleves', _eleve),
+		'DONNEES/STRUCTURES/STRUCTURES_ELEVE':
+			('structures_eleves', _structures_eleve),
+		'DONNEES/OPTIONS/OPTION': ('options', _options_eleve),
+	}),
+	'STS_EDT': ('sts', {
+		'PARAMETRES': ('parametres', _parametres_sts),
+		'NOMENCLATURES/MEFS/MEF': ('mefs', _mef),
+		'NOMENCLATURES/MATIERES/MATIERE': ('matieres', _matiere),
+		'DONNEES/INDIVIDUS/INDIVIDU': ('individus', _individu),
+		'DONNEES/SUPPLEANTS/SUPPLEANT': ('individus', _individu),
+		'DONNEES/STRUCTURE/DIVISIONS/DIVISION': ('divisions', _division),
+		'DONNEES/STRUCTURE/GROUPES/GROUPE': ('groupes', _groupe),
+	}),
+	'EDT_STS': ('edt_sts', {
+		'PARAMETRES': ('parametres', _parametres_siecle),
+		'DONNEES/STRUCTURE/DIVISIONS/DIVISION': ('divisions', _division),
+		'DONNEES/STRUCTURE/GROUPES/GROUPE': ('groupes', _groupe),
+	}),
+	'pykol_nomenclatures': ('nomenclature_colles', {
+		'colles/colle': ('colles', _colle),
+	}),
+}
+
+# Type d'historique ImportBeeLog de chacun des fichiers lus par
+# BEEImporter, indexé par l'attribut qui contient ses données.
+TYPES_FICHIERS_BEE = (
+	('structures', ImportBeeLog.IMPORT_TYPE_STRUCTURES),
+	('nomenclatures', ImportBeeLog.IMPORT_TYPE_NOMENCLATURES),
+	('eleves', ImportBeeLog.IMPORT_TYPE_BASE_ELEVES),
+	('sts', ImportBeeLog.IMPORT_TYPE_STS),
+	('nomenclature_colles', ImportBeeLog.IMPORT_TYPE_COLLES),
+)
+
+# Dépendances des étapes de l'import : à chaque étape, on associe les
+# fichiers dont elle lit les données et les étapes dont elle utilise le
+# résultat. Une étape absente de ce dictionnaire est toujours exécutée.
+DEPENDANCES_ETAPES = {
+	'import_mefs': (('nomenclatures', 'sts'), ()),
+	'import_programmes': (('nomenclatures',), ('import_mefs',)),
+	'import_professeurs': (('sts',), ()),
+	'import_divisions': (('structures', 'sts'),
+		('import_mefs', 'import_programmes')),
+	'import_groupes': (('structures', 'sts', 'edt_sts'),
+		('import_divisions', 'import_professeurs')),
+	'import_services': (('sts', 'edt_sts'),
+		('import_divisions', 'import_groupes', 'import_professeurs')),
+	'import_etudiants': (('eleves',), ('import_divisions',)),
+	'import_options_etudiants': (('eleves',),
+		('import_etudiants', 'import_programmes')),
+	'import_colles': (('nomenclature_colles',),
+		('import_divisions', 'import_programmes', 'import_groupes',
+			'import_services')),
+}
+
+class DonneesXML:
+	"""
+	Données extraites d'un fichier XML de SIECLE, de STS ou de pyKol.
+
+	L'attribut racine contient la balise racine du fichier,
+	l'attribut parametres le dictionnaire extrait de sa balise
+	<PARAMETRES> et l'attribut empreinte l'empreinte SHA-256 du contenu
+	XML. Les listes d'enregistrements sont accessibles par leur nom, par
+	exemple donnees['divisions'].
+	"""
+	def __init__(self, racine):
+		self.racine = racine
+		self.parametres = {}
+		self.listes = defaultdict(list)
+		self.empreinte = None
+
+	def __getitem__(self, nom):
+		return self.listes[nom]
+
+	def ajouter(self, nom, enregistrement):
+		if enregistrement is None:
+			return
+		if nom == 'parametres':
+			self.parametres = enregistrement
+		else:
+			self.listes[nom].append(enregistrement)
+
+class _LecteurEmpreinte:
+	"""
+	Enveloppe d'un fichier ouvert qui calcule l'empreinte SHA-256 des
+	données lues au fur et à mesure de leur lecture.
+	"""
+	def __init__(self, fichier):
+		self.fichier = fichier
+		self.sha256 = hashlib.sha256()
+
+	def read(self, taille=-1):
+		donnees = self.fichier.read(taille)
+		self.sha256.update(donnees.encode('utf-8')
+				if isinstance(donnees, str) else donnees)
+		return donnees
+
+def lire_xml(xml):
+	"""
+	Lit en flux un fichier XML et renvoie le couple (attribut, donnees)
+	où donnees est l'instance de DonneesXML extraite du fichier et
+	attribut le nom de l'attribut de BEEImporter qui doit la recevoir.
+
+	Le type du fichier est déterminé par sa balise racine, dès le début
+	de la lecture. Chaque balise est retirée de l'arbre une fois lue :
+	seules restent en mémoire les balises en cours de lecture et les
+	enregistrements extraits.
+
+	L'empreinte du fichier est calculée pendant cette même lecture.
+
+	Cette fonction lève une exception ValueError si le fichier n'est
+	pas un XML valide ou si sa balise racine n'est pas gérée.
+	"""
+	donnees = None
+	extracteurs = None
+	lecteur = _LecteurEmpreinte(xml)
+
+	# Pile des couples (balise, chemin) des balises ouvertes, hors
+	# balises intérieures à un enregistrement.
+	pile = []
+	# Profondeur de la balise courante sous la balise d'un
+	# enregistrement en cours de lecture (0 hors enregistrement). Les
+	# balises intérieures sont laissées dans l'arbre pour l'extracteur,
+	# sans qu'il soit utile de calculer leur chemin.
+	profondeur = 0
+
+	try:
+		for evenement, elem in ET.iterparse(lecteur, events=('start', 'end')):
+			if evenement == 'start':
+				if profondeur:
+					profondeur += 1
+					continue
+
+				if not pile:
+					# Auto-détection du type de fichier
+					# TODO: pour tous les fichiers sauf STS-EDT, la
+					# balise racine possède une indication de version
+					# dans l'attribut VERSION, que l'on devrait
+					# vérifier.
+					try:
+						attribut, extracteurs = FORMATS_XML[elem.tag]
+					except KeyError:
+						raise ValueError('type-inconnu', xml)
+					donnees = DonneesXML(elem.tag)
+					pile.append((elem, None))
+					continue
+
+				parent_chemin = pile[-1][1]
+				chemin = elem.tag if parent_chemin is None \
+						else parent_chemin + '/' + elem.tag
+				pile.append((elem, chemin))
+				if chemin in extracteurs:
+					profondeur = 1
+				continue
+
+			if profondeur > 1:
+				# La balise fait partie d'un enregistrement en cours
+				# de lecture.
+				profondeur -= 1
+				continue
+
+			_, chemin = pile.pop()
+			if not pile:
+				# Fin de la balise racine
+				break
+
+			if profondeur:
+				profondeur = 0
+				nom, extracteur = extracteurs[chemin]
+				donnees.ajouter(nom, extracteur(elem))
+
+			pile[-1][0].remove(elem)
+
+	except ET.ParseError:
+		raise ValueError('xml-invalide', xml)
+
+	if donnees is None:
+		raise ValueError('xml-invalide', xml)
+
+	# La fin du fichier, après la balise racine, entre aussi dans
+	# l'empreinte.
+	while lecteur.read(64 * 1024):
+		pass
+	donnees.empreinte = lecteur.sha256.hexdigest()
+
+	return attribut, donnees
+
+def _modifier_champs(objet, donnees):
+	"""
+	Affecte à l'objet les valeurs du dictionnaire donnees et renvoie la
+	liste des champs dont la valeur a effectivement changé, sans rien
+	enregistrer dans la base de données.
+	"""
+	champs = []
+	for champ, valeur in donnees.items():
+		attname = objet._meta.get_field(champ).attname
+		valeur_base = valeur.pk if isinstance(valeur, models.Model) \
+				else valeur
+		if getattr(objet, attname) != valeur_base:
+			setattr(objet, champ, valeur)
+			champs.append(champ)
+	return champs
+
 class BEEImporter:
 	"""
 	Classe qui gère l'import des données depuis les fichiers XML
@@ -175,47 +674,30 @@ class BEEImporter:
 		Prend en paramètre les fichiers XML à importer (déjà ouverts) et
 		auto-détecte le type de ces fichiers pour réaliser l'import.
 
+		Chaque fichier est lu une seule fois, en flux, par lire_xml :
+		seuls les enregistrements utiles aux étapes de l'import sont
+		conservés en mémoire.
+
 		Cette fonction lève une exception ValueError si l'un des
 		fichiers donné en argument ne correspond pas au format attendu
 		(XML invalide ou bien balise racine ne faisant pas partie de la
 		liste des balises gérées).
 		"""
 		fichiers_invalides = []
-		self.structures_et = self.nomenclatures_et = \
-				self.eleves_et = self.sts_et = \
-				self.edt_sts_et = \
-				self.nomenclature_colles_et = None
+		self.structures = self.nomenclatures = \
+				self.eleves = self.sts = \
+				self.edt_sts = \
+				self.nomenclature_colles = None
 		for xml in xmls:
 			try:
-				xml_et = ET.parse(xml)
-			except ET.ParseError:
-				fichiers_invalides.append(ValueError('xml-invalide', xml))
+				attribut, donnees = lire_xml(xml)
+			except ValueError as e:
+				fichiers_invalides.append(e)
 				continue
 
-			# Auto-détection du type de fichier
-			# TODO: pour tous les fichiers sauf STS-EDT, la balise
-			# racine possède une indication de version dans l'attribut
-			# VERSION, que l'on devrait vérifier.
 			# TODO vérifier que l'on ne donne pas plusieurs fois le même
 			# type de fichier
-			xml_root = xml_et.getroot()
-			if xml_root.tag == 'BEE_STRUCTURES':
-				# Testé en version 2.0
-				self.structures_et = xml_et
-			elif xml_root.tag == 'BEE_NOMENCLATURES':
-				# Testé en version 3.1
-				self.nomenclatures_et = xml_et
-			elif xml_root.tag == 'BEE_ELEVES':
-				# Testé en version 3.0
-				self.eleves_et = xml_et
-			elif xml_root.tag == 'STS_EDT':
-				self.sts_et = xml_et
-			elif xml_root.tag == 'EDT_STS':
-				self.edt_sts_et = xml_et
-			elif xml_root.tag == 'pykol_nomenclatures':
-				self.nomenclature_colles_et = xml_et
-			else:
-				fichiers_invalides.append(ValueError('type-inconnu', xml))
+			setattr(self, attribut, donnees)
 
 		if fichiers_invalides:
 			if len(fichiers_invalides) == 1:
@@ -248,69 +730,189 @@ class BEEImporter:
 
 		self.professeurs = {}
 
-	def full_import(self):
+		# Données lues dans la base par _charger_services lors du
+		# premier appel à _stocker_services.
+		self._services = None
+
+		# Étapes réellement exécutées (et non restaurées depuis la base
+		# parce que leurs fichiers sont inchangés).
+		self.etapes_executees = set()
+
+		# Dictionnaire qui à chaque type d'historique associe
+		# l'empreinte du dernier fichier importé pour l'année. Il est
+		# peuplé par le premier appel à _fichier_inchange().
+		self._empreintes = None
+
+	def full_import(self, forcer=False):
 		"""
 		Réalise toutes les étapes d'importation des données.
+
+		Les étapes dont les fichiers n'ont pas changé depuis le dernier
+		import sont ignorées, sauf si forcer est vrai.
+		"""
+		for etape, _ in ETAPES_IMPORT_BEE:
+			self.executer_etape(etape, forcer)
+
+	def _fichier_inchange(self, attribut):
+		"""
+		Indique si le fichier stocké dans l'attribut donné a la même
+		empreinte que le dernier fichier du même type importé pour
+		l'année en cours.
+		"""
+		if self._empreintes is None:
+			self._empreintes = {}
+			for import_type, empreinte in ImportBeeLog.objects.filter(
+					annee=self.annee).order_by('-date_import', '-pk'
+					).values_list('import_type', 'empreinte'):
+				self._empreintes.setdefault(import_type, empreinte)
+
+		import_type = dict(TYPES_FICHIERS_BEE).get(attribut)
+		donnees = getattr(self, attribut)
+		return import_type is not None and bool(donnees.empreinte) \
+				and self._empreintes.get(import_type) == donnees.empreinte
+
+	def etape_necessaire(self, etape):
+		"""
+		Indique si l'étape donnée doit être exécutée. Une étape peut
+		être ignorée lorsque tous ses fichiers présents sont identiques
+		à ceux du dernier import et qu'aucune des étapes dont elle
+		dépend n'a été exécutée.
 		"""
-		self.import_etablissement()
-		self.import_annee()
-		self.import_mefs()
-		self.import_programmes()
-		self.import_professeurs()
-		self.import_divisions()
-		self.import_groupes()
-		self.import_services()
-		self.import_etudiants()
-		self.import_options_etudiants()
-		self.import_colles()
-
-		self.log_imports()
+		try:
+			fichiers, prerequis = DEPENDANCES_ETAPES[etape]
+		except KeyError:
+			return True
+
+		if self.etapes_executees.intersection(prerequis):
+			return True
+
+		presents = [attribut for attribut in fichiers
+				if getattr(self, attribut) is not None]
+		if not presents:
+			# L'étape relit alors ses données depuis la base.
+			return True
+
+		return not all(self._fichier_inchange(attribut)
+				for attribut in presents)
+
+	def executer_etape(self, etape, forcer=False):
+		"""
+		Exécute l'étape donnée et renvoie le nombre d'enregistrements
+		traités. Si l'étape n'est pas nécessaire (et que forcer est
+		faux), son état est seulement restauré depuis la base et la
+		fonction renvoie None.
+		"""
+		if forcer or self.etape_necessaire(etape):
+			nb_lignes = getattr(self, etape)()
+			self.etapes_executees.add(etape)
+			return nb_lignes or 0
+
+		self.restaurer({etape})
+		return None
+
+	def _parametre(self, nom):
+		"""
+		Renvoie la valeur du paramètre donné (uaj ou annee) lue dans le
+		premier fichier qui le renseigne.
+		"""
+		for donnees in (self.sts, self.structures, self.nomenclatures,
+				self.eleves, self.edt_sts):
+			if donnees is not None and donnees.parametres.get(nom):
+				return donnees.parametres[nom]
+		return None
+
+	def restaurer(self, etapes):
+		"""
+		Reconstruit, à partir de la base de données, l'état que laissent
+		les étapes données (noms de méthodes de ETAPES_IMPORT_BEE), afin
+		de reprendre l'import à l'étape suivante sans exécuter de
+		nouveau celles qui sont déjà terminées.
+
+		Les objets sont relus d'après les codes présents dans les
+		fichiers. Faute de mieux, les matières sont toutes relues, comme
+		lorsque le fichier Nomenclatures est absent.
+		"""
+		if 'import_etablissement' in etapes:
+			self.etablissement = Etablissement.objects.get(
+					numero_uai=self._parametre('uaj'))
+
+		if 'import_annee' in etapes:
+			self.annee = Annee.objects.get(nom=self._parametre('annee'))
+
+		if 'import_mefs' in etapes:
+			codes = set(mef.code for donnees in (self.nomenclatures,
+				self.sts) if donnees is not None
+				for mef in donnees['mefs'])
+			mefs = ModuleElementaireFormation.objects.all()
+			if codes:
+				mefs = mefs.filter(code_mef__in=codes)
+			self.mefs = dict((mef.code_mef, mef) for mef in mefs)
+
+		if 'import_programmes' in etapes:
+			self.matieres = dict((matiere.code_matiere, matiere)
+					for matiere in Matiere.objects.all())
+
+		if 'import_professeurs' in etapes:
+			professeurs = Professeur.objects.all()
+			if self.sts:
+				professeurs = professeurs.filter(id_acad__in=[
+					individu.id for individu in self.sts['individus']])
+			self.professeurs = dict((prof.id_acad, prof)
+					for prof in professeurs)
+
+		if 'import_divisions' in etapes:
+			codes = set(division.code for donnees in (self.structures,
+				self.sts) if donnees is not None
+				for division in donnees['divisions'] if division.code_mef)
+			classes = Classe.all_objects.filter(annee=self.annee)
+			if codes:
+				classes = classes.filter(code_structure__in=codes)
+			self.classes = dict((classe.code_structure, classe)
+					for classe in classes)
+
+		if 'import_groupes' in etapes:
+			codes = set(groupe.code for donnees in (self.structures,
+				self.sts, self.edt_sts) if donnees is not None
+				for groupe in donnees['groupes'])
+			self.groupes = dict((groupe.code_structure, groupe)
+				for groupe in Groupe.objects.filter(annee=self.annee,
+					code_structure__in=codes))
+
+		if 'import_etudiants' in etapes and self.eleves:
+			self.etudiants = dict((etudiant.numero_siecle, etudiant)
+				for etudiant in Etudiant.objects.filter(
+					numero_siecle__in=[eleve.elenoet
+						for eleve in self.eleves['eleves']]
+				).order_by('pk'))
 
 	def log_imports(self):
 		"""
 		Enregistre dans la base de données la date d'import des données.
 		"""
-		fichiers = (
-			{
-				'field': 'structures_et',
-				'type': ImportBeeLog.IMPORT_TYPE_STRUCTURES,
-			},
-			{
-				'field': 'nomenclatures_et',
-				'type': ImportBeeLog.IMPORT_TYPE_NOMENCLATURES,
-			},
-			{
-				'field': 'eleves_et',
-				'type': ImportBeeLog.IMPORT_TYPE_BASE_ELEVES,
-			},
-			{
-				'field': 'sts_et',
-				'type': ImportBeeLog.IMPORT_TYPE_STS,
-			},
-			{
-				'field': 'nomenclature_colles_et',
-				'type': ImportBeeLog.IMPORT_TYPE_COLLES,
-			},
-		)
-		for fichier in fichiers:
+		nb_logs = 0
+		for attribut, import_type in TYPES_FICHIERS_BEE:
 			try:
-				xml_et = getattr(self, fichier['field'])
-				if xml_et is None:
+				donnees = getattr(self, attribut)
+				if donnees is None:
 					continue
 
 				log = ImportBeeLog(
 					date_import=timezone.now(),
-					import_type=fichier['type'],
+					import_type=import_type,
 					annee=self.annee,
+					empreinte=donnees.empreinte or '',
 				)
 				try:
-					log.date_fichier = parse_datetime_francaise(xml_et.getroot().find('PARAMETRES/HORODATAGE').text)
+					log.date_fichier = parse_datetime_francaise(donnees.parametres['horodatage'])
 				except:
 					log.date_fichier = timezone.now()
 				log.save()
+				nb_logs += 1
 			except:
 				continue
 
+		return nb_logs
+
 	def import_annee(self):
 		"""
 		Détermine l'année scolaire à partir des fichiers fournis, et la
@@ -321,31 +923,31 @@ class BEEImporter:
 		fournis, ou bien si elle n'existe pas en base de données et
 		qu'elle ne peut pas être créée car le fichier STS est manquant.
 		"""
-		if self.sts_et:
-			annee_et = self.sts_et.getroot().find('PARAMETRES/ANNEE_SCOLAIRE')
-			annee_fichier = annee_et.attrib['ANNEE']
-			debut = isodate.parse_date(annee_et.find('DATE_DEBUT').text)
-			fin = isodate.parse_date(annee_et.find('DATE_FIN').text)
+		if self.sts:
+			parametres = self.sts.parametres
+			annee_fichier = parametres['annee']
+			debut = isodate.parse_date(parametres['annee_debut'])
+			fin = isodate.parse_date(parametres['annee_fin'])
 			self.annee, _ = Annee.objects.update_or_create(
 					nom=annee_fichier,
 					defaults={'debut': debut, 'fin': fin})
 
 		annee_erreurs = []
-		for xml_siecle in (self.structures_et, self.nomenclatures_et,
-				self.eleves_et, self.edt_sts_et):
-			if xml_siecle is None:
+		for donnees in (self.structures, self.nomenclatures,
+				self.eleves, self.edt_sts):
+			if donnees is None:
 				continue
-			annee_fichier = xml_siecle.getroot().find('PARAMETRES/ANNEE_SCOLAIRE').text
+			annee_fichier = donnees.parametres.get('annee')
 			if self.annee:
 				if annee_fichier != self.annee.nom:
 					annee_erreurs.append(ValueError('annee-mismatch',
-						xml_siecle))
+						donnees))
 			else:
 				try:
 					self.annee = Annee.objects.get(nom=annee_fichier)
 				except Annee.DoesNotExist:
 					annee_erreurs.append(ValueError('annee-inexistante',
-						xml_siecle))
+						donnees))
 
 		if annee_erreurs:
 			raise ValueError(annee_erreurs)
@@ -357,6 +959,8 @@ class BEEImporter:
 		except:
 			pass
 
+		return 1
+
 	def import_etablissement(self):
 		"""
 		Import des données de l'établissement à partir de la balise <UAJ> de
@@ -364,17 +968,13 @@ class BEEImporter:
 		"""
 		# Le fichier STS permet de créer l'établissement s'il n'existe
 		# pas
-		if self.sts_et:
-			uaj_xml = self.sts_et.getroot().find('PARAMETRES/UAJ')
-			academie = Academie.objects.get(pk=int(uaj_xml.find('ACADEMIE/CODE').text))
-			denomination = "{} {}".format(
-				uaj_xml.find('DENOM_PRINC'),
-				uaj_xml.find('DENOM_COMPL'),
-			)
+		if self.sts:
+			parametres = self.sts.parametres
+			academie = Academie.objects.get(pk=int(parametres['academie']))
 
 			etab_data = {
-				'numero_uai': uaj_xml.attrib['CODE'],
-				'denomination': denomination,
+				'numero_uai': parametres['uaj'],
+				'denomination': parametres['denomination'],
 				'academie': academie,
 			}
 			self.etablissement, _ = Etablissement.objects.update_or_create(
@@ -382,22 +982,22 @@ class BEEImporter:
 				defaults=etab_data)
 
 		etab_erreurs = []
-		for xml_siecle in (self.structures_et, self.nomenclatures_et,
-				self.eleves_et, self.edt_sts_et):
-			if xml_siecle is None:
+		for donnees in (self.structures, self.nomenclatures,
+				self.eleves, self.edt_sts):
+			if donnees is None:
 				continue
 
-			etab_fichier = xml_siecle.getroot().find('PARAMETRES/UAJ').text
+			etab_fichier = donnees.parametres.get('uaj')
 			if self.etablissement:
 				if etab_fichier != self.etablissement.numero_uai:
 					etab_erreurs.append(ValueError('etab-mismatch',
-						xml_siecle))
+						donnees))
 			else:
 				try:
 					self.etablissement = Etablissement.objects.get(numero_uai=etab_fichier)
 				except Etablissement.DoesNotExist:
 					etab_erreurs.append(ValueError('etab-inexistant',
-						xml_siecle))
+						donnees))
 
 		if etab_erreurs:
 			raise ValueError(etab_erreurs)
@@ -405,12 +1005,14 @@ class BEEImporter:
 		if not self.etablissement:
 			raise ValueError('etab-inconnu')
 
+		return 1
+
 	def import_mefs(self):
 		"""
 		Import des Modules Élémentaires de Formation
 
-		Cette fonction prend en paramètre un sous-arbre etree qui correspond
-		à un fragment XML de la forme (version STS) :
+		Les MEFs sont lus dans des fragments XML de la forme (version
+		STS) :
 		<MEFS>
 		  <MEF CODE="30112013210">
 			<FORMATION>1HEC-E</FORMATION>
@@ -435,44 +1037,18 @@ class BEEImporter:
 		associe son instance ModuleElementaireFormation.
 		"""
 		# Les données se trouvent dans STS ou dans Nomenclatures.
-		if self.nomenclatures_et:
-			mefs_nomenclatures_et = \
-				self.nomenclatures_et.getroot().findall('DONNEES/MEFS/MEF')
-		else:
-			mefs_nomenclatures_et = []
-
-		if self.sts_et:
-			mefs_sts_et = self.sts_et.findall('NOMENCLATURES/MEFS/MEF')
-		else:
-			mefs_sts_et = []
-
 		# On construit le dictionnaire qui à chaque code MEF contient
 		# les informations qui serviront à mettre à jour la base de
 		# données
 		mefs_dict = {}
-		for mef_et in chain(mefs_nomenclatures_et, mefs_sts_et):
-			if 'CODE_MEF' in mef_et.attrib:
-				code_mef = CodeMEF(mef_et.attrib['CODE_MEF'])
-			elif 'CODE' in mef_et.attrib:
-				code_mef = CodeMEF(mef_et.attrib['CODE'])
-			else:
-				continue
-
-			if not code_mef.est_superieur():
+		for donnees in (self.nomenclatures, self.sts):
+			if donnees is None:
 				continue
 
-			mef_data = mefs_dict.setdefault(str(code_mef), {})
-
-			# La version SIECLE ne possède pas toujours le tag LIBELLE_EDITION
-			if mef_et.find('LIBELLE_EDITION') is not None:
-				mef_data.setdefault('libelle',
-						mef_et.find('LIBELLE_EDITION').text)
-			# En revanche, l'import SIECLE comporte plus souvent un
-			# LIBELLE_LONG, que l'on utilise si le MEF n'a toujours pas de
-			# libelle.
-			elif mef_et.find('LIBELLE_LONG') is not None:
-				mef_data.setdefault('libelle',
-						mef_et.find('LIBELLE_LONG').text)
+			for mef in donnees['mefs']:
+				mef_data = mefs_dict.setdefault(mef.code, {})
+				if mef.libelle is not None:
+					mef_data.setdefault('libelle', mef.libelle)
 
 		# On crée à présent tous les MEFs dans la base de données
 		self.mefs = {}
@@ -488,20 +1064,71 @@ class BEEImporter:
 			self.mefs = dict([(mef.code_mef, mef) for mef in
 				ModuleElementaireFormation.objects.all()])
 
-	def _stocker_services(self, groupe_et, code_div, code_groupe):
+		return len(mefs_dict)
+
+	def _charger_services(self):
+		"""
+		Lit dans la base de données, en une requête chacun, les
+		éléments nécessaires à _stocker_services : les matières, les
+		enseignements et les services des classes importées, ainsi que
+		les disciplines des professeurs.
 		"""
-		Crée dans la base de données les objets Service qui se trouvent
-		dans le groupe ou la division donnée par le fragment groupe_et.
+		if self._services is not None:
+			return self._services
+
+		# Pour la culture générale en ECS/ECE, on fait un petit extra :
+		# les sous-matières d'une matière virtuelle sont associées au
+		# code de la matière virtuelle.
+		matieres = defaultdict(list)
+		for matiere in Matiere.objects.filter(virtuelle=False
+				).select_related('parent'):
+			matieres[matiere.code_matiere].append(matiere)
+			if matiere.parent is not None and matiere.parent.virtuelle:
+				matieres[matiere.parent.code_matiere].append(matiere)
+
+		classes = list(self.classes.values())
+		enseignements = defaultdict(list)
+		for enseignement in Enseignement.objects.filter(classe__in=classes
+				).order_by('pk'):
+			enseignements[(enseignement.matiere_id,
+				enseignement.classe_id,
+				enseignement.groupe_id)].append(enseignement)
+
+		disciplines = defaultdict(set)
+		for prof_pk, code in Professeur.disciplines.through.objects.filter(
+				professeur__in=self.professeurs.values()).values_list(
+					'professeur_id', 'discipline_id'):
+			disciplines[prof_pk].add(code)
+
+		self._services = {
+			'matieres': matieres,
+			'enseignements': enseignements,
+			'disciplines': disciplines,
+			'existants': set(Service.objects.filter(
+				enseignement__classe__in=classes).values_list(
+					'enseignement_id', 'professeur_id')),
+			'nouveaux': [],
+		}
+		return self._services
+
+	def _stocker_services(self, services, code_div, code_groupe):
+		"""
+		Prépare les objets Service donnés par la liste services,
+		extraite d'un groupe ou d'une division. Ces objets sont
+		enregistrés dans la base de données par _enregistrer_services.
 
 		Cette méthode crée les objets Enseignement associés aux classes
 		s'il n'en existe aucun déjà existant dans la base de données.
 		Sinon, elle tente de réutiliser les objets déjà présents (dont
 		le groupe n'est pas encore défini).
 		"""
-		for service_et in groupe_et.findall('SERVICES/SERVICE'):
-			code_matiere = service_et.attrib['CODE_MATIERE']
+		donnees = self._charger_services()
+		enseignements = donnees['enseignements']
+
+		for service in services:
+			code_matiere = service.code_matiere
 
-			# On préfère un .filter à un .get car :
+			# On obtient une liste plutôt qu'une seule matière car :
 			# 1. il arrive que l'administration ne remplisse pas
 			#    correctement ses emplois du temps et ajoute des matières
 			#    qui ne sont pas dans le programme de la classe (c'est
@@ -510,24 +1137,14 @@ class BEEImporter:
 			# 2. on obtient ainsi un itérable, ce qui convient bien au hack
 			#    pour la culture générale plus bas, qui manipule deux
 			#    matières.
+			matieres = donnees['matieres'].get(code_matiere, [])
 
-			# Pour la culture générale en ECS/ECE, on fait un petit extra...
-			matieres = Matiere.objects.filter(
-					Q(code_matiere=code_matiere) |
-					Q(parent__virtuelle=True, parent__code_matiere=code_matiere),
-				virtuelle=False
-			)
-
-			# Pour l'instant, on ne se préoccupe que des cours généraux, la
-			# bonne solution serait de se contenter des programmes dans la
-			# nomenclature.
-			if service_et.attrib['CODE_MOD_COURS'] != 'CG':
-				continue
+			# Pour l'instant, on ne se préoccupe que des cours généraux
+			# (seuls conservés par lire_xml), la bonne solution serait de
+			# se contenter des programmes dans la nomenclature.
 
-			codes_enseignants = [x.attrib['ID'] for x in
-					service_et.findall('ENSEIGNANTS/ENSEIGNANT')]
 			# TODO et si la clé code_prof n'existe pas ?
-			profs = [self.professeurs[code_prof] for code_prof in codes_enseignants]
+			profs = [self.professeurs[code_prof] for code_prof in service.enseignants]
 
 			# Bien souvent, cette boucle ne fait qu'une seule itération.
 			# Elle n'en fait deux que pour la culture générale en ECS/ECE
@@ -535,31 +1152,30 @@ class BEEImporter:
 			for matiere in matieres:
 				groupe = self.groupes.get(code_groupe,
 						self.classes.get(code_groupe))
-
-				enseignement = Enseignement.objects.filter(
-						matiere=matiere,
-						classe=self.classes[code_div],
-						groupe=groupe).first()
-				if enseignement is None:
-					enseignement = Enseignement.objects.filter(
-							matiere=matiere,
-							classe=self.classes[code_div],
-							groupe__isnull=True).first()
-					if enseignement is None:
+				classe = self.classes[code_div]
+				cle = (matiere.pk, classe.pk,
+						groupe.pk if groupe is not None else None)
+
+				if enseignements[cle]:
+					enseignement = enseignements[cle][0]
+				else:
+					sans_groupe = enseignements[(matiere.pk, classe.pk, None)]
+					if not sans_groupe:
 						enseignement = Enseignement(
 								matiere=matiere,
-								classe=self.classes[code_div],
+								classe=classe,
 								groupe=groupe)
 					else:
+						enseignement = sans_groupe.pop(0)
 						enseignement.groupe = groupe
 					enseignement.save()
+					enseignements[cle].append(enseignement)
 
 				for prof in profs:
 					# Dernier extra pour la culture générale : on relie le
 					# prof de philo à la sous-matière philo et le prof de
 					# lettres à la sous-matière lettres.
-					disciplines_prof = prof.disciplines.values_list('code',
-							flat=True)
+					disciplines_prof = donnees['disciplines'][prof.pk]
 
 					if matiere.code_matiere == '001701' and \
 							'L0201' not in disciplines_prof and \
@@ -569,9 +1185,30 @@ class BEEImporter:
 							'L0100' not in disciplines_prof:
 						continue
 
-					Service.objects.update_or_create(
-							enseignement=enseignement,
-							professeur=prof)
+					if (enseignement.pk, prof.pk) in donnees['existants']:
+						continue
+					donnees['existants'].add((enseignement.pk, prof.pk))
+					donnees['nouveaux'].append(Service(
+						enseignement=enseignement,
+						professeur=prof))
+
+	def _enregistrer_services(self):
+		"""
+		Crée en bloc les services préparés par _stocker_services.
+		"""
+		if not self._services or not self._services['nouveaux']:
+			return
+
+		nouveaux = self._services['nouveaux']
+		Service.objects.bulk_create(nouveaux)
+		self._services['nouveaux'] = []
+
+		# Les enregistrements en bloc n'envoient pas de signal : on
+		# invalide explicitement les permissions et les appartenances
+		# aux classes qui dépendent des services.
+		invalider_permissions()
+		AppartenanceClasse.objects.recalculer_apres_commit(
+			*set(service.enseignement.classe_id for service in nouveaux))
 
 	def import_divisions(self):
 		"""
@@ -590,22 +1227,17 @@ class BEEImporter:
 		appel à la méthode import_mefs().
 		"""
 		# Les données se trouvent dans STS ou dans Structures.
-		if self.structures_et:
-			div_structures_et = self.structures_et.getroot().findall('DONNEES/DIVISIONS/DIVISION')
-		else:
-			div_structures_et = []
-
-		if self.sts_et:
-			div_sts_et = self.sts_et.getroot().findall('DONNEES/STRUCTURE/DIVISIONS/DIVISION')
-		else:
-			div_sts_et = []
+		divisions = []
+		for donnees in (self.structures, self.sts):
+			if donnees is not None:
+				divisions = chain(divisions, donnees['divisions'])
 
 		# Création d'un dictionnaire qui à chaque classe associe les
 		# données trouvées dans les fichiers
 		div_dict = {}
-		for division in chain(div_structures_et, div_sts_et):
+		for division in divisions:
 			# On ne garde que les classes de l'enseignement supérieur
-			code_mef = appartenance_mef_cpge(division.find('MEFS_APPARTENANCE'))
+			code_mef = division.code_mef
 			if not code_mef:
 				continue
 
@@ -613,12 +1245,7 @@ class BEEImporter:
 
 			# Le code_structure est l'identifiant unique de la classe dans
 			# la base élèves.
-			if 'CODE_STRUCTURE' in division.attrib: # Version SIECLE
-				code_structure = division.attrib['CODE_STRUCTURE']
-			elif 'CODE' in division.attrib: # Version STS
-				code_structure = division.attrib['CODE']
-			else:
-				continue # Curieux, pas de code pour la classe ?
+			code_structure = division.code
 
 			if code_mef.annee() == 1:
 				classe_niveau = Classe.NIVEAU_PREMIERE_ANNEE
@@ -630,16 +1257,17 @@ class BEEImporter:
 			classe_data.update({
 				'mef': mef,
 				'slug': slugify("{annee}-{code}".format(annee=self.annee, code=code_structure)),
-				'nom': division.find('LIBELLE_LONG').text,
+				'nom': division.libelle,
 				'niveau': classe_niveau,
 				'mode': Groupe.MODE_AUTOMATIQUE,
-				'xml': division,
+				'services': division.services,
 				})
 
 		# On crée à présent les classes dans la base de données
+		services_divisions = []
 		with transaction.atomic():
 			for code_structure, classe_data in div_dict.items():
-				classe_xml = classe_data.pop('xml')
+				classe_services = classe_data.pop('services')
 				try:
 					classe = Classe.all_objects.get(
 						code_structure=code_structure,
@@ -690,8 +1318,15 @@ class BEEImporter:
 
 				# Dans le fichier STS, on peut trouver des services
 				# d'enseignement parmi les informations de la division.
-				self._stocker_services(classe_xml, code_structure,
+				services_divisions.append((code_structure,
+					classe_services))
+
+			# Les services sont stockés une fois toutes les classes
+			# créées, afin que _charger_services les connaisse toutes.
+			for code_structure, classe_services in services_divisions:
+				self._stocker_services(classe_services, code_structure,
 						code_structure)
+			self._enregistrer_services()
 
 		# Si aucune donnée n'a été importée, on charge les classes
 		# depuis la base de données.
@@ -699,6 +1334,8 @@ class BEEImporter:
 			self.classes = dict([(c.code_structure, c)
 				for c in Classe.all_objects.filter(annee=self.annee)])
 
+		return len(div_dict)
+
 	def import_services(self):
 		"""
 		Lire les services d'enseignement depuis le fichier STS ou EDT-STS
@@ -707,17 +1344,22 @@ class BEEImporter:
 		if not self.classes:
 			return
 
-		div_sts_et = []
-		if self.sts_et:
-			div_sts_et = chain(div_sts_et, self.sts_et.getroot().findall('DONNEES/STRUCTURE/DIVISIONS/DIVISION'))
-		if self.edt_sts_et:
-			div_sts_et = chain(div_sts_et, self.edt_sts_et.getroot().findall('DONNEES/STRUCTURE/DIVISIONS/DIVISION'))
+		divisions = []
+		for donnees in (self.sts, self.edt_sts):
+			if donnees is not None:
+				divisions = chain(divisions, donnees['divisions'])
 
-		for div_et in div_sts_et:
-			code_structure = div_et.attrib['CODE']
+		nb_services = 0
+		for division in divisions:
+			code_structure = division.code
 			if code_structure not in self.classes:
 				continue
-			self._stocker_services(div_et, code_structure, code_structure)
+			self._stocker_services(division.services, code_structure,
+					code_structure)
+			nb_services += len(division.services)
+		self._enregistrer_services()
+
+		return nb_services
 
 	def import_groupes(self):
 		"""
@@ -725,34 +1367,19 @@ class BEEImporter:
 		du fichier Structures.
 		"""
 		# Les données se trouvent dans STS ou dans Structures.
-		if self.structures_et:
-			groupe_structures_et = \
-				self.structures_et.getroot().findall('DONNEES/GROUPES/GROUPE')
-		else:
-			groupe_structures_et = []
-
-		groupe_sts_et = []
-		for et in (self.sts_et, self.edt_sts_et):
-			if et is not None:
-				groupe_sts_et = chain(groupe_sts_et, et.findall('DONNEES/STRUCTURE/GROUPES/GROUPE'))
+		groupes = []
+		for donnees in (self.structures, self.sts, self.edt_sts):
+			if donnees is not None:
+				groupes = chain(groupes, donnees['groupes'])
 
 		# Création d'un dictionnaire qui à chaque groupe associe les
 		# données trouvées dans les fichiers
 		groupe_dict = {}
-		for groupe_et in chain(groupe_structures_et, groupe_sts_et):
-			# Récupération du code structure
-			if 'CODE_STRUCTURE' in groupe_et.attrib: # Version SIECLE Structures.xml
-				code_structure = groupe_et.attrib['CODE_STRUCTURE']
-			elif 'CODE' in groupe_et.attrib: # Version STS-EMP
-				code_structure = groupe_et.attrib['CODE']
-			else:
-				continue
+		for groupe_xml in groupes:
+			code_structure = groupe_xml.code
 
-			divisions_et = groupe_et.findall('DIVISIONS_APPARTENANCE/DIVISION_APPARTENANCE')
-			if all([
-				div_et.attrib.get('CODE',
-					  div_et.attrib.get('CODE_STRUCTURE')) not in self.classes
-					for div_et in divisions_et]):
+			if all([code_div not in self.classes
+					for code_div, _ in groupe_xml.divisions]):
 				continue
 
 			groupe_data = groupe_dict.setdefault(code_structure, {})
@@ -760,10 +1387,8 @@ class BEEImporter:
 			# L'effectif est présent dans la version STS. On l'importe dans
 			# ce cas. Le détail de l'effectif par classe est importé plus
 			# bas, une fois que le groupe est créé.
-			try:
-				groupe_data['effectif_sts'] = int(groupe_et.find('EFFECTIF_PREVU').text)
-			except:
-				pass
+			if groupe_xml.effectif is not None:
+				groupe_data['effectif_sts'] = groupe_xml.effectif
 
 			groupe_data['nom'] = code_structure
 			groupe_data['slug'] = slugify('{}-{}'.format(self.annee, code_structure))
@@ -778,19 +1403,8 @@ class BEEImporter:
 
 			# On détaille les effectifs du groupe par classe et on
 			# stocke les Enseignement qu'il faudra créer.
-			for division_et in divisions_et:
-				try:
-					# Version STS
-					code_div = division_et.attrib['CODE']
-				except KeyError:
-					# Version SIECLE/Structure
-					code_div = division_et.find('CODE_STRUCTURE').text
-
+			for code_div, effectif_div in groupe_xml.divisions:
 				classe = self.classes[code_div]
-				try:
-					effectif_div = int(division_et.find('EFFECTIF_PREVU').text)
-				except:
-					effectif_div = None
 
 				GroupeEffectif.objects.update_or_create(
 						groupe=groupe, classe=classe,
@@ -798,13 +1412,19 @@ class BEEImporter:
 
 				# On stocke les services d'enseignement correspondant à ce
 				# groupe et à cette classe.
-				self._stocker_services(groupe_et, code_div,
+				self._stocker_services(groupe_xml.services, code_div,
 						code_groupe=code_structure)
-				self._stocker_services(groupe_et, code_div, code_div)
+				self._stocker_services(groupe_xml.services, code_div,
+						code_div)
+
+		self._enregistrer_services()
 
 		# TODO faut-il peupler self.groupes avec la base de données s'il
 		# est vide à ce stade de la méthode ?
 
+		return len(groupe_dict)
+
+	@transaction.atomic
 	def import_etudiants(self):
 		"""
 		Import de la liste des étudiants à partir de l'export SIECLE
@@ -814,13 +1434,16 @@ class BEEImporter:
 		pyKol seront mis à jour si les informations présentes dans le
 		fichier XML diffèrent.
 
-		Les étudiants sont identifiés par leur INE (provenant du RNIE).
+		Les étudiants sont identifiés par leur INE (provenant du RNIE),
+		ou à défaut par leur numéro SIECLE. Ils sont lus dans la base en
+		une seule requête et seuls ceux dont les informations diffèrent
+		sont enregistrés, en bloc.
 
 		L'import des étudiants doit nécessairement être réalisé après
 		l'import des structures, car la création d'un étudiant nécessite de
 		le rattacher à une classe déjà existante dans la base de données.
 		"""
-		if not self.eleves_et:
+		if not self.eleves:
 			return
 
 		# On construit le dictionnaire qui à chaque numéro d'élève
@@ -828,34 +1451,46 @@ class BEEImporter:
 		# Ceci permettra de filtrer rapidement plus tard les élèves à
 		# importer.
 		classe_etudiant = {}
-		for struct_eleve in self.eleves_et.getroot().findall('DONNEES/STRUCTURES/STRUCTURES_ELEVE'):
-			# Dans struct_eleve on trouve une liste de <STRUCTURE> dont
-			# certains sont des divisions et d'autres des groupes. On cherche
-			# uniquement les divisions et on les essaie une par une.
-			num_eleve = struct_eleve.attrib['ELENOET']
-			for structure_et in struct_eleve.findall('STRUCTURE'):
-				type_structure = structure_et.find('TYPE_STRUCTURE')
-				if type_structure is None or type_structure.text != 'D':
-					continue
+		for struct_eleve in self.eleves['structures_eleves']:
+			# On essaie une par une les divisions de l'étudiant.
+			for code_structure in struct_eleve.divisions:
 				try:
-					code_structure = structure_et.find('CODE_STRUCTURE').text
-					classe_etudiant[num_eleve] = self.classes[code_structure]
+					classe_etudiant[struct_eleve.elenoet] = self.classes[code_structure]
 					break
 				except:
 					# L'étudiant n'est pas dans une classe gérée par pyKol.
 					continue
 
+		# Les étudiants déjà présents dans la base sont lus en une seule
+		# requête, et repérés par leur INE ou par leur numéro SIECLE.
+		ines = set()
+		numeros = set()
+		for eleve in self.eleves['eleves']:
+			numeros.add(eleve.elenoet)
+			if eleve.ine:
+				ines.add(eleve.ine)
+		par_ine = {}
+		par_numero = {}
+		for etudiant in Etudiant.objects.filter(Q(ine__in=ines) |
+				Q(numero_siecle__in=numeros)):
+			if etudiant.ine:
+				par_ine[etudiant.ine] = etudiant
+			par_numero[etudiant.numero_siecle] = etudiant
+
+		etudiants_modifies = []
+		champs_modifies = set()
+
 		# On peut à présent créer ou mettre à jour les élèves dans la base de
 		# données. Le dictionnaire classe_etudiant permet de mettre la main
 		# sur la classe où affecter l'étudiant.
-		for eleve in self.eleves_et.getroot().findall('DONNEES/ELEVES/ELEVE'):
+		for eleve in self.eleves['eleves']:
 			# TODO On regarde si on connait la scolarité de l'an dernier
 			#origine = None
 			#if eleve.find('SCOLARITE_AN_DERNIER'):
 			#	uai_origine = eleve.find('SCOLARITE_AN_DERNIER/CODE_RNE').text
 			#	# origine = Etablissement.objects.get(numero_uai=uai_origine)
 
-			num_eleve = eleve.attrib['ELENOET']
+			num_eleve = eleve.elenoet
 
 			etudiant_data = {}
 
@@ -866,49 +1501,96 @@ class BEEImporter:
 				# qu'il s'agisse d'une démission. Pour le savoir, on
 				# regarde s'il était déjà présent dans la base de
 				# données.
-				if not Etudiant.objects.filter(numero_siecle=num_eleve).exists():
+				if num_eleve not in par_numero:
 					continue
 
-			etudiant_data['entree'] = parse_date_francaise(eleve.find('DATE_ENTREE').text)
+			etudiant_data['entree'] = parse_date_francaise(eleve.date_entree)
 
-			try:
-				etudiant_data['sortie'] = parse_date_francaise(eleve.find('DATE_SORTIE').text)
-			except:
-				pass
+			if eleve.date_sortie is not None:
+				etudiant_data['sortie'] = parse_date_francaise(eleve.date_sortie)
 
-			email_et = eleve.find('MEL')
-			if email_et is not None and email_et.text:
-				etudiant_data['email'] = email_et.text
+			if eleve.email:
+				etudiant_data['email'] = eleve.email
 
-			etudiant_data['sexe'] = int(eleve.find('CODE_SEXE').text)
-			etudiant_data['first_name'] = eleve.find('PRENOM').text.title()
-			etudiant_data['last_name'] = eleve.find('NOM_DE_FAMILLE').text.title()
-			etudiant_data['birth_date'] = parse_date_francaise(eleve.find('DATE_NAISS').text)
+			etudiant_data['sexe'] = int(eleve.sexe)
+			etudiant_data['first_name'] = eleve.prenom.title()
+			etudiant_data['last_name'] = eleve.nom.title()
+			etudiant_data['birth_date'] = parse_date_francaise(eleve.date_naissance)
 
 			# On tente de retrouver l'étudiant avec son INE, et au pire
 			# le numéro SIECLE.
 			etudiant_data['numero_siecle'] = num_eleve
 
-			if eleve.find('ID_NATIONAL') is None:
-				if eleve.find('INE_RNIE') is not None:
-					etudiant_data['ine'] = eleve.find('INE_RNIE').text
-			else:
-				etudiant_data['ine'] = eleve.find('ID_NATIONAL').text
+			if eleve.ine is not None:
+				etudiant_data['ine'] = eleve.ine
 
+			etudiant = None
 			if etudiant_data.get('ine'):
-				self.etudiants[num_eleve], _ = Etudiant.objects.filter(
-						Q(ine=etudiant_data['ine']) |
-						Q(numero_siecle=etudiant_data['numero_siecle'])
-					).update_or_create(defaults=etudiant_data)
+				etudiant = par_ine.get(etudiant_data['ine'])
+			if etudiant is None:
+				etudiant = par_numero.get(num_eleve)
+
+			if etudiant is None:
+				# L'héritage multi-tables d'Etudiant empêche la
+				# création en bloc.
+				etudiant = Etudiant.objects.create(**etudiant_data)
+				if etudiant.ine:
+					par_ine[etudiant.ine] = etudiant
+				par_numero[num_eleve] = etudiant
 			else:
-				self.etudiants[num_eleve], _ = Etudiant.objects.filter(
-						numero_siecle=etudiant_data['numero_siecle']
-					).update_or_create(defaults=etudiant_data)
+				champs = _modifier_champs(etudiant, etudiant_data)
+				if champs:
+					etudiants_modifies.append(etudiant)
+					champs_modifies.update(champs)
+
+			self.etudiants[num_eleve] = etudiant
+
+		if etudiants_modifies:
+			Etudiant.objects.bulk_update(etudiants_modifies,
+					sorted(champs_modifies))
+
+			# Les enregistrements en bloc n'envoient pas de signal : on
+			# invalide explicitement les données mises en cache qui
+			# dépendent des étudiants.
+			invalider('navigation',
+					*[etudiant.pk for etudiant in etudiants_modifies])
+			invalider('calendrier', TOUS)
 
 		# Une fois que tous les étudiants ont été importés, on met à jour
 		# les compositions des classes
-		for classe in self.classes.values():
-			classe.update_etudiants()
+		self._mettre_a_jour_classes()
+
+		return len(self.etudiants)
+
+	def _mettre_a_jour_classes(self):
+		"""
+		Met à jour la composition des classes importées d'après la
+		classe de chaque étudiant, comme le fait
+		Classe.update_etudiants, en n'écrivant que les différences.
+		"""
+		classes = list(self.classes.values())
+		if not classes:
+			return
+
+		Membre = Groupe.etudiants.through
+		membres = {}
+		for membre_pk, classe_pk, etudiant_pk in Membre.objects.filter(
+				groupe__in=classes).values_list('pk', 'groupe_id',
+					'etudiant_id'):
+			membres[(classe_pk, etudiant_pk)] = membre_pk
+		attendus = set(Etudiant.objects.filter(classe__in=classes
+			).values_list('classe_id', 'pk'))
+
+		existants = set(membres)
+
+		Membre.objects.filter(pk__in=[membres[cle]
+			for cle in existants - attendus]).delete()
+		Membre.objects.bulk_create([Membre(groupe_id=classe_pk,
+				etudiant_id=etudiant_pk)
+			for classe_pk, etudiant_pk in attendus - existants])
+
+		invalider('resultats', *set(classe_pk
+			for classe_pk, _ in attendus ^ existants))
 
 	@transaction.atomic
 	def import_options_etudiants(self):
@@ -916,7 +1598,7 @@ class BEEImporter:
 		Import des options suivies par chaque étudiant à partir de
 		l'export SIECLE de la liste des élèves.
 		"""
-		if not self.eleves_et:
+		if not self.eleves:
 			return
 
 		# Représentation temporaire des options afin de comparer la
@@ -925,22 +1607,24 @@ class BEEImporter:
 		SiecleOption = namedtuple('SiecleOption', ['rang', 'modalite',
 			'matiere'])
 
-		for eleve_et in self.eleves_et.getroot().findall('DONNEES/OPTIONS/OPTION'):
+		nb_etudiants = 0
+		for options_eleve in self.eleves['options']:
 			try:
-				etudiant = self.etudiants[eleve_et.attrib['ELENOET']]
+				etudiant = self.etudiants[options_eleve.elenoet]
 			except:
 				continue
+			nb_etudiants += 1
 
 			# On commence par faire la liste des options présentes dans
 			# le fichier SIECLE.
 			options_siecle = set()
-			for option_et in eleve_et.findall('OPTIONS_ELEVE'):
+			for num_option, code_modalite, code_matiere in options_eleve.options:
 				try:
 					options_siecle.add(SiecleOption(
-						rang=int(option_et.find('NUM_OPTION').text),
+						rang=int(num_option),
 						modalite=OptionEtudiant.parse_modalite_election(
-							option_et.find('CODE_MODALITE_ELECT').text),
-						matiere=self.matieres[option_et.find('CODE_MATIERE').text]
+							code_modalite),
+						matiere=self.matieres[code_matiere]
 					))
 				except:
 					# On ignore les matières qui n'existeraient pas.
@@ -980,12 +1664,12 @@ class BEEImporter:
 					modalite_option=option_add.modalite,
 					matiere=option_add.matiere).save()
 
+		return nb_etudiants
+
 	def _dict_matieres(self):
 		"""
-		Création du dictionnaire des matières à partir d'un fragment XML
-
-		Cette fonction prend en paramètre un sous-arbre etree qui correspond
-		à du XML de la forme :
+		Création du dictionnaire des matières à partir des fragments XML
+		de la forme :
 
 		<MATIERES>
 		  <MATIERE CODE_MATIERE="001700">
@@ -1013,27 +1697,15 @@ class BEEImporter:
 		fichiers de nomenclatures SIECLE ou d'emploi du temps STS.
 		"""
 		# Les données se trouvent dans STS ou dans Structures.
-		if self.nomenclatures_et:
-			div_nomenclatures_et = \
-				self.nomenclatures_et.getroot().findall('DONNEES/MATIERES/MATIERE')
-		else:
-			div_nomenclatures_et = []
-
-		if self.sts_et:
-			div_sts_et = self.sts_et.getroot().findall('NOMENCLATURES/MATIERES/MATIERE')
-		else:
-			div_sts_et = []
+		matieres_xml = []
+		for donnees in (self.nomenclatures, self.sts):
+			if donnees is not None:
+				matieres_xml = chain(matieres_xml, donnees['matieres'])
 
 		matieres = {}
-		for matiere in chain(div_nomenclatures_et, div_sts_et):
-			if 'CODE_MATIERE' in matiere.attrib:
-				code_matiere = matiere.attrib['CODE_MATIERE']
-			elif 'CODE' in matiere.attrib:
-				code_matiere = matiere.attrib['CODE']
-			else:
-				continue
-
-			nom_matiere = matiere.find('LIBELLE_EDITION').text
+		for matiere in matieres_xml:
+			code_matiere = matiere.code
+			nom_matiere = matiere.libelle
 
 			# On regroupe les langues dans une même matière parent. On
 			# identifie les groupes de matières avec les deux derniers
@@ -1106,7 +1778,7 @@ class BEEImporter:
 
 			matieres[code_matiere] = {
 					'code_matiere': code_matiere,
-					'nom': matiere.find('LIBELLE_EDITION').text,
+					'nom': nom_matiere,
 					'virtuelle': matiere_virtuelle,
 					'code_parent': code_parent,
 					}
@@ -1174,7 +1846,7 @@ class BEEImporter:
 		leurs matières.
 		"""
 		# Les données sont dans Nomenclature.
-		if not self.nomenclatures_et:
+		if not self.nomenclatures:
 			# On remplit le dictionnaire des matières à partir de la
 			# base de données, faute d'avoir le fichier XML.
 			for matiere in Matiere.objects.all():
@@ -1187,24 +1859,21 @@ class BEEImporter:
 
 		# On stocke les rangs des options obligatoires.
 		rang_option = defaultdict(dict)
-		for option_et in \
-				self.nomenclatures_et.getroot().findall('DONNEES/OPTIONS_OBLIGATOIRES/OPTION_OBLIGATOIRE'):
-			code_mef = option_et.find('CODE_MEF').text
-			code_matiere = option_et.find('CODE_MATIERE').text
-			rang_option[code_mef][code_matiere] = int(option_et.find('RANG_OPTION').text)
+		for option in self.nomenclatures['options_obligatoires']:
+			rang_option[option.code_mef][option.code_matiere] = option.rang
 
 		# On peut ensuite créer les options.
-		for programme_et in self.nomenclatures_et.getroot().findall('DONNEES/PROGRAMMES/PROGRAMME'):
+		for programme in self.nomenclatures['programmes']:
 			try:
-				mef = self.mefs[programme_et.find('CODE_MEF').text]
+				mef = self.mefs[programme.code_mef]
 			except:
 				continue
 
 			matiere = self._creer_matiere(dict_matieres,
-				programme_et.find('CODE_MATIERE').text)
+				programme.code_matiere)
 
 			modalite_option = MEFMatiere.parse_modalite_election(
-					programme_et.find('CODE_MODALITE_ELECT').text)
+					programme.code_modalite)
 
 			defaults = {}
 			if modalite_option == MEFMatiere.MODALITE_OBLIGATOIRE:
@@ -1241,41 +1910,63 @@ class BEEImporter:
 					modalite_option=modalite_option,
 					defaults=defaults)
 
+		return len(self.nomenclatures['programmes'])
 
+	@transaction.atomic
 	def import_professeurs(self):
 		"""
 		Import de la liste des professeurs depuis STS.
 
 		Cette fonction peuple le dictionnaire self.professeurs qui à
 		chaque code professeur associe l'objet Professeur correspondant.
+
+		Les professeurs, leurs disciplines et les disciplines elles-mêmes
+		sont lus dans la base en une requête chacun. Seuls les
+		professeurs dont les informations diffèrent du fichier STS sont
+		enregistrés, en bloc.
 		"""
-		if not self.sts_et:
+		if not self.sts:
 			# Charger les profs depuis la base si pas de STS
 			for prof in Professeur.objects.all():
 				self.professeurs[prof.id_acad] = prof
 			return
 
-		for individu in chain(
-					self.sts_et.getroot().findall('DONNEES/INDIVIDUS/INDIVIDU'),
-					self.sts_et.getroot().findall('DONNEES/SUPPLEANTS/SUPPLEANT'),
-				):
-			individu_id = individu.attrib['ID']
-			nom = individu.find('NOM_USAGE').text.title()
-			prenom = individu.find('PRENOM').text.title()
-			numero_sts = individu.attrib.get('ID')
-
-			sexe_xml = individu.find('SEXE').text
-			if sexe_xml == '1':
+		# XXX La recherche n'est absolument pas robuste aux homonymes,
+		# mais les fichiers XML de STS ne donnent pour identifiant
+		# qu'une clé primaire opaque, non documentée et probablement
+		# instable avec le temps.
+		professeurs_existants = dict(((prof.last_name, prof.first_name,
+			prof.sexe), prof) for prof in Professeur.objects.all())
+		disciplines_existantes = Discipline.objects.in_bulk()
+
+		# Liens existants entre professeurs et disciplines : à chaque
+		# professeur, on associe le dictionnaire qui à chaque code de
+		# discipline associe l'identifiant du lien.
+		DisciplineProfesseur = Professeur.disciplines.through
+		liens_existants = defaultdict(dict)
+		for lien_pk, prof_pk, code in DisciplineProfesseur.objects.values_list(
+				'pk', 'professeur_id', 'discipline_id'):
+			liens_existants[prof_pk][code] = lien_pk
+
+		nouvelles_disciplines = {}
+		professeurs_modifies = []
+		champs_modifies = set()
+		liens_a_creer = []
+		liens_a_supprimer = []
+
+		for individu in self.sts['individus']:
+			individu_id = individu.id
+			nom = individu.nom.title()
+			prenom = individu.prenom.title()
+			numero_sts = individu.id
+
+			if individu.sexe == '1':
 				sexe = User.SEXE_HOMME
 			else:
 				sexe = User.SEXE_FEMME
 
-			fonction = individu.find('FONCTION').text
-
-			if individu.find('GRADE') is not None:
-				grade_xml = individu.find('GRADE').text
-			else:
-				grade_xml = None
+			fonction = individu.fonction
+			grade_xml = individu.grade
 
 			if grade_xml == "CERT CE" or grade_xml == "CERT. H CL" or \
 					grade_xml == "CERT. CL N":
@@ -1288,16 +1979,12 @@ class BEEImporter:
 			else:
 				grade = Professeur.CORPS_AUTRE
 
-			# XXX La recherche n'est absolument pas robuste aux homonymes,
-			# mais les fichiers XML de STS ne donnent pour identifiant
-			# qu'une clé primaire opaque, non documentée et probablement
-			# instable avec le temps.
 			if fonction == "ENS":
 				# Construction de la liste des disciplines du
 				# professeur.
 				# On calcule aussi le nombre d'heures pour tenter de
 				# deviner le code indemnité à appliquer pour les colles.
-				# Ce n'est qu'une approximation : on obtient via STS
+				# Ce n'est qu'une approximation : on obtient via STS
 				# l'ORS. On va considérer que des ORS de 8h, 9h, 10, 11h
 				# sont des ORS de CPGE et appliquer l'indemnité de CPGE
 				# pour les colles. Le vrai critère vient du service, qui
@@ -1308,37 +1995,40 @@ class BEEImporter:
 				# donne qu'une première approximation qui doit être
 				# confirmée manuellement par le secrétariat.
 
-				disciplines = []
+				disciplines = set()
 				nb_heures = 0
-				for discipline_et in individu.findall('DISCIPLINES/DISCIPLINE'):
-					discipline, _ = Discipline.objects.get_or_create(
-							code=discipline_et.attrib['CODE'],
-							defaults={'nom': discipline_et.find('LIBELLE_COURT').text})
-					disciplines.append(discipline)
-					nb_heures += float(discipline_et.find('NB_HEURES').text)
+				for discipline_xml in individu.disciplines:
+					if discipline_xml.code not in disciplines_existantes:
+						nouvelles_disciplines.setdefault(discipline_xml.code,
+							Discipline(code=discipline_xml.code,
+								nom=discipline_xml.libelle))
+					disciplines.add(discipline_xml.code)
+					nb_heures += discipline_xml.nb_heures
 
 				# Comme dit plus haut, ceci n'est qu'une vague
 				# approximation.
 				est_prof_cpge = 8 <= nb_heures <= 11
 
-				# On ne peut pas utiliser la méthode
-				# Professeur.objects.update_or_create car il faut
-				# initialiser les colles de comptes de colles du
-				# professeur.
-				try:
-					professeur = Professeur.objects.get(
-						last_name=nom,
-						first_name=prenom,
-						sexe=sexe)
-
-					professeur.etablissement = self.etablissement
-					professeur.corps = grade
-					professeur.id_acad = numero_sts
+				professeur = professeurs_existants.get((nom, prenom, sexe))
+				if professeur is not None:
+					professeur_data = {
+						'etablissement': self.etablissement,
+						'corps': grade,
+						'id_acad': numero_sts,
+					}
 					if est_prof_cpge:
-						professeur.code_indemnite = Professeur.CODE_INDEMNITE_PROF_CPGE
-					professeur.save()
-
-				except Professeur.DoesNotExist:
+						professeur_data['code_indemnite'] = \
+							Professeur.CODE_INDEMNITE_PROF_CPGE
+
+					champs = _modifier_champs(professeur, professeur_data)
+					if champs:
+						professeurs_modifies.append(professeur)
+						champs_modifies.update(champs)
+
+				else:
+					# On ne peut pas créer les professeurs en bloc car
+					# il faut initialiser les comptes de colles de
+					# chaque professeur.
 					professeur = Professeur.objects.create(
 						last_name=nom,
 						first_name=prenom,
@@ -1349,58 +2039,72 @@ class BEEImporter:
 						code_indemnite = Professeur.CODE_INDEMNITE_PROF_CPGE if est_prof_cpge
 							else Professeur.CODE_INDEMNITE_PROF_AUTRE,
 						)
+					professeurs_existants[(nom, prenom, sexe)] = professeur
+
+				liens = liens_existants[professeur.pk]
+				liens_a_creer.extend(DisciplineProfesseur(
+						professeur_id=professeur.pk, discipline_id=code)
+					for code in disciplines - liens.keys())
+				liens_a_supprimer.extend(lien_pk
+					for code, lien_pk in liens.items()
+					if code not in disciplines and lien_pk is not None)
+				liens_existants[professeur.pk] = dict.fromkeys(disciplines)
 
-				professeur.disciplines.set(disciplines)
 				self.professeurs[individu_id] = professeur
 
 			elif fonction == "DIR":
-				user, _ = User.objects.update_or_create(
+				user, _ = User.objects.get_or_create(
 						last_name=nom,
 						first_name=prenom,
-						defaults={
-							'last_name': nom,
-							'first_name': prenom,
-							'sexe': sexe,
-							})
+						defaults={'sexe': sexe})
+				if user.sexe != sexe:
+					user.sexe = sexe
+					user.save(update_fields=['sexe'])
 				perm_direction = Permission.objects.get(codename='direction',
 						content_type=ContentType.objects.get_for_model(User))
 				user.user_permissions.add(perm_direction)
 
+		Discipline.objects.bulk_create(nouvelles_disciplines.values())
+		if professeurs_modifies:
+			Professeur.objects.bulk_update(professeurs_modifies,
+					sorted(champs_modifies))
+		DisciplineProfesseur.objects.filter(pk__in=liens_a_supprimer).delete()
+		DisciplineProfesseur.objects.bulk_create(liens_a_creer)
+
+		# Les enregistrements en bloc n'envoient pas de signal : on
+		# invalide explicitement les menus des professeurs modifiés.
+		invalider('navigation', *[prof.pk for prof in professeurs_modifies])
+
+		return len(self.sts['individus'])
+
 	def import_colles(self):
-		if not self.nomenclature_colles_et:
+		if not self.nomenclature_colles:
 			return
 
-		for colle_et in self.nomenclature_colles_et.getroot().findall('colles/colle'):
-			nomenclature_id = colle_et.attrib['id']
-			mefs = [x.text for x in colle_et.findall('codes_mefs/code_mef')]
-			matieres = [x.text for x in colle_et.findall('codes_matieres/code_matiere')]
-			duree = isodate.parse_duration(colle_et.find('duree').text)
+		for colle_xml in self.nomenclature_colles['colles']:
+			nomenclature_id = colle_xml.id
+			mefs = colle_xml.mefs
+			matieres = colle_xml.matieres
+			duree = isodate.parse_duration(colle_xml.duree)
 
-			periode_et = colle_et.find('periode')
-			if periode_et is None:
+			if colle_xml.periode is None:
 				periode = CollesEnseignement.PERIODE_ANNEE
-			elif periode_et.text == 'premiere_periode':
+			elif colle_xml.periode == 'premiere_periode':
 				periode = CollesEnseignement.PERIODE_PREMIERE
-			elif periode_et.text == 'deuxieme_periode':
+			elif colle_xml.periode == 'deuxieme_periode':
 				periode = CollesEnseignement.PERIODE_DEUXIEME
 
-			try:
-				nom_enveloppe = colle_et.find('nom').text
-			except:
-				nom_enveloppe = ''
+			nom_enveloppe = colle_xml.nom or ''
 
-			frequence_text = colle_et.find('frequence').text
+			frequence_text = colle_xml.frequence
 			if frequence_text == 'hebdomadaire':
 				frequence = CollesEnseignement.FREQUENCE_HEBDOMADAIRE
 			elif frequence_text == 'trimestrielle':
 				frequence = CollesEnseignement.FREQUENCE_TRIMESTRIELLE
 
 			mode_defaut = CollesEnseignement.MODE_INTERROGATION
-			try:
-				if colle_et.find('mode_defaut').text == 'travaux_diriges':
-					mode_defaut = CollesEnseignement.MODE_TD
-			except:
-				pass
+			if colle_xml.mode_defaut == 'travaux_diriges':
+				mode_defaut = CollesEnseignement.MODE_TD
 
 			for classe in Classe.all_objects.filter(mef__code_mef__in=mefs,
 					annee=self.annee):
@@ -1444,3 +2148,171 @@ class BEEImporter:
 						colles_ens.save()
 
 					colles_ens.enseignements.set(enseignements)
+
+		return len(self.nomenclature_colles['colles'])
+
+# Nomenclature des dotations en colles, ajoutée à chaque import
+NOMENCLATURE_COLLES = os.path.join(settings.BASE_DIR,
+		'pykol/data/NomenclatureColles.xml')
+
+def ouvrir_fichier_bee(fichier):
+	"""
+	Ouvre un fichier envoyé depuis SIECLE ou STS. Ces fichiers sont
+	fournis soit directement au format XML, soit dans une archive ZIP
+	dont on lit alors le premier fichier.
+	"""
+	try:
+		fzip = zipfile.ZipFile(fichier)
+		return fzip.open(fzip.namelist()[0])
+	except zipfile.BadZipFile:
+		fichier.seek(0)
+		return fichier
+
+def verifier_xml(fichier):
+	"""
+	Vérifie, en le lisant en flux, qu'un fichier envoyé depuis SIECLE
+	ou STS (XML ou archive ZIP) contient un XML bien formé, et renvoie
+	le nom de sa balise racine. Le fichier est ensuite replacé à son
+	début, pour être enregistré par lancer_import.
+
+	Cette fonction lève une exception ValueError si le fichier n'est
+	pas lisible.
+	"""
+	racine = None
+	xml = fichier
+	try:
+		xml = ouvrir_fichier_bee(fichier)
+		pile = []
+		for evenement, elem in ET.iterparse(xml, events=('start', 'end')):
+			if evenement == 'start':
+				if racine is None:
+					racine = elem.tag
+				pile.append(elem)
+				continue
+
+			pile.pop()
+			if pile:
+				pile[-1].remove(elem)
+
+	except (ET.ParseError, IndexError, zipfile.BadZipFile):
+		raise ValueError('xml-invalide', fichier)
+
+	finally:
+		if xml is not fichier:
+			xml.close()
+		fichier.seek(0)
+
+	return racine
+
+def executer_import(import_pk):
+	"""
+	Exécute les étapes d'un import SIECLE/STS qui ne sont pas encore
+	terminées.
+
+	Chaque étape est validée dans sa propre transaction, avec la ligne
+	ImportBeeEtape qui enregistre sa durée et le nombre
+	d'enregistrements traités, ou bien qu'elle a été ignorée car ses
+	fichiers n'ont pas changé depuis le dernier import.
+
+	En cas d'erreur, l'import est marqué en erreur sur l'étape qui a
+	échoué : un nouvel appel reprend l'import à cette étape.
+	"""
+	import_bee = ImportBee.objects.get(pk=import_pk)
+	try:
+		with battement(ImportBee, import_pk):
+			_executer_etapes(import_bee)
+
+	except Exception as e:
+		logger.exception("Erreur lors de l'import SIECLE/STS %d",
+			import_pk)
+		ImportBee.objects.filter(pk=import_pk).update(
+			etat=ImportBee.ETAT_ERREUR, date_fin=timezone.now(),
+			erreur=str(e))
+
+	import_bee.refresh_from_db()
+	return import_bee
+
+def _executer_etapes(import_bee):
+	import_pk = import_bee.pk
+	fichiers = []
+	try:
+		terminees = dict(import_bee.etapes.values_list('etape', 'ignoree'))
+
+		for fichier in import_bee.fichiers():
+			fichier.open('rb')
+			fichiers.append(fichier)
+		xmls = [ouvrir_fichier_bee(fichier) for fichier in fichiers]
+		colles = open(NOMENCLATURE_COLLES, 'rb')
+		fichiers.append(colles)
+		xmls.append(colles)
+
+		importer = BEEImporter(*xmls)
+		importer.restaurer(terminees)
+		importer.etapes_executees = set(etape
+				for etape, ignoree in terminees.items() if not ignoree)
+
+		for etape, _ in ETAPES_IMPORT_BEE:
+			if etape in terminees:
+				continue
+
+			ImportBee.objects.filter(pk=import_pk).update(
+				etat=ImportBee.ETAT_EN_COURS, etape=etape)
+			debut = timezone.now()
+			with transaction.atomic():
+				nb_lignes = importer.executer_etape(etape,
+						import_bee.forcer)
+				ImportBeeEtape.objects.create(import_bee=import_bee,
+					etape=etape, date_debut=debut,
+					duree=timezone.now() - debut,
+					nb_lignes=nb_lignes or 0,
+					ignoree=nb_lignes is None)
+
+		ImportBee.objects.filter(pk=import_pk).update(
+			etat=ImportBee.ETAT_TERMINE, etape='',
+			date_fin=timezone.now(), erreur='')
+
+	finally:
+		for fichier in fichiers:
+			fichier.close()
+
+def _executer_import(import_pk):
+	try:
+		executer_import(import_pk)
+	finally:
+		connections.close_all()
+
+def _demarrer_import(import_bee):
+	transaction.on_commit(lambda: threading.Thread(
+		target=_executer_import, args=(import_bee.pk,),
+		daemon=True).start())
+
+def lancer_import(utilisateur, fichiers, forcer=False):
+	"""
+	Crée un import à partir des fichiers envoyés et le lance dans un fil
+	d'exécution séparé, après la validation de la transaction en cours.
+
+	Le dictionnaire fichiers associe à chaque nom de champ de ImportBee
+	(fichier_sts, fichier_eleves, etc.) le fichier envoyé. Ces fichiers
+	sont enregistrés dans l'espace de stockage privé. Si forcer est
+	vrai, toutes les étapes sont exécutées, même celles dont les
+	fichiers n'ont pas changé depuis le dernier import.
+	"""
+	import_bee = ImportBee(utilisateur=utilisateur, forcer=forcer)
+	for champ, fichier in fichiers.items():
+		getattr(import_bee, champ).save(fichier.name, fichier, save=False)
+	import_bee.save()
+	_demarrer_import(import_bee)
+	return import_bee
+
+def reprendre_import(import_bee):
+	"""
+	Relance un import en erreur à partir de l'étape qui a échoué.
+	"""
+	import_bee.etat = ImportBee.ETAT_ATTENTE
+	import_bee.erreur = ''
+	import_bee.date_fin = None
+	import_bee.date_activite = timezone.now()
+	import_bee.save(update_fields=('etat', 'erreur', 'date_fin',
+		'date_activite'))
+	_demarrer_import(import_bee)
+	return import_bee
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Outils de mise en cache de données calculées.
+
+Les données mises en cache sont regroupées en espaces (par exemple
+'resultats'), eux-mêmes découpés selon un identifiant (par exemple la
+clé primaire d'une classe). Chaque couple (espace, identifiant) possède
+un numéro de version, qui fait partie de la clé de toutes les entrées
+de cache correspondantes. Invalider un identifiant revient à
+incrémenter ce numéro : les anciennes entrées ne sont alors plus jamais
+lues et finissent par expirer d'elles-mêmes.
+
+Ce fonctionnement ne nécessite que les opérations get, add, set et incr
+du cache de Django. Il convient donc aussi bien au cache en mémoire
+locale qu'au cache sur fichiers.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+PREFIXE = 'pykol'
+
+# Identifiant dont la version est commune à tous les objets d'un espace
+TOUS = 'tous'
+
+def cle_cache(*parties):
+	"""
+	Construit une clé de cache à partir des éléments donnés.
+
+	Les clés trop longues sont remplacées par leur empreinte, afin de
+	respecter les limites de longueur de certains systèmes de cache.
+	"""
+	cle = ':'.join([PREFIXE] + [str(partie) for partie in parties])
+	if len(cle) > 200:
+		cle = '{}:{}'.format(PREFIXE,
+			hashlib.sha1(cle.encode('utf-8')).hexdigest())
+	return cle
+
+def version(espace, ident):
+	"""
+	Renvoie le numéro de version courant du couple (espace, ident).
+
+	Lorsque le numéro n'existe pas encore dans le cache (ou qu'il en a
+	été évincé), il est initialisé à partir de l'heure courante en
+	nanosecondes. Un numéro ainsi créé ne peut donc pas coïncider avec
+	celui d'une entrée périmée qui serait encore dans le cache.
+	"""
+	cle = cle_cache(espace, 'version', ident)
+	numero = cache.get(cle)
+	if numero is None:
+		numero = time.time_ns()
+		if not cache.add(cle, numero, timeout=None):
+			numero = cache.get(cle, numero)
+	return numero
+
+def versions(espace, idents):
+	"""
+	Renvoie le dictionnaire qui associe à chacun des identifiants donnés
+	son numéro de version courant dans l'espace espace. Les numéros
+	présents dans le cache sont lus en une seule opération.
+	"""
+	cles = {cle_cache(espace, 'version', ident): ident for ident in idents}
+	numeros = cache.get_many(cles.keys())
+	return {ident: numeros[cle] if cle in numeros else version(espace, ident)
+		for cle, ident in cles.items()}
+
+def invalider(espace, *idents):
+	"""
+	Invalide toutes les entrées du cache associées aux identifiants
+	donnés dans l'espace espace.
+
+	L'invalidation a lieu à la validation de la transaction en cours,
+	afin qu'une autre requête ne puisse pas remettre en cache des
+	données calculées avant la modification.
+	"""
+	def incrementer():
+		for ident in idents:
+			try:
+				cache.incr(cle_cache(espace, 'version', ident))
+			except ValueError:
+				# Aucune version en cache : la prochaine version créée
+				# sera de toute façon nouvelle.
+				pass
+	transaction.on_commit(incrementer)
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Import d'un colloscope au format OpenDocument
+
+L'import se fait en trois temps :
+- lecture du tableur, qui construit en mémoire l'état souhaité du
+  colloscope (la liste des groupes pour chaque créneau et chaque
+  semaine) ;
+- comparaison de cet état avec les colles et les ColleDetails déjà
+  présents dans la base de données ;
+- application des seules différences, avec des insertions et des mises
+  à jour groupées, puis une unique passe de comptabilisation pour
+  toutes les colles modifiées.
+
+Ceci évite de recalculer un par un les détails et les mouvements
+comptables de chaque colle, ce qui était beaucoup trop lent pour un
+colloscope complet sur une année.
+"""
+
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+from itertools import zip_longest, islice
+
+from django.db import transaction
+
+from pykol.models import constantes
+from pykol.models.base import Professeur
+from pykol.models.colles import Colle, ColleDetails, Trinome
+from pykol.models.comptabilite import CompteDecouvert
+from pykol.lib.odftools import iter_rows
+
+class ColloscopeImporter:
+	"""
+	Classe qui gère l'import d'un colloscope au format OpenDocument
+	pour une classe donnée.
+
+	Le fichier doit avoir le même format que celui produit par la vue
+	colloscope_odf.
+	"""
+	# Colonnes fixées par l'export ODF, après la colonne des numéros de
+	# créneaux.
+	NB_ENTETES_FIXES = 5
+
+	# États des colles que l'import a le droit de modifier ou de
+	# supprimer.
+	ETATS_MODIFIABLES = (Colle.ETAT_PREVUE, Colle.ETAT_BROUILLON)
+
+	# Champs de Colle mis à jour par l'import
+	CHAMPS_COLLE = ('classe_id', 'creneau_id', 'semaine_id', 'groupe_id',
+			'enseignement_id', 'colles_ens_id', 'duree', 'mode')
+
+	def __init__(self, classe):
+		self.classe = classe
+
+		self.semaines = list(classe.semaine_set.order_by('debut'))
+		self.creneaux = dict([(c.pk, c) for c in
+			classe.creneau_set.select_related('colleur', 'colles_ens',
+				'enseignement')])
+		self.groupes = {
+			constantes.PERIODE_PREMIERE:
+				dict([(g.nom, g) for g in classe.trinomes.filter(
+					periode__in=(constantes.PERIODE_ANNEE,
+						constantes.PERIODE_PREMIERE)
+				)]),
+			constantes.PERIODE_DEUXIEME:
+				dict([(g.nom, g) for g in classe.trinomes.filter(
+					periode__in=(constantes.PERIODE_ANNEE,
+						constantes.PERIODE_DEUXIEME)
+				)]),
+		}
+
+		# Le calcul de la période d'une semaine nécessite de parcourir
+		# le calendrier de l'année, on ne le fait qu'une fois.
+		self.periodes = dict([(s.pk, s.periode) for s in self.semaines])
+
+		# Dictionnaire qui à chaque couple (créneau, semaine) présent
+		# dans le fichier associe la liste des trinômes qui doivent
+		# passer la colle.
+		self.cible = OrderedDict()
+
+		# Liste des erreurs rencontrées lors de l'import du fichier.
+		# C'est un triplet de la forme (code_erreur, (ligne, colonne),
+		# message), où ligne, colonne et/ou leur couple peuvent être
+		# None si l'erreur ne concerne pas une position particulière
+		# dans le fichier.
+		self.erreurs = []
+
+		# Position dans le fichier de chaque case, pour pouvoir
+		# signaler les erreurs détectées après la lecture.
+		self.positions = {}
+
+		# Modifications calculées par calculer_modifications()
+		self.a_creer = []
+		self.a_modifier = []
+		self.a_supprimer = []
+
+	def lire_ods(self, fichier):
+		"""
+		Lecture du fichier OpenDocument et construction de l'état cible
+		du colloscope. Cette méthode ne modifie pas la base de données.
+		"""
+		# On lit une colonne de plus que les semaines du colloscope,
+		# afin de détecter du contenu placé au-delà de la dernière
+		# semaine.
+		nb_colonnes = 1 + self.NB_ENTETES_FIXES + len(self.semaines) + 1
+		lignes = iter_rows(fichier, max_columns=nb_colonnes)
+
+		for ligne_num, ligne in islice(enumerate(lignes), 2, None):
+			try:
+				# On ignore les lignes qui commencent par un numéro
+				# vide.
+				creneau_text = ligne[0].text.strip()
+				if not creneau_text:
+					continue
+				id_creneau = int(creneau_text)
+				creneau = self.creneaux[id_creneau]
+			except (IndexError, ValueError, KeyError):
+				self.erreurs.append(('creneau_invalide',
+					(ligne_num, 0),
+					"La valeur n'est pas un numéro de créneau "
+					"valide pour cette classe."))
+				continue
+
+			# On ignore les colonnes fixes suivantes
+			cells = ligne[1 + self.NB_ENTETES_FIXES:]
+
+			# Et on arrive aux semaines
+			for sem_num, (sem_cell, semaine) in enumerate(
+					zip_longest(cells, self.semaines)):
+				position = (ligne_num, sem_num + self.NB_ENTETES_FIXES)
+
+				if sem_cell is None:
+					groupes_text = ''
+				else:
+					groupes_text = sem_cell.text.strip()
+
+				if semaine is None:
+					# On trouve du contenu dans une case qui ne
+					# correspond à aucune semaine du colloscope. On
+					# signale l'erreur. Si le contenu de la case est
+					# vide, on ne signale rien : c'est juste un reliquat
+					# fantôme du tableur.
+					if groupes_text:
+						self.erreurs.append(('semaine_invalide',
+							position,
+							"Case située au-delà de la dernière "
+							"semaine de colles."))
+
+					# Il n'y a plus aucune semaine intéressante à
+					# attendre sur cette ligne.
+					break
+
+				trinomes = []
+				for num_groupe in groupes_text.split(","):
+					num_groupe = num_groupe.strip()
+					if not num_groupe:
+						continue
+
+					try:
+						trinome = self.groupes[self.periodes[semaine.pk]][num_groupe]
+					except KeyError:
+						self.erreurs.append(('groupe_invalide',
+							position,
+							"Identifiant de groupe de colle "
+							"inconnu."))
+						continue
+
+					if trinome not in trinomes:
+						trinomes.append(trinome)
+
+				self.cible[(creneau, semaine)] = trinomes
+				self.positions[(creneau, semaine)] = position
+
+	def _valeurs_cibles(self, colle, creneau, semaine, trinome,
+			ancien_detail, ancien_eleves, ancien_colleur_id,
+			etudiants_trinomes):
+		"""
+		Calcule les valeurs que doit prendre une colle (éventuellement
+		nouvelle) pour correspondre au créneau, à la semaine et au
+		trinôme donnés.
+
+		Les règles suivies sont celles de Colle.ajout_details :
+		lorsque le créneau ne précise pas le colleur, ou que le trinôme
+		est vide, on reprend les informations du ColleDetails actuel.
+		"""
+		avant = [getattr(colle, champ) for champ in self.CHAMPS_COLLE]
+
+		colle.classe = self.classe
+		colle.creneau = creneau
+		colle.semaine = semaine
+		colle.groupe = trinome
+		for champ, valeur in creneau.basecolle_fields().items():
+			setattr(colle, champ, valeur)
+
+		horaire = semaine.horaire_creneau(creneau)
+		colleur_id = creneau.colleur_id or ancien_colleur_id
+		eleves = etudiants_trinomes[trinome.pk] or ancien_eleves
+
+		salle = creneau.salle
+		if ancien_detail is None:
+			action_detail = 'creer'
+		else:
+			if not salle and horaire == ancien_detail.horaire:
+				salle = ancien_detail.salle
+
+			detail_modifie = colleur_id != ancien_detail.colleur_id or \
+					eleves != ancien_eleves or \
+					horaire != ancien_detail.horaire
+
+			if not detail_modifie and not ancien_detail.salle and salle:
+				action_detail = 'salle'
+			elif detail_modifie or ancien_detail.salle != salle:
+				action_detail = 'creer'
+			else:
+				action_detail = None
+
+		if colle.mode == Colle.MODE_TD:
+			colle.duree = \
+					datetime.combine(datetime.min, creneau.fin) - \
+					datetime.combine(datetime.min, creneau.debut)
+			duree_interrogation = colle.duree
+		else:
+			colle.duree = colle.duree_pour_effectif(len(eleves))
+			duree_interrogation = len(eleves) * colle.get_duree_etudiant()
+
+		return {
+			'colle_modifiee': avant != [getattr(colle, champ)
+				for champ in self.CHAMPS_COLLE],
+			'horaire': horaire,
+			'salle': salle,
+			'colleur_id': colleur_id,
+			'eleves': eleves,
+			'action_detail': action_detail,
+			'duree_interrogation': duree_interrogation,
+		}
+
+	def calculer_modifications(self, supprimer=False):
+		"""
+		Compare l'état cible lu dans le fichier avec les colles
+		existantes, et détermine les colles à créer, à modifier et à
+		supprimer.
+
+		Si le paramètre supprimer vaut True, toutes les colles pas
+		encore effectuées de la classe qui ne figurent pas dans le
+		fichier sont supprimées. Sinon, seules les cases présentes dans
+		le fichier sont mises à jour.
+		"""
+		colles = list(Colle.all_objects.filter(classe=self.classe
+			).select_related('colles_ens', 'classe'))
+
+		details = dict([(d.colle_id, d) for d in
+			ColleDetails.objects.filter(colle__classe=self.classe,
+				actif=True)])
+		eleves_details = defaultdict(set)
+		for detail_id, etudiant_id in ColleDetails.eleves.through.objects.filter(
+				colledetails__colle__classe=self.classe,
+				colledetails__actif=True).values_list(
+						'colledetails_id', 'etudiant_id'):
+			eleves_details[detail_id].add(etudiant_id)
+
+		etudiants_trinomes = defaultdict(set)
+		for trinome_id, etudiant_id in Trinome.etudiants.through.objects.filter(
+				trinome__classe=self.classe).values_list(
+						'trinome_id', 'etudiant_id'):
+			etudiants_trinomes[trinome_id].add(etudiant_id)
+
+		# Répartition des colles existantes par case du colloscope
+		colles_cases = defaultdict(list)
+		for colle in colles:
+			colles_cases[(colle.creneau_id, colle.semaine_id)].append(colle)
+
+		def ancien(colle):
+			detail = details.get(colle.pk)
+			if detail is None:
+				return (None, set(), None)
+			return (detail, eleves_details[detail.pk], detail.colleur_id)
+
+		conservees = set()
+		for (creneau, semaine), trinomes in self.cible.items():
+			colles_case = sorted(colles_cases[(creneau.pk, semaine.pk)],
+					key=lambda c: c.pk)
+
+			if trinomes and (creneau.colles_ens is None or
+					creneau.colles_ens.compte_colles_id is None):
+				self.erreurs.append(('update_echoue',
+					self.positions[(creneau, semaine)],
+					"Ce créneau n'est rattaché à aucune dotation de "
+					"colles."))
+				continue
+
+			# Les colles déjà présentes pour un trinôme demandé sont
+			# conservées, y compris lorsqu'elles ont été annulées : le
+			# trinôme est alors considéré comme déjà servi, et aucune
+			# nouvelle colle ne lui est attribuée. Les colles effectuées
+			# ou annulées ne sont jamais modifiées, et une colle annulée
+			# n'est jamais supprimée.
+			trinomes_pks = dict([(t.pk, t) for t in trinomes])
+			restants = set()
+			libres = []
+			for colle in colles_case:
+				if colle.groupe_id in trinomes_pks and \
+						colle.groupe_id not in restants:
+					restants.add(colle.groupe_id)
+					conservees.add(colle.pk)
+					if colle.etat in self.ETATS_MODIFIABLES:
+						self.a_modifier.append((colle, creneau,
+							semaine, trinomes_pks[colle.groupe_id]))
+				elif colle.etat == Colle.ETAT_ANNULEE:
+					conservees.add(colle.pk)
+				elif colle.etat in self.ETATS_MODIFIABLES:
+					libres.append(colle)
+				else:
+					conservees.add(colle.pk)
+
+			# Les autres trinômes réutilisent d'abord les colles libres
+			# de la case (ceci correspond à un changement de groupe sur
+			# une colle), et on crée de nouvelles colles ensuite.
+			nouveaux = [t for t in trinomes if t.pk not in restants]
+			for trinome, colle in zip_longest(nouveaux, libres):
+				if trinome is None:
+					continue
+				if colle is None:
+					self.a_creer.append((Colle(), creneau, semaine,
+						trinome))
+				else:
+					conservees.add(colle.pk)
+					self.a_modifier.append((colle, creneau, semaine,
+						trinome))
+
+		cases_fichier = set((creneau.pk, semaine.pk)
+				for (creneau, semaine) in self.cible)
+		for colle in colles:
+			if colle.pk in conservees:
+				continue
+			if (colle.creneau_id, colle.semaine_id) in cases_fichier:
+				self.a_supprimer.append(colle)
+			elif supprimer and colle.etat in self.ETATS_MODIFIABLES:
+				self.a_supprimer.append(colle)
+
+		# Calcul des valeurs cibles de chaque colle créée ou modifiée
+		colleurs_ids = set(d.colleur_id for d in details.values())
+		colleurs_ids.update(c.colleur_id for c in self.creneaux.values())
+		self.comptes_prevus = dict(Professeur.objects.filter(
+			pk__in=colleurs_ids).values_list('pk', 'compte_prevu_id'))
+
+		self.cibles = []
+		for colle, creneau, semaine, trinome in self.a_creer + self.a_modifier:
+			if colle.pk is None:
+				anciens = (None, set(), None)
+			else:
+				anciens = ancien(colle)
+			valeurs = self._valeurs_cibles(colle, creneau, semaine,
+					trinome, *anciens,
+					etudiants_trinomes=etudiants_trinomes)
+
+			if valeurs['colleur_id'] is None:
+				self.erreurs.append(('update_echoue',
+					self.positions[(creneau, semaine)],
+					"Aucun colleur n'est indiqué pour ce créneau."))
+				continue
+
+			self.cibles.append((colle, anciens[0], valeurs))
+
+	@transaction.atomic
+	def appliquer(self):
+		"""
+		Enregistre dans la base de données les modifications calculées
+		par calculer_modifications().
+
+		Cette méthode peut lever l'exception CompteDecouvert si la
+		comptabilisation des colles dépasse le découvert autorisé d'un
+		compte. Dans ce cas, aucune modification n'est conservée.
+		"""
+		nom_classe = str(self.classe)
+
+		# Création et mise à jour des colles
+		nouvelles = [colle for colle, _, _ in self.cibles
+				if colle.pk is None]
+		Colle.all_objects.bulk_update([colle
+			for colle, _, valeurs in self.cibles
+			if colle.pk is not None and valeurs['colle_modifiee']],
+			[champ[:-3] if champ.endswith('_id') else champ
+				for champ in self.CHAMPS_COLLE])
+		Colle.all_objects.bulk_create(nouvelles)
+
+		# Mise à jour des détails
+		details_salle = []
+		details_nouveaux = []
+		for colle, ancien_detail, valeurs in self.cibles:
+			if valeurs['action_detail'] == 'salle':
+				ancien_detail.salle = valeurs['salle']
+				details_salle.append(ancien_detail)
+			elif valeurs['action_detail'] == 'creer':
+				details_nouveaux.append((ColleDetails(colle=colle,
+					horaire=valeurs['horaire'],
+					salle=valeurs['salle'],
+					colleur_id=valeurs['colleur_id']),
+					valeurs['eleves']))
+
+		ColleDetails.objects.bulk_update(details_salle, ('salle',))
+		Colle.invalider_calendrier(*set(colle.pk
+			for colle, _, valeurs in self.cibles
+			if colle.pk is not None and (valeurs['colle_modifiee'] or
+				valeurs['action_detail'] == 'salle')))
+		Colle.all_objects.ajout_details_lot(details_nouveaux)
+
+		# Comptabilité : on renvoie sur le compte de la matière les
+		# heures des colles supprimées ou dont la dotation change, puis
+		# on crée les nouveaux virements.
+		Colle.all_objects.comptabiliser_lot([(colle,
+			self.comptes_prevus[valeurs['colleur_id']],
+			valeurs['duree_interrogation'],
+			"Colle du {date} en {classe}".format(
+				date=valeurs['horaire'], classe=nom_classe))
+			for colle, _, valeurs in self.cibles],
+			annulations=[colle for colle in self.a_supprimer
+				if colle.etat in self.ETATS_MODIFIABLES])
+
+		Colle.all_objects.filter(pk__in=[c.pk for c in self.a_supprimer]
+				).delete()
+
+	def importer(self, fichier, supprimer=False):
+		"""
+		Réalise toutes les étapes de l'import. Les modifications ne
+		sont enregistrées que si aucune erreur n'a été détectée.
+		"""
+		self.lire_ods(fichier)
+		if self.erreurs:
+			return
+
+		self.calculer_modifications(supprimer=supprimer)
+		if self.erreurs:
+			return
+
+		try:
+			self.appliquer()
+		except CompteDecouvert:
+			self.erreurs.append(('compte_decouvert', None,
+				"Les colles du fichier dépassent la dotation "
+				"disponible pour cette classe."))
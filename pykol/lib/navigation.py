@@ -16,10 +16,49 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+"""
+Menu de navigation de pyKol.
+
+Le menu est décrit une fois pour toutes par des NavigationItem. Pour un
+utilisateur donné, il est résolu en un arbre de NavigationEntree, qui
+ne contient plus que les entrées autorisées et leurs liens. Cet arbre
+est conservé dans le cache de Django, avec une clé qui dépend de deux
+numéros de version de l'espace 'navigation' : celui de l'utilisateur,
+incrémenté lorsque ses groupes, ses permissions ou ses classes changent,
+et un numéro commun à tous les utilisateurs.
+"""
+
+from collections import namedtuple
 import copy
+from datetime import date
 from importlib import import_module
+
+from django.core.cache import cache
 from django.urls import reverse
 
+from pykol.lib.cache import cle_cache, version, TOUS
+
+# Durée maximale de conservation d'un menu dans le cache, en secondes
+DUREE_CACHE = 24 * 3600
+
+# Entrée résolue du menu pour un utilisateur. Le champ link vaut None
+# lorsque l'entrée n'est pas un lien, et le champ children est le tuple
+# des entrées filles.
+NavigationEntree = namedtuple('NavigationEntree',
+		('label', 'link', 'icon', 'children'))
+
+def resolve(item_user):
+	"""
+	Construit le tuple des NavigationEntree correspondant aux enfants
+	autorisés d'un NavigationItemUser.
+	"""
+	return tuple(NavigationEntree(
+			label=child.label,
+			link=child.get_link(),
+			icon=child.icon,
+			children=resolve(child) if child.has_children() else ())
+		for child in item_user)
+
 class NavigationChildrenList:
 	def __init__(self, children_list):
 		self.children_list = children_list
@@ -59,7 +98,9 @@ class NavigationItem:
 		self.user_passes_test = user_passes_test
 		self.icon = icon
 		self.name = name
-		self.children = NavigationChildrenList(children)
+		# Copie de la liste, pour ne pas partager la valeur par défaut
+		# entre toutes les entrées.
+		self.children = NavigationChildrenList(list(children))
 		self.parent = None
 
 	def is_link(self):
@@ -148,6 +189,26 @@ class Navigation:
 	def get_for_user(self, user):
 		return self.root_item.get_for_user(user)
 
+	def get_tree_for_user(self, user):
+		"""
+		Renvoie le menu résolu pour l'utilisateur, sous la forme d'un
+		tuple de NavigationEntree, en le lisant dans le cache lorsque
+		c'est possible.
+		"""
+		if not user.is_authenticated:
+			return resolve(self.get_for_user(user))
+
+		# La date fait partie de la clé, car les classes affichées sont
+		# celles de l'année scolaire en cours.
+		cle = cle_cache('navigation', self.name, user.pk, date.today(),
+			version('navigation', TOUS),
+			version('navigation', user.pk))
+		arbre = cache.get(cle)
+		if arbre is None:
+			arbre = resolve(self.get_for_user(user))
+			cache.set(cle, arbre, DUREE_CACHE)
+		return arbre
+
 nav = Navigation()
 
 def tuple_flatten(tpl):
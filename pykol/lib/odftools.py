@@ -19,6 +19,24 @@
 """Fonctions utilitaires pour manipuler les documents au format
 OpenDocument."""
 
+from collections import namedtuple
+import datetime
+import decimal
+import io
+import mimetypes
+import os
+import re
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+import zipfile
+
+import odf.opendocument
+from odf.namespaces import nsdict, OFFICENS, TABLENS, TEXTNS, DRAWNS, \
+		XLINKNS
+from odf.element import Text
+from odf.draw import Frame
+from odf.text import UserFieldDecl, UserFieldGet
+from odf.table import Table
 from odf.text import P
 from odf.table import TableCell
 
@@ -49,3 +67,716 @@ def iter_columns(row):
 		repeat = int(cell.getAttribute('numbercolumnsrepeated') or 1)
 		for i in range(repeat):
 			yield(cell)
+
+# Écriture de classeurs OpenDocument en flux
+#
+# Les classes suivantes permettent de produire un classeur OpenDocument
+# sans construire l'arbre complet du document en mémoire : le fichier
+# content.xml est écrit ligne par ligne dans l'archive zip, qui est
+# elle-même renvoyée par morceaux au fur et à mesure de sa production.
+# Seuls les styles, peu nombreux, sont décrits à l'aide des éléments de
+# odfpy.
+
+SPREADSHEET_MIMETYPE = 'application/vnd.oasis.opendocument.spreadsheet'
+
+# Taille à partir de laquelle les données produites sont renvoyées
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class Cell:
+	"""
+	Case d'un tableau écrit en flux.
+
+	Le type de la valeur est déduit de value lorsque valuetype n'est
+	pas précisé : chaîne de caractères, nombre, date ou heure. Le texte
+	affiché est par défaut la représentation de la valeur. Le paramètre
+	style est un élément Style de odfpy ou directement le nom du style.
+	"""
+	__slots__ = ('value', 'valuetype', 'text', 'style', 'columnsspanned',
+			'rowsspanned', 'repeated')
+
+	def __init__(self, value=None, valuetype=None, text=None, style=None,
+			columnsspanned=1, rowsspanned=1, repeated=1):
+		self.value = value
+		self.valuetype = valuetype
+		self.text = text
+		self.style = style
+		self.columnsspanned = columnsspanned
+		self.rowsspanned = rowsspanned
+		self.repeated = repeated
+
+	def _attributes(self):
+		value = self.value
+		valuetype = self.valuetype
+		text = self.text
+
+		if valuetype is None and value is not None:
+			if isinstance(value, str):
+				valuetype = 'string'
+			elif isinstance(value, (int, float, decimal.Decimal)):
+				valuetype = 'float'
+			elif isinstance(value, datetime.time):
+				valuetype = 'time'
+			elif isinstance(value, datetime.date):
+				valuetype = 'date'
+			else:
+				valuetype = 'string'
+				value = str(value)
+
+		attributes = []
+		if self.style is not None:
+			attributes.append(('table:style-name', _style_name(self.style)))
+		if valuetype is not None:
+			attributes.append(('office:value-type', valuetype))
+
+		if valuetype == 'float':
+			attributes.append(('office:value', str(value)))
+			if text is None:
+				text = str(value)
+		elif valuetype == 'time':
+			if isinstance(value, datetime.time):
+				if text is None:
+					text = value.strftime("%H:%M")
+				value = value.strftime("PT%HH%MM%SS")
+			attributes.append(('office:time-value', value))
+		elif valuetype == 'date':
+			if isinstance(value, datetime.date):
+				if text is None:
+					text = value.strftime("%d/%m/%Y")
+				value = value.isoformat()
+			attributes.append(('office:date-value', value))
+		elif text is None and value is not None:
+			text = value
+
+		if self.columnsspanned != 1:
+			attributes.append(('table:number-columns-spanned',
+				str(self.columnsspanned)))
+		if self.rowsspanned != 1:
+			attributes.append(('table:number-rows-spanned',
+				str(self.rowsspanned)))
+		if self.repeated != 1:
+			attributes.append(('table:number-columns-repeated',
+				str(self.repeated)))
+
+		return attributes, text
+
+	def to_xml(self):
+		attributes, text = self._attributes()
+		res = '<table:table-cell' + ''.join([' {}={}'.format(nom,
+			quoteattr(valeur)) for nom, valeur in attributes])
+		if text is None:
+			return res + '/>'
+		return '{}><text:p>{}</text:p></table:table-cell>'.format(res,
+			escape(str(text)))
+
+class CoveredCell:
+	"""
+	Case d'un tableau recouverte par une case fusionnée.
+	"""
+	__slots__ = ('repeated',)
+
+	def __init__(self, repeated=1):
+		self.repeated = repeated
+
+	def to_xml(self):
+		if self.repeated == 1:
+			return '<table:covered-table-cell/>'
+		return '<table:covered-table-cell table:number-columns-repeated="{}"/>'.format(self.repeated)
+
+class Column:
+	"""
+	Description d'une colonne d'un tableau écrit en flux.
+	"""
+	__slots__ = ('style', 'repeated')
+
+	def __init__(self, style=None, repeated=1):
+		self.style = style
+		self.repeated = repeated
+
+	def to_xml(self):
+		res = '<table:table-column'
+		if self.style is not None:
+			res += ' table:style-name={}'.format(
+					quoteattr(_style_name(self.style)))
+		if self.repeated != 1:
+			res += ' table:number-columns-repeated="{}"'.format(self.repeated)
+		return res + '/>'
+
+class StreamingTable:
+	"""
+	Feuille d'un classeur écrit en flux.
+
+	Les lignes d'en-tête header_rows et les lignes rows sont des
+	itérables de cases. Une case peut être une instance de Cell ou de
+	CoveredCell, ou directement une valeur (None pour une case vide).
+	L'itérable rows n'est parcouru qu'au moment de l'écriture du
+	document : il peut s'agir d'un générateur.
+	"""
+	def __init__(self, name, columns=(), header_rows=(), rows=()):
+		self.name = name
+		self.columns = columns
+		self.header_rows = header_rows
+		self.rows = rows
+
+	@staticmethod
+	def _row_xml(row):
+		cells = []
+		for cell in row:
+			if not isinstance(cell, (Cell, CoveredCell)):
+				cell = Cell(cell)
+			cells.append(cell.to_xml())
+		return '<table:table-row>{}</table:table-row>'.format(''.join(cells))
+
+	def iter_xml(self):
+		"""
+		Itérateur sur les morceaux du code XML de la feuille.
+		"""
+		yield '<table:table table:name={}>{}'.format(
+			quoteattr(str(self.name)),
+			''.join([column.to_xml() for column in self.columns]))
+		if self.header_rows:
+			yield '<table:table-header-rows>{}</table:table-header-rows>'.format(
+				''.join([self._row_xml(row) for row in self.header_rows]))
+		for row in self.rows:
+			yield self._row_xml(row)
+		yield '</table:table>'
+
+class _StreamBuffer(io.RawIOBase):
+	"""
+	Fichier en écriture seule qui conserve les données écrites jusqu'à
+	ce qu'elles soient récupérées par pop().
+	"""
+	def __init__(self):
+		super().__init__()
+		self.chunks = []
+		self.size = 0
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.chunks.append(bytes(data))
+		self.size += len(data)
+		return len(data)
+
+	def pop(self):
+		data = b''.join(self.chunks)
+		self.chunks = []
+		self.size = 0
+		return data
+
+def _style_name(style):
+	if isinstance(style, str):
+		return style
+	return style.getAttribute('name')
+
+def _document_tags(root):
+	"""
+	Renvoie les balises ouvrante et fermante de l'élément racine d'un
+	fichier XML d'un document OpenDocument.
+	"""
+	return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+		'<office:{root} {namespaces} office:version="1.2">'.format(
+			root=root,
+			namespaces=' '.join(['xmlns:{}={}'.format(prefix, quoteattr(ns))
+				for ns, prefix in sorted(nsdict.items(),
+					key=lambda n: n[1])])),
+		'</office:{}>'.format(root))
+
+class StreamingSpreadsheet:
+	"""
+	Classeur OpenDocument écrit en flux.
+
+	Les styles sont des éléments de odfpy (Style, NumberStyle...),
+	ajoutés avant l'écriture avec add_style. Les feuilles, instances de
+	StreamingTable, sont ajoutées avec add_table. L'itération sur le
+	classeur produit le contenu du fichier .ods par morceaux.
+	"""
+	mimetype = SPREADSHEET_MIMETYPE
+
+	def __init__(self):
+		self.styles = []
+		self.tables = []
+
+	def add_style(self, style):
+		self.styles.append(style)
+		return style
+
+	def add_table(self, table):
+		self.tables.append(table)
+		return table
+
+	def _styles_xml(self):
+		buffer = io.StringIO()
+		for style in self.styles:
+			style.toXml(0, buffer)
+		return buffer.getvalue()
+
+	def __iter__(self):
+		buffer = _StreamBuffer()
+		with zipfile.ZipFile(buffer, 'w',
+				compression=zipfile.ZIP_DEFLATED) as archive:
+			archive.writestr(zipfile.ZipInfo('mimetype'), self.mimetype,
+					compress_type=zipfile.ZIP_STORED)
+			archive.writestr('META-INF/manifest.xml',
+				'<?xml version="1.0" encoding="UTF-8"?>\n'
+				'<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+				'<manifest:file-entry manifest:full-path="/" manifest:media-type="{}"/>'
+				'<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+				'<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>'
+				'</manifest:manifest>'.format(self.mimetype))
+			debut, fin = _document_tags('document-styles')
+			archive.writestr('styles.xml',
+				debut + '<office:styles/>' + fin)
+
+			content_info = zipfile.ZipInfo('content.xml')
+			content_info.compress_type = zipfile.ZIP_DEFLATED
+			with archive.open(content_info, 'w') as content:
+				debut, fin = _document_tags('document-content')
+				content.write((debut + '<office:automatic-styles>{}'
+					'</office:automatic-styles>'
+					'<office:body><office:spreadsheet>'.format(
+						self._styles_xml())).encode('utf-8'))
+				for table in self.tables:
+					for chunk in table.iter_xml():
+						content.write(chunk.encode('utf-8'))
+						if buffer.size >= STREAM_CHUNK_SIZE:
+							yield buffer.pop()
+				content.write(('</office:spreadsheet></office:body>'
+					+ fin).encode('utf-8'))
+		yield buffer.pop()
+
+# Lecture de classeurs OpenDocument en flux
+#
+# Plutôt que de charger l'arbre complet du document avec odfpy, on lit
+# content.xml avec iterparse et on renvoie les lignes d'une feuille au
+# fur et à mesure. Les cases vides répétées (que les tableurs ajoutent
+# volontiers en fin de ligne ou de feuille, parfois par milliers) ne
+# sont développées que si un contenu les suit.
+
+# Contenu d'une case lue : sa valeur typée (chaîne, nombre, date, heure
+# ou booléen) et son texte affiché.
+CellValue = namedtuple('CellValue', ('value', 'text'))
+
+# Case vide
+EMPTY_CELL = CellValue(None, '')
+
+_TAG_TABLE = '{{{}}}table'.format(TABLENS)
+_TAG_ROW = '{{{}}}table-row'.format(TABLENS)
+_TAG_CELL = '{{{}}}table-cell'.format(TABLENS)
+_TAG_COVERED_CELL = '{{{}}}covered-table-cell'.format(TABLENS)
+_TAG_P = '{{{}}}p'.format(TEXTNS)
+_TAG_S = '{{{}}}s'.format(TEXTNS)
+_TAG_TAB = '{{{}}}tab'.format(TEXTNS)
+_ATTR_VALUE_TYPE = '{{{}}}value-type'.format(OFFICENS)
+_ATTR_COLUMNS_REPEATED = '{{{}}}number-columns-repeated'.format(TABLENS)
+_ATTR_ROWS_REPEATED = '{{{}}}number-rows-repeated'.format(TABLENS)
+
+_DURATION_RE = re.compile(
+	r'^-?P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d*)?)S)?$')
+
+def _element_text(element):
+	"""
+	Texte d'un paragraphe, en tenant compte des espaces et tabulations
+	codés par des éléments.
+	"""
+	res = [element.text or '']
+	for child in element:
+		if child.tag == _TAG_S:
+			res.append(' ' * int(child.get('{{{}}}c'.format(TEXTNS), 1)))
+		elif child.tag == _TAG_TAB:
+			res.append('\t')
+		else:
+			res.append(_element_text(child))
+		res.append(child.tail or '')
+	return ''.join(res)
+
+def _parse_time(value):
+	"""
+	Convertit en heure la durée ISO 8601 d'une case de type time. Une
+	durée négative ou de 24 heures ou plus ne correspond à aucune heure
+	de la journée et lève une exception ValueError.
+	"""
+	match = _DURATION_RE.match(value)
+	if match is None or value.startswith('-'):
+		raise ValueError("Durée invalide : {}".format(value))
+	jours, heures, minutes, secondes = match.groups()
+	duree = datetime.timedelta(days=int(jours or 0),
+		hours=int(heures or 0), minutes=int(minutes or 0),
+		seconds=float(secondes or 0))
+	if duree >= datetime.timedelta(days=1):
+		raise ValueError("Durée invalide : {}".format(value))
+	return (datetime.datetime.min + duree).time()
+
+def _cell_value(cell):
+	"""
+	Renvoie le contenu CellValue d'une case, ou EMPTY_CELL si la case
+	est vide.
+	"""
+	text = ''.join([_element_text(p) for p in cell.findall(_TAG_P)])
+	valuetype = cell.get(_ATTR_VALUE_TYPE)
+
+	if valuetype in ('float', 'percentage', 'currency'):
+		value = float(cell.get('{{{}}}value'.format(OFFICENS)))
+	elif valuetype == 'time':
+		value = _parse_time(cell.get('{{{}}}time-value'.format(OFFICENS)))
+	elif valuetype == 'date':
+		date_value = cell.get('{{{}}}date-value'.format(OFFICENS))
+		if 'T' in date_value:
+			value = datetime.datetime.fromisoformat(date_value)
+		else:
+			value = datetime.date.fromisoformat(date_value)
+	elif valuetype == 'boolean':
+		value = cell.get('{{{}}}boolean-value'.format(OFFICENS)) == 'true'
+	else:
+		if not text:
+			return EMPTY_CELL
+		value = text
+
+	return CellValue(value, text)
+
+def iter_rows(fichier, max_columns=None, table_index=0):
+	"""
+	Itérateur sur les lignes d'une feuille d'un classeur OpenDocument.
+
+	Le paramètre fichier est un chemin ou un objet fichier ouvert en
+	lecture binaire. Chaque ligne est une liste de CellValue, les cases
+	vides valant EMPTY_CELL. Les cases recouvertes par une fusion sont
+	considérées comme vides.
+
+	Si max_columns est donné, seules les max_columns premières colonnes
+	sont lues et chaque ligne est complétée par des cases vides jusqu'à
+	cette largeur. Sinon, les cases vides en fin de ligne sont omises.
+	Les lignes vides en fin de feuille ne sont pas renvoyées.
+	"""
+	with zipfile.ZipFile(fichier) as archive, \
+			archive.open('content.xml') as content:
+		table_num = -1
+		empty_rows = 0
+		for event, element in ElementTree.iterparse(content,
+				events=('start', 'end')):
+			if event == 'start':
+				if element.tag == _TAG_TABLE:
+					table_num += 1
+				continue
+
+			if element.tag == _TAG_TABLE and table_num == table_index:
+				return
+
+			if element.tag != _TAG_ROW:
+				continue
+
+			if table_num != table_index:
+				element.clear()
+				continue
+
+			row = []
+			pending_empty = 0
+			for cell in element:
+				if max_columns is not None and \
+						len(row) + pending_empty >= max_columns:
+					break
+
+				if cell.tag == _TAG_CELL:
+					value = _cell_value(cell)
+				elif cell.tag == _TAG_COVERED_CELL:
+					value = EMPTY_CELL
+				else:
+					continue
+
+				repeat = int(cell.get(_ATTR_COLUMNS_REPEATED, 1))
+				if value is EMPTY_CELL:
+					pending_empty += repeat
+					continue
+
+				row.extend([EMPTY_CELL] * pending_empty)
+				pending_empty = 0
+				if max_columns is not None:
+					repeat = min(repeat, max_columns - len(row))
+				row.extend([value] * repeat)
+
+			rows_repeat = int(element.get(_ATTR_ROWS_REPEATED, 1))
+			element.clear()
+
+			if not row:
+				empty_rows += rows_repeat
+				continue
+
+			if max_columns is not None:
+				row.extend([EMPTY_CELL] * (max_columns - len(row)))
+
+			for _ in range(empty_rows):
+				yield [EMPTY_CELL] * (max_columns or 0)
+			empty_rows = 0
+
+			for _ in range(rows_repeat):
+				yield list(row)
+
+# Modèles de documents texte OpenDocument
+#
+# Un modèle est lu une seule fois avec odfpy, puis compilé sous la forme
+# d'une liste de morceaux de code XML entre lesquels s'intercalent des
+# emplacements : champs utilisateurs, fin de tableaux nommés et contenu
+# de cadres d'images nommés. Produire une copie du modèle revient alors
+# à concaténer des chaînes de caractères. Les copies sont placées les
+# unes à la suite des autres dans le corps d'un même document, qui ne
+# contient qu'une seule fois les styles et les déclarations du modèle.
+
+# Éléments de tête du corps d'un document texte, qui ne doivent figurer
+# qu'une seule fois dans le document produit.
+_BODY_DECLARATIONS = set([(TEXTNS, 'variable-decls'),
+	(TEXTNS, 'sequence-decls'), (TEXTNS, 'user-field-decls'),
+	(TEXTNS, 'dde-connection-decls'), (OFFICENS, 'forms'),
+	(TABLENS, 'calculation-settings'), (TABLENS, 'content-validations'),
+	(TABLENS, 'label-ranges')])
+
+_SLOT_MARK = '\ue000{}\ue001'
+_SLOT_RE = re.compile('\ue000(\\d+)\ue001')
+
+def _to_xml(element, level=1):
+	buffer = io.StringIO()
+	element.toXml(level, buffer)
+	return buffer.getvalue()
+
+class OdtTemplate:
+	"""
+	Modèle de document texte OpenDocument compilé.
+
+	Les champs utilisateurs dont le nom figure dans fields sont remplacés
+	par le texte fourni pour chaque copie et leurs déclarations sont
+	retirées. Le code XML fourni pour les tableaux de nom figurant dans
+	tables est ajouté à la fin de ces tableaux. L'image des cadres dont
+	le nom figure dans frames peut être remplacée par une image commune
+	à toutes les copies (voir OdtTemplateDocument.add_picture) ; les
+	autres éléments du cadre, comme son titre, sont conservés.
+	"""
+	_cache = {}
+
+	def __init__(self, path, fields=(), tables=(), frames=()):
+		self.path = path
+		with zipfile.ZipFile(path) as archive:
+			self.entries = [(info, archive.read(info))
+				for info in archive.infolist()
+				if info.filename not in ('mimetype', 'content.xml')]
+
+		document = odf.opendocument.load(path)
+		self.mimetype = document.getMediaType()
+
+		# Chaque emplacement est un triplet (type, nom, code XML
+		# d'origine) ; il est repéré dans le code XML par une marque
+		# contenant son indice.
+		self.slots = []
+
+		# Chemins dans l'archive des images d'origine de chaque cadre
+		self.frame_pictures = {}
+
+		def mark(kind, name, default):
+			self.slots.append((kind, name, default))
+			return Text(_SLOT_MARK.format(len(self.slots) - 1))
+
+		for field in document.getElementsByType(UserFieldGet)[:]:
+			name = field.getAttrNS(TEXTNS, 'name')
+			if name in fields:
+				field.parentNode.insertBefore(mark('field', name,
+					_to_xml(field)), field)
+				field.parentNode.removeChild(field)
+
+		for decl in document.getElementsByType(UserFieldDecl)[:]:
+			if decl.getAttrNS(TEXTNS, 'name') in fields:
+				decl.parentNode.removeChild(decl)
+
+		for table in document.getElementsByType(Table)[:]:
+			name = table.getAttrNS(TABLENS, 'name')
+			if name in tables:
+				table.appendChild(mark('table', name, ''))
+
+		for frame in document.getElementsByType(Frame)[:]:
+			name = frame.getAttrNS(DRAWNS, 'name')
+			if name in frames:
+				images = [child for child in frame.childNodes
+					if child.nodeType == child.ELEMENT_NODE
+						and child.qname == (DRAWNS, 'image')]
+				self.frame_pictures.setdefault(name, set()).update(
+					image.getAttrNS(XLINKNS, 'href') for image in images)
+				slot = mark('frame', name,
+					''.join([_to_xml(image) for image in images]))
+				if images:
+					frame.insertBefore(slot, images[0])
+				else:
+					frame.appendChild(slot)
+				for image in images:
+					frame.removeChild(image)
+
+		# Le contenu propre à chaque copie est le corps du document,
+		# sans les déclarations de tête.
+		text = document.text
+		body = ''.join([_to_xml(child, level=3)
+			for child in text.childNodes
+			if child.nodeType != child.ELEMENT_NODE
+				or child.qname not in _BODY_DECLARATIONS])
+		content = document.contentxml().decode('utf-8')
+		self.content_start, body_found, self.content_end = \
+			content.partition(body)
+		if not body_found:
+			raise ValueError("Impossible de repérer le corps du modèle "
+				"{}".format(path))
+
+		# Découpage du corps en morceaux : les indices pairs sont du
+		# code XML, les indices impairs des numéros d'emplacements.
+		self.parts = _SLOT_RE.split(body)
+		for i in range(1, len(self.parts), 2):
+			self.parts[i] = self.slots[int(self.parts[i])]
+
+		# Images des cadres également utilisées ailleurs dans le modèle,
+		# qu'il faut conserver même si les cadres reçoivent une autre
+		# image.
+		elsewhere = ''.join([self.content_start, self.content_end]
+			+ self.parts[::2] + [data.decode('utf-8', 'replace')
+				for info, data in self.entries
+				if info.filename == 'styles.xml'])
+		self.shared_pictures = set([href
+			for hrefs in self.frame_pictures.values() for href in hrefs
+			if href in elsewhere])
+
+	@classmethod
+	def load(cls, path, fields=(), tables=(), frames=()):
+		"""
+		Renvoie le modèle compilé du fichier path, en réutilisant la
+		compilation précédente si le fichier n'a pas été modifié depuis.
+		"""
+		key = (path, os.path.getmtime(path), tuple(fields), tuple(tables),
+			tuple(frames))
+		try:
+			return cls._cache[key]
+		except KeyError:
+			template = cls(path, fields=fields, tables=tables,
+				frames=frames)
+			cls._cache[key] = template
+			return template
+
+	def new_document(self):
+		return OdtTemplateDocument(self)
+
+class OdtTemplateDocument:
+	"""
+	Document texte formé de copies successives d'un modèle compilé.
+
+	La méthode save et la méthode getMediaType reprennent l'interface
+	des documents de odfpy, afin de pouvoir utiliser OdfResponse.
+	"""
+	def __init__(self, template):
+		self.template = template
+		self.body = []
+		self.pictures = {}
+		self.frames = {}
+
+	def add_picture(self, frame, filename):
+		"""
+		Place l'image du fichier filename dans les cadres de nom frame
+		de toutes les copies. L'image n'est stockée qu'une seule fois
+		dans le document.
+		"""
+		mediatype, _ = mimetypes.guess_type(filename)
+		_, ext = os.path.splitext(filename)
+		href = 'Pictures/{}{}'.format(frame, ext)
+		self.pictures[href] = (filename, mediatype or '')
+		self.frames[frame] = ('<draw:image xlink:href={} '
+			'xlink:type="simple" xlink:show="embed" '
+			'xlink:actuate="onLoad"{}/>'.format(quoteattr(href),
+				' draw:mime-type={}'.format(quoteattr(mediatype))
+				if mediatype else ''))
+
+	def _removed_pictures(self):
+		"""
+		Chemins des images du modèle qui ne figurent plus dans le
+		document : celles des cadres qui ont reçu une nouvelle image, à
+		moins qu'elles ne soient utilisées ailleurs, et celles qui
+		portent le nom d'une nouvelle image.
+		"""
+		replaced = set()
+		kept = set(self.template.shared_pictures)
+		for frame, hrefs in self.template.frame_pictures.items():
+			if frame in self.frames:
+				replaced.update(hrefs)
+			else:
+				kept.update(hrefs)
+		return (replaced - kept) | set(self.pictures)
+
+	def add_copy(self, fields=None, tables=None):
+		"""
+		Ajoute une copie du modèle à la fin du document.
+
+		Le paramètre fields associe aux noms des champs utilisateurs le
+		texte qui les remplace, tables associe aux noms des tableaux le
+		code XML des lignes à leur ajouter.
+		"""
+		self.body.append(self.render_copy(fields=fields, tables=tables))
+
+	def add_rendered_copy(self, xml):
+		"""
+		Ajoute à la fin du document une copie déjà produite par
+		render_copy, éventuellement par un autre document issu du même
+		modèle et portant les mêmes images.
+		"""
+		self.body.append(xml)
+
+	def render_copy(self, fields=None, tables=None):
+		"""
+		Renvoie le code XML d'une copie du modèle, sans l'ajouter au
+		document. Les paramètres sont ceux de add_copy.
+		"""
+		fields = fields or {}
+		tables = tables or {}
+		parts = []
+		for i, part in enumerate(self.template.parts):
+			if i % 2 == 0:
+				parts.append(part)
+				continue
+
+			kind, name, default = part
+			if kind == 'field':
+				if name in fields:
+					value = fields[name]
+					parts.append('<text:span>{}</text:span>'.format(
+						escape(str(value if value is not None else ''))))
+				else:
+					parts.append(default)
+			elif kind == 'table':
+				parts.append(tables.get(name, default))
+			else:
+				parts.append(self.frames.get(name, default))
+
+		return ''.join(parts)
+
+	def getMediaType(self):
+		return self.template.mimetype
+
+	def save(self, outputfp):
+		removed = self._removed_pictures()
+		manifest_entries = ''.join(['<manifest:file-entry '
+			'manifest:full-path={} manifest:media-type={}/>'.format(
+				quoteattr(href), quoteattr(mediatype))
+			for href, (_, mediatype) in self.pictures.items()])
+		removed_entries = re.compile('<manifest:file-entry[^>]*'
+			'manifest:full-path=(?:{})[^>]*/>'.format('|'.join(
+				[re.escape(quoteattr(href)) for href in removed])
+				or '(?!)'))
+
+		with zipfile.ZipFile(outputfp, 'w',
+				compression=zipfile.ZIP_DEFLATED) as archive:
+			archive.writestr(zipfile.ZipInfo('mimetype'),
+				self.template.mimetype, compress_type=zipfile.ZIP_STORED)
+			for info, data in self.template.entries:
+				if info.filename == 'META-INF/manifest.xml':
+					data = removed_entries.sub('',
+						data.decode('utf-8')).replace(
+						'</manifest:manifest>',
+						manifest_entries + '</manifest:manifest>'
+					).encode('utf-8')
+				elif info.filename in removed:
+					continue
+				archive.writestr(info.filename, data)
+			archive.writestr('content.xml',
+				(self.template.content_start + ''.join(self.body)
+				+ self.template.content_end).encode('utf-8'))
+			for href, (filename, _) in self.pictures.items():
+				archive.write(filename, href)
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Calcul des tableaux de résultats de colles d'une classe.
+
+Toutes les notes de la classe sont chargées en une seule requête sous
+forme de colonnes (indice de l'étudiant, indice de la semaine, valeur,
+type de note, enseignement). Les cellules du tableau, les moyennes et
+les moyennes par période de notation sont ensuite calculées en un seul
+parcours de ces colonnes, en accumulant dans des tableaux plats indexés
+par étudiant.
+
+Les tableaux calculés sont conservés dans le cache de Django. Toute
+modification d'une note, d'une colle, d'une semaine ou d'une période de
+notation invalide les tableaux de la classe concernée (voir le module
+pykol.signals).
+"""
+
+from array import array
+from collections import OrderedDict, namedtuple
+from datetime import datetime, time, timedelta
+from operator import attrgetter
+
+from django.core.cache import cache
+from django.db.models import Min
+from django.utils import timezone
+
+from pykol.models.base import Etudiant
+from pykol.models.colles import Semaine, ColleNote, Colle, \
+		ColleDetails, PeriodeNotation
+from pykol.models.fields import Moyenne, Note
+from pykol.lib.sortedcollection import SortedCollection
+from pykol.lib.cache import cle_cache, version
+
+SemaineTuple = namedtuple('SemaineTuple', ('debut', 'fin',
+	'numero'))
+
+# Ligne du tableau des résultats d'un étudiant. Le champ periodes est la
+# liste des moyennes sur chaque période de notation, le champ
+# rangs_periodes la liste des rangs correspondants et le champ notes
+# donne pour chaque semaine la liste des notes obtenues. Le rang vaut
+# None lorsque l'étudiant n'a aucune note comptée dans la moyenne.
+LigneResultats = namedtuple('LigneResultats', ('etudiant', 'moyenne',
+	'rang', 'periodes', 'rangs_periodes', 'notes'))
+
+# Durée maximale de conservation d'un tableau dans le cache, en secondes
+DUREE_CACHE = 24 * 3600
+
+class _EnAttente:
+	def __reduce__(self):
+		# Le marqueur reste unique après passage par le cache
+		return 'EN_ATTENTE'
+
+	def __repr__(self):
+		return 'EN_ATTENTE'
+
+# Marqueur placé dans les cellules pour une colle passée qui n'a pas
+# encore été notée.
+EN_ATTENTE = _EnAttente()
+
+class ResultatsEnseignement:
+	"""
+	Résultats des étudiants d'une classe dans un enseignement.
+
+	Les étudiants sont repérés par leur indice dans la liste etudiants,
+	les semaines par leur indice dans la liste des semaines du tableau
+	complet.
+	"""
+	def __init__(self, enseignement, etudiants, periodes, nb_semaines):
+		self.enseignement = enseignement
+		self.etudiants = etudiants
+		self.periodes = periodes
+		self.nb_semaines = nb_semaines
+
+		nb_etudiants = len(etudiants)
+		nb_moyennes = nb_etudiants * (len(periodes) + 1)
+
+		# Cellules non vides du tableau, indexées par
+		# etudiant * nb_semaines + semaine.
+		self.cellules = {}
+
+		# Accumulateurs des moyennes. La moyenne annuelle de l'étudiant
+		# i est à l'indice i, celle de la période p à l'indice
+		# (p + 1) * nb_etudiants + i.
+		self.points = array('d', [0.]) * nb_moyennes
+		self.nb_notes = array('l', [0]) * nb_moyennes
+		self.kinds = array('b', [0]) * nb_moyennes
+
+		# Rangs, indexés comme les accumulateurs. La valeur 0 indique un
+		# étudiant non classé.
+		self.rangs = array('l', [0]) * nb_moyennes
+
+	def _accumuler(self, indice, note):
+		"""
+		Ajoute une note à la moyenne d'indice donné, en suivant les
+		mêmes règles que Moyenne.__iadd__.
+		"""
+		if self.nb_notes[indice] == 0 and note.kind is not None:
+			self.kinds[indice] = note.kind
+		if note.compte_dans_moyenne():
+			self.nb_notes[indice] += 1
+			self.points[indice] += float(note.value or 0)
+			self.kinds[indice] = min(self.kinds[indice] or Note.NON_NOTE,
+					note.kind)
+
+	def moyenne(self, indice):
+		"""
+		Renvoie l'objet Moyenne correspondant à l'accumulateur d'indice
+		donné.
+		"""
+		moyenne = Moyenne()
+		if self.nb_notes[indice]:
+			moyenne.points = self.points[indice]
+			moyenne.nb_notes = self.nb_notes[indice]
+		if self.kinds[indice]:
+			moyenne.kind = self.kinds[indice]
+		return moyenne
+
+	def rang(self, indice):
+		"""
+		Renvoie le rang correspondant à l'accumulateur d'indice donné,
+		ou None si l'étudiant n'est pas classé.
+		"""
+		return self.rangs[indice] or None
+
+	def _classer(self):
+		"""
+		Calcule les rangs des étudiants pour la moyenne annuelle et pour
+		chaque période de notation.
+
+		Chaque classement se fait par un unique tri des indices des
+		étudiants selon leur moyenne. Les étudiants ex-aequo reçoivent
+		le même rang, et le rang suivant tient compte de leur nombre.
+		Les étudiants qui n'ont aucune note comptée dans la moyenne ne
+		sont pas classés.
+		"""
+		nb_etudiants = len(self.etudiants)
+		if not nb_etudiants:
+			return
+
+		for debut in range(0, len(self.nb_notes), nb_etudiants):
+			moyennes = [(self.points[i] / self.nb_notes[i], i)
+				for i in range(debut, debut + nb_etudiants)
+				if self.nb_notes[i]]
+			moyennes.sort(reverse=True)
+
+			moyenne_courante = None
+			rang_courant = 0
+			for position, (moyenne, indice) in enumerate(moyennes, 1):
+				if moyenne != moyenne_courante:
+					moyenne_courante = moyenne
+					rang_courant = position
+				self.rangs[indice] = rang_courant
+
+	def notes(self, etudiant):
+		"""
+		Liste des cellules (liste des notes) de l'étudiant d'indice
+		donné, pour chaque semaine.
+		"""
+		debut = etudiant * self.nb_semaines
+		return [self.cellules.get(debut + semaine, [])
+				for semaine in range(self.nb_semaines)]
+
+	def lignes(self):
+		"""
+		Itérateur sur les lignes du tableau, dans l'ordre des étudiants.
+		"""
+		nb_etudiants = len(self.etudiants)
+		for i, etudiant in enumerate(self.etudiants):
+			yield LigneResultats(
+				etudiant=etudiant,
+				moyenne=self.moyenne(i),
+				rang=self.rang(i),
+				periodes=[self.moyenne((p + 1) * nb_etudiants + i)
+					for p in range(len(self.periodes))],
+				rangs_periodes=[self.rang((p + 1) * nb_etudiants + i)
+					for p in range(len(self.periodes))],
+				notes=self.notes(i))
+
+class TableauResultats:
+	"""
+	Tableau des résultats de colles d'une classe pour une liste
+	d'enseignements.
+	"""
+	def __init__(self, classe, enseignements):
+		self.classe = classe
+		self.enseignements = list(enseignements)
+		self.semaines = SortedCollection([
+			SemaineTuple(*s) for s in Semaine.objects.filter(
+				classe=classe, debut__lte=timezone.localtime()
+				).values_list('debut', 'fin', 'numero')],
+			key=attrgetter('debut'))
+		self.resultats = OrderedDict()
+		self._calculer()
+
+	@classmethod
+	def charger(cls, classe, enseignements):
+		"""
+		Renvoie le tableau des résultats, en le lisant dans le cache
+		lorsque c'est possible.
+
+		La clé de cache dépend de la classe, des enseignements et des
+		périodes de notation de ces enseignements, ainsi que du numéro
+		de version des résultats de la classe.
+		"""
+		enseignements = list(enseignements)
+		periodes = PeriodeNotation.objects.filter(
+			enseignement__in=enseignements).order_by('pk').values_list(
+			'pk', 'debut', 'fin')
+		cle = cle_cache('resultats', classe.pk,
+			version('resultats', classe.pk),
+			','.join(str(e.pk) for e in enseignements),
+			';'.join('{}/{}/{}'.format(*p) for p in periodes))
+
+		tableau = cache.get(cle)
+		if tableau is None:
+			tableau = cls(classe, enseignements)
+			duree = tableau.duree_validite()
+			if duree > 0:
+				cache.set(cle, tableau, duree)
+		return tableau
+
+	def duree_validite(self):
+		"""
+		Durée, en secondes, pendant laquelle le tableau reste valable en
+		l'absence de modification dans la base de données.
+
+		Le tableau dépend aussi de la date courante : une nouvelle
+		semaine du colloscope peut commencer, ou une colle non notée
+		peut passer en attente de notation. Le tableau n'est donc
+		conservé que jusqu'au prochain de ces événements.
+		"""
+		maintenant = timezone.localtime()
+		echeances = Colle.objects.filter(
+			enseignement__in=self.enseignements,
+			etat=Colle.ETAT_PREVUE,
+			mode=Colle.MODE_INTERROGATION,
+			detail_actif__horaire__gt=maintenant,
+		).aggregate(prochaine_colle=Min('detail_actif__horaire'))
+		prochaine_semaine = Semaine.objects.filter(classe=self.classe,
+			debut__gt=maintenant.date()).aggregate(
+			debut=Min('debut'))['debut']
+
+		duree = DUREE_CACHE
+		if echeances['prochaine_colle'] is not None:
+			duree = min(duree,
+				(echeances['prochaine_colle'] - maintenant).total_seconds())
+		if prochaine_semaine is not None:
+			debut = timezone.make_aware(
+				datetime.combine(prochaine_semaine, time()))
+			duree = min(duree, (debut - maintenant).total_seconds())
+		return int(duree)
+
+	def _semaine(self, debut, fin, numero, horaire):
+		"""
+		Renvoie la semaine d'une note ou d'une colle.
+
+		Si la colle fait référence à une semaine du colloscope, on
+		utilise cette semaine : on affiche ainsi le résultat de la colle
+		à la date où elle était initialement prévue, peu importe si elle
+		a été déplacée par la suite.
+
+		Sinon, on cherche la semaine du colloscope qui contient la date.
+		Si une telle semaine n'existe pas, on en crée une fictive (non
+		sauvée dans la base de données) que l'on insère dans la liste
+		triée des semaines.
+		"""
+		if debut is not None:
+			semaine = SemaineTuple(debut=debut, fin=fin, numero=numero)
+			if semaine not in self.semaines:
+				self.semaines.insert(semaine)
+			return semaine
+
+		date = horaire.date()
+		try:
+			semaine = self.semaines.find_le(date)
+			if semaine.fin >= date:
+				return semaine
+		except ValueError:
+			pass
+
+		debut_semaine = date - timedelta(days=date.weekday())
+		fin_semaine = debut_semaine + timedelta(days=6)
+		semaine = SemaineTuple(debut=debut_semaine, fin=fin_semaine,
+			numero="({0}-{1})".format(*debut_semaine.isocalendar()))
+		self.semaines.insert(semaine)
+		return semaine
+
+	def _calculer(self):
+		enseignements = dict([(e.pk, e) for e in self.enseignements])
+
+		# Chargement des notes en colonnes
+		col_etudiant = []
+		col_semaine = []
+		col_note = []
+		col_enseignement = []
+		for etudiant_id, enseignement_id, debut, fin, numero, horaire, \
+				note in ColleNote.objects.filter(
+					colle__enseignement__in=enseignements).values_list(
+					'eleve_id', 'colle__enseignement_id',
+					'colle__semaine__debut', 'colle__semaine__fin',
+					'colle__semaine__numero', 'horaire', 'note'):
+			col_etudiant.append(etudiant_id)
+			col_semaine.append(self._semaine(debut, fin, numero, horaire))
+			col_note.append(note)
+			col_enseignement.append(enseignement_id)
+
+		# Colles passées en attente de notation
+		colles_non_notees = Colle.objects.filter(
+			enseignement__in=enseignements,
+			etat=Colle.ETAT_PREVUE,
+			mode=Colle.MODE_INTERROGATION,
+			detail_actif__horaire__lte=timezone.localtime(),
+		).exclude(collenote__isnull=False)
+		attentes = []
+		for etudiant_id, enseignement_id, debut, fin, numero, horaire in \
+				ColleDetails.eleves.through.objects.filter(
+					colledetails__colle__in=colles_non_notees,
+					colledetails__actif=True).values_list(
+					'etudiant_id', 'colledetails__colle__enseignement_id',
+					'colledetails__colle__semaine__debut',
+					'colledetails__colle__semaine__fin',
+					'colledetails__colle__semaine__numero',
+					'colledetails__horaire'):
+			attentes.append((etudiant_id, enseignement_id,
+				self._semaine(debut, fin, numero, horaire)))
+
+		# Les semaines sont maintenant toutes connues : on peut les
+		# numéroter.
+		indices_semaines = dict([(semaine, i)
+			for i, semaine in enumerate(self.semaines)])
+		nb_semaines = len(indices_semaines)
+
+		# Étudiants de chaque enseignement, triés par nom
+		etudiants_ens = dict([(pk, set()) for pk in enseignements])
+		for etudiant_id, enseignement_id in zip(col_etudiant,
+				col_enseignement):
+			etudiants_ens[enseignement_id].add(etudiant_id)
+		etudiants = dict([(e.pk, e) for e in Etudiant.objects.filter(
+			pk__in=set(col_etudiant)).order_by('last_name', 'first_name')])
+		ordre = dict([(pk, i) for i, pk in enumerate(etudiants)])
+
+		periodes = dict([(pk, []) for pk in enseignements])
+		for periode in PeriodeNotation.objects.filter(
+				enseignement__in=enseignements).order_by('debut'):
+			periodes[periode.enseignement_id].append(periode)
+
+		indices_etudiants = {}
+		for enseignement in self.enseignements:
+			liste = sorted(etudiants_ens[enseignement.pk],
+					key=ordre.__getitem__)
+			indices_etudiants[enseignement.pk] = dict([(pk, i)
+				for i, pk in enumerate(liste)])
+			self.resultats[enseignement] = ResultatsEnseignement(
+				enseignement, [etudiants[pk] for pk in liste],
+				periodes[enseignement.pk], nb_semaines)
+
+		# Périodes de notation qui contiennent chaque semaine, pour
+		# chaque enseignement. Un professeur peut faire compter une même
+		# note sur plusieurs périodes qui se chevauchent.
+		periodes_semaines = {}
+		for enseignement in self.enseignements:
+			periodes_semaines[enseignement.pk] = [
+				[p for p, periode in enumerate(periodes[enseignement.pk])
+					if periode.debut <= semaine.debut <= periode.fin]
+				for semaine in self.semaines]
+
+		# Parcours unique des colonnes de notes
+		for etudiant_id, semaine, note, enseignement_id in zip(
+				col_etudiant, col_semaine, col_note, col_enseignement):
+			resultats = self.resultats[enseignements[enseignement_id]]
+			i = indices_etudiants[enseignement_id][etudiant_id]
+			j = indices_semaines[semaine]
+			nb_etudiants = len(resultats.etudiants)
+
+			resultats.cellules.setdefault(i * nb_semaines + j, []
+					).append(note)
+			resultats._accumuler(i, note)
+			for p in periodes_semaines[enseignement_id][j]:
+				resultats._accumuler((p + 1) * nb_etudiants + i, note)
+
+		# Les élèves présents sur une colle peuvent ne pas tous être de
+		# la même classe : on ne garde que ceux du tableau.
+		for etudiant_id, enseignement_id, semaine in attentes:
+			try:
+				i = indices_etudiants[enseignement_id][etudiant_id]
+			except KeyError:
+				continue
+			j = indices_semaines[semaine]
+			self.resultats[enseignements[enseignement_id]].cellules \
+					.setdefault(i * nb_semaines + j, []).append(EN_ATTENTE)
+
+		for resultats in self.resultats.values():
+			resultats._classer()
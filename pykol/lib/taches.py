@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Suivi des tâches de fond exécutées dans des fils d'exécution du
+serveur (imports SIECLE/STS et lots d'attestations ECTS).
+
+Une tâche est un objet dont le modèle possède les champs etat,
+date_creation, date_activite, date_fin et erreur, ainsi que les
+constantes ETAT_ATTENTE, ETAT_EN_COURS et ETAT_ERREUR. Tant que la
+tâche s'exécute, un fil secondaire met régulièrement à jour sa date
+d'activité. Si le processus qui l'exécute disparaît, cette date n'est
+plus mise à jour et la tâche peut être déclarée abandonnée.
+"""
+
+from contextlib import contextmanager
+from datetime import timedelta
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+def delai_abandon():
+	return timedelta(seconds=settings.PYKOL_TACHES_DELAI_ABANDON)
+
+def _battre(modele, pk, arret, intervalle):
+	try:
+		while not arret.wait(intervalle):
+			modele.objects.filter(pk=pk).update(
+				date_activite=timezone.now())
+	finally:
+		connection.close()
+
+@contextmanager
+def battement(modele, pk):
+	"""
+	Gestionnaire de contexte qui marque la tâche comme active au début
+	du bloc, puis régulièrement tant que le bloc s'exécute.
+	"""
+	modele.objects.filter(pk=pk).update(date_activite=timezone.now())
+	arret = threading.Event()
+	fil = threading.Thread(target=_battre, daemon=True,
+		args=(modele, pk, arret, delai_abandon().total_seconds() / 5))
+	fil.start()
+	try:
+		yield
+	finally:
+		arret.set()
+		fil.join()
+
+def taches_abandonnees(queryset):
+	"""
+	Renvoie les tâches du queryset, en attente ou en cours, qui n'ont
+	donné aucun signe de vie depuis le délai PYKOL_TACHES_DELAI_ABANDON.
+	"""
+	modele = queryset.model
+	limite = timezone.now() - delai_abandon()
+	return queryset.filter(
+		Q(date_activite__lt=limite) |
+		Q(date_activite__isnull=True, date_creation__lt=limite),
+		etat__in=(modele.ETAT_ATTENTE, modele.ETAT_EN_COURS))
+
+def marquer_abandonnees(queryset):
+	"""
+	Marque en erreur les tâches abandonnées du queryset (voir
+	taches_abandonnees). Renvoie le nombre de tâches concernées.
+	"""
+	modele = queryset.model
+	return taches_abandonnees(queryset).update(etat=modele.ETAT_ERREUR,
+		date_fin=timezone.now(),
+		erreur="Tâche interrompue avant la fin de son exécution")
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Chargement du calendrier scolaire officiel.
+
+Le ministère publie en open-data le jeu de données
+fr-en-calendrier-scolaire, qui donne les dates des vacances de chaque
+académie. Ce module lit ce jeu de données, soit depuis un fichier
+exporté (CSV ou JSON) depuis data.education.gouv.fr, ce qui permet de
+l'utiliser sur un serveur sans accès à Internet, soit depuis la réponse
+de l'API du site. Les vacances sont ensuite enregistrées en bloc pour
+toutes les années scolaires concernées.
+"""
+
+import csv
+import io
+import json
+import unicodedata
+from collections import defaultdict
+from datetime import timedelta, timezone
+
+from django.db import transaction
+import isodate
+
+from pykol.models.base import Annee, Vacances
+
+# Noms des champs du jeu de données, lorsque l'export CSV utilise les
+# libellés des colonnes plutôt que leurs noms.
+LIBELLES_CHAMPS = {
+	'Description': 'description',
+	'Population': 'population',
+	'Date de début': 'start_date',
+	'Date de fin': 'end_date',
+	'Académies': 'location',
+	'Zones': 'zones',
+	'Année scolaire': 'annee_scolaire',
+}
+
+def _normaliser(nom):
+	"""
+	Forme d'un nom d'académie utilisée pour les comparaisons,
+	indépendante de la casse et des accents.
+	"""
+	nom = unicodedata.normalize('NFKD', nom or '')
+	return ''.join(c for c in nom
+			if not unicodedata.combining(c)).strip().casefold()
+
+def _date_utc(valeur):
+	"""
+	Renvoie la date, en temps universel, de l'instant donné au format
+	ISO 8601 dans le jeu de données.
+
+	Une date seule désigne minuit à l'heure de Paris, c'est-à-dire la
+	veille en temps universel.
+	"""
+	try:
+		instant = isodate.parse_datetime(valeur)
+	except (isodate.ISO8601Error, ValueError):
+		return isodate.parse_date(valeur) - timedelta(days=1)
+
+	if instant.tzinfo is not None:
+		instant = instant.astimezone(timezone.utc)
+	return instant.date()
+
+def annee_scolaire(annee):
+	"""
+	Nom de l'année scolaire dans le jeu de données (par exemple
+	« 2023-2024 »).
+	"""
+	return '{}-{}'.format(annee.debut.year, annee.fin.year)
+
+class CalendrierOfficiel:
+	"""
+	Index des vacances du calendrier scolaire officiel, par académie
+	puis par année scolaire.
+
+	Les enregistrements sont lus une seule fois. Pour chaque académie
+	et chaque année scolaire, on conserve le dictionnaire qui au nom de
+	chaque période de vacances associe le couple (début, fin) des jours
+	inclus dans la période.
+	"""
+	def __init__(self, enregistrements):
+		# Les dates de vacances sont données en prenant le dernier
+		# jour de cours (vacances après la classe) et le premier
+		# jour de reprise (reprise des cours le matin de la date de
+		# fin). Or, pyKol stocke les périodes en prenant en compte
+		# les jours inclus dans la période. Il faut donc décaler les
+		# dates d'un jour.
+		un_jour = timedelta(days=1)
+
+		self.academies = defaultdict(lambda: defaultdict(dict))
+		for enregistrement in enregistrements:
+			# Certaines périodes sont déclinées pour les enseignants,
+			# avec des dates différentes de celles des élèves.
+			if enregistrement.get('population') == 'Enseignants':
+				continue
+
+			try:
+				debut = _date_utc(enregistrement['start_date']) + un_jour
+				fin = _date_utc(enregistrement['end_date']) - un_jour
+				nom = enregistrement['description'].strip()
+				academie = _normaliser(enregistrement['location'])
+				annee = enregistrement['annee_scolaire'].strip()
+			except (KeyError, TypeError, AttributeError, ValueError,
+					isodate.ISO8601Error):
+				continue
+
+			# Les événements ponctuels (rentrée scolaire par exemple)
+			# ne contiennent aucun jour de vacances.
+			if fin < debut:
+				continue
+
+			self.academies[academie][annee].setdefault(nom, (debut, fin))
+
+	@classmethod
+	def lire(cls, fichier):
+		"""
+		Lit un export du jeu de données, au format JSON (liste des
+		enregistrements, éventuellement sous la clé 'results' comme
+		dans les réponses de l'API) ou CSV (séparé par des
+		points-virgules, comme sur data.education.gouv.fr).
+
+		Cette fonction lève une exception ValueError si le fichier
+		n'est dans aucun de ces formats.
+		"""
+		contenu = fichier.read()
+		if isinstance(contenu, bytes):
+			try:
+				contenu = contenu.decode('utf-8-sig')
+			except UnicodeDecodeError:
+				raise ValueError("Le fichier n'est pas encodé en UTF-8")
+
+		if contenu.lstrip()[:1] in ('[', '{'):
+			try:
+				donnees = json.loads(contenu)
+			except json.JSONDecodeError as e:
+				raise ValueError("Fichier JSON invalide : {}".format(e))
+
+			if isinstance(donnees, dict):
+				donnees = donnees.get('results', [])
+			# Les anciens exports placent les champs sous la clé
+			# 'fields'.
+			return cls([enregistrement.get('fields', enregistrement)
+				for enregistrement in donnees
+				if isinstance(enregistrement, dict)])
+
+		entete = contenu.split('\n', 1)[0]
+		lecteur = csv.DictReader(io.StringIO(contenu),
+				delimiter=';' if ';' in entete else ',')
+		if not lecteur.fieldnames or not {'start_date', 'description'} \
+				<= set(LIBELLES_CHAMPS.get(champ, champ)
+					for champ in lecteur.fieldnames):
+			raise ValueError("Le fichier n'est pas un export du "
+					"calendrier scolaire")
+
+		return cls([dict((LIBELLES_CHAMPS.get(champ, champ), valeur)
+			for champ, valeur in ligne.items())
+			for ligne in lecteur])
+
+	def vacances(self, academie, annee):
+		"""
+		Renvoie le dictionnaire des vacances de l'académie pour l'année
+		scolaire donnée (objet Annee), ou None si le calendrier ne
+		contient pas cette année.
+		"""
+		return self.academies[_normaliser(academie.nom)].get(
+				annee_scolaire(annee))
+
+@transaction.atomic
+def enregistrer_vacances(calendrier, academie, annees=None):
+	"""
+	Met à jour les vacances des années scolaires données (toutes les
+	années par défaut) à partir du calendrier officiel de l'académie.
+
+	Les vacances existantes sont lues en une requête. Seules celles
+	dont les dates ont changé sont modifiées, les nouvelles sont créées
+	et celles qui ont disparu du calendrier sont supprimées, le tout en
+	bloc. Les jours fériés ne sont pas modifiés, ni les années absentes
+	du calendrier.
+
+	Renvoie le triplet (créées, modifiées, supprimées) des nombres de
+	périodes de vacances concernées.
+	"""
+	if annees is None:
+		annees = Annee.objects.all()
+
+	periodes = {}
+	for annee in annees:
+		vacances = calendrier.vacances(academie, annee)
+		if vacances is not None:
+			periodes[annee.pk] = (annee, vacances)
+
+	existantes = defaultdict(dict)
+	a_supprimer = []
+	for vacances in Vacances.objects.filter(annee__in=periodes.keys(),
+			type_vacances=Vacances.TYPE_VACANCES).order_by('pk'):
+		if vacances.nom in existantes[vacances.annee_id]:
+			# Doublon d'une période déjà présente
+			a_supprimer.append(vacances.pk)
+		else:
+			existantes[vacances.annee_id][vacances.nom] = vacances
+
+	a_creer = []
+	a_modifier = []
+	for annee, vacances_annee in periodes.values():
+		anciennes = existantes[annee.pk]
+		for nom, (debut, fin) in vacances_annee.items():
+			vacances = anciennes.pop(nom, None)
+			if vacances is None:
+				a_creer.append(Vacances(annee=annee, nom=nom,
+					type_vacances=Vacances.TYPE_VACANCES,
+					debut=debut, fin=fin))
+			elif (vacances.debut, vacances.fin) != (debut, fin):
+				vacances.debut = debut
+				vacances.fin = fin
+				a_modifier.append(vacances)
+		a_supprimer.extend(vacances.pk for vacances in anciennes.values())
+
+	Vacances.objects.bulk_create(a_creer)
+	Vacances.objects.bulk_update(a_modifier, ('debut', 'fin'))
+	Vacances.objects.filter(pk__in=a_supprimer).delete()
+
+	# Les écritures en bloc n'envoient pas de signaux.
+	for annee_pk in periodes:
+		Annee.invalider_calendrier(annee_pk)
+
+	return len(a_creer), len(a_modifier), len(a_supprimer)
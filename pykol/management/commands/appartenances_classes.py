@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2019 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Commande de gestion qui reconstruit la table des appartenances des
+professeurs aux classes, par exemple après des modifications faites
+directement dans la base de données.
+"""
+
+from django.core.management.base import BaseCommand
+
+from pykol.models.base import AppartenanceClasse
+
+class Command(BaseCommand):
+	help = "Reconstruit la table des appartenances aux classes"
+
+	def handle(self, *args, **options):
+		AppartenanceClasse.objects.recalculer()
+		self.stdout.write(self.style.SUCCESS(
+			"{} appartenance(s) aux classes".format(
+				AppartenanceClasse.objects.count())))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2019 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Commande de gestion qui produit les lots d'attestations ECTS
+abandonnés, par exemple après un redémarrage du serveur pendant leur
+production. Les lots dont la production est toujours active dans un
+autre processus ne sont pas touchés.
+"""
+
+from django.core.management.base import BaseCommand
+
+from pykol.models.ects import AttestationsLot
+from pykol.lib.attestations import generer_lot
+from pykol.lib.taches import taches_abandonnees, marquer_abandonnees
+
+class Command(BaseCommand):
+	help = "Produit les lots d'attestations ECTS inachevés"
+
+	def handle(self, *args, **options):
+		# Les lots abandonnés sont d'abord marqués en erreur, afin
+		# qu'un autre processus ne les considère plus comme en cours,
+		# puis produits à nouveau.
+		abandonnes = list(taches_abandonnees(
+			AttestationsLot.objects.all()).values_list('pk', flat=True))
+		marquer_abandonnees(AttestationsLot.objects.filter(
+			pk__in=abandonnes))
+		lots = AttestationsLot.objects.filter(pk__in=abandonnes,
+			etat=AttestationsLot.ETAT_ERREUR).order_by('date_creation')
+		for lot in lots:
+			lot = generer_lot(lot.pk)
+			lot.refresh_from_db()
+			if lot.etat == AttestationsLot.ETAT_TERMINE:
+				self.stdout.write(self.style.SUCCESS(
+					"{} : {} attestation(s)".format(lot, lot.nb_etudiants)))
+			else:
+				self.stdout.write(self.style.ERROR(
+					"{} : {}".format(lot, lot.erreur)))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2019 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Commande de gestion qui termine les imports SIECLE/STS restés en
+attente, par exemple après un redémarrage du serveur pendant leur
+exécution. Les imports en erreur donnés en argument sont repris à partir
+de l'étape qui a échoué.
+"""
+
+from django.core.management.base import BaseCommand
+
+from pykol.models.base import ImportBee
+from pykol.lib.bee import executer_import
+
+class Command(BaseCommand):
+	help = "Termine les imports SIECLE/STS inachevés"
+
+	def add_arguments(self, parser):
+		parser.add_argument('imports', nargs='*', type=int,
+			help="Identifiants d'imports en erreur à reprendre")
+
+	def handle(self, *args, **options):
+		imports = ImportBee.objects.filter(
+			etat__in=(ImportBee.ETAT_ATTENTE,
+				ImportBee.ETAT_EN_COURS))
+		if options['imports']:
+			imports = imports | ImportBee.objects.filter(
+				pk__in=options['imports'], etat=ImportBee.ETAT_ERREUR)
+
+		for import_bee in imports.order_by('date_creation'):
+			import_bee = executer_import(import_bee.pk)
+			if import_bee.etat == ImportBee.ETAT_TERMINE:
+				self.stdout.write(self.style.SUCCESS(
+					"{} : {} étape(s)".format(import_bee,
+						import_bee.etapes.count())))
+			else:
+				self.stdout.write(self.style.ERROR(
+					"{} : {}".format(import_bee, import_bee.erreur)))
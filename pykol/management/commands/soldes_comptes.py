@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Commande de gestion qui reconstruit ou vérifie la table des soldes
+des comptes à partir des lignes des mouvements validés.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pykol.models.base import Annee
+from pykol.models.comptabilite import CompteSolde
+
+class Command(BaseCommand):
+	help = "Reconstruit ou vérifie les soldes des comptes d'heures"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--annee', type=int,
+			help="Clé primaire de l'année scolaire à traiter "
+				"(toutes les années par défaut)")
+		parser.add_argument('--verifier', action='store_true',
+			help="Vérifie les soldes sans les modifier")
+
+	def handle(self, *args, **options):
+		annee = None
+		if options['annee'] is not None:
+			try:
+				annee = Annee.objects.get(pk=options['annee'])
+			except Annee.DoesNotExist:
+				raise CommandError("Année scolaire inconnue")
+
+		ecarts = CompteSolde.objects.verifier(annee)
+		for (compte, annee_id, taux), enregistre, calcule in ecarts:
+			self.stdout.write("Compte {compte}, année {annee}, "
+				"taux {taux} : solde enregistré {enregistre}, "
+				"solde calculé {calcule}".format(compte=compte,
+					annee=annee_id, taux=taux,
+					enregistre=enregistre[0], calcule=calcule[0]))
+
+		if options['verifier']:
+			if ecarts:
+				raise CommandError("{} solde(s) incorrect(s)".format(
+					len(ecarts)))
+			self.stdout.write(self.style.SUCCESS("Soldes corrects"))
+		else:
+			CompteSolde.objects.reconstruire(annee)
+			self.stdout.write(self.style.SUCCESS("Soldes reconstruits"))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Commande de gestion qui charge les vacances scolaires depuis un export
+(CSV ou JSON) du calendrier scolaire officiel publié sur
+data.education.gouv.fr, sans accès au réseau.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pykol.models.base import Academie, Annee, Etablissement
+from pykol.lib.vacances import CalendrierOfficiel, enregistrer_vacances
+
+class Command(BaseCommand):
+	help = "Charge les vacances scolaires depuis un export du " \
+		"calendrier scolaire officiel"
+
+	def add_arguments(self, parser):
+		parser.add_argument('fichier',
+			help="Export CSV ou JSON du jeu de données "
+				"fr-en-calendrier-scolaire")
+		parser.add_argument('--academie', type=int,
+			help="Numéro de l'académie (par défaut, celle de "
+				"l'établissement principal)")
+		parser.add_argument('--annee', type=int, action='append',
+			help="Clé primaire d'une année scolaire à traiter "
+				"(toutes les années par défaut)")
+
+	def handle(self, *args, **options):
+		try:
+			if options['academie'] is not None:
+				academie = Academie.objects.get(pk=options['academie'])
+			else:
+				academie = Etablissement.objects.get(
+					pk=settings.PYKOL_UAI_DEFAUT).academie
+		except (Academie.DoesNotExist, Etablissement.DoesNotExist):
+			raise CommandError("Académie inconnue")
+
+		annees = None
+		if options['annee']:
+			annees = Annee.objects.filter(pk__in=options['annee'])
+
+		try:
+			with open(options['fichier'], 'rb') as fichier:
+				calendrier = CalendrierOfficiel.lire(fichier)
+		except (OSError, ValueError) as e:
+			raise CommandError(str(e))
+
+		creees, modifiees, supprimees = enregistrer_vacances(calendrier,
+				academie, annees)
+		self.stdout.write(self.style.SUCCESS("Vacances de l'académie "
+			"{} : {} créée(s), {} modifiée(s), {} supprimée(s)".format(
+				academie, creees, modifiees, supprimees)))
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+def colle_detail_actif_init(apps, schema_editor):
+	Colle = apps.get_model('pykol', 'Colle')
+	ColleDetails = apps.get_model('pykol', 'ColleDetails')
+
+	Colle.all_objects.update(detail_actif=models.Subquery(
+		ColleDetails.objects.filter(colle=models.OuterRef('pk'),
+			actif=True).order_by('-pk').values('pk')[:1]))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0047_taux_colles_20'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='colle',
+            name='detail_actif',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pykol.ColleDetails', verbose_name='détails actifs'),
+        ),
+		migrations.RunPython(colle_detail_actif_init,
+			migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:50
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+def comptesolde_init(apps, schema_editor):
+	CompteSolde = apps.get_model('pykol', 'CompteSolde')
+	MouvementLigne = apps.get_model('pykol', 'MouvementLigne')
+
+	CompteSolde.objects.bulk_create([CompteSolde(
+		compte_id=l['compte'], annee_id=l['mouvement__annee'],
+		taux=l['taux'], duree=l['duree'],
+		duree_interrogation=l['duree_interrogation'])
+		for l in MouvementLigne.objects.filter(mouvement__etat=1
+			).values('compte', 'mouvement__annee', 'taux').annotate(
+				duree=models.Sum('duree'),
+				duree_interrogation=models.Sum('duree_interrogation')
+			).order_by()])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0048_colle_detail_actif'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompteSolde',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taux', models.PositiveSmallIntegerField(blank=True, choices=[(1, '1è année - 19 étudiants ou moins'), (2, '1è année - Entre 20 et 35 étudiants'), (3, '1è année - À partir de 36 étudiants'), (4, '2è année - 19 étudiants ou moins'), (5, '2è année - Entre 20 et 35 étudiants'), (6, '2è année - À partir de 36 étudiants')], null=True, verbose_name='taux')),
+                ('duree_interrogation', models.DurationField(default=datetime.timedelta, verbose_name="durée d'interrogation")),
+                ('duree', models.DurationField(default=datetime.timedelta, verbose_name="nombre d'heures")),
+                ('annee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pykol.annee', verbose_name='année')),
+                ('compte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='soldes', to='pykol.compte')),
+            ],
+            options={
+                'verbose_name': 'solde de compte',
+                'verbose_name_plural': 'soldes de comptes',
+                'unique_together': {('compte', 'annee', 'taux')},
+            },
+        ),
+		migrations.RunPython(comptesolde_init,
+			migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import pykol.lib.files
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0049_comptesolde'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttestationsLot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_attestation', models.PositiveSmallIntegerField(choices=[(1, 'résultats'), (2, 'attestations de parcours')], verbose_name="type d'attestation")),
+                ('etat', models.PositiveSmallIntegerField(choices=[(1, 'en attente'), (2, 'en cours'), (3, 'terminé'), (4, 'erreur')], default=1, verbose_name='état')),
+                ('date_creation', models.DateTimeField(auto_now_add=True, verbose_name='date de création')),
+                ('date_fin', models.DateTimeField(blank=True, null=True, verbose_name='date de fin')),
+                ('nb_etudiants', models.PositiveIntegerField(default=0, verbose_name="nombre d'étudiants")),
+                ('nb_traites', models.PositiveIntegerField(default=0, verbose_name="nombre d'étudiants traités")),
+                ('fichier', models.FileField(blank=True, null=True, storage=pykol.lib.files.PrivateFileSystemStorage(), upload_to='attestations_ects/')),
+                ('erreur', models.TextField(blank=True)),
+                ('jury', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots_attestations', to='pykol.jury')),
+            ],
+            options={
+                'verbose_name': "lot d'attestations ECTS",
+                'verbose_name_plural': "lots d'attestations ECTS",
+                'ordering': ['-date_creation'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AttestationEtudiant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('empreinte', models.CharField(max_length=64)),
+                ('contenu', models.TextField()),
+                ('etudiant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pykol.etudiant', verbose_name='étudiant')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attestations', to='pykol.attestationslot')),
+            ],
+            options={
+                'unique_together': {('lot', 'etudiant')},
+            },
+        ),
+    ]
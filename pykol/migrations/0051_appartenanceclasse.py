@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Création de la table des appartenances des professeurs aux classes, et
+calcul initial de son contenu à partir des services, des coordinations,
+des créneaux, des colles et des permissions sur les colloscopes.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+ROLES = ('enseignant', 'coordonnateur', 'colleur_creneau',
+		'colleur_colle', 'colloscope')
+
+def peupler_appartenances(apps, schema_editor):
+	Service = apps.get_model('pykol', 'Service')
+	Classe = apps.get_model('pykol', 'Classe')
+	Creneau = apps.get_model('pykol', 'Creneau')
+	ColleDetails = apps.get_model('pykol', 'ColleDetails')
+	ColloscopePermission = apps.get_model('pykol', 'ColloscopePermission')
+	AppartenanceClasse = apps.get_model('pykol', 'AppartenanceClasse')
+
+	requetes = (
+		('enseignant', Service.objects.filter(professeur__isnull=False
+			).values_list('professeur_id', 'enseignement__classe_id')),
+		('coordonnateur', Classe.objects.filter(coordonnateur__isnull=False
+			).values_list('coordonnateur_id', 'pk')),
+		('colleur_creneau', Creneau.objects.filter(colleur__isnull=False
+			).values_list('colleur_id', 'classe_id')),
+		('colleur_colle', ColleDetails.objects.filter(actif=True,
+			colleur__isnull=False
+			).values_list('colleur_id', 'colle__classe_id')),
+		('colloscope', ColloscopePermission.objects.filter(
+			droit__codename='change_colloscope',
+			user__professeur__isnull=False
+			).values_list('user_id', 'classe_id')),
+	)
+
+	roles = defaultdict(set)
+	for role, requete in requetes:
+		for cle in requete.distinct():
+			roles[cle].add(role)
+
+	AppartenanceClasse.objects.bulk_create([
+		AppartenanceClasse(user_id=user_id, classe_id=classe_id,
+			**{role: role in roles_classe for role in ROLES})
+		for (user_id, classe_id), roles_classe in roles.items()])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0050_attestationslot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppartenanceClasse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enseignant', models.BooleanField(default=False)),
+                ('coordonnateur', models.BooleanField(default=False)),
+                ('colleur_creneau', models.BooleanField(default=False, verbose_name='colleur sur un créneau')),
+                ('colleur_colle', models.BooleanField(default=False, verbose_name="colleur d'une colle")),
+                ('colloscope', models.BooleanField(default=False, verbose_name='gestion du colloscope')),
+                ('classe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appartenances', to='pykol.classe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appartenances', to=settings.AUTH_USER_MODEL, verbose_name='utilisateur')),
+            ],
+            options={
+                'verbose_name': 'appartenance à une classe',
+                'verbose_name_plural': 'appartenances aux classes',
+                'unique_together': {('user', 'classe')},
+            },
+        ),
+        migrations.RunPython(peupler_appartenances,
+            migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import pykol.lib.files
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0051_appartenanceclasse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportBee',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etat', models.PositiveSmallIntegerField(choices=[(1, 'en attente'), (2, 'en cours'), (3, 'terminé'), (4, 'erreur')], default=1, verbose_name='état')),
+                ('date_creation', models.DateTimeField(auto_now_add=True, verbose_name='date de création')),
+                ('date_fin', models.DateTimeField(blank=True, null=True, verbose_name='date de fin')),
+                ('etape', models.CharField(blank=True, choices=[('import_etablissement', 'établissement'), ('import_annee', 'année scolaire'), ('import_mefs', 'formations'), ('import_programmes', 'programmes'), ('import_professeurs', 'professeurs'), ('import_divisions', 'classes'), ('import_groupes', 'groupes'), ('import_services', 'services'), ('import_etudiants', 'étudiants'), ('import_options_etudiants', 'options des étudiants'), ('import_colles', 'dotations en colles'), ('log_imports', 'historique')], max_length=30, verbose_name='étape')),
+                ('erreur', models.TextField(blank=True)),
+                ('fichier_sts', models.FileField(blank=True, null=True, storage=pykol.lib.files.PrivateFileSystemStorage(), upload_to='import_bee/')),
+                ('fichier_structures', models.FileField(blank=True, null=True, storage=pykol.lib.files.PrivateFileSystemStorage(), upload_to='import_bee/')),
+                ('fichier_nomenclatures', models.FileField(blank=True, null=True, storage=pykol.lib.files.PrivateFileSystemStorage(), upload_to='import_bee/')),
+                ('fichier_eleves', models.FileField(blank=True, null=True, storage=pykol.lib.files.PrivateFileSystemStorage(), upload_to='import_bee/')),
+                ('utilisateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'import SIECLE/STS',
+                'verbose_name_plural': 'imports SIECLE/STS',
+                'ordering': ['-date_creation'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportBeeEtape',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etape', models.CharField(choices=[('import_etablissement', 'établissement'), ('import_annee', 'année scolaire'), ('import_mefs', 'formations'), ('import_programmes', 'programmes'), ('import_professeurs', 'professeurs'), ('import_divisions', 'classes'), ('import_groupes', 'groupes'), ('import_services', 'services'), ('import_etudiants', 'étudiants'), ('import_options_etudiants', 'options des étudiants'), ('import_colles', 'dotations en colles'), ('log_imports', 'historique')], max_length=30, verbose_name='étape')),
+                ('date_debut', models.DateTimeField(verbose_name='date de début')),
+                ('duree', models.DurationField(verbose_name='durée')),
+                ('nb_lignes', models.PositiveIntegerField(default=0, verbose_name="nombre d'enregistrements")),
+                ('import_bee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='etapes', to='pykol.importbee')),
+            ],
+            options={
+                'verbose_name': "étape d'import SIECLE/STS",
+                'verbose_name_plural': "étapes d'import SIECLE/STS",
+                'ordering': ['date_debut'],
+                'unique_together': {('import_bee', 'etape')},
+            },
+        ),
+    ]
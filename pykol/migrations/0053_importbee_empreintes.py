@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0052_importbee_importbeeetape'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importbee',
+            name='forcer',
+            field=models.BooleanField(default=False, verbose_name='importer aussi les fichiers inchangés'),
+        ),
+        migrations.AddField(
+            model_name='importbeeetape',
+            name='ignoree',
+            field=models.BooleanField(default=False, verbose_name='ignorée'),
+        ),
+        migrations.AddField(
+            model_name='importbeelog',
+            name='empreinte',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pykol', '0054_attestationslot_date_activite'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importbee',
+            name='date_activite',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='dernière activité'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+def valider_dotations_brouillon(apps, schema_editor):
+	"""
+	Validation des mouvements de dotation laissés à l'état de brouillon
+	par la migration 0030 pour les colles qui étaient alors en
+	brouillon.
+
+	Depuis, Colle.comptabiliser valide toujours la dotation d'une
+	colle. Ces mouvements en brouillon ne créditent donc pas le compte
+	des colles prévues du colleur alors que le passage de la colle à
+	l'état effectué, ou l'annulation de la dotation, le débitent. Ce
+	compte n'ayant pas de découvert autorisé, ces opérations seraient
+	refusées.
+
+	Les soldes de comptes sont recalculés à partir des lignes de
+	mouvements validés, comme lors de la migration 0049.
+	"""
+	Mouvement = apps.get_model('pykol', 'Mouvement')
+	MouvementLigne = apps.get_model('pykol', 'MouvementLigne')
+	CompteSolde = apps.get_model('pykol', 'CompteSolde')
+
+	if not Mouvement.objects.filter(etat=0, colle__isnull=False).update(
+			etat=1):
+		return
+
+	CompteSolde.objects.all().delete()
+	CompteSolde.objects.bulk_create([CompteSolde(
+		compte_id=l['compte'], annee_id=l['mouvement__annee'],
+		taux=l['taux'], duree=l['duree'],
+		duree_interrogation=l['duree_interrogation'])
+		for l in MouvementLigne.objects.filter(mouvement__etat=1
+			).values('compte', 'mouvement__annee', 'taux').annotate(
+				duree=models.Sum('duree'),
+				duree_interrogation=models.Sum('duree_interrogation')
+			).order_by()])
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('pykol', '0055_importbee_date_activite'),
+	]
+
+	operations = [
+		migrations.RunPython(valider_dotations_brouillon,
+			migrations.RunPython.noop, elidable=True),
+	]
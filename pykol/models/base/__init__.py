@@ -23,6 +23,8 @@ from .utilisateurs import User, Etudiant, Professeur, Discipline, \
 from .annee import Periode, Annee, Vacances
 from .enseignement import Matiere, Groupe, Service, \
 		Enseignement, Classe, GroupeEffectif, \
-		AbstractBaseGroupe, OptionEtudiant, AbstractPeriode
+		AbstractBaseGroupe, OptionEtudiant, AbstractPeriode, \
+		AppartenanceClasse
 from .enseignement import ModuleElementaireFormation, MEFMatiere
-from .import_bee import ImportBeeLog
+from .import_bee import ImportBeeLog, ImportBee, ImportBeeEtape, \
+		ETAPES_IMPORT_BEE
@@ -22,9 +22,15 @@ from django.db import models
 from django.urls import reverse
 
 import requests
-import isodate
 
 from pykol.models import constantes
+from pykol.lib.cache import version, invalider
+
+# Calendriers scolaires déjà calculés par ce processus : à chaque clé
+# primaire d'année, on associe le couple (empreinte, calendrier), où
+# l'empreinte contient les bornes de l'année et la version de ses
+# vacances dans le cache.
+_calendriers = {}
 
 class Periode(models.Model):
 	"""
@@ -49,6 +55,72 @@ class Periode(models.Model):
 	def __str__(self):
 		return self.nom
 
+class CalendrierScolaire:
+	"""
+	Calendrier d'une année scolaire, calculé une seule fois à partir de
+	ses périodes de vacances.
+
+	Il contient les intervalles de vacances triés et la table qui à
+	chaque jour travaillé de l'année associe le couple (numéro de la
+	semaine d'enseignement, semestre).
+	"""
+	def __init__(self, debut, fin, lundi_premiere_semaine, vacances):
+		"""
+		Le paramètre vacances est la liste des couples (début, fin) des
+		périodes de vacances (hors jours fériés) de l'année.
+		"""
+		self.debut = debut
+		self.fin = fin
+		self.vacances = sorted(vacances)
+
+		un_jour = timedelta(days=1)
+		jours_vacances = set()
+		for v_debut, v_fin in self.vacances:
+			jour = max(v_debut, debut)
+			while jour <= min(v_fin, fin):
+				jours_vacances.add(jour)
+				jour += un_jour
+
+		# Les vacances sont décomptées du numéro de semaine à partir de
+		# leur dernier jour, comme dans Vacances.duree.
+		retraits = sorted((v_fin, v_fin - max(v_debut + un_jour, debut))
+				for v_debut, v_fin in self.vacances)
+
+		self.semaines = {}
+		retrait = timedelta()
+		indice = 0
+		jour = debut
+		while jour <= fin:
+			while indice < len(retraits) and retraits[indice][0] <= jour:
+				retrait += retraits[indice][1]
+				indice += 1
+
+			if jour.weekday() != 6 and jour not in jours_vacances:
+				numero = (jour - lundi_premiere_semaine - retrait).days // 7 + 1
+				if numero <= constantes.SEMAINES_PREMIERE_PERIODE:
+					periode = constantes.PERIODE_PREMIERE
+				else:
+					periode = constantes.PERIODE_DEUXIEME
+				self.semaines[jour] = (numero, periode)
+
+			jour += un_jour
+
+	def est_vacances(self, date):
+		return any(v_debut <= date <= v_fin
+				for v_debut, v_fin in self.vacances)
+
+	def numero_semaine(self, date):
+		try:
+			return self.semaines[date][0]
+		except KeyError:
+			return None
+
+	def periode_enseignement(self, date):
+		try:
+			return self.semaines[date][1]
+		except KeyError:
+			return None
+
 class AnneeManager(models.Manager):
 	"""
 	Gestionnaire qui ajoute l'accès à l'année actuelle.
@@ -92,12 +164,12 @@ class Annee(Periode):
 		jour férié).
 
 		Si le paramètre seulement_vacances vaut True, on regarde
-		uniquement si la date tombe sur une période de vacances.
+		uniquement si la date tombe sur une période de vacances. Le
+		calendrier scolaire de l'année suffit alors à répondre.
 		"""
-		qs = self.vacances.filter(debut__lte=date, fin__gte=date)
 		if seulement_vacances:
-			qs = qs.filter(type_vacances=Vacances.TYPE_VACANCES)
-		return qs.exists()
+			return self.calendrier().est_vacances(date)
+		return self.vacances.filter(debut__lte=date, fin__gte=date).exists()
 
 	def est_travaille(self, date, seulement_vacances=True):
 		"""
@@ -123,14 +195,13 @@ class Annee(Periode):
 		"""
 		Mise à jour de la liste des vacances depuis les données publiées
 		en open-data par le ministère.
+
+		Sur un serveur sans accès à Internet, on peut charger à la
+		place un export du calendrier (commande vacances_scolaires ou
+		action de l'interface d'administration).
 		"""
-		# Les dates de vacances sont données en prenant le dernier
-		# jour de cours (vacances après la classe) et le premier
-		# jour de reprise (reprise des cours le matin de la date de
-		# fin). Or, pyKol stocke les périodes en prenant en compte
-		# les jours inclus dans la période. Il faut donc décaler les
-		# dates d'un jour.
-		un_jour = timedelta(days=1)
+		from pykol.lib.vacances import CalendrierOfficiel, \
+				enregistrer_vacances
 
 		# Lors de la requête au serveur, on demande toute période de
 		# vacances qui une intersection non vide avec l'année en cours.
@@ -140,24 +211,10 @@ class Annee(Periode):
 				f'annee_scolaire:"{self.debut.year}-{self.fin.year}"',
 				f'location:"{academie.nom.title()}"',
 			]
-		}).json()
-
-		# Pas de fantôme vieille période vacances restant
-		self.vacances.filter(type_vacances=Vacances.TYPE_VACANCES).delete()
-
-		for vacances_json in calendrier['results']:
-			debut = isodate.parse_datetime(vacances_json['start_date']).date() \
-					+ un_jour
-			fin   = isodate.parse_datetime(vacances_json['end_date']).date() \
-					- un_jour
-			vacances = Vacances(
-					annee=self,
-					type_vacances=Vacances.TYPE_VACANCES,
-					nom=vacances_json['description'],
-					debut=debut,
-					fin=fin,
-				)
-			vacances.save()
+		}, timeout=10).json()
+
+		enregistrer_vacances(CalendrierOfficiel(calendrier['results']),
+				academie, [self])
 
 	def lundi_premiere_semaine(self):
 		"""
@@ -172,27 +229,55 @@ class Annee(Periode):
 		lundi = jour4 - timedelta(days=jour4.weekday())
 		return lundi
 
+	def calendrier(self):
+		"""
+		Renvoie le calendrier scolaire (CalendrierScolaire) de l'année.
+
+		Le calendrier est conservé en mémoire par le processus. Il est
+		recalculé lorsque les bornes de l'année changent ou lorsque ses
+		vacances sont modifiées (les récepteurs de pykol.signals
+		invalident alors l'espace de cache 'calendrier_scolaire').
+		"""
+		empreinte = (self.debut, self.fin,
+				version('calendrier_scolaire', self.pk))
+		try:
+			empreinte_connue, calendrier = _calendriers[self.pk]
+			if empreinte_connue == empreinte:
+				return calendrier
+		except KeyError:
+			pass
+
+		calendrier = CalendrierScolaire(self.debut, self.fin,
+				self.lundi_premiere_semaine(),
+				self.vacances.filter(type_vacances=Vacances.TYPE_VACANCES
+					).values_list('debut', 'fin'))
+		_calendriers[self.pk] = (empreinte, calendrier)
+		return calendrier
+
+	@staticmethod
+	def invalider_calendrier(annee_pk):
+		"""
+		Invalide le calendrier scolaire de l'année donnée, à appeler
+		après toute modification de ses vacances.
+
+		Le calendrier du processus courant est oublié immédiatement,
+		afin que la suite de la transaction en cours voie les nouvelles
+		vacances. Les autres processus recalculent le leur après la
+		validation de la transaction.
+		"""
+		_calendriers.pop(annee_pk, None)
+		invalider('calendrier_scolaire', annee_pk)
+
 	def numero_semaine(self, date):
 		"""
 		Renvoie le numéro de la semaine d'enseignement qui contient la
 		date donnée. Si aucune semaine de correspond, la fonction
 		renvoie None.
 
-		Les semaines sont numérotées à partir de 1.
+		Les semaines sont numérotées à partir de 1. Les jours de
+		vacances sont retirés du décompte.
 		"""
-		if date < self.debut or date > self.fin or \
-				not self.est_travaille(date):
-			return None
-
-		depuis_debut = date - self.lundi_premiere_semaine()
-
-		# On retire les jours contenus dans les vacances
-		jours_vacances = sum([v.duree
-			for v in self.vacances.filter(fin__lte=date,
-				type_vacances=Vacances.TYPE_VACANCES
-				)], timedelta())
-
-		return (depuis_debut - jours_vacances).days // 7 + 1
+		return self.calendrier().numero_semaine(date)
 
 	def periode_enseignement(self, date):
 		"""
@@ -201,14 +286,7 @@ class Annee(Periode):
 		Le nombre de semaines du premier semestre est défini dans
 		pykol.models.constantes.SEMAINES_PREMIERE_PERIODE.
 		"""
-		numero_semaine = self.numero_semaine(date)
-		if numero_semaine is None:
-			return None
-
-		if numero_semaine <= constantes.SEMAINES_PREMIERE_PERIODE:
-			return constantes.PERIODE_PREMIERE
-		else:
-			return constantes.PERIODE_DEUXIEME
+		return self.calendrier().periode_enseignement(date)
 
 class Vacances(Periode):
 	"""
@@ -16,10 +16,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction
 from django.db.models import Q, F
 from django.urls import reverse
 
+from pykol.lib.cache import invalider
 from pykol.models import constantes
 from pykol.models.comptabilite import Compte
 from .annee import Annee
@@ -504,3 +507,148 @@ class Classe(Groupe):
 				colloscopepermission__classe=self,
 				colloscopepermission__matiere_seulement=False,
 				colloscopepermission__droit__codename='change_colloscope')
+
+class AppartenanceClasseManager(models.Manager):
+	def roles(self, classes=None):
+		"""
+		Calcule, à partir des services, des coordinations, des créneaux,
+		des colles et des permissions sur les colloscopes, le
+		dictionnaire qui associe à chaque couple (utilisateur, classe)
+		l'ensemble des rôles de l'utilisateur dans la classe.
+
+		Si classes est fourni, le calcul est restreint à ces classes.
+		"""
+		from pykol.models.colles import Creneau, ColleDetails, \
+				ColloscopePermission
+
+		def filtre(chemin, qs):
+			if classes is None:
+				return qs
+			return qs.filter(**{chemin + '__in': classes})
+
+		requetes = (
+			('enseignant', filtre('enseignement__classe',
+				Service.objects.filter(professeur__isnull=False)
+				).values_list('professeur_id', 'enseignement__classe_id')),
+			('coordonnateur', filtre('pk',
+				Classe.all_objects.filter(coordonnateur__isnull=False)
+				).values_list('coordonnateur_id', 'pk')),
+			('colleur_creneau', filtre('classe',
+				Creneau.objects.filter(colleur__isnull=False)
+				).values_list('colleur_id', 'classe_id')),
+			('colleur_colle', filtre('colle__classe',
+				ColleDetails.objects.filter(actif=True,
+					colleur__isnull=False)
+				).values_list('colleur_id', 'colle__classe_id')),
+			('colloscope', filtre('classe',
+				ColloscopePermission.objects.filter(
+					droit__codename='change_colloscope',
+					user__professeur__isnull=False)
+				).values_list('user_id', 'classe_id')),
+		)
+
+		roles = defaultdict(set)
+		for role, requete in requetes:
+			for cle in requete.distinct():
+				roles[cle].add(role)
+		return roles
+
+	@transaction.atomic
+	def recalculer(self, classes=None):
+		"""
+		Met à jour la table des appartenances pour les classes données
+		(ou pour toutes les classes si classes vaut None). Les classes
+		qui n'existent plus sont ignorées.
+		"""
+		appartenances = self.all()
+		if classes is not None:
+			classes = list(Classe.all_objects.filter(pk__in=classes
+				).values_list('pk', flat=True))
+			appartenances = appartenances.filter(classe__in=classes)
+
+		existantes = {(a.user_id, a.classe_id): a
+			for a in appartenances}
+		a_creer = []
+		a_modifier = []
+		for (user_id, classe_id), roles in self.roles(classes).items():
+			valeurs = {role: role in roles
+				for role in AppartenanceClasse.ROLES}
+			appartenance = existantes.pop((user_id, classe_id), None)
+			if appartenance is None:
+				a_creer.append(AppartenanceClasse(user_id=user_id,
+					classe_id=classe_id, **valeurs))
+			elif any(getattr(appartenance, role) != valeur
+					for role, valeur in valeurs.items()):
+				for role, valeur in valeurs.items():
+					setattr(appartenance, role, valeur)
+				a_modifier.append(appartenance)
+
+		self.filter(pk__in=[a.pk for a in existantes.values()]).delete()
+		self.bulk_create(a_creer)
+		self.bulk_update(a_modifier, AppartenanceClasse.ROLES)
+
+		# Le menu de navigation liste les classes de l'utilisateur
+		invalider('navigation', *set(a.user_id
+			for a in a_creer + list(existantes.values())))
+
+	def recalculer_apres_commit(self, *classes):
+		"""
+		Planifie la mise à jour des appartenances des classes données
+		après la validation de la transaction en cours.
+
+		Les classes sont regroupées par connexion, pour que plusieurs
+		modifications d'une même transaction ne donnent lieu qu'à un
+		seul recalcul.
+		"""
+		classes = set(classes) - {None}
+		if not classes:
+			return
+
+		connexion = transaction.get_connection(self.db)
+		en_attente = connexion.__dict__.setdefault(
+				'_pykol_appartenances', set())
+		en_attente.update(classes)
+
+		def recalculer():
+			if en_attente:
+				a_recalculer = set(en_attente)
+				en_attente.clear()
+				self.recalculer(a_recalculer)
+
+		transaction.on_commit(recalculer, using=self.db)
+
+class AppartenanceClasse(models.Model):
+	"""
+	Rôles d'un professeur dans une classe.
+
+	Cette table dénormalisée est calculée à partir des services, de la
+	coordination des classes, des créneaux et des colles, ainsi que des
+	permissions sur les colloscopes. Elle est tenue à jour par les
+	signaux de pykol.signals et peut être reconstruite par la commande
+	appartenances_classes. Une ligne n'existe que si l'utilisateur
+	possède au moins un rôle dans la classe.
+	"""
+	user = models.ForeignKey('User', on_delete=models.CASCADE,
+			related_name='appartenances',
+			verbose_name="utilisateur")
+	classe = models.ForeignKey(Classe, on_delete=models.CASCADE,
+			related_name='appartenances')
+
+	enseignant = models.BooleanField(default=False)
+	coordonnateur = models.BooleanField(default=False)
+	colleur_creneau = models.BooleanField(default=False,
+			verbose_name="colleur sur un créneau")
+	colleur_colle = models.BooleanField(default=False,
+			verbose_name="colleur d'une colle")
+	colloscope = models.BooleanField(default=False,
+			verbose_name="gestion du colloscope")
+
+	ROLES = ('enseignant', 'coordonnateur', 'colleur_creneau',
+			'colleur_colle', 'colloscope')
+
+	objects = AppartenanceClasseManager()
+
+	class Meta:
+		verbose_name = "appartenance à une classe"
+		verbose_name_plural = "appartenances aux classes"
+		unique_together = ('user', 'classe')
@@ -22,6 +22,8 @@ SIECLE et STS.
 """
 
 from django.db import models
+
+import pykol.lib.files
 from .annee import Annee
 
 class ImportBeeLog(models.Model):
@@ -48,3 +50,131 @@ class ImportBeeLog(models.Model):
 		(IMPORT_TYPE_GRILLES_ECTS , "grilles ECTS"),
 	)
 	import_type = models.PositiveSmallIntegerField(choices=IMPORT_TYPE_CHOICES)
+
+	# Empreinte SHA-256 du contenu XML du fichier importé
+	empreinte = models.CharField(max_length=64, blank=True)
+
+# Étapes d'un import SIECLE/STS, dans l'ordre où elles sont exécutées par
+# BEEImporter.full_import. Chaque étape est le nom d'une méthode de
+# BEEImporter.
+ETAPES_IMPORT_BEE = (
+	('import_etablissement', "établissement"),
+	('import_annee', "année scolaire"),
+	('import_mefs', "formations"),
+	('import_programmes', "programmes"),
+	('import_professeurs', "professeurs"),
+	('import_divisions', "classes"),
+	('import_groupes', "groupes"),
+	('import_services', "services"),
+	('import_etudiants', "étudiants"),
+	('import_options_etudiants', "options des étudiants"),
+	('import_colles', "dotations en colles"),
+	('log_imports', "historique"),
+)
+
+class ImportBee(models.Model):
+	"""
+	Import de fichiers SIECLE et STS, réalisé en tâche de fond.
+
+	Les fichiers envoyés sont conservés dans l'espace de stockage privé.
+	Chaque étape de l'import est validée séparément dans la base de
+	données et enregistrée dans ImportBeeEtape : un import qui a échoué
+	peut être repris à partir de l'étape en erreur, sans exécuter de
+	nouveau les étapes déjà terminées.
+	"""
+	utilisateur = models.ForeignKey('User', blank=True, null=True,
+			on_delete=models.SET_NULL, related_name='+')
+
+	ETAT_ATTENTE = 1
+	ETAT_EN_COURS = 2
+	ETAT_TERMINE = 3
+	ETAT_ERREUR = 4
+	ETAT_CHOICES = (
+		(ETAT_ATTENTE, "en attente"),
+		(ETAT_EN_COURS, "en cours"),
+		(ETAT_TERMINE, "terminé"),
+		(ETAT_ERREUR, "erreur"),
+	)
+	etat = models.PositiveSmallIntegerField(verbose_name="état",
+			choices=ETAT_CHOICES, default=ETAT_ATTENTE)
+
+	date_creation = models.DateTimeField(auto_now_add=True,
+			verbose_name="date de création")
+	date_fin = models.DateTimeField(blank=True, null=True,
+			verbose_name="date de fin")
+	# Mise à jour régulièrement pendant l'exécution de l'import (voir
+	# pykol.lib.taches)
+	date_activite = models.DateTimeField(blank=True, null=True,
+			verbose_name="dernière activité")
+
+	# Lorsque ce champ est faux, les étapes dont les fichiers n'ont pas
+	# changé depuis le dernier import de l'année sont ignorées.
+	forcer = models.BooleanField(default=False,
+			verbose_name="importer aussi les fichiers inchangés")
+
+	# Étape en cours d'exécution, ou étape qui a échoué
+	etape = models.CharField(max_length=30, blank=True,
+			choices=ETAPES_IMPORT_BEE, verbose_name="étape")
+	erreur = models.TextField(blank=True)
+
+	fichier_sts = models.FileField(blank=True, null=True,
+			storage=pykol.lib.files.private_storage,
+			upload_to='import_bee/')
+	fichier_structures = models.FileField(blank=True, null=True,
+			storage=pykol.lib.files.private_storage,
+			upload_to='import_bee/')
+	fichier_nomenclatures = models.FileField(blank=True, null=True,
+			storage=pykol.lib.files.private_storage,
+			upload_to='import_bee/')
+	fichier_eleves = models.FileField(blank=True, null=True,
+			storage=pykol.lib.files.private_storage,
+			upload_to='import_bee/')
+
+	class Meta:
+		verbose_name = "import SIECLE/STS"
+		verbose_name_plural = "imports SIECLE/STS"
+		ordering = ['-date_creation']
+
+	def __str__(self):
+		return "Import SIECLE/STS {} du {}".format(self.pk,
+				self.date_creation)
+
+	def en_cours(self):
+		return self.etat in (self.ETAT_ATTENTE, self.ETAT_EN_COURS)
+
+	@property
+	def progression(self):
+		"""
+		Pourcentage des étapes de l'import déjà terminées.
+		"""
+		return len(self.etapes.all()) * 100 // len(ETAPES_IMPORT_BEE)
+
+	def fichiers(self):
+		"""
+		Liste des fichiers envoyés pour cet import.
+		"""
+		return [fichier for fichier in (self.fichier_sts,
+			self.fichier_structures, self.fichier_nomenclatures,
+			self.fichier_eleves) if fichier]
+
+class ImportBeeEtape(models.Model):
+	"""
+	Étape terminée d'un import SIECLE/STS, avec sa durée et le nombre
+	d'enregistrements traités. Une étape ignorée est une étape dont les
+	fichiers n'avaient pas changé depuis le dernier import.
+	"""
+	import_bee = models.ForeignKey(ImportBee, on_delete=models.CASCADE,
+			related_name='etapes')
+	etape = models.CharField(max_length=30, choices=ETAPES_IMPORT_BEE,
+			verbose_name="étape")
+	date_debut = models.DateTimeField(verbose_name="date de début")
+	duree = models.DurationField(verbose_name="durée")
+	nb_lignes = models.PositiveIntegerField(default=0,
+			verbose_name="nombre d'enregistrements")
+	ignoree = models.BooleanField(default=False, verbose_name="ignorée")
+
+	class Meta:
+		verbose_name = "étape d'import SIECLE/STS"
+		verbose_name_plural = "étapes d'import SIECLE/STS"
+		unique_together = ('import_bee', 'etape')
+		ordering = ['date_debut']
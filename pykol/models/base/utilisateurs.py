@@ -348,20 +348,15 @@ class Professeur(CodeIndemniteMixin, User):
 		verbose_name_plural = "professeurs"
 
 	def mes_classes(self):
-		"""Liste des classes où le professeur intervient"""
+		"""
+		Liste des classes où le professeur intervient
+
+		Cette liste est lue dans la table des appartenances aux classes,
+		tenue à jour lors des modifications des services, des créneaux,
+		des colles et des permissions sur les colloscopes.
+		"""
 		from pykol.models.base import Classe
-		qs = Classe.objects.filter(enseignements__service__professeur=self).union(
-				Classe.objects.filter(coordonnateur=self)).union(
-				Classe.objects.filter(creneau__colleur=self)).union(
-				Classe.objects.filter(colle__colledetails__actif=True,
-					colle__colledetails__colleur=self)).union(
-				Classe.objects.filter(colle__colledetails__actif=True,
-					colle__colledetails__eleves__classe__pk=F('pk'),
-					colle__colledetails__colleur=self)).union(
-				Classe.objects.filter(
-					colloscopepermission__droit__codename='change_colloscope',
-					colloscopepermission__user=self))
-		return qs
+		return Classe.objects.filter(appartenances__user=self)
 
 	def construire_comptes(self, commit=True):
 		"""
@@ -16,7 +16,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections import defaultdict
 from datetime import timedelta, datetime
+from itertools import chain
 
 from django.db import models, transaction
 from django.urls import reverse
@@ -27,6 +29,7 @@ from pykol.models.base import Classe, Professeur, Matiere, Etudiant, \
 from pykol.models.fields import NoteField
 from pykol.models.comptabilite import Mouvement, MouvementLigne, \
 		Lettrage
+from pykol.lib.cache import invalider
 
 # Liste des jours de la semaine, numérotation ISO
 LISTE_JOURS = enumerate(["lundi", "mardi", "mercredi", "jeudi",
@@ -121,20 +124,294 @@ class ColleQuerySet(models.QuerySet):
 		Mise à jour des colles de ce QuerySet pour répercuter les
 		modifications de leur créneau.
 		"""
-		for colle in self.filter(creneau__isnull=False,
-				semaine__isnull=False):
-			colle.ajout_details(
-					horaire=colle.semaine.horaire_creneau(colle.creneau),
-					salle=colle.creneau.salle,
-					colleur=colle.creneau.colleur)
+		self.filter(creneau__isnull=False, semaine__isnull=False
+			).select_related('creneau__colleur', 'semaine'
+			)._synchro_lot(lambda colle: (
+				colle.semaine.horaire_creneau(colle.creneau),
+				colle.creneau.salle, colle.creneau.colleur, None))
 
 	def synchro_trinome(self):
 		"""
 		Mise à jour des colles de ce QuerySet pour répercuter les
 		modifications sur le trinome de colle
 		"""
-		for colle in self.filter(groupe__isnull=False):
-			colle.ajout_details(etudiants=colle.groupe.etudiants.all())
+		self.filter(groupe__isnull=False).prefetch_related(
+			'groupe__etudiants')._synchro_lot(lambda colle: (
+				None, '', None,
+				[etudiant.pk for etudiant in colle.groupe.etudiants.all()]))
+
+	@transaction.atomic
+	def _synchro_lot(self, cible):
+		"""
+		Équivalent groupé de Colle.ajout_details pour toutes les colles
+		du QuerySet.
+
+		La fonction cible renvoie, pour chaque colle, le quadruplet
+		(horaire, salle, colleur, identifiants des étudiants) à passer à
+		ajout_details. Les nouveaux détails sont calculés en mémoire en
+		suivant les mêmes règles, puis seuls les détails modifiés sont
+		enregistrés en bloc. La comptabilité n'est reprise que pour les
+		colles dont la dotation change.
+		"""
+		colles = list(self.select_related('detail_actif__colleur',
+			'colles_ens', 'classe').prefetch_related(
+				'detail_actif__eleves'))
+
+		noms_classes = {}
+		details_salle = []
+		details_nouveaux = []
+		colles_duree = []
+		dotations = []
+		for colle in colles:
+			horaire, salle, colleur, etudiants = cible(colle)
+
+			try:
+				ancien_detail = colle.details
+			except ColleDetails.DoesNotExist:
+				ancien_detail = None
+
+			if ancien_detail is not None:
+				anciens_etudiants = set(etudiant.pk
+					for etudiant in ancien_detail.eleves.all())
+				if not colleur:
+					colleur = ancien_detail.colleur
+				if not etudiants:
+					etudiants = anciens_etudiants
+				if not horaire:
+					horaire = ancien_detail.horaire
+				if not salle and horaire == ancien_detail.horaire:
+					salle = ancien_detail.salle
+				etudiants = set(etudiants)
+
+				detail_modifie = colleur != ancien_detail.colleur or \
+						etudiants != anciens_etudiants or \
+						horaire != ancien_detail.horaire
+
+				if not detail_modifie and \
+						not ancien_detail.salle and salle:
+					ancien_detail.salle = salle
+					details_salle.append(ancien_detail)
+					continue
+
+				detail_modifie = detail_modifie or \
+					ancien_detail.salle != salle
+			else:
+				etudiants = set(etudiants or ())
+				detail_modifie = True
+
+			if detail_modifie:
+				details_nouveaux.append((ColleDetails(colle=colle,
+					horaire=horaire, salle=salle, colleur=colleur),
+					etudiants))
+
+				if colle.mode != Colle.MODE_TD:
+					colle.duree = colle.duree_pour_effectif(len(etudiants))
+					colles_duree.append(colle)
+
+			if colle.mode == Colle.MODE_TD:
+				duree_interrogation = colle.duree
+			else:
+				duree_interrogation = len(etudiants) * \
+						colle.get_duree_etudiant()
+
+			if colle.classe_id not in noms_classes:
+				noms_classes[colle.classe_id] = str(colle.classe)
+			dotations.append((colle, colleur.compte_prevu_id,
+				duree_interrogation,
+				"Colle du {date} en {classe}".format(date=horaire,
+					classe=noms_classes[colle.classe_id])))
+
+		ColleDetails.objects.bulk_update(details_salle, ('salle',))
+		Colle.all_objects.bulk_update(colles_duree, ('duree',))
+		Colle.invalider_calendrier(*set(detail.colle_id
+			for detail in details_salle))
+		Colle.invalider_calendrier(*set(colle.pk for colle in colles_duree))
+		Colle.all_objects.ajout_details_lot(details_nouveaux)
+		Colle.all_objects.comptabiliser_lot(dotations)
+
+	@transaction.atomic
+	def ajout_details_lot(self, details):
+		"""
+		Enregistre en bloc de nouveaux ColleDetails actifs.
+
+		Le paramètre details est une liste de couples (ColleDetails non
+		encore enregistré, identifiants des étudiants). Les anciens
+		détails des colles concernées sont désactivés et le pointeur
+		Colle.detail_actif est mis à jour.
+		"""
+		ColleDetails.objects.filter(actif=True, colle__in=[
+			detail.colle_id for detail, _ in details]
+			).update(actif=False)
+		ColleDetails.objects.bulk_create([d for d, _ in details])
+		ColleDetails.eleves.through.objects.bulk_create([
+			ColleDetails.eleves.through(colledetails_id=detail.pk,
+				etudiant_id=etudiant_id)
+			for detail, eleves in details
+			for etudiant_id in eleves])
+		for detail, _ in details:
+			detail.colle.detail_actif = detail
+		Colle.all_objects.bulk_update([detail.colle
+			for detail, _ in details], ('detail_actif',))
+		invalider('resultats', *set(detail.colle.classe_id
+			for detail, _ in details))
+		Colle.invalider_calendrier(*set(detail.colle_id
+			for detail, _ in details))
+
+		# Les enregistrements en bloc n'envoient pas de signal : on
+		# invalide explicitement les permissions et les appartenances
+		# aux classes qui dépendent du colleur.
+		from pykol.lib.auth import invalider_permissions
+		from pykol.models.base import AppartenanceClasse
+		invalider_permissions()
+		AppartenanceClasse.objects.recalculer_apres_commit(
+			*set(detail.colle.classe_id for detail, _ in details))
+
+	@staticmethod
+	def _dotation_identique(lignes, compte_debit, compte_credit, duree,
+			duree_interrogation, motif):
+		"""
+		Teste si un mouvement de dotation existant correspond déjà au
+		virement que l'on souhaite faire pour une colle, y compris son
+		motif (qui contient la date de la colle).
+		"""
+		if len(lignes) != 2 or lignes[0].mouvement.motif != motif:
+			return False
+		attendu = sorted([
+			(compte_debit, -duree, -duree_interrogation, motif),
+			(compte_credit, duree, duree_interrogation, motif)],
+			key=lambda l: l[1])
+		actuel = sorted([(l.compte_id, l.duree, l.duree_interrogation,
+			l.motif) for l in lignes], key=lambda l: l[1])
+		return attendu == actuel
+
+	@transaction.atomic
+	def comptabiliser_lot(self, dotations, annulations=()):
+		"""
+		Mise à jour groupée des écritures de dotation de colles.
+
+		Le paramètre dotations est une liste de quadruplets (colle,
+		compte à créditer, durée d'interrogation, motif) : chaque colle
+		doit être financée par un virement de colle.duree depuis le
+		compte de colles de sa matière. Les colles dont le mouvement de
+		dotation correspond déjà ne sont pas modifiées. Pour les autres,
+		l'ancien mouvement est annulé par un virement retour lettré,
+		comme dans Colle.annuler_mouvement, avant de créer le nouveau.
+
+		Les colles de la liste annulations voient uniquement leur
+		dotation rendue au compte de la matière.
+
+		Tous les mouvements sont validés ensemble, ce qui peut lever
+		l'exception CompteDecouvert.
+		"""
+		maintenant = timezone.now()
+
+		lignes_dotation = defaultdict(list)
+		for ligne in MouvementLigne.objects.filter(
+				mouvement__lignes__pk__in=[colle.ligne_dotation_id
+					for colle in chain((d[0] for d in dotations),
+						annulations)
+					if colle.ligne_dotation_id]
+				).select_related('mouvement').distinct():
+			lignes_dotation[ligne.mouvement_id].append(ligne)
+		mouvement_colle = dict([(ligne.pk, mouvement_id)
+			for mouvement_id, lignes in lignes_dotation.items()
+			for ligne in lignes])
+
+		retours = []
+		virements = []
+		for colle, compte_credit, duree_interrogation, motif in dotations:
+			compte_debit = colle.colles_ens.compte_colles_id
+			if colle.ligne_dotation_id is not None:
+				anciennes_lignes = lignes_dotation[
+						mouvement_colle[colle.ligne_dotation_id]]
+				if self._dotation_identique(anciennes_lignes,
+						compte_debit, compte_credit, colle.duree,
+						duree_interrogation, motif):
+					continue
+				retours.append((colle, anciennes_lignes))
+
+			virements.append((colle, Mouvement(date=maintenant,
+					annee_id=colle.classe.annee_id, colle=colle,
+					motif=motif), [
+				MouvementLigne(compte_id=compte_debit,
+					duree=-colle.duree,
+					duree_interrogation=-duree_interrogation,
+					motif=motif),
+				MouvementLigne(compte_id=compte_credit,
+					duree=colle.duree,
+					duree_interrogation=duree_interrogation,
+					motif=motif),
+				]))
+
+		for colle in annulations:
+			if colle.ligne_dotation_id is not None:
+				retours.append((colle, lignes_dotation[
+					mouvement_colle[colle.ligne_dotation_id]]))
+
+		mouvements_retour = []
+		for colle, anciennes_lignes in retours:
+			mouvement_id = anciennes_lignes[0].mouvement_id
+			motif_retour = "Annulation du mouvement {pk}".format(
+					pk=mouvement_id)
+			mouvements_retour.append((Mouvement(date=maintenant,
+				annee_id=anciennes_lignes[0].mouvement.annee_id,
+				colle=colle, motif=motif_retour), [
+					MouvementLigne(compte_id=ligne.compte_id,
+						duree=-ligne.duree,
+						duree_interrogation=-ligne.duree_interrogation,
+						taux=ligne.taux, motif=motif_retour)
+					for ligne in anciennes_lignes],
+				anciennes_lignes))
+
+		mouvements = [mv for mv, _, _ in mouvements_retour] + \
+				[mv for _, mv, _ in virements]
+		Mouvement.objects.bulk_create(mouvements)
+
+		lignes = []
+		for mv, nouvelles_lignes, _ in mouvements_retour:
+			for ligne in nouvelles_lignes:
+				ligne.mouvement = mv
+				lignes.append(ligne)
+		for _, mv, nouvelles_lignes in virements:
+			for ligne in nouvelles_lignes:
+				ligne.mouvement = mv
+				lignes.append(ligne)
+		MouvementLigne.objects.bulk_create(lignes)
+
+		# Lettrage des lignes de crédit des anciens mouvements avec les
+		# lignes de débit des mouvements de retour.
+		lettrages = [Lettrage(mode=Lettrage.LETTRAGE_TOTAL)
+				for _ in mouvements_retour]
+		Lettrage.objects.bulk_create(lettrages)
+		lignes_lettrees = []
+		for lettrage, (_, nouvelles_lignes, anciennes_lignes) in \
+				zip(lettrages, mouvements_retour):
+			for ligne in anciennes_lignes:
+				if ligne.duree > timedelta():
+					ligne.lettrage = lettrage
+					lignes_lettrees.append(ligne)
+			for ligne in nouvelles_lignes:
+				if ligne.duree < timedelta():
+					ligne.lettrage = lettrage
+					lignes_lettrees.append(ligne)
+		MouvementLigne.objects.bulk_update(lignes_lettrees, ('lettrage',))
+
+		# Rattachement des nouvelles lignes de dotation aux colles
+		for colle, _, (_, ligne_credit) in virements:
+			colle.ligne_dotation = ligne_credit
+		Colle.all_objects.bulk_update([colle for colle, _, _ in virements],
+				('ligne_dotation',))
+
+		Mouvement.objects.valider_lot(mouvements)
+
+	def with_details(self):
+		"""
+		Charge en même temps que les colles leur ColleDetails actif, le
+		colleur et la liste des élèves, en un nombre fixe de requêtes.
+		"""
+		return self.select_related('detail_actif__colleur', 'classe',
+				'enseignement__matiere', 'colles_ens').prefetch_related(
+						'detail_actif__eleves')
 
 class ColleManager(models.Manager):
 	def get_queryset(self):
@@ -150,6 +427,15 @@ class ColleManager(models.Manager):
 	def synchro_trinome(self):
 		return self.get_queryset().synchro_trinome()
 
+	def ajout_details_lot(self, *args, **kwargs):
+		return self.get_queryset().ajout_details_lot(*args, **kwargs)
+
+	def comptabiliser_lot(self, *args, **kwargs):
+		return self.get_queryset().comptabiliser_lot(*args, **kwargs)
+
+	def with_details(self):
+		return self.get_queryset().with_details()
+
 class ColleConfirmeeManager(ColleManager):
 	"""
 	Gestionnaire personnalisé sur les colles qui permet de n'afficher
@@ -196,6 +482,13 @@ class Colle(AbstractBaseColle):
 		verbose_name="ligne de dotation", on_delete=models.PROTECT,
 		blank=True, null=True)
 
+	# Pointeur vers le ColleDetails actif, maintenu par ajout_details
+	# (et par ColleDetails.save), pour éviter de rechercher le détail
+	# actif à chaque accès.
+	detail_actif = models.ForeignKey('ColleDetails',
+		verbose_name="détails actifs", on_delete=models.SET_NULL,
+		blank=True, null=True, editable=False, related_name='+')
+
 	# On remplace le gestionnaire objects, mais en prenant soin de
 	# laisser le gestionnaire par défaut all_objects en première
 	# position (c'est lui qui est utilisé par Django comme gestionnaire
@@ -206,13 +499,34 @@ class Colle(AbstractBaseColle):
 	@property
 	def details(self):
 		"""Renvoie le dernier ColleDetails actif pour cette colle"""
-		return self.colledetails_set.get(actif=True)
+		if self.detail_actif_id is None:
+			return self.colledetails_set.get(actif=True)
+		return self.detail_actif
 
 	@property
 	def colleur(self):
 		"""Renvoie le colleur qui assure cette colle"""
 		return self.details.colleur
 
+	@staticmethod
+	def invalider_calendrier(*colles_pks):
+		"""
+		Invalide les événements iCalendar des colles données, ainsi que
+		les flux des colleurs et des étudiants de tous leurs détails,
+		actifs ou non. Les signaux appellent cette méthode ; elle doit
+		l'être explicitement après les modifications en bloc.
+		"""
+		if not colles_pks:
+			return
+		utilisateurs = set(ColleDetails.objects.filter(
+			colle__in=colles_pks, colleur__isnull=False).values_list(
+				'colleur_id', flat=True))
+		utilisateurs.update(ColleDetails.eleves.through.objects.filter(
+			colledetails__colle__in=colles_pks).values_list(
+				'etudiant_id', flat=True))
+		invalider('calendrier_colle', *colles_pks)
+		invalider('calendrier_utilisateur', *utilisateurs)
+
 	def get_duree_etudiant(self):
 		"""
 		Détermine la durée d'interrogation par étudiant
@@ -226,16 +540,22 @@ class Colle(AbstractBaseColle):
 		else:
 			return self.duree_etudiant
 
+	def duree_pour_effectif(self, nb_eleves):
+		"""
+		Calcule la durée d'une colle en mode interrogation pour le
+		nombre d'élèves donné.
+		"""
+		if self.colles_ens.frequence == self.colles_ens.FREQUENCE_HEBDOMADAIRE:
+			return timedelta(hours=1)
+		else:
+			return nb_eleves * self.get_duree_etudiant()
+
 	def _update_duree(self):
 		# On laisse la durée par défaut pour le mode TD
 		if self.mode == Colle.MODE_TD:
 			return
 
-		if self.colles_ens.frequence == self.colles_ens.FREQUENCE_HEBDOMADAIRE:
-			self.duree = timedelta(hours=1)
-		else:
-			self.duree = self.details.eleves.count() * \
-					self.get_duree_etudiant()
+		self.duree = self.duree_pour_effectif(self.details.eleves.count())
 		self.save()
 
 	def __str__(self):
@@ -316,6 +636,7 @@ class Colle(AbstractBaseColle):
 			detail.save()
 			detail.eleves.set(etudiants)
 
+			self.detail_actif = detail
 			self._update_duree()
 
 		# Mise à jour des écritures comptables s'il y a un changement de
@@ -401,7 +722,7 @@ class Colle(AbstractBaseColle):
 			compte_debit=self.colleur.compte_prevu,
 			compte_credit=self.colleur.compte_effectue,
 			motif=str(self))
-		mv.valider()
+		Mouvement.objects.valider_lot([mv])
 
 		# On lettre la ligne de dotation et la ligne qui débite cette
 		# dotation pour payer le colleur.
@@ -455,6 +776,20 @@ class ColleDetails(models.Model):
 		verbose_name = "détails de la colle"
 		verbose_name_plural = "détails de la colle"
 
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+
+		# Mise à jour du pointeur Colle.detail_actif, y compris lorsque
+		# le détail est modifié en dehors de Colle.ajout_details (par
+		# exemple depuis l'administration).
+		colles = Colle.all_objects.filter(pk=self.colle_id)
+		if self.actif:
+			colles.exclude(detail_actif=self).update(detail_actif=self)
+			if ColleDetails.colle.is_cached(self):
+				self.colle.detail_actif = self
+		else:
+			colles.filter(detail_actif=self).update(detail_actif=None)
+
 class ColleNote(models.Model):
 	"""
 	Note attribuée à une colle pour un étudiant.
@@ -23,6 +23,7 @@ effectuées et leur mise en paiement."""
 from datetime import timedelta
 
 from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.utils.timezone import localtime
 from django.template.loader import get_template
 
@@ -30,7 +31,7 @@ from pykol.models.base import Annee, Professeur, Classe, Etablissement, \
 		CodeIndemniteMixin
 from pykol.models.comptabilite import ColleDureeTaux, Compte, \
 		Mouvement, MouvementLigne
-from pykol.models.colles import Colle
+from pykol.models.colles import Colle, ColleDetails, ColleNote
 
 class ColleReleve(models.Model):
 	"""
@@ -107,8 +108,8 @@ class ColleReleve(models.Model):
 		"""
 		Valide les écritures comptables correspond aux colles relevées.
 		"""
-		for ligne in self.lignes.all():
-			ligne.mouvement_ligne.mouvement.valider()
+		Mouvement.objects.valider_lot(Mouvement.objects.filter(
+			lignes__collereleveligne__releve=self).distinct())
 
 	def maj_etat(self, date=None):
 		"""
@@ -163,6 +164,123 @@ class ColleReleve(models.Model):
 		colle.releve = self
 		colle.save()
 
+	@transaction.atomic
+	def ajout_colles(self, colles):
+		"""
+		Ajout groupé au relevé de toutes les colles du QuerySet donné.
+
+		Les durées sont calculées par une seule agrégation SQL, puis
+		chaque ligne du relevé (colleur, taux) reçoit une seule ligne
+		de débit sur le compte des colles effectuées du colleur. Les
+		colles sont marquées comme relevées par une seule requête.
+		Cette méthode ne valide pas les mouvements, ce qui reste le rôle
+		de comptabiliser(). Elle lève l'exception ValueError si l'une
+		des colles n'a pas de colleur.
+		"""
+		# On verrouille les colles pour ne pas les relever deux fois.
+		colles_pk = list(colles.filter(releve__isnull=True).order_by('pk'
+			).select_for_update().values_list('pk', flat=True))
+		if not colles_pk:
+			return
+		colles = Colle.all_objects.filter(pk__in=colles_pk)
+
+		# Les colles dont le détail actif n'est pas renseigné sont
+		# rattachées à leur ColleDetails actif, comme le fait
+		# Colle.details.
+		rattachees = [Colle(pk=colle_pk, detail_actif_id=detail_pk)
+			for colle_pk, detail_pk in ColleDetails.objects.filter(
+				colle__in=colles.filter(detail_actif__isnull=True),
+				actif=True).values_list('colle', 'pk')]
+		Colle.all_objects.bulk_update(rattachees, ('detail_actif',))
+		Colle.invalider_calendrier(*[colle.pk for colle in rattachees])
+
+		sans_colleur = colles.filter(detail_actif__colleur__isnull=True
+			).first()
+		if sans_colleur is not None:
+			raise ValueError("La colle {} n'a pas de colleur.".format(
+				sans_colleur.pk))
+
+		taux_classes = dict([(classe.pk, ColleReleveLigne.taux_colle(classe))
+			for classe in Classe.objects.filter(
+				pk__in=colles.values('classe'))])
+
+		# Durée d'interrogation de chaque colle : la somme des durées
+		# des notes pour une interrogation, la durée de la colle pour un
+		# TD.
+		notes = ColleNote.objects.filter(colle=models.OuterRef('pk')
+			).order_by().values('colle').annotate(
+				total=models.Sum('duree')).values('total')
+		sommes = colles.annotate(
+			duree_interrogation_colle=models.Case(
+				models.When(mode=Colle.MODE_TD, then=models.F('duree')),
+				default=Coalesce(
+					models.Subquery(notes), timedelta()),
+				output_field=models.DurationField())
+			).values('classe', 'detail_actif__colleur',
+				'detail_actif__colleur__code_indemnite',
+				'detail_actif__colleur__compte_effectue').annotate(
+				duree_totale=models.Sum('duree'),
+				duree_interrogation_totale=models.Sum(
+					'duree_interrogation_colle')).order_by()
+
+		groupes = {}
+		for somme in sommes:
+			cle = (somme['detail_actif__colleur'],
+					taux_classes[somme['classe']])
+			groupe = groupes.setdefault(cle, {
+				'code_indemnite': somme['detail_actif__colleur__code_indemnite'],
+				'compte_effectue': somme['detail_actif__colleur__compte_effectue'],
+				'duree': timedelta(),
+				'duree_interrogation': timedelta(),
+				})
+			groupe['duree'] += somme['duree_totale']
+			groupe['duree_interrogation'] += somme['duree_interrogation_totale']
+
+		lignes = dict([((ligne.colleur_id, ligne.taux), ligne)
+			for ligne in self.lignes.select_related('mouvement_ligne')])
+
+		# Création des mouvements des nouvelles lignes du relevé
+		nouvelles = [cle for cle in groupes if cle not in lignes]
+		mouvements = [Mouvement(annee=self.annee, date=self.date,
+			motif=str(self)) for _ in nouvelles]
+		Mouvement.objects.bulk_create(mouvements)
+		credits = [MouvementLigne(compte=self.compte_colles,
+			mouvement=mouvement, taux=taux, motif=str(self))
+			for mouvement, (_, taux) in zip(mouvements, nouvelles)]
+		MouvementLigne.objects.bulk_create(credits)
+		for (colleur, taux), credit in zip(nouvelles, credits):
+			lignes[(colleur, taux)] = ColleReleveLigne(releve=self,
+				colleur_id=colleur, taux=taux,
+				code_indemnite=groupes[(colleur, taux)]['code_indemnite'],
+				mouvement_ligne=credit)
+
+		debits = []
+		for (colleur, taux), groupe in groupes.items():
+			ligne = lignes[(colleur, taux)]
+			ligne.duree += groupe['duree']
+			ligne.duree_interrogation += groupe['duree_interrogation']
+			ligne.mouvement_ligne.duree = ligne.duree
+			ligne.mouvement_ligne.duree_interrogation = \
+					ligne.duree_interrogation
+			debits.append(MouvementLigne(
+				compte_id=groupe['compte_effectue'],
+				mouvement_id=ligne.mouvement_ligne.mouvement_id,
+				duree=-groupe['duree'],
+				duree_interrogation=-groupe['duree_interrogation'],
+				taux=taux,
+				motif=str(self)))
+
+		MouvementLigne.objects.bulk_create(debits)
+		MouvementLigne.objects.bulk_update([lignes[cle].mouvement_ligne
+			for cle in groupes], ('duree', 'duree_interrogation'))
+		ColleReleveLigne.objects.bulk_update([lignes[cle]
+			for cle in groupes if cle not in nouvelles],
+			('duree', 'duree_interrogation'))
+		ColleReleveLigne.objects.bulk_create([lignes[cle]
+			for cle in nouvelles])
+
+		colles.update(etat=Colle.ETAT_RELEVEE, releve=self)
+
 	def lignes_par_prof(self):
 		return self.lignes.order_by('colleur__last_name',
 				'colleur__first_name', 'taux')
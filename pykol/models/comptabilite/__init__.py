@@ -17,4 +17,5 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from .comptabilite import Compte, Mouvement, Lettrage, \
-		MouvementLigne, ColleDureeTaux, CompteDecouvert
+		MouvementLigne, ColleDureeTaux, CompteDecouvert, CompteSolde, \
+		MouvementNonEquilibre
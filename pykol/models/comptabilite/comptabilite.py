@@ -86,10 +86,11 @@ class Compte(MPTTModel):
 
 		comptes = self.get_descendants(include_self=True)
 
-		return MouvementLigne.objects.filter(compte__in=comptes,
-			mouvement__annee=annee,
-			mouvement__etat=Mouvement.ETAT_VALIDE).values('taux'
-		).aggregate(duree=models.Sum('duree'),
+		# Les soldes sont lus dans la table CompteSolde, tenue à jour
+		# lors de la validation des mouvements, plutôt que recalculés à
+		# partir de toutes les lignes de l'année.
+		return CompteSolde.objects.filter(compte__in=comptes,
+			annee=annee).aggregate(duree=models.Sum('duree'),
 			duree_interrogation=models.Sum('duree_interrogation'))
 
 	def sens_affichage(self):
@@ -119,7 +120,28 @@ class Compte(MPTTModel):
 		Renvoie True quand le retrait de la ligne donnée en paramètre ne
 		provoque pas un dépassement du découvert autorisé.
 		"""
-		solde = self.solde(ligne.mouvement.annee)
+		return self.retrait_duree_possible(ligne.duree,
+				ligne.duree_interrogation, ligne.mouvement.annee)
+
+	def retrait_duree_possible(self, duree, duree_interrogation,
+			annee=None, solde=None):
+		"""
+		Renvoie True quand le retrait des durées données en paramètre
+		ne provoque pas un dépassement du découvert autorisé. Les
+		durées sont celles que porterait une ligne de mouvement sur ce
+		compte (négatives pour un débit), ce qui permet de tester en une
+		seule fois le cumul de plusieurs lignes.
+
+		Le paramètre solde permet de fournir le solde du compte s'il a
+		déjà été calculé (au format renvoyé par Compte.solde).
+
+		Seules les durées effectivement retirées sont comparées au
+		découvert autorisé : un compte qui dépasse déjà son découvert
+		(par exemple suite à la reprise des données antérieures au
+		contrôle du découvert) peut toujours être crédité.
+		"""
+		if solde is None:
+			solde = self.solde(annee)
 
 		if self.decouvert_autorise:
 			if self.decouvert_duree is None:
@@ -136,11 +158,12 @@ class Compte(MPTTModel):
 			duree_interrogation_minimale = timedelta()
 
 		return \
-			(duree_minimale is None or
-				solde['duree'] - ligne.duree >= duree_minimale) and \
+			(duree_minimale is None or duree >= timedelta() or
+				(solde['duree'] or timedelta()) + duree >= duree_minimale) and \
 			(duree_interrogation_minimale is None or
-				solde['duree_interrogation'] - ligne.duree_interrogation >= \
-				duree_interrogation_minimale)
+				duree_interrogation >= timedelta() or
+				(solde['duree_interrogation'] or timedelta()) + \
+				duree_interrogation >= duree_interrogation_minimale)
 
 class CompteDecouvert(Exception):
 	"""
@@ -181,8 +204,106 @@ class MouvementManager(models.Manager):
 
 		return mv
 
+	@transaction.atomic
+	def valider_lot(self, mouvements):
+		"""
+		Valide en une seule fois une liste de mouvements.
+
+		Les comptes concernés sont verrouillés une seule fois, dans
+		l'ordre de leurs clés primaires. On vérifie ensuite que tous les
+		mouvements sont équilibrés, puis que l'effet cumulé des
+		mouvements sur chaque compte ne dépasse pas son découvert
+		autorisé.
+
+		Cette méthode lève MouvementNonEquilibre ou CompteDecouvert (dont
+		l'attribut ligne désigne la première ligne, et donc le mouvement,
+		qui fait passer le compte à découvert). Dans ce cas, aucun
+		mouvement n'est validé. Les mouvements déjà validés sont ignorés.
+		"""
+		mouvements = dict([(mv.pk, mv) for mv in mouvements])
+		a_valider = list(self.filter(pk__in=mouvements,
+			etat=Mouvement.ETAT_BROUILLON).order_by('pk'
+			).select_for_update().values_list('pk', flat=True))
+
+		if a_valider:
+			lignes_qs = MouvementLigne.objects.filter(
+					mouvement__in=a_valider)
+
+			# On verrouille les comptes pour éviter toute autre
+			# transaction concurrente pendant que l'on vérifie les
+			# soldes.
+			comptes = dict([(compte.pk, compte) for compte in
+				Compte.objects.filter(pk__in=lignes_qs.values('compte')
+					).order_by('pk').select_for_update()])
+
+			# Équilibre de chacun des mouvements
+			equilibres = set([somme['mouvement'] for somme in
+				lignes_qs.values('mouvement').annotate(
+					duree=models.Sum('duree'),
+					duree_interrogation=models.Sum('duree_interrogation')
+				).order_by()
+				if somme['duree'] == timedelta() and
+					somme['duree_interrogation'] == timedelta()])
+			for pk in a_valider:
+				if pk not in equilibres:
+					raise MouvementNonEquilibre(mouvements[pk])
+
+			# Effet cumulé des mouvements sur chaque compte
+			effets = {}
+			for ligne in lignes_qs.order_by('mouvement', 'pk'):
+				ligne.mouvement = mouvements[ligne.mouvement_id]
+				effet = effets.setdefault(
+					(ligne.compte_id, ligne.mouvement.annee_id),
+					[timedelta(), timedelta(), []])
+				effet[0] += ligne.duree
+				effet[1] += ligne.duree_interrogation
+				effet[2].append(ligne)
+
+			soldes = {}
+			for annee_id in {annee_id for _, annee_id in effets}:
+				soldes[annee_id] = CompteSolde.objects.soldes_sous_arbres(
+					comptes.values(), annee_id)
+
+			for (compte_id, annee_id), (duree, duree_interrogation,
+					lignes) in effets.items():
+				if duree >= timedelta() and \
+						duree_interrogation >= timedelta():
+					continue
+
+				compte = comptes[compte_id]
+				solde = soldes[annee_id][compte_id]
+				if compte.retrait_duree_possible(duree,
+						duree_interrogation, solde=solde):
+					continue
+
+				# On cherche la ligne de débit à partir de laquelle le
+				# cumul n'est plus possible.
+				cumul = [timedelta(), timedelta()]
+				ligne_fautive = None
+				for ligne in lignes:
+					cumul[0] += ligne.duree
+					cumul[1] += ligne.duree_interrogation
+					if ligne.sens == MouvementLigne.SENS_DEBIT:
+						ligne_fautive = ligne
+						if not compte.retrait_duree_possible(*cumul,
+								solde=solde):
+							break
+				raise CompteDecouvert(ligne_fautive)
+
+			self.filter(pk__in=a_valider).update(
+					etat=Mouvement.ETAT_VALIDE)
+			CompteSolde.objects.imputer_mouvements(a_valider)
+
+		for mv in mouvements.values():
+			mv.etat = Mouvement.ETAT_VALIDE
+
 class MouvementNonEquilibre(Exception):
-	pass
+	"""
+	Exception levée lors de la validation d'un mouvement dont les
+	lignes ne sont pas de somme nulle.
+	"""
+	def __init__(self, mouvement=None):
+		self.mouvement = mouvement
 
 class Mouvement(models.Model):
 	"""
@@ -270,20 +391,7 @@ class Mouvement(models.Model):
 		Valide le mouvement à condition qu'il soit équilibré et que les
 		soldes des comptes le permettent.
 		"""
-		# On verrouille les comptes pour éviter toute autre transaction
-		# concurrente pendant que l'on vérifie les soldes.
-		comptes = Compte.objects.filter(lignes__mouvement=self
-			).select_for_update()
-
-		if not self.est_equilibre():
-			raise MouvementNonEquilibre()
-		for ligne in self.lignes.all():
-			if ligne.sens == MouvementLigne.SENS_DEBIT and \
-				not ligne.compte.retrait_possible(ligne):
-				raise CompteDecouvert(ligne)
-
-		self.etat = self.ETAT_VALIDE
-		self.save()
+		Mouvement.objects.valider_lot([self])
 
 	def _premiere_ligne_sens(self, sens):
 		for ligne in self.lignes.all():
@@ -421,3 +529,164 @@ class MouvementLigne(ColleDureeTaux):
 			return self.SENS_CREDIT
 		else:
 			return self.SENS_DEBIT
+
+class CompteSoldeManager(models.Manager):
+	def _sommes_lignes(self, lignes):
+		"""
+		Regroupe les lignes données par compte, année et taux, et
+		renvoie un dictionnaire qui associe à chaque triplet (compte,
+		année, taux) le couple des durées cumulées.
+		"""
+		return dict([((l['compte'], l['mouvement__annee'], l['taux']),
+			(l['duree'], l['duree_interrogation']))
+			for l in lignes.values('compte', 'mouvement__annee', 'taux'
+				).annotate(duree=models.Sum('duree'),
+					duree_interrogation=models.Sum('duree_interrogation')
+				).order_by()])
+
+	@transaction.atomic
+	def imputer_mouvements(self, mouvements):
+		"""
+		Ajoute aux soldes des comptes les lignes des mouvements donnés
+		en paramètre, qui viennent d'être validés.
+
+		L'appelant doit avoir verrouillé les comptes concernés (comme
+		le fait Mouvement.valider) : la mise à jour se fait alors dans
+		la même transaction que la validation.
+		"""
+		sommes = self._sommes_lignes(MouvementLigne.objects.filter(
+			mouvement__in=mouvements))
+		if not sommes:
+			return
+
+		soldes = {}
+		for solde in self.filter(
+				compte__in={compte for compte, _, _ in sommes},
+				annee__in={annee for _, annee, _ in sommes}):
+			soldes[(solde.compte_id, solde.annee_id, solde.taux)] = solde
+
+		a_creer = []
+		a_modifier = []
+		for (compte, annee, taux), (duree, duree_interrogation) in \
+				sommes.items():
+			try:
+				solde = soldes[(compte, annee, taux)]
+				a_modifier.append(solde)
+			except KeyError:
+				solde = self.model(compte_id=compte, annee_id=annee,
+						taux=taux)
+				a_creer.append(solde)
+			solde.duree += duree
+			solde.duree_interrogation += duree_interrogation
+
+		self.bulk_update(a_modifier, ('duree', 'duree_interrogation'))
+		self.bulk_create(a_creer)
+
+	def calculer(self, annee=None):
+		"""
+		Recalcule les soldes à partir de toutes les lignes des
+		mouvements validés, éventuellement pour une seule année.
+		"""
+		lignes = MouvementLigne.objects.filter(
+			mouvement__etat=Mouvement.ETAT_VALIDE)
+		if annee is not None:
+			lignes = lignes.filter(mouvement__annee=annee)
+		return self._sommes_lignes(lignes)
+
+	def _soldes_enregistres(self, annee=None):
+		soldes = self.all()
+		if annee is not None:
+			soldes = soldes.filter(annee=annee)
+		return dict([((compte, annee, taux),
+			(duree, duree_interrogation))
+			for compte, annee, taux, duree, duree_interrogation in
+			soldes.values_list('compte', 'annee', 'taux', 'duree',
+				'duree_interrogation')])
+
+	def verifier(self, annee=None):
+		"""
+		Compare les soldes enregistrés avec ceux recalculés à partir
+		des lignes. Renvoie la liste des écarts, sous la forme de
+		triplets ((compte, année, taux), solde enregistré, solde
+		calculé). Les soldes nuls sont considérés comme absents.
+		"""
+		zero = (timedelta(), timedelta())
+		enregistres = self._soldes_enregistres(annee)
+		calcules = self.calculer(annee)
+
+		ecarts = []
+		for cle in sorted(set(enregistres) | set(calcules),
+				key=lambda cle: (cle[0], cle[1], cle[2] or 0)):
+			enregistre = enregistres.get(cle, zero)
+			calcule = calcules.get(cle, zero)
+			if enregistre != calcule:
+				ecarts.append((cle, enregistre, calcule))
+		return ecarts
+
+	@transaction.atomic
+	def reconstruire(self, annee=None):
+		"""
+		Reconstruit entièrement la table des soldes à partir des lignes
+		des mouvements validés.
+		"""
+		# On verrouille tous les comptes pour ne pas manquer un
+		# mouvement validé pendant la reconstruction.
+		list(Compte.objects.select_for_update().order_by('pk'
+			).values_list('pk', flat=True))
+
+		soldes = self.all()
+		if annee is not None:
+			soldes = soldes.filter(annee=annee)
+		soldes.delete()
+
+		self.bulk_create([self.model(compte_id=compte, annee_id=annee,
+			taux=taux, duree=duree,
+			duree_interrogation=duree_interrogation)
+			for (compte, annee, taux), (duree, duree_interrogation)
+			in self.calculer(annee).items()])
+
+	def soldes_sous_arbres(self, comptes, annee):
+		"""
+		Calcule en une seule requête le solde de chacun des comptes
+		donnés, en incluant leurs sous-comptes. Renvoie un dictionnaire
+		qui associe à la clé primaire de chaque compte un dictionnaire
+		au même format que Compte.solde.
+		"""
+		comptes = list(comptes)
+		lignes = self.filter(annee=annee,
+			compte__tree_id__in={c.tree_id for c in comptes}
+			).values_list('compte__tree_id', 'compte__lft', 'duree',
+				'duree_interrogation')
+
+		resultat = dict([(c.pk, {'duree': None, 'duree_interrogation': None})
+			for c in comptes])
+		for tree_id, lft, duree, duree_interrogation in lignes:
+			for compte in comptes:
+				if compte.tree_id == tree_id and \
+						compte.lft <= lft <= compte.rght:
+					solde = resultat[compte.pk]
+					solde['duree'] = (solde['duree'] or timedelta()) + duree
+					solde['duree_interrogation'] = \
+						(solde['duree_interrogation'] or timedelta()) + \
+						duree_interrogation
+		return resultat
+
+class CompteSolde(ColleDureeTaux):
+	"""
+	Solde d'un compte pour une année et un taux donnés.
+
+	Cette table est une copie matérialisée de la somme des lignes des
+	mouvements validés, mise à jour à chaque validation. Elle peut être
+	reconstruite avec la commande de gestion soldes_comptes.
+	"""
+	compte = models.ForeignKey(Compte, on_delete=models.CASCADE,
+			related_name='soldes')
+	annee = models.ForeignKey('Annee', on_delete=models.CASCADE,
+			verbose_name="année")
+
+	objects = CompteSoldeManager()
+
+	class Meta:
+		verbose_name = "solde de compte"
+		verbose_name_plural = "soldes de comptes"
+		unique_together = ('compte', 'annee', 'taux')
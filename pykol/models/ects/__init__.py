@@ -19,3 +19,4 @@
 from .grille import Grille, GrilleLigne, GrilleMatchLigne, \
 		GrilleGroupeLignes
 from .jury import Jury, Mention
+from .attestations import AttestationsLot, AttestationEtudiant
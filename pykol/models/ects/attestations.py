@@ -0,0 +1,117 @@
+# -*- coding: utf-8
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2019 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.db import models
+from django.urls import reverse
+
+from pykol.models.base import Etudiant
+import pykol.lib.files
+from .jury import Jury
+
+class AttestationsLot(models.Model):
+	"""
+	Lot d'attestations ECTS de tous les étudiants d'un jury, produit en
+	tâche de fond et stocké dans un unique fichier.
+	"""
+	jury = models.ForeignKey(Jury, on_delete=models.CASCADE,
+			related_name='lots_attestations')
+
+	TYPE_RESULTATS = 1
+	TYPE_PARCOURS = 2
+	TYPE_CHOICES = (
+		(TYPE_RESULTATS, "résultats"),
+		(TYPE_PARCOURS, "attestations de parcours"),
+	)
+	type_attestation = models.PositiveSmallIntegerField(
+			verbose_name="type d'attestation", choices=TYPE_CHOICES)
+
+	ETAT_ATTENTE = 1
+	ETAT_EN_COURS = 2
+	ETAT_TERMINE = 3
+	ETAT_ERREUR = 4
+	ETAT_CHOICES = (
+		(ETAT_ATTENTE, "en attente"),
+		(ETAT_EN_COURS, "en cours"),
+		(ETAT_TERMINE, "terminé"),
+		(ETAT_ERREUR, "erreur"),
+	)
+	etat = models.PositiveSmallIntegerField(verbose_name="état",
+			choices=ETAT_CHOICES, default=ETAT_ATTENTE)
+
+	date_creation = models.DateTimeField(auto_now_add=True,
+			verbose_name="date de création")
+	date_fin = models.DateTimeField(blank=True, null=True,
+			verbose_name="date de fin")
+	# Mise à jour régulièrement pendant la production du lot (voir
+	# pykol.lib.taches)
+	date_activite = models.DateTimeField(blank=True, null=True,
+			verbose_name="dernière activité")
+
+	# Avancement de la génération
+	nb_etudiants = models.PositiveIntegerField(default=0,
+			verbose_name="nombre d'étudiants")
+	nb_traites = models.PositiveIntegerField(default=0,
+			verbose_name="nombre d'étudiants traités")
+
+	fichier = models.FileField(blank=True, null=True,
+			storage=pykol.lib.files.private_storage,
+			upload_to='attestations_ects/')
+	erreur = models.TextField(blank=True)
+
+	class Meta:
+		verbose_name = "lot d'attestations ECTS"
+		verbose_name_plural = "lots d'attestations ECTS"
+		ordering = ['-date_creation']
+
+	def __str__(self):
+		return "Lot d'attestations {} du {}".format(self.pk, self.jury)
+
+	def get_absolute_url(self):
+		return reverse('ects_jury_lot_telecharger',
+				kwargs={'pk': self.jury_id, 'lot_pk': self.pk})
+
+	def en_cours(self):
+		return self.etat in (self.ETAT_ATTENTE, self.ETAT_EN_COURS)
+
+	@property
+	def progression(self):
+		"""
+		Pourcentage des étudiants dont l'attestation est produite.
+		"""
+		if not self.nb_etudiants:
+			return 100 if self.etat == self.ETAT_TERMINE else 0
+		return self.nb_traites * 100 // self.nb_etudiants
+
+class AttestationEtudiant(models.Model):
+	"""
+	Attestation d'un étudiant au sein d'un lot, conservée sous la forme
+	du code XML de sa copie du modèle.
+
+	L'empreinte résume les données (mentions et état civil) ayant servi
+	à produire l'attestation. Lors d'une nouvelle génération, seules
+	les attestations dont l'empreinte a changé sont reproduites.
+	"""
+	lot = models.ForeignKey(AttestationsLot, on_delete=models.CASCADE,
+			related_name='attestations')
+	etudiant = models.ForeignKey(Etudiant, on_delete=models.CASCADE,
+			verbose_name="étudiant")
+	empreinte = models.CharField(max_length=64)
+	contenu = models.TextField()
+
+	class Meta:
+		unique_together = ('lot', 'etudiant')
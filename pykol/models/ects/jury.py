@@ -16,13 +16,142 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections import Counter, defaultdict
+
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from django.urls import reverse
 
 from pykol.models.base import Etudiant, Classe, Enseignement, \
-		AbstractPeriode
-from .grille import Grille, GrilleLigne
+		AbstractPeriode, OptionEtudiant
+from .grille import Grille, GrilleLigne, GrilleMatchLigne
+
+def _grilles_applicables(grilles, options):
+	"""
+	Version en mémoire de Grille.objects.filter_applicables : renvoie
+	les grilles dont l'étudiant suit toutes les matières des
+	GrilleMatchLigne, la plus pertinente en premier.
+
+	Le paramètre options est la liste des OptionEtudiant de l'étudiant
+	dans la classe, et grilles doit contenir les grilles du MEF de la
+	classe avec leurs match_options préchargées.
+	"""
+	matieres_options = Counter(option.matiere_id for option in options)
+	applicables = []
+	for grille in grilles:
+		match_options = grille.match_options.all()
+		actual_match = sum(matieres_options[match.matiere.matiere_id]
+			for match in match_options)
+		if actual_match == len(match_options):
+			applicables.append((actual_match, grille))
+
+	# Le tri est stable : à pertinence égale, les grilles restent dans
+	# l'ordre de leur clé primaire.
+	applicables.sort(key=lambda x: -x[0])
+	return [grille for _, grille in applicables]
+
+def _enseignements_suivis(enseignements, options):
+	"""
+	Version en mémoire de Enseignement.objects.filter_etudiant : renvoie
+	les enseignements de la classe suivis par l'étudiant, d'après la
+	liste de ses OptionEtudiant dans la classe.
+	"""
+	obligatoires = {(option.matiere_id, option.rang_option)
+		for option in options
+		if option.modalite_option == Enseignement.MODALITE_OBLIGATOIRE}
+	facultatives = {option.matiere_id for option in options
+		if option.modalite_option == Enseignement.MODALITE_FACULTATIVE}
+
+	suivis = []
+	for enseignement in enseignements:
+		if enseignement.modalite_option == Enseignement.MODALITE_COMMUN or \
+			(enseignement.modalite_option ==
+				Enseignement.MODALITE_OBLIGATOIRE and
+				(enseignement.matiere_id, enseignement.rang_option)
+				in obligatoires) or \
+			(enseignement.modalite_option ==
+				Enseignement.MODALITE_FACULTATIVE and
+				enseignement.matiere_id in facultatives):
+			suivis.append(enseignement)
+	return suivis
+
+def _lignes_similaires(ligne, autre):
+	"""
+	Indique si deux lignes de grilles correspondent à la même mention,
+	selon le critère de MentionManager.credit_or_create.
+	"""
+	return autre.libelle == ligne.libelle and \
+		autre.matiere_id == ligne.matiere_id and \
+		(ligne.groupe is None or (autre.groupe is not None and
+			autre.groupe.libelle == ligne.groupe.libelle))
+
+class _MentionsJury:
+	"""
+	Mentions d'un jury en cours de création, conservées en mémoire
+	puis écrites dans la base en une seule fois.
+
+	La méthode credit_or_create reproduit le comportement de
+	MentionManager.credit_or_create sans effectuer de requête.
+	"""
+	# Valeur du paramètre enseignement lorsque l'on accepte une
+	# mention quel que soit son enseignement.
+	TOUS = object()
+
+	def __init__(self, jury):
+		self.jury = jury
+		self.mentions = []
+		self.lignes = {}
+		self.par_etudiant = defaultdict(list)
+
+	def credit_or_create(self, etudiant, credits, enseignement=TOUS,
+			credits_exacts=False, ligne_similaire=None,
+			nouvelle_ligne=None):
+		"""
+		Recherche une mention de l'étudiant qui possède une ligne
+		similaire à ligne_similaire (et, si demandé, le même
+		enseignement ou exactement le nombre de crédits donné). Si elle
+		existe, on lui ajoute les crédits, sinon on la crée avec ce
+		nombre de crédits. Dans les deux cas, on associe ensuite
+		nouvelle_ligne à la mention.
+		"""
+		mention = None
+		for candidate in self.par_etudiant[etudiant.pk]:
+			if enseignement is not self.TOUS and \
+				candidate.enseignement != enseignement:
+				continue
+			if credits_exacts and candidate.credits != credits:
+				continue
+			if ligne_similaire is not None and not any(
+				_lignes_similaires(ligne_similaire, ligne)
+				for ligne in self.lignes[id(candidate)]):
+				continue
+			mention = candidate
+			break
+
+		if mention is None:
+			mention = Mention(etudiant=etudiant, jury=self.jury,
+				enseignement=None if enseignement is self.TOUS
+					else enseignement,
+				credits=credits)
+			self.mentions.append(mention)
+			self.lignes[id(mention)] = []
+			self.par_etudiant[etudiant.pk].append(mention)
+		else:
+			mention.credits += credits
+
+		if nouvelle_ligne is not None and \
+			nouvelle_ligne not in self.lignes[id(mention)]:
+			self.lignes[id(mention)].append(nouvelle_ligne)
+
+		return mention
+
+	def enregistrer(self):
+		Mention.objects.bulk_create(self.mentions)
+		Mention.grille_lignes.through.objects.bulk_create([
+			Mention.grille_lignes.through(mention_id=mention.pk,
+				grilleligne_id=ligne.pk)
+			for mention in self.mentions
+			for ligne in self.lignes[id(mention)]])
 
 class JuryManager(models.Manager):
 	@transaction.atomic
@@ -31,6 +160,10 @@ class JuryManager(models.Manager):
 		Crée un jury pour une classe, en peuplant ce jury de mentions
 		vierges pour toutes les matières suivies par les étudiants,
 		selon les grilles ECTS présentes dans la base de données.
+
+		Les grilles, les options des étudiants et les enseignements de
+		la classe sont lus une seule fois. Les correspondances sont
+		établies en mémoire, puis les mentions sont créées par lots.
 		"""
 		jury = Jury(classe=classe, periode=periode, **kwargs)
 		jury.save()
@@ -42,17 +175,30 @@ class JuryManager(models.Manager):
 		if periode != Jury.PERIODE_ANNEE:
 			grilles = grilles.filter(semestre=periode)
 
+		grilles = list(grilles.order_by('pk').prefetch_related(
+			Prefetch('lignes', queryset=GrilleLigne.objects.select_related(
+				'matiere', 'groupe')),
+			Prefetch('match_options',
+				queryset=GrilleMatchLigne.objects.select_related(
+					'matiere')),
+		))
+
+		enseignements = list(Enseignement.objects.filter(classe=classe))
+		options_etudiants = defaultdict(list)
+		for option in OptionEtudiant.objects.filter(classe=classe):
+			options_etudiants[option.etudiant_id].append(option)
+
+		mentions = _MentionsJury(jury)
+
 		# Pour chaque étudiant, on crée toutes les mentions qui
 		# s'appliquent, en fonction des matières suivies par l'étudiant.
 		for etudiant in classe.etudiants.all():
-			grilles_applicables = grilles.filter_applicables(classe=classe,
-					etudiant=etudiant)
+			options = options_etudiants[etudiant.pk]
+			grilles_applicables = _grilles_applicables(grilles, options)
 			periodes_traitees = set()
 
-			enseignements = Enseignement.objects.filter_etudiant(
-				etudiant=etudiant,
-				classe=classe,
-			)
+			enseignements_suivis = _enseignements_suivis(enseignements,
+					options)
 
 			for grille in grilles_applicables:
 				# On ne garde qu'une grille par semestre
@@ -61,7 +207,7 @@ class JuryManager(models.Manager):
 				periodes_traitees.add(grille.semestre)
 
 				lignes_restantes = set(grille.lignes.all())
-				for enseignement in enseignements:
+				for enseignement in enseignements_suivis:
 					# On cherche une ligne de la grille qui correspond à
 					# cet enseignement. Oui, c'est quadratique, mais vu
 					# le tout petit nombre d'enseignements en pratique,
@@ -69,19 +215,15 @@ class JuryManager(models.Manager):
 					# complexité asymptotique.
 					mention = None
 					for ligne in lignes_restantes.copy():
-						if enseignement.matiere != ligne.matiere.matiere or \
+						if enseignement.matiere_id != ligne.matiere.matiere_id or \
 							enseignement.rang_option != ligne.matiere.rang_option or \
 							enseignement.modalite_option != ligne.matiere.modalite_option:
 							continue
 
-						mention, _ = Mention.objects.credit_or_create(
-							etudiant=etudiant, jury=jury,
-							enseignement=enseignement,
-							grille_ligne__similar=ligne,
-							defaults = {
-								'grille_ligne': ligne,
-								'credits': ligne.credits,
-							})
+						mention = mentions.credit_or_create(etudiant,
+							ligne.credits, enseignement=enseignement,
+							ligne_similaire=ligne,
+							nouvelle_ligne=ligne)
 
 						lignes_restantes.remove(ligne)
 
@@ -93,12 +235,8 @@ class JuryManager(models.Manager):
 						# sans aucun crédit.
 						if enseignement.modalite_option == \
 								Enseignement.MODALITE_FACULTATIVE:
-							Mention.objects.credit_or_create(
-								etudiant=etudiant, jury=jury,
-								enseignement=enseignement,
-								defaults={
-									'credits': 0,
-								})
+							mentions.credit_or_create(etudiant, 0,
+								enseignement=enseignement)
 
 				# Certaines lignes doivent être créées dans tous les
 				# cas, même si elles ne correspondent à aucun
@@ -110,15 +248,12 @@ class JuryManager(models.Manager):
 						#enseignement = Enseignement.objects.filter(classe=classe,
 						#	matiere=ligne.matiere.matiere
 						#).order_by('modalite_option').first()
-						Mention.objects.credit_or_create(
-							etudiant=etudiant, jury=jury,
-							credits=ligne.credits,
-							grille_ligne__similar=ligne,
-							defaults={
-								'grille_ligne': ligne,
-								'credits': ligne.credits,
-							}
-						)
+						mentions.credit_or_create(etudiant,
+							ligne.credits, credits_exacts=True,
+							ligne_similaire=ligne,
+							nouvelle_ligne=ligne)
+
+		mentions.enregistrer()
 
 		return jury
 
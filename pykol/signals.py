@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# pyKol - Gestion de colles en CPGE
+# Copyright (c) 2018 Florian Hatat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Récepteurs des signaux de pyKol.
+
+Ces récepteurs invalident les données mises en cache, ainsi que les
+permissions mémorisées par PykolBackend, lorsque les objets dont elles
+dépendent sont modifiés. Ils tiennent également à jour la table des
+appartenances des professeurs aux classes et invalident les menus de
+navigation, les flux iCalendar et les calendriers scolaires mis en
+cache.
+"""
+
+from django.db.models.signals import pre_save, post_save, pre_delete, \
+		post_delete, m2m_changed
+from django.dispatch import receiver
+from django.contrib.auth.models import Group
+
+from pykol.models.base import Service, Classe, AppartenanceClasse, \
+		User, Professeur, Etudiant, Annee, Vacances, Matiere
+from pykol.models.colles import Colle, ColleDetails, ColleNote, \
+		Semaine, PeriodeNotation, ColloscopePermission, Creneau
+from pykol.lib.cache import invalider, TOUS
+from pykol.lib.auth import invalider_permissions
+
+@receiver(post_save, sender=ColleNote)
+@receiver(post_delete, sender=ColleNote)
+@receiver(post_save, sender=ColleDetails)
+@receiver(post_delete, sender=ColleDetails)
+def resultats_colle_modifiee(sender, instance, **kwargs):
+	invalider('resultats', instance.colle.classe_id)
+
+@receiver(m2m_changed, sender=ColleDetails.eleves.through)
+def resultats_eleves_modifies(sender, instance, action, reverse, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if reverse:
+		# L'instance est l'étudiant : on invalide les classes des
+		# colles concernées.
+		classes = set(Colle.all_objects.filter(
+			colledetails__pk__in=kwargs.get('pk_set') or ()
+			).values_list('classe_id', flat=True))
+		invalider('resultats', *classes)
+	else:
+		invalider('resultats', instance.colle.classe_id)
+
+@receiver(post_save, sender=Colle)
+@receiver(post_delete, sender=Colle)
+@receiver(post_save, sender=Semaine)
+@receiver(post_delete, sender=Semaine)
+def resultats_classe_modifiee(sender, instance, **kwargs):
+	invalider('resultats', instance.classe_id)
+
+@receiver(post_save, sender=PeriodeNotation)
+@receiver(post_delete, sender=PeriodeNotation)
+def resultats_periode_modifiee(sender, instance, **kwargs):
+	invalider('resultats', instance.enseignement.classe_id)
+
+@receiver(post_save, sender=ColloscopePermission)
+@receiver(post_delete, sender=ColloscopePermission)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Colle)
+@receiver(post_delete, sender=Colle)
+@receiver(post_save, sender=ColleDetails)
+@receiver(post_delete, sender=ColleDetails)
+def permissions_modifiees(sender, **kwargs):
+	invalider_permissions()
+
+# Pour chacun des modèles dont dépendent les appartenances aux classes,
+# chemin vers la classe concernée puis champs de l'objet qui
+# interviennent dans le calcul des appartenances.
+CHAMPS_APPARTENANCE = {
+	Service: ('enseignement__classe', 'enseignement_id', 'professeur_id'),
+	Creneau: ('classe', 'classe_id', 'colleur_id'),
+	ColleDetails: ('colle__classe', 'colle_id', 'colleur_id', 'actif'),
+	ColloscopePermission: ('classe', 'classe_id', 'user_id'),
+}
+
+def _classe_appartenance(sender, instance):
+	return sender._base_manager.filter(pk=instance.pk).values_list(
+			CHAMPS_APPARTENANCE[sender][0], flat=True).first()
+
+@receiver(pre_save, sender=Service)
+@receiver(pre_save, sender=Creneau)
+@receiver(pre_save, sender=ColleDetails)
+@receiver(pre_save, sender=ColloscopePermission)
+@receiver(pre_delete, sender=Service)
+@receiver(pre_delete, sender=Creneau)
+@receiver(pre_delete, sender=ColleDetails)
+@receiver(pre_delete, sender=ColloscopePermission)
+def appartenances_avant(sender, instance, **kwargs):
+	# La classe et les champs utiles sont lus avant la modification,
+	# pour ne recalculer les appartenances que s'ils changent, et pour
+	# recalculer aussi celles de l'ancienne classe en cas de
+	# déplacement.
+	instance._pykol_appartenance_avant = None
+	if instance.pk is not None:
+		instance._pykol_appartenance_avant = \
+			sender._base_manager.filter(pk=instance.pk).values_list(
+				*CHAMPS_APPARTENANCE[sender]).first()
+
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Creneau)
+@receiver(post_save, sender=ColleDetails)
+@receiver(post_save, sender=ColloscopePermission)
+@receiver(post_delete, sender=Service)
+@receiver(post_delete, sender=Creneau)
+@receiver(post_delete, sender=ColleDetails)
+@receiver(post_delete, sender=ColloscopePermission)
+def appartenances_modifiees(sender, instance, **kwargs):
+	avant = getattr(instance, '_pykol_appartenance_avant', None)
+	classes = []
+	if avant is not None:
+		classes.append(avant[0])
+
+	if kwargs.get('signal') is post_save:
+		champs = tuple(getattr(instance, champ)
+			for champ in CHAMPS_APPARTENANCE[sender][1:])
+		if avant is not None and avant[1:] == champs:
+			return
+		classes.append(_classe_appartenance(sender, instance))
+
+	AppartenanceClasse.objects.recalculer_apres_commit(*classes)
+
+@receiver(post_save, sender=Classe)
+def appartenances_coordonnateur(sender, instance, **kwargs):
+	AppartenanceClasse.objects.recalculer_apres_commit(instance.pk)
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def navigation_droits_modifies(sender, instance, action, reverse, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if not reverse:
+		invalider('navigation', instance.pk)
+	elif action == 'post_clear':
+		# Les utilisateurs concernés ne sont plus connus
+		invalider('navigation', TOUS)
+	else:
+		invalider('navigation', *(kwargs.get('pk_set') or ()))
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Classe)
+@receiver(post_delete, sender=Classe)
+@receiver(post_save, sender=Annee)
+@receiver(post_delete, sender=Annee)
+def navigation_tous_modifies(sender, **kwargs):
+	if kwargs.get('action', 'post_').startswith('post_'):
+		invalider('navigation', TOUS)
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Professeur)
+@receiver(post_save, sender=Etudiant)
+def navigation_utilisateur_modifie(sender, instance, update_fields=None,
+		**kwargs):
+	# La mise à jour de la date de dernière connexion ne change pas le
+	# menu de l'utilisateur.
+	if update_fields is not None and set(update_fields) <= {'last_login'}:
+		return
+	invalider('navigation', instance.pk)
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Professeur)
+@receiver(post_save, sender=Etudiant)
+@receiver(post_save, sender=Classe)
+@receiver(post_save, sender=Matiere)
+def calendrier_noms_modifies(sender, update_fields=None, **kwargs):
+	# Les flux iCalendar affichent les noms des colleurs, des
+	# étudiants, des classes et des matières.
+	if update_fields is not None and set(update_fields) <= {'last_login'}:
+		return
+	invalider('calendrier', TOUS)
+
+@receiver(post_save, sender=Colle)
+@receiver(pre_delete, sender=Colle)
+def calendrier_colle_modifiee(sender, instance, **kwargs):
+	# Les utilisateurs concernés sont lus avant la suppression de la
+	# colle et de ses détails.
+	Colle.invalider_calendrier(instance.pk)
+
+@receiver(post_save, sender=ColleDetails)
+@receiver(pre_delete, sender=ColleDetails)
+@receiver(post_save, sender=ColleNote)
+@receiver(post_delete, sender=ColleNote)
+def calendrier_details_modifies(sender, instance, **kwargs):
+	Colle.invalider_calendrier(instance.colle_id)
+
+@receiver(m2m_changed, sender=ColleDetails.eleves.through)
+def calendrier_eleves_modifies(sender, instance, action, reverse,
+		pk_set=None, **kwargs):
+	# Les étudiants retirés sont encore présents avant la modification,
+	# les étudiants ajoutés ne le sont qu'après.
+	if action not in ('pre_remove', 'pre_clear', 'post_add'):
+		return
+	if reverse:
+		details = ColleDetails.objects.filter(eleves=instance) \
+			if pk_set is None else ColleDetails.objects.filter(pk__in=pk_set)
+		Colle.invalider_calendrier(*set(details.values_list('colle_id',
+			flat=True)))
+	else:
+		Colle.invalider_calendrier(instance.colle_id)
+
+@receiver(post_save, sender=Vacances)
+@receiver(post_delete, sender=Vacances)
+def calendrier_scolaire_modifie(sender, instance, **kwargs):
+	Annee.invalider_calendrier(instance.annee_id)
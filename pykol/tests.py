@@ -17,9 +17,60 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from django.test import TestCase
+from datetime import date, time, timedelta
+import hashlib
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+import zipfile
+
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from pykol.models.fields import validateur_lettre23
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import odf.opendocument
+from odf.number import Number, NumberStyle
+from odf.opendocument import OpenDocumentSpreadsheet
+from odf.style import Style
+from odf.table import Table, TableColumn, TableRow, TableCell, \
+		CoveredTableCell
+from odf.text import P, S, Tab
+
+from pykol.models.base import Annee, Academie, Etablissement, Classe, \
+		ModuleElementaireFormation, Matiere, Enseignement, Professeur, \
+		Etudiant, MEFMatiere, OptionEtudiant, User, Service, JetonAcces, \
+		Groupe, ImportBee, Vacances, ETAPES_IMPORT_BEE
+from pykol.models import constantes
+from pykol.models.colles import Colle, CollesEnseignement, Trinome, \
+		Semaine, Creneau, ColleNote, PeriodeNotation, ColleDetails, \
+		ColloscopePermission, ColleReleve
+from pykol.models.fields import Moyenne, Note, validateur_lettre23
+from pykol.models.comptabilite import Compte, CompteDecouvert, \
+		CompteSolde, Mouvement, MouvementLigne
+from pykol.models.ects import Grille, GrilleLigne, GrilleMatchLigne, \
+		GrilleGroupeLignes, Jury, Mention, AttestationsLot, \
+		AttestationEtudiant
+from pykol.forms.import_bee import ImportBEEForm
+from pykol.lib.import_colloscope import ColloscopeImporter
+from pykol.lib import attestations, bee
+from pykol.lib.auth import precalculer_permissions_colles
+from pykol.lib.attestations import chemin_modele
+from pykol.lib.resultats import TableauResultats, EN_ATTENTE
+from pykol.lib.vacances import CalendrierOfficiel, enregistrer_vacances, \
+		_date_utc
+from pykol.lib.odftools import OdtTemplate, iter_rows, EMPTY_CELL, \
+		tablecell_to_text, iter_columns, StreamingSpreadsheet, \
+		StreamingTable, Column, Cell, CoveredCell, STREAM_CHUNK_SIZE
+from pykol.views.colles.resultats import classe_resultats_odf
+from pykol.views.generic import StreamingOdfResponse
 
 class ValidationUaiTests(TestCase):
 	def test_lettre_code_correcte_1(self):
@@ -28,3 +79,1715 @@ class ValidationUaiTests(TestCase):
 	def test_lettre_code_incorrecte(self):
 		with self.assertRaises(ValidationError):
 			validateur_lettre23("0740003A")
+
+def creer_compte(nom, parent=None, decouvert_autorise=True):
+	return Compte.objects.create(nom=nom, parent=parent,
+			categorie=Compte.CATEGORIE_ACTIFS,
+			decouvert_autorise=decouvert_autorise)
+
+def creer_etablissement(test):
+	"""
+	Crée l'académie et l'établissement 0021593W, avec leurs comptes.
+	"""
+	racine = creer_compte("Racine")
+	test.academie = Academie.objects.create(id=1, nom="Lyon",
+			nom_complet="Académie de Lyon", slug="lyon",
+			departements="69",
+			compte_dotation=creer_compte("Dotation", racine),
+			compte_paiement=creer_compte("Paiement", racine))
+	test.etablissement = Etablissement.objects.create(
+			numero_uai="0021593W", appellation="Lycée",
+			denomination="Lycée", academie=test.academie, nature_uai=300,
+			compte_colles=creer_compte("Colles", racine),
+			compte_releves=creer_compte("Relevés", racine),
+			compte_professeurs=creer_compte("Professeurs", racine))
+
+@override_settings(PYKOL_UAI_DEFAUT="0021593W")
+def creer_classe(test, nb_etudiants=6):
+	"""
+	Crée une classe de six étudiants répartis en deux trinômes, avec un
+	enseignement de mathématiques, deux colleurs, deux créneaux et
+	quatre semaines de colles. Les objets sont enregistrés comme
+	attributs du test.
+	"""
+	creer_etablissement(test)
+	test.annee = Annee.objects.create(nom="Année",
+			debut=date.today() - timedelta(days=60),
+			fin=date.today() + timedelta(days=240))
+	mef = ModuleElementaireFormation.objects.create(
+			code_mef="30112345678", libelle="MP")
+	test.classe = Classe.objects.create(nom="MP", annee=test.annee,
+			slug="mp", mef=mef, niveau=1,
+			etablissement=test.etablissement, code_structure="MP",
+			compte_colles=creer_compte("Classe",
+				test.etablissement.compte_colles))
+	test.matiere = Matiere.objects.create(nom="Mathématiques",
+			virtuelle=False, code_matiere="M")
+	test.enseignement = Enseignement.objects.create(classe=test.classe,
+			matiere=test.matiere, modalite_option=1)
+	test.colles_ens = CollesEnseignement.objects.create(
+			classe=test.classe, frequence=1,
+			duree_frequentielle=timedelta(minutes=20),
+			compte_colles=creer_compte("Colles MP",
+				test.classe.compte_colles))
+	test.colles_ens.enseignements.add(test.enseignement)
+
+	test.colleurs = [Professeur.objects.create(
+		email="colleur{}@example.org".format(i),
+		last_name="Colleur{}".format(i)) for i in range(2)]
+	test.etudiants = [Etudiant.objects.create(
+		email="etudiant{}@example.org".format(i),
+		last_name="Étudiant{}".format(i), classe=test.classe,
+		numero_siecle=str(i)) for i in range(nb_etudiants)]
+	test.classe.update_etudiants()
+
+	test.trinomes = []
+	for i in range(nb_etudiants // 3):
+		trinome = Trinome.objects.create(nom=str(i + 1),
+				annee=test.annee, classe=test.classe, slug=str(i + 1))
+		trinome.etudiants.set(test.etudiants[3 * i:3 * i + 3])
+		test.trinomes.append(trinome)
+
+	lundi = test.annee.lundi_premiere_semaine()
+	test.semaines = [Semaine.objects.create(
+		debut=lundi + timedelta(days=7 * i + 7),
+		fin=lundi + timedelta(days=7 * i + 12),
+		classe=test.classe, numero=str(i + 1)) for i in range(4)]
+	test.creneaux = [Creneau.objects.create(classe=test.classe,
+		enseignement=test.enseignement, colles_ens=test.colles_ens,
+		jour=i + 1, debut=time(17), fin=time(18),
+		salle="S{}".format(i), colleur=test.colleurs[i])
+		for i in range(2)]
+
+class ComptesTestCase(TestCase):
+	def setUp(self):
+		self.annee = Annee.objects.create(nom="2018-2019",
+				debut=date(2018, 9, 1), fin=date(2019, 7, 6))
+		self.source = Compte.objects.create(nom="Source",
+				categorie=Compte.CATEGORIE_ACTIFS,
+				decouvert_autorise=True,
+				decouvert_duree=timedelta(hours=2),
+				decouvert_duree_interrogation=timedelta(hours=2))
+		self.destination = Compte.objects.create(nom="Destination",
+				categorie=Compte.CATEGORIE_ACTIFS)
+
+	def virement(self, heures):
+		return Mouvement.objects.virement(self.source, self.destination,
+				timedelta(hours=heures), timedelta(hours=heures),
+				annee=self.annee, motif="Virement")
+
+class DecouvertTests(ComptesTestCase):
+	def test_debit_dans_la_limite(self):
+		mv = self.virement(2)
+		mv.valider()
+		self.assertEqual(Mouvement.objects.get(pk=mv.pk).etat,
+				Mouvement.ETAT_VALIDE)
+		self.assertEqual(self.source.solde(self.annee)['duree'],
+				timedelta(hours=-2))
+
+	def test_debit_hors_limite(self):
+		mv = self.virement(3)
+		with self.assertRaises(CompteDecouvert) as contexte:
+			mv.valider()
+		self.assertEqual(contexte.exception.ligne.pk,
+				mv.lignes.get(compte=self.source).pk)
+		self.assertEqual(Mouvement.objects.get(pk=mv.pk).etat,
+				Mouvement.ETAT_BROUILLON)
+
+	def test_debit_cumule_hors_limite(self):
+		mv1 = self.virement(1)
+		mv2 = self.virement(2)
+		with self.assertRaises(CompteDecouvert) as contexte:
+			Mouvement.objects.valider_lot([mv1, mv2])
+		self.assertEqual(contexte.exception.ligne.pk,
+				mv2.lignes.get(compte=self.source).pk)
+
+	def test_compte_deja_a_decouvert(self):
+		self.virement(2).valider()
+		self.source.decouvert_duree = timedelta(hours=1)
+		self.source.decouvert_duree_interrogation = timedelta(hours=3)
+		self.source.save()
+
+		# Le compte dépasse désormais son découvert en durée, mais un
+		# retrait de durée d'interrogation seule reste possible.
+		mv = Mouvement.objects.virement(self.source, self.destination,
+				timedelta(), timedelta(hours=1),
+				annee=self.annee, motif="Virement")
+		mv.valider()
+		self.assertEqual(Mouvement.objects.get(pk=mv.pk).etat,
+				Mouvement.ETAT_VALIDE)
+
+		with self.assertRaises(CompteDecouvert):
+			self.virement(1).valider()
+
+	def test_sans_decouvert(self):
+		mv = Mouvement.objects.virement(self.destination, self.source,
+				timedelta(hours=1), timedelta(hours=1),
+				annee=self.annee, motif="Virement")
+		with self.assertRaises(CompteDecouvert):
+			mv.valider()
+
+class MouvementAdminTests(ComptesTestCase):
+	def setUp(self):
+		super().setUp()
+		self.client.force_login(User.objects.create_superuser(
+			email="admin@example.org", password="admin"))
+
+	def test_mouvement_valide_non_modifiable(self):
+		mv = self.virement(1)
+		ligne = mv.lignes.get(compte=self.source)
+		reponse = self.client.post('/admin/pykol/mouvement/', {
+			'action': 'valider_mouvements',
+			'_selected_action': [mv.pk]})
+		self.assertEqual(reponse.status_code, 302)
+		self.assertEqual(Mouvement.objects.get(pk=mv.pk).etat,
+				Mouvement.ETAT_VALIDE)
+
+		self.assertEqual(self.client.get(
+			'/admin/pykol/mouvement/{}/change/'.format(mv.pk)
+			).status_code, 200)
+		self.assertEqual(self.client.post(
+			'/admin/pykol/mouvementligne/{}/change/'.format(ligne.pk), {
+				'compte': self.source.pk, 'mouvement': mv.pk,
+				'duree': '10:00:00', 'duree_interrogation': '10:00:00',
+			}).status_code, 403)
+		self.assertEqual(self.client.post(
+			'/admin/pykol/mouvementligne/{}/delete/'.format(ligne.pk),
+			{'post': 'yes'}).status_code, 403)
+		self.assertEqual(self.client.post(
+			'/admin/pykol/mouvement/{}/delete/'.format(mv.pk),
+			{'post': 'yes'}).status_code, 403)
+		self.client.post('/admin/pykol/mouvement/', {
+			'action': 'delete_selected', '_selected_action': [mv.pk],
+			'post': 'yes'})
+
+		self.assertTrue(MouvementLigne.objects.filter(pk=ligne.pk,
+			duree=timedelta(hours=-1)).exists())
+		self.assertEqual(CompteSolde.objects.verifier(self.annee), [])
+		self.assertEqual(self.source.solde(self.annee)['duree'],
+				timedelta(hours=-1))
+
+class ColloscopeTestCase(TestCase):
+	def setUp(self):
+		creer_classe(self)
+
+	def importer(self, cases):
+		"""
+		Importe un colloscope dont chaque ligne correspond à un créneau
+		et donne les trinômes de chaque semaine.
+		"""
+		document = OpenDocumentSpreadsheet()
+		table = Table(name="Colloscope", parent=document.spreadsheet)
+		for _ in range(2):
+			TableRow(parent=table)
+		for creneau, ligne in zip(self.creneaux, cases):
+			tr = TableRow(parent=table)
+			for valeur in [creneau.pk, '', '', '', '', ''] + ligne:
+				cellule = TableCell(parent=tr)
+				if valeur:
+					P(parent=cellule, text=str(valeur))
+		fichier = io.BytesIO()
+		document.save(fichier)
+		fichier.seek(0)
+
+		importer = ColloscopeImporter(self.classe)
+		importer.importer(fichier)
+		self.assertEqual(importer.erreurs, [])
+		return importer
+
+class ImportColloscopeTests(ColloscopeTestCase):
+	def test_colle_annulee_conservee(self):
+		self.importer([['1', '2', '', ''], ['', '', '', '']])
+		annulee = Colle.all_objects.get(groupe=self.trinomes[0])
+		annulee.annuler()
+
+		self.importer([['1', '2', '', ''], ['', '', '', '']])
+		annulee.refresh_from_db()
+		self.assertEqual(annulee.etat, Colle.ETAT_ANNULEE)
+		self.assertFalse(Colle.all_objects.filter(
+			groupe=self.trinomes[0]).exclude(
+				etat=Colle.ETAT_ANNULEE).exists())
+		self.assertEqual(Colle.all_objects.count(), 2)
+
+		self.importer([['', '2', '', ''], ['', '', '', '']])
+		self.assertTrue(Colle.all_objects.filter(pk=annulee.pk).exists())
+		self.assertEqual(Colle.all_objects.count(), 2)
+
+	def test_dotation_apres_changement_de_date(self):
+		self.importer([['1', '', '', ''], ['', '', '', '']])
+		colle = Colle.all_objects.get()
+		mouvement = colle.ligne_dotation.mouvement
+
+		Creneau.objects.filter(pk=self.creneaux[0].pk).update(jour=3)
+		self.importer([['1', '', '', ''], ['', '', '', '']])
+		colle = Colle.all_objects.select_related(
+				'ligne_dotation__mouvement').get()
+		self.assertNotEqual(colle.ligne_dotation.mouvement.pk,
+				mouvement.pk)
+		self.assertNotEqual(colle.ligne_dotation.mouvement.motif,
+				mouvement.motif)
+
+@override_settings(PYKOL_UAI_DEFAUT="0021593W")
+class ReleveCreationTests(ColloscopeTestCase):
+	def setUp(self):
+		super().setUp()
+		self.client.force_login(User.objects.create(
+			email="admin@example.org", is_superuser=True))
+		self.importer([['1', '2', '', ''], ['', '', '', '']])
+		Colle.objects.update(etat=Colle.ETAT_NOTEE)
+
+	def test_releve_cree(self):
+		response = self.client.post(reverse('releve_creer'))
+		releve = ColleReleve.objects.get()
+		self.assertRedirects(response, reverse('releve_detail',
+			kwargs={'pk': releve.pk}), fetch_redirect_response=False)
+		self.assertEqual(Colle.objects.filter(releve=releve).count(), 2)
+
+	def test_colle_sans_colleur(self):
+		ColleDetails.objects.filter(colle__groupe=self.trinomes[1]).update(
+				colleur=None)
+
+		response = self.client.post(reverse('releve_creer'), follow=True)
+		self.assertRedirects(response, reverse('releve_list'))
+		self.assertIn("n'a pas de colleur", [str(message)
+			for message in response.context['messages']][0])
+		self.assertFalse(ColleReleve.objects.exists())
+		self.assertFalse(Colle.objects.filter(
+			releve__isnull=False).exists())
+
+@override_settings(PYKOL_UAI_DEFAUT="0021593W")
+class PermissionsCollesTests(ColloscopeTestCase):
+	PERMISSIONS = ('pykol.add_colle', 'pykol.change_colle',
+			'pykol.delete_colle', 'pykol.view_colle',
+			'pykol.add_colledetails', 'pykol.add_collenote')
+
+	def setUp(self):
+		super().setUp()
+		physique = Enseignement.objects.create(classe=self.classe,
+				matiere=Matiere.objects.create(nom="Physique",
+					virtuelle=False, code_matiere="P"),
+				modalite_option=1)
+		self.colles_ens.enseignements.add(physique)
+		self.creneaux.append(Creneau.objects.create(classe=self.classe,
+			enseignement=physique, colles_ens=self.colles_ens, jour=3,
+			debut=time(17), fin=time(18), salle="S2",
+			colleur=self.colleurs[0]))
+		self.importer([['1', '2', '', ''], ['2', '', '1', ''],
+			['', '1', '', '2']])
+
+		# Colle sans détails actifs
+		sans_details = Colle.objects.filter(
+				creneau=self.creneaux[1]).first()
+		Colle.objects.filter(pk=sans_details.pk).update(detail_actif=None)
+		ColleDetails.objects.filter(colle=sans_details).update(actif=False)
+
+		droit = Permission.objects.get(content_type__app_label='pykol',
+				codename='change_colloscope')
+		professeur_maths = Professeur.objects.create(
+				email="maths@example.org", last_name="Maths")
+		Service.objects.create(professeur=professeur_maths,
+				enseignement=self.enseignement)
+		Service.objects.create(professeur=self.colleurs[1],
+				enseignement=self.enseignement)
+		professeur_physique = Professeur.objects.create(
+				email="physique@example.org", last_name="Physique")
+		Service.objects.create(professeur=professeur_physique,
+				enseignement=physique)
+		ColloscopePermission.objects.create(user=professeur_physique,
+				classe=self.classe, droit=droit, matiere_seulement=True)
+		direction = User.objects.create(email="direction@example.org",
+				last_name="Direction")
+		ColloscopePermission.objects.create(user=direction,
+				classe=self.classe, droit=droit, matiere_seulement=False)
+
+		self.utilisateurs = self.colleurs + [professeur_maths,
+				professeur_physique, direction, self.etudiants[0]]
+
+	def test_precalcul_identique_a_has_perm(self):
+		colles = list(Colle.objects.with_details())
+		self.assertEqual(len(colles), 6)
+
+		for utilisateur in self.utilisateurs:
+			precalcul = User.objects.get(pk=utilisateur.pk)
+			precalculer_permissions_colles(precalcul, colles)
+			for colle in colles:
+				attendues = set(perm for perm in self.PERMISSIONS
+					if User.objects.get(pk=utilisateur.pk).has_perm(
+						perm, Colle.objects.get(pk=colle.pk)))
+				with self.assertNumQueries(0):
+					obtenues = set(perm for perm in self.PERMISSIONS
+						if precalcul.has_perm(perm, colle))
+				self.assertEqual(obtenues, attendues,
+						msg="{} : {}".format(utilisateur, colle.pk))
+
+class CalendrierTests(ColloscopeTestCase):
+	def setUp(self):
+		super().setUp()
+		cache.clear()
+		with self.captureOnCommitCallbacks(execute=True):
+			self.importer([['1', '2', '', ''], ['2', '1', '', '']])
+		self.urls = [reverse('colle_calendrier', kwargs={
+			'uuid': JetonAcces.objects.create(owner=colleur,
+				scope='colles_icalendar').uuid})
+			for colleur in self.colleurs]
+
+	def test_modification_details(self):
+		reponses = [self.client.get(url) for url in self.urls]
+		for url, reponse in zip(self.urls, reponses):
+			self.assertEqual(self.client.get(url,
+				HTTP_IF_NONE_MATCH=reponse['ETag']).status_code, 304)
+
+		details = Colle.objects.filter(
+			detail_actif__colleur=self.colleurs[0]).first().detail_actif
+		with self.captureOnCommitCallbacks(execute=True):
+			details.salle = "B42"
+			details.save()
+
+		# Seul le flux du colleur de la colle modifiée change
+		reponse = self.client.get(self.urls[0],
+				HTTP_IF_NONE_MATCH=reponses[0]['ETag'])
+		self.assertEqual(reponse.status_code, 200)
+		contenu = reponse.content.decode()
+		self.assertEqual(contenu.count('LOCATION:B42'), 1)
+		self.assertEqual(contenu.count('BEGIN:VEVENT'), 2)
+		self.assertEqual(self.client.get(self.urls[1],
+			HTTP_IF_NONE_MATCH=reponses[1]['ETag']).status_code, 304)
+
+def ancien_numero_semaine(annee, jour):
+	"""
+	Numéro de semaine calculé comme avant la mise en cache du
+	calendrier scolaire, par une requête sur les vacances de l'année.
+	"""
+	if jour < annee.debut or jour > annee.fin or jour.weekday() == 6 \
+			or annee.vacances.filter(debut__lte=jour, fin__gte=jour,
+				type_vacances=Vacances.TYPE_VACANCES).exists():
+		return None
+
+	jours_vacances = sum([vacances.duree for vacances in
+		annee.vacances.filter(fin__lte=jour,
+			type_vacances=Vacances.TYPE_VACANCES)], timedelta())
+	return (jour - annee.lundi_premiere_semaine() - jours_vacances
+		).days // 7 + 1
+
+class CalendrierScolaireTests(TestCase):
+	def setUp(self):
+		self.annee = Annee.objects.create(nom="2026",
+			debut=date(2026, 9, 1), fin=date(2027, 7, 3))
+		for nom, debut, fin, type_vacances in (
+				("Été", date(2026, 7, 4), date(2026, 9, 2),
+					Vacances.TYPE_VACANCES),
+				("Toussaint", date(2026, 10, 17), date(2026, 10, 31),
+					Vacances.TYPE_VACANCES),
+				("Armistice", date(2026, 11, 11), date(2026, 11, 11),
+					Vacances.TYPE_FERIE),
+				("Noël", date(2026, 12, 19), date(2027, 1, 3),
+					Vacances.TYPE_VACANCES),
+				("Hiver", date(2027, 2, 6), date(2027, 2, 21),
+					Vacances.TYPE_VACANCES),
+				("Printemps", date(2027, 4, 3), date(2027, 4, 18),
+					Vacances.TYPE_VACANCES)):
+			Vacances.objects.create(annee=self.annee, nom=nom,
+				debut=debut, fin=fin, type_vacances=type_vacances)
+
+	def ancienne_periode(self, jour):
+		numero = ancien_numero_semaine(self.annee, jour)
+		if numero is None:
+			return None
+		if numero <= constantes.SEMAINES_PREMIERE_PERIODE:
+			return constantes.PERIODE_PREMIERE
+		return constantes.PERIODE_DEUXIEME
+
+	def test_equivalence(self):
+		jour = self.annee.debut - timedelta(days=10)
+		while jour <= self.annee.fin + timedelta(days=10):
+			self.assertEqual(self.annee.numero_semaine(jour),
+				ancien_numero_semaine(self.annee, jour), jour)
+			self.assertEqual(self.annee.periode_enseignement(jour),
+				self.ancienne_periode(jour), jour)
+			self.assertEqual(self.annee.est_vacances(jour),
+				self.annee.vacances.filter(debut__lte=jour,
+					fin__gte=jour,
+					type_vacances=Vacances.TYPE_VACANCES).exists(), jour)
+			jour += timedelta(days=1)
+
+	def test_cas_limites(self):
+		# Vacances à cheval sur le début de l'année
+		self.assertIsNone(self.annee.numero_semaine(date(2026, 9, 1)))
+		self.assertTrue(self.annee.est_vacances(date(2026, 9, 1)))
+		self.assertEqual(self.annee.numero_semaine(date(2026, 9, 3)), 1)
+
+		# Dimanche
+		self.assertIsNone(self.annee.numero_semaine(date(2026, 9, 6)))
+		self.assertFalse(self.annee.est_travaille(date(2026, 9, 6)))
+
+		# Dernier jour des vacances, puis jour de la reprise
+		self.assertIsNone(self.annee.numero_semaine(date(2026, 10, 31)))
+		self.assertEqual(self.annee.numero_semaine(date(2026, 11, 2)),
+			self.annee.numero_semaine(date(2026, 10, 16)) + 1)
+
+		# Un jour férié reste compté dans les semaines d'enseignement.
+		self.assertEqual(self.annee.numero_semaine(date(2026, 11, 11)),
+			ancien_numero_semaine(self.annee, date(2026, 11, 11)))
+
+		# Passage d'un semestre à l'autre
+		self.assertEqual(self.annee.numero_semaine(date(2027, 1, 30)),
+			constantes.SEMAINES_PREMIERE_PERIODE)
+		self.assertEqual(self.annee.periode_enseignement(date(2027, 1, 30)),
+			constantes.PERIODE_PREMIERE)
+		self.assertEqual(self.annee.numero_semaine(date(2027, 2, 1)),
+			constantes.SEMAINES_PREMIERE_PERIODE + 1)
+		self.assertEqual(self.annee.periode_enseignement(date(2027, 2, 1)),
+			constantes.PERIODE_DEUXIEME)
+
+		# Hors de l'année
+		self.assertIsNone(self.annee.numero_semaine(date(2027, 7, 5)))
+		self.assertIsNone(self.annee.periode_enseignement(
+			date(2026, 8, 31)))
+
+	def test_invalidation_vacances(self):
+		jour = date(2026, 10, 13)
+		avant = self.annee.numero_semaine(jour)
+		with self.assertNumQueries(0):
+			self.assertEqual(Annee.objects.model.numero_semaine(
+				self.annee, jour), avant)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			vacances = Vacances.objects.create(annee=self.annee,
+				nom="Pont", debut=date(2026, 9, 26),
+				fin=date(2026, 10, 4))
+		self.assertNotEqual(self.annee.numero_semaine(jour), avant)
+		self.assertEqual(self.annee.numero_semaine(jour),
+			ancien_numero_semaine(self.annee, jour))
+		self.assertEqual(Annee.objects.get(pk=self.annee.pk
+			).numero_semaine(jour), ancien_numero_semaine(self.annee, jour))
+
+		with self.captureOnCommitCallbacks(execute=True):
+			vacances.delete()
+		self.assertEqual(self.annee.numero_semaine(jour), avant)
+
+	def test_invalidation_bornes(self):
+		jour = date(2026, 10, 13)
+		avant = self.annee.numero_semaine(jour)
+
+		self.annee.debut = date(2026, 9, 7)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.annee.save()
+		self.assertNotEqual(self.annee.numero_semaine(jour), avant)
+		self.assertEqual(self.annee.numero_semaine(jour),
+			ancien_numero_semaine(self.annee, jour))
+		self.assertIsNone(self.annee.numero_semaine(date(2026, 9, 4)))
+		self.assertEqual(Annee.objects.get(pk=self.annee.pk
+			).numero_semaine(jour), ancien_numero_semaine(self.annee, jour))
+
+# Extrait du calendrier scolaire officiel, tel que renvoyé par l'API
+CALENDRIER_OFFICIEL = [
+	{"description": "Vacances de la Toussaint", "population": "-",
+		"start_date": "2026-10-16T22:00:00+00:00",
+		"end_date": "2026-11-01T23:00:00+00:00", "location": "Lyon",
+		"annee_scolaire": "2026-2027"},
+	{"description": "Vacances de Noël", "population": "-",
+		"start_date": "2026-12-18T23:00:00+00:00",
+		"end_date": "2027-01-03T23:00:00+00:00", "location": "Lyon",
+		"annee_scolaire": "2026-2027"},
+	{"description": "Vacances d'Hiver", "population": "-",
+		"start_date": "2027-02-06", "end_date": "2027-02-22",
+		"location": "Lyon", "annee_scolaire": "2026-2027"},
+	{"description": "Vacances de Noël", "population": "-",
+		"start_date": "2026-12-18T23:00:00+00:00",
+		"end_date": "2027-01-03T23:00:00+00:00", "location": "Besançon",
+		"annee_scolaire": "2026-2027"},
+	{"description": "Rentrée scolaire des élèves", "population": "Élèves",
+		"start_date": "2026-08-31T22:00:00+00:00",
+		"end_date": "2026-08-31T22:00:00+00:00", "location": "Lyon",
+		"annee_scolaire": "2026-2027"},
+	{"description": "Vacances de la Toussaint", "population": "Enseignants",
+		"start_date": "2026-10-15T22:00:00+00:00",
+		"end_date": "2026-11-02T23:00:00+00:00", "location": "Lyon",
+		"annee_scolaire": "2026-2027"},
+]
+
+class CalendrierOfficielTests(TestCase):
+	# Vacances attendues pour l'académie de Lyon : les dates sont des
+	# jours inclus dans les vacances.
+	attendues = {
+		"Vacances de la Toussaint": (date(2026, 10, 17), date(2026, 10, 31)),
+		"Vacances de Noël": (date(2026, 12, 19), date(2027, 1, 2)),
+		"Vacances d'Hiver": (date(2027, 2, 6), date(2027, 2, 20)),
+	}
+
+	def setUp(self):
+		creer_etablissement(self)
+		self.annee = Annee.objects.create(nom="2026",
+			debut=date(2026, 9, 1), fin=date(2027, 7, 3))
+
+	def test_date_utc(self):
+		# Minuit à Paris est encore la veille en temps universel.
+		self.assertEqual(_date_utc("2026-10-16T22:00:00+00:00"),
+			date(2026, 10, 16))
+		self.assertEqual(_date_utc("2026-10-17T00:00:00+02:00"),
+			date(2026, 10, 16))
+		self.assertEqual(_date_utc("2026-10-17"), date(2026, 10, 16))
+
+	def test_json(self):
+		for donnees in ({"results": CALENDRIER_OFFICIEL},
+				[{"fields": enregistrement}
+					for enregistrement in CALENDRIER_OFFICIEL]):
+			calendrier = CalendrierOfficiel.lire(io.BytesIO(
+				json.dumps(donnees).encode('utf-8')))
+			self.assertEqual(calendrier.vacances(self.academie,
+				self.annee), self.attendues)
+
+	def test_csv_libelles(self):
+		# Export du site, avec les libellés des colonnes et les heures
+		# locales.
+		lignes = ["Description;Population;Date de début;Date de fin;"
+			"Académies;Zones;Année scolaire"]
+		for enregistrement in CALENDRIER_OFFICIEL:
+			dates = []
+			for champ in ('start_date', 'end_date'):
+				valeur = enregistrement[champ]
+				if 'T' in valeur:
+					instant = timezone.datetime.fromisoformat(valeur)
+					valeur = instant.astimezone(timezone.get_fixed_timezone(
+						120 if 4 <= instant.month <= 10 else 60)).isoformat()
+				dates.append(valeur)
+			lignes.append(";".join([enregistrement['description'],
+				enregistrement['population']] + dates + [
+				enregistrement['location'], "Zone A",
+				enregistrement['annee_scolaire']]))
+
+		calendrier = CalendrierOfficiel.lire(io.BytesIO(
+			("\ufeff" + "\n".join(lignes) + "\n").encode('utf-8')))
+		self.assertEqual(calendrier.vacances(self.academie, self.annee),
+			self.attendues)
+
+		with self.assertRaises(ValueError):
+			CalendrierOfficiel.lire(io.BytesIO(b"x;y\n1;2\n"))
+
+	def test_enseignants_ignores(self):
+		calendrier = CalendrierOfficiel([enregistrement
+			for enregistrement in CALENDRIER_OFFICIEL
+			if enregistrement['population'] == "Enseignants"])
+		self.assertIsNone(calendrier.vacances(self.academie, self.annee))
+
+	def test_second_chargement(self):
+		Vacances.objects.create(annee=self.annee, nom="Ancienne",
+			debut=date(2026, 10, 1), fin=date(2026, 10, 3))
+		Vacances.objects.create(annee=self.annee, nom="Vacances de Noël",
+			debut=date(2026, 12, 1), fin=date(2026, 12, 3))
+		Vacances.objects.create(annee=self.annee, nom="Armistice",
+			debut=date(2026, 11, 11), fin=date(2026, 11, 11),
+			type_vacances=Vacances.TYPE_FERIE)
+		calendrier = CalendrierOfficiel(CALENDRIER_OFFICIEL)
+
+		self.assertEqual(enregistrer_vacances(calendrier, self.academie),
+			(2, 1, 1))
+		self.assertEqual(dict((nom, (debut, fin)) for nom, debut, fin in
+			self.annee.vacances.filter(type_vacances=Vacances.TYPE_VACANCES
+				).values_list('nom', 'debut', 'fin')), self.attendues)
+		self.assertTrue(self.annee.vacances.filter(nom="Armistice").exists())
+
+		with CaptureQueriesContext(connection) as requetes:
+			self.assertEqual(enregistrer_vacances(calendrier,
+				self.academie), (0, 0, 0))
+		self.assertEqual([requete['sql'] for requete in requetes
+			if requete['sql'].split()[0] in ('INSERT', 'UPDATE',
+				'DELETE')], [])
+
+class CreationJuryTests(TestCase):
+	"""
+	Comparaison de la création des mentions d'un jury en mémoire avec
+	la création mention par mention à l'aide des méthodes des
+	gestionnaires de modèles.
+	"""
+	def setUp(self):
+		creer_classe(self, nb_etudiants=9)
+		self.matieres = [self.matiere] + [Matiere.objects.create(
+			nom="Matière {}".format(i), virtuelle=False,
+			code_matiere="X{}".format(i)) for i in range(4)]
+		m = self.matieres
+
+		# Enseignements communs (m[0], m[4]), obligatoires (m[1], m[2])
+		# et facultatifs (m[1], m[3]).
+		for matiere, modalite, rang in ((m[1], 2, 1), (m[2], 2, 1),
+				(m[3], 3, 1), (m[4], 1, None), (m[1], 3, 1)):
+			Enseignement.objects.create(classe=self.classe,
+					matiere=matiere, modalite_option=modalite,
+					rang_option=rang)
+
+		for i, etudiant in enumerate(self.etudiants):
+			options = []
+			if i % 3 == 0:
+				options.append((m[1], 2))
+			if i % 3 == 1:
+				options.append((m[2], 2))
+			if i % 2 == 0:
+				options.append((m[3], 3))
+			if i % 4 == 1:
+				options.append((m[1], 3))
+			for matiere, modalite in options:
+				OptionEtudiant.objects.create(classe=self.classe,
+						etudiant=etudiant, matiere=matiere,
+						rang_option=1, modalite_option=modalite)
+
+		mef_matieres = {}
+		def mef_matiere(matiere, modalite, rang=None):
+			cle = (matiere.pk, modalite, rang)
+			if cle not in mef_matieres:
+				mef_matieres[cle] = MEFMatiere.objects.create(
+						mef=self.classe.mef, matiere=matiere,
+						modalite_option=modalite, rang_option=rang)
+			return mef_matieres[cle]
+
+		for semestre in (1, 2):
+			for ref, option in (("commune", None), ("option 1", m[1]),
+					("option 2", m[2])):
+				grille = Grille.objects.create(code_mef=self.classe.mef,
+						ref=ref, semestre=semestre)
+				if option:
+					GrilleMatchLigne.objects.create(grille=grille,
+							matiere=mef_matiere(option, 2, 1))
+				groupe = GrilleGroupeLignes.objects.create(
+						libelle="Sciences", grille=grille, position=1)
+				lignes = [
+					("Mathématiques", groupe, 8, mef_matiere(m[0], 1), False),
+					("Travaux pratiques", groupe, 2, mef_matiere(m[0], 1), False),
+					("", None, 3, mef_matiere(m[4], 1), True),
+					("Forcée", groupe, semestre, mef_matiere(m[3], 2, 2), True),
+					("Facultative", None, 0, mef_matiere(m[3], 3, 1), False),
+				]
+				if option:
+					lignes.append(("Option", None, 5 + semestre,
+						mef_matiere(option, 2, 1), False))
+				for position, (libelle, groupe_ligne, credits, matiere,
+						force_creation) in enumerate(lignes):
+					GrilleLigne.objects.create(grille=grille,
+							libelle=libelle, groupe=groupe_ligne,
+							position=position, credits=credits,
+							matiere=matiere,
+							force_creation=force_creation)
+
+	def creer_jury_requetes(self, periode):
+		"""
+		Création des mentions étudiant par étudiant, en interrogeant la
+		base pour chaque grille et chaque mention.
+		"""
+		classe = self.classe
+		jury = Jury.objects.create(classe=classe, periode=periode,
+				date=timezone.now())
+
+		grilles = Grille.objects.filter(code_mef=classe.mef)
+		if periode != Jury.PERIODE_ANNEE:
+			grilles = grilles.filter(semestre=periode)
+
+		for etudiant in classe.etudiants.all():
+			periodes_traitees = set()
+			# SQLite refuse le tri par défaut des enseignements dans
+			# l'union construite par filter_etudiant : on le retire
+			# puis on le rétablit.
+			enseignements = Enseignement.objects.filter(pk__in=list(
+				Enseignement.objects.order_by().filter_etudiant(
+					etudiant=etudiant, classe=classe
+				).values_list('pk', flat=True)))
+
+			for grille in grilles.filter_applicables(classe=classe,
+					etudiant=etudiant):
+				if grille.semestre in periodes_traitees:
+					continue
+				periodes_traitees.add(grille.semestre)
+
+				lignes_restantes = set(grille.lignes.all())
+				for enseignement in enseignements:
+					mention = None
+					for ligne in lignes_restantes.copy():
+						if enseignement.matiere != ligne.matiere.matiere or \
+							enseignement.rang_option != ligne.matiere.rang_option or \
+							enseignement.modalite_option != ligne.matiere.modalite_option:
+							continue
+						mention, _ = Mention.objects.credit_or_create(
+							etudiant=etudiant, jury=jury,
+							enseignement=enseignement,
+							grille_ligne__similar=ligne,
+							defaults={
+								'grille_ligne': ligne,
+								'credits': ligne.credits,
+							})
+						lignes_restantes.remove(ligne)
+
+					if mention is None and enseignement.modalite_option == \
+							Enseignement.MODALITE_FACULTATIVE:
+						Mention.objects.credit_or_create(
+							etudiant=etudiant, jury=jury,
+							enseignement=enseignement,
+							defaults={'credits': 0})
+
+				for ligne in lignes_restantes:
+					if ligne.force_creation:
+						Mention.objects.credit_or_create(
+							etudiant=etudiant, jury=jury,
+							credits=ligne.credits,
+							grille_ligne__similar=ligne,
+							defaults={
+								'grille_ligne': ligne,
+								'credits': ligne.credits,
+							})
+
+		return jury
+
+	def mentions(self, jury):
+		return [(mention.etudiant_id, mention.enseignement_id,
+			mention.credits, mention.mention, mention.globale,
+			sorted(ligne.pk for ligne in mention.grille_lignes.all()))
+			for mention in Mention.objects.filter(jury=jury
+				).order_by('pk')]
+
+	def test_creation_identique(self):
+		for periode in (Jury.PERIODE_ANNEE, Jury.PERIODE_PREMIERE,
+				Jury.PERIODE_DEUXIEME):
+			attendues = self.mentions(self.creer_jury_requetes(periode))
+			obtenues = self.mentions(Jury.objects.create_from_classe(
+				self.classe, periode, date=timezone.now()))
+			self.assertTrue(attendues)
+			self.assertEqual(attendues, obtenues)
+
+def classeur(*feuilles):
+	"""
+	Enregistre avec odfpy un classeur dont chaque feuille est une liste
+	de lignes. Une ligne est une liste de cases TableCell ou
+	CoveredTableCell, ou bien directement un TableRow.
+	"""
+	document = OpenDocumentSpreadsheet()
+	for num, lignes in enumerate(feuilles):
+		table = Table(name="Feuille{}".format(num),
+			parent=document.spreadsheet)
+		for ligne in lignes:
+			if isinstance(ligne, list):
+				cases = ligne
+				ligne = TableRow()
+				for case in cases:
+					ligne.addElement(case)
+			table.addElement(ligne)
+	fichier = io.BytesIO()
+	document.save(fichier)
+	fichier.seek(0)
+	return fichier
+
+def case(texte=None, **kwargs):
+	cellule = TableCell(**kwargs)
+	if texte is not None:
+		cellule.addElement(P(text=texte))
+	return cellule
+
+class LectureOdsTests(TestCase):
+	def textes(self, fichier, **kwargs):
+		return [[cellule.text for cellule in ligne]
+			for ligne in iter_rows(fichier, **kwargs)]
+
+	def test_cases_vides_repetees(self):
+		fichier = classeur([
+			[case("a"), case(numbercolumnsrepeated=16384)],
+			[case("a"), case(numbercolumnsrepeated=3), case("b")],
+			[case("x", numbercolumnsrepeated=2)],
+		])
+		self.assertEqual(self.textes(fichier),
+			[["a"], ["a", "", "", "", "b"], ["x", "x"]])
+
+	def test_max_columns(self):
+		fichier = classeur([
+			[case("a"), case("b"), case("c"), case("d")],
+			[case("a")],
+			[case("x", numbercolumnsrepeated=1000)],
+			[case(numbercolumnsrepeated=1000), case("z")],
+			[],
+			[case("fin")],
+		])
+		self.assertEqual(self.textes(fichier, max_columns=3), [
+			["a", "b", "c"],
+			["a", "", ""],
+			["x", "x", "x"],
+			["", "", ""],
+			["", "", ""],
+			["fin", "", ""],
+		])
+
+	def test_cases_recouvertes(self):
+		fichier = classeur([
+			[case("a", numbercolumnsspanned=2), CoveredTableCell(),
+				case("b")],
+		])
+		self.assertEqual(self.textes(fichier), [["a", "", "b"]])
+
+	def test_espaces_et_tabulations(self):
+		paragraphe = P(text="a")
+		paragraphe.addElement(S(c=3))
+		paragraphe.addText("b")
+		paragraphe.addElement(Tab())
+		paragraphe.addText("c")
+		cellule = TableCell()
+		cellule.addElement(paragraphe)
+
+		fichier = classeur([[cellule]])
+		self.assertEqual(self.textes(fichier), [["a   b\tc"]])
+
+	def test_valeurs_typees(self):
+		fichier = classeur([[
+			case("2,50", valuetype='float', value=2.5),
+			case("10:30", valuetype='time', timevalue='PT10H30M00S'),
+			case("01/09/2026", valuetype='date', datevalue='2026-09-01'),
+			case("01/09/2026 08:00", valuetype='date',
+				datevalue='2026-09-01T08:00:00'),
+			case("texte"),
+		]])
+		ligne, = iter_rows(fichier)
+		self.assertEqual([cellule.value for cellule in ligne], [2.5,
+			time(10, 30), date(2026, 9, 1),
+			timezone.datetime(2026, 9, 1, 8, 0), "texte"])
+		self.assertEqual(ligne[0].text, "2,50")
+
+	def test_duree_hors_journee(self):
+		for duree in ('PT24H00M00S', 'P1DT02H00M00S', '-PT01H00M00S'):
+			fichier = classeur([[case("", valuetype='time',
+				timevalue=duree)]])
+			with self.assertRaises(ValueError):
+				list(iter_rows(fichier))
+
+	def test_lignes_vides_finales(self):
+		fichier = classeur([
+			[case("a")],
+			[case()],
+			[case("b")],
+			TableRow(numberrowsrepeated=1048570),
+		])
+		self.assertEqual(self.textes(fichier), [["a"], [], ["b"]])
+
+	def test_table_index(self):
+		fichier = classeur([[case("premier")]], [[case("second")]])
+		self.assertEqual(self.textes(fichier, table_index=1),
+			[["second"]])
+		fichier.seek(0)
+		self.assertEqual(self.textes(fichier, table_index=2), [])
+
+	def test_equivalence_odfpy(self):
+		# Sans case recouverte ni espace codé, le lecteur en flux donne
+		# le même texte que la lecture précédente par odfpy.
+		lignes = [
+			[case("Civilité"), case("Nom"), case("Prénom"), case("Mél")],
+			[case("M."), case(" dupont "), case("jean"),
+				case("j@example.com")],
+			[case("Mme"), case("MARTIN"), case("anne"),
+				case(numbercolumnsrepeated=20)],
+			[case(numbercolumnsrepeated=4)],
+			[case("1"), case(numbercolumnsrepeated=5), case("2, 3"),
+				case("4", numbercolumnsrepeated=2)],
+		]
+		fichier = classeur(lignes)
+		document = odf.opendocument.load(fichier)
+		table = document.spreadsheet.getElementsByType(Table)[0]
+		attendus = [[tablecell_to_text(cellule) for cellule in
+			iter_columns(ligne)] for ligne in
+			table.getElementsByType(TableRow)]
+
+		fichier.seek(0)
+		for ligne, attendu in zip(iter_rows(fichier, max_columns=9),
+				attendus):
+			attendu = (attendu + [""] * 9)[:9]
+			self.assertEqual([cellule.text for cellule in ligne], attendu)
+
+		fichier.seek(0)
+		self.assertEqual(len(list(iter_rows(fichier))), len(attendus))
+
+class EcritureOdsTests(TestCase):
+	@staticmethod
+	def empreinte(num):
+		# Texte qui se compresse mal, pour que l'archive dépasse la
+		# taille d'un morceau.
+		return hashlib.sha256(str(num).encode()).hexdigest()
+
+	def classeur(self, nb_lignes):
+		ods = StreamingSpreadsheet()
+		nombre = ods.add_style(NumberStyle(name="Nombre"))
+		Number(parent=nombre, minintegerdigits=1, decimalplaces=2)
+		style = ods.add_style(Style(datastylename=nombre, name="Note",
+			family='table-cell'))
+
+		def lignes():
+			yield [Cell(2.5, text="2,50", style=style), time(10, 30),
+				date(2026, 9, 1), timezone.datetime(2026, 9, 1, 8, 0),
+				None, "fin"]
+			yield [Cell("fusion", columnsspanned=2), CoveredCell(),
+				Cell("x", repeated=2)]
+			for num in range(nb_lignes):
+				yield [self.empreinte(num), num]
+
+		ods.add_table(StreamingTable("Première",
+			columns=(Column(), Column(style, repeated=5)),
+			header_rows=(["Titre", "Valeur"],), rows=lignes()))
+		ods.add_table(StreamingTable("Seconde", rows=[["seule"]]))
+		return ods
+
+	def test_aller_retour(self):
+		# Assez de lignes pour que le classeur soit envoyé en plusieurs
+		# morceaux.
+		nb_lignes = 3 * STREAM_CHUNK_SIZE // 64
+		reponse = StreamingOdfResponse(self.classeur(nb_lignes),
+			filename="essai.ods")
+		self.assertEqual(reponse['Content-Type'],
+			'application/vnd.oasis.opendocument.spreadsheet')
+		self.assertEqual(reponse['Content-Disposition'],
+			'attachment; filename="essai.ods"')
+		morceaux = list(reponse.streaming_content)
+		self.assertGreater(len(morceaux), 1)
+		contenu = b''.join(morceaux)
+
+		with zipfile.ZipFile(io.BytesIO(contenu)) as archive:
+			self.assertIsNone(archive.testzip())
+			mimetype = archive.infolist()[0]
+			self.assertEqual(mimetype.filename, 'mimetype')
+			self.assertEqual(mimetype.compress_type, zipfile.ZIP_STORED)
+			self.assertEqual(archive.read('mimetype'),
+				b'application/vnd.oasis.opendocument.spreadsheet')
+			self.assertIn('META-INF/manifest.xml', archive.namelist())
+		# Le type MIME est lisible à une position fixe de l'archive.
+		self.assertEqual(contenu[30:38], b'mimetype')
+
+		lignes = list(iter_rows(io.BytesIO(contenu)))
+		self.assertEqual(len(lignes), nb_lignes + 3)
+		self.assertEqual([cellule.text for cellule in lignes[0]],
+			["Titre", "Valeur"])
+		self.assertEqual([cellule.value for cellule in lignes[1]],
+			[2.5, time(10, 30), date(2026, 9, 1),
+				timezone.datetime(2026, 9, 1, 8, 0), None, "fin"])
+		self.assertEqual(lignes[1][0].text, "2,50")
+		self.assertEqual([cellule.text for cellule in lignes[2]],
+			["fusion", "", "x", "x"])
+		self.assertEqual([cellule.value for cellule in lignes[-1]],
+			[self.empreinte(nb_lignes - 1), nb_lignes - 1])
+		self.assertEqual([[cellule.text for cellule in ligne]
+			for ligne in iter_rows(io.BytesIO(contenu), table_index=1)],
+			[["seule"]])
+
+	def test_lecture_odfpy(self):
+		contenu = b''.join(self.classeur(2))
+		document = odf.opendocument.load(io.BytesIO(contenu))
+
+		styles = dict((style.getAttribute('name'), style)
+			for style in document.automaticstyles.getElementsByType(Style))
+		self.assertEqual(styles["Note"].getAttribute('datastylename'),
+			"Nombre")
+		self.assertEqual(len(document.automaticstyles.getElementsByType(
+			NumberStyle)), 1)
+
+		premiere, seconde = document.spreadsheet.getElementsByType(Table)
+		self.assertEqual(premiere.getAttribute('name'), "Première")
+		self.assertEqual(seconde.getAttribute('name'), "Seconde")
+		colonnes = premiere.getElementsByType(TableColumn)
+		self.assertEqual(colonnes[1].getAttribute('stylename'), "Note")
+		self.assertEqual(colonnes[1].getAttribute('numbercolumnsrepeated'),
+			'5')
+
+		lignes = premiere.getElementsByType(TableRow)
+		note = lignes[1].getElementsByType(TableCell)[0]
+		self.assertEqual(note.getAttribute('stylename'), "Note")
+		self.assertEqual(note.getAttribute('value'), '2.5')
+		fusion = lignes[2].getElementsByType(TableCell)[0]
+		self.assertEqual(fusion.getAttribute('numbercolumnsspanned'), '2')
+		self.assertEqual(len(lignes[2].getElementsByType(
+			CoveredTableCell)), 1)
+		self.assertEqual(tablecell_to_text(fusion), "fusion")
+
+@override_settings(PYKOL_UAI_DEFAUT="0021593W")
+class ImportColleursTests(TestCase):
+	def setUp(self):
+		creer_etablissement(self)
+		direction = User.objects.create(email="direction@example.org")
+		direction.user_permissions.add(Permission.objects.get(
+			codename='direction'))
+		self.client.force_login(direction)
+
+	def test_import(self):
+		Professeur.objects.create(last_name="Martin", first_name="Anne",
+			email="ancien@example.com")
+		fichier = classeur([
+			[case("Civilité"), case("Nom"), case("Prénom"), case("Mél")],
+			[case("M."), case(" dupont "), case("jean"),
+				case("j@example.com"), case(numbercolumnsrepeated=1000)],
+			[case("Mme"), case("MARTIN"), case("anne"), case(numbercolumnsrepeated=1000)],
+			[case("M."), case("SEUL")],
+			TableRow(numberrowsrepeated=1000),
+		])
+		fichier.name = "colleurs.ods"
+
+		reponse = self.client.post(reverse('import_colleurs'),
+			{'colleurs': fichier})
+		self.assertRedirects(reponse, reverse('direction_list_user'),
+			fetch_redirect_response=False)
+		self.assertEqual(sorted(Professeur.objects.values_list(
+			'last_name', 'first_name', 'sexe', 'email')), [
+			("Dupont", "Jean", Professeur.SEXE_HOMME, "j@example.com"),
+			("Martin", "Anne", Professeur.SEXE_FEMME, None),
+		])
+
+class OdtTemplateTests(TestCase):
+	def setUp(self):
+		self.template = OdtTemplate(chemin_modele('ects_modele_resultats'),
+			frames=('signature_proviseur', 'tampon_lycee'))
+		fd, self.image = tempfile.mkstemp(suffix='.png')
+		with os.fdopen(fd, 'wb') as image:
+			image.write(b'\x89PNG\r\n\x1a\n')
+		self.addCleanup(os.remove, self.image)
+
+	def test_remplacement_image(self):
+		ancienne, = self.template.frame_pictures['tampon_lycee']
+		document = self.template.new_document()
+		document.add_picture('tampon_lycee', self.image)
+		document.add_copy()
+		fichier = io.BytesIO()
+		document.save(fichier)
+
+		with zipfile.ZipFile(fichier) as archive:
+			noms = archive.namelist()
+			contenu = archive.read('content.xml').decode('utf-8')
+			manifeste = archive.read('META-INF/manifest.xml').decode('utf-8')
+
+		self.assertIn('Pictures/tampon_lycee.png', noms)
+		self.assertIn('Pictures/tampon_lycee.png', manifeste)
+		self.assertNotIn(ancienne, noms)
+		self.assertNotIn(ancienne, manifeste)
+		self.assertNotIn(ancienne, contenu)
+		self.assertIn('<svg:title>Tampon du lycée</svg:title>', contenu)
+
+		# L'image de la signature, qui n'est pas remplacée, est
+		# conservée.
+		signature, = self.template.frame_pictures['signature_proviseur']
+		self.assertIn(signature, noms)
+		self.assertIn(signature, contenu)
+
+@override_settings(PYKOL_ATTESTATIONS_PROCESSUS=0)
+class AttestationsLotTests(TestCase):
+	def setUp(self):
+		creer_classe(self)
+		self.etablissement.chef_etablissement = User.objects.create(
+				email="chef@example.org", last_name="Chef")
+		self.etablissement.save()
+		for i, etudiant in enumerate(self.etudiants):
+			etudiant.birth_date = date(2000, 1, i + 1)
+			etudiant.save()
+		self.jury = Jury.objects.create(classe=self.classe, periode=1,
+				date=timezone.now())
+		for etudiant in self.etudiants:
+			Mention.objects.create(etudiant=etudiant, jury=self.jury,
+					mention=4, credits=30, globale=True)
+		self.addCleanup(self.supprimer_fichiers)
+
+	def supprimer_fichiers(self):
+		for lot in AttestationsLot.objects.all():
+			if lot.fichier:
+				lot.fichier.delete(save=False)
+
+	def lot(self, **kwargs):
+		return AttestationsLot.objects.create(jury=self.jury,
+				type_attestation=AttestationsLot.TYPE_RESULTATS,
+				**kwargs)
+
+	def generer(self, lot):
+		with mock.patch.object(attestations, 'produire_attestations',
+				wraps=attestations.produire_attestations) as produire:
+			attestations.generer_lot(lot.pk)
+		lot.refresh_from_db()
+		self.assertEqual(lot.etat, AttestationsLot.ETAT_TERMINE)
+		return sorted(pk for appel in produire.call_args_list
+				for pk in appel.args[2])
+
+	def test_reprise_lot_interrompu(self):
+		termine = self.lot()
+		self.generer(termine)
+
+		# Lot interrompu après avoir produit deux attestations, dont
+		# l'une n'est plus à jour.
+		interrompu = self.lot(etat=AttestationsLot.ETAT_EN_COURS)
+		for attestation in termine.attestations.filter(
+				etudiant__in=self.etudiants[:2]):
+			AttestationEtudiant.objects.create(lot=interrompu,
+					etudiant_id=attestation.etudiant_id,
+					empreinte=attestation.empreinte,
+					contenu=attestation.contenu)
+		Mention.objects.filter(jury=self.jury,
+				etudiant=self.etudiants[1]).update(mention=5)
+
+		self.assertEqual(self.generer(interrompu), [self.etudiants[1].pk])
+		self.assertEqual(interrompu.nb_traites, len(self.etudiants))
+		self.assertEqual(interrompu.attestations.count(),
+				len(self.etudiants))
+
+	def test_commande_lots_abandonnes(self):
+		ancienne = timezone.now() - timedelta(days=1)
+		actif = self.lot(etat=AttestationsLot.ETAT_EN_COURS)
+		AttestationsLot.objects.filter(pk=actif.pk).update(
+				date_activite=timezone.now())
+		abandonne = self.lot()
+		AttestationsLot.objects.filter(pk=abandonne.pk).update(
+				date_creation=ancienne)
+
+		call_command('attestations_ects', stdout=io.StringIO())
+
+		actif.refresh_from_db()
+		abandonne.refresh_from_db()
+		self.assertEqual(actif.etat, AttestationsLot.ETAT_EN_COURS)
+		self.assertFalse(actif.attestations.exists())
+		self.assertEqual(abandonne.etat, AttestationsLot.ETAT_TERMINE)
+
+class ResultatsTests(ColloscopeTestCase):
+	def setUp(self):
+		super().setUp()
+		self.importer([['1', '2', '1', '2'], ['2', '1', '', '']])
+
+		# Chaque colle est notée, sauf celle du deuxième créneau en
+		# deuxième semaine. Les notes donnent des ex-aequo.
+		self.notes = {}
+		colles = Colle.all_objects.order_by('semaine__debut', 'creneau')
+		for colle in colles:
+			if colle.creneau == self.creneaux[1] and \
+					colle.semaine == self.semaines[1]:
+				self.en_attente = colle
+				continue
+			semaine = self.semaines.index(colle.semaine)
+			for etudiant in colle.details.eleves.all():
+				i = self.etudiants.index(etudiant)
+				if (i, semaine) == (4, 3):
+					note = Note('ae')
+				else:
+					note = Note(8 + 2 * (i % 3))
+				ColleNote.objects.create(colle=colle, eleve=etudiant,
+					note=note, horaire=colle.details.horaire,
+					duree=timedelta(minutes=20))
+				self.notes.setdefault(etudiant, []).append(
+					(semaine, note))
+
+		self.periodes = [
+			PeriodeNotation.objects.create(enseignement=self.enseignement,
+				nom="Premier semestre", debut=self.semaines[0].debut,
+				fin=self.semaines[1].fin),
+			PeriodeNotation.objects.create(enseignement=self.enseignement,
+				nom="Deuxième semestre", debut=self.semaines[2].debut,
+				fin=self.semaines[3].fin),
+		]
+
+	def moyennes(self, etudiant):
+		"""
+		Moyenne annuelle et moyennes par période attendues pour un
+		étudiant.
+		"""
+		moyenne = Moyenne()
+		periodes = [Moyenne(), Moyenne()]
+		for semaine, note in self.notes[etudiant]:
+			moyenne += note
+			periodes[semaine // 2] += note
+		return moyenne, periodes
+
+	@staticmethod
+	def classement(moyennes):
+		"""
+		Rangs attendus : un étudiant sans note n'est pas classé, les
+		ex-aequo ont le même rang.
+		"""
+		valeurs = [moyenne.value for moyenne in moyennes]
+		return [None if valeur is None else
+			1 + len([autre for autre in valeurs
+				if autre is not None and autre > valeur])
+			for valeur in valeurs]
+
+	def test_tableau(self):
+		tableau = TableauResultats(self.classe, [self.enseignement])
+		resultats = tableau.resultats[self.enseignement]
+		lignes = list(resultats.lignes())
+
+		self.assertEqual([ligne.etudiant for ligne in lignes],
+			sorted(self.notes, key=lambda e: (e.last_name, e.first_name)))
+
+		for ligne in lignes:
+			moyenne, periodes = self.moyennes(ligne.etudiant)
+			cellules = [[] for _ in range(len(tableau.semaines))]
+			for semaine, note in self.notes[ligne.etudiant]:
+				cellules[semaine].append(note)
+			if ligne.etudiant in self.en_attente.details.eleves.all():
+				cellules[1].append(EN_ATTENTE)
+
+			self.assertEqual(repr(ligne.moyenne), repr(moyenne))
+			self.assertEqual(ligne.moyenne.value, moyenne.value)
+			self.assertEqual([repr(m) for m in ligne.periodes],
+				[repr(m) for m in periodes])
+			self.assertEqual([[repr(n) for n in cellule]
+				for cellule in ligne.notes],
+				[[repr(n) for n in cellule] for cellule in cellules])
+
+	def test_classement(self):
+		tableau = TableauResultats(self.classe, [self.enseignement])
+		lignes = list(tableau.resultats[self.enseignement].lignes())
+		attendues = [self.moyennes(ligne.etudiant) for ligne in lignes]
+
+		rangs = self.classement([moyenne for moyenne, _ in attendues])
+		self.assertEqual([ligne.rang for ligne in lignes], rangs)
+		self.assertLess(len(set(rangs)), len(rangs))
+		for p in range(len(self.periodes)):
+			self.assertEqual([ligne.rangs_periodes[p] for ligne in lignes],
+				self.classement([periodes[p] for _, periodes in attendues]))
+
+	def test_export_odf(self):
+		tableau = TableauResultats(self.classe, [self.enseignement])
+		lignes = list(tableau.resultats[self.enseignement].lignes())
+		reponse = classe_resultats_odf(None, tableau)
+		contenu = io.BytesIO(b''.join(reponse.streaming_content))
+		feuille = [[cellule.value for cellule in ligne]
+			for ligne in iter_rows(contenu, max_columns=7)]
+
+		self.assertEqual(feuille[0], ["Étudiant", "Moyenne",
+			"Moyenne Premier semestre", "Moyenne Deuxième semestre",
+			"Rang", "Rang Premier semestre", "Rang Deuxième semestre"])
+		self.assertEqual(len(feuille), len(lignes) + 1)
+		for ligne, cellules in zip(lignes, feuille[1:]):
+			self.assertEqual(cellules[0], str(ligne.etudiant))
+			self.assertEqual(cellules[4:], [None if rang is None
+				else float(rang) for rang in
+				[ligne.rang] + ligne.rangs_periodes])
+
+def xml_sts_bee():
+	"""
+	Export STS-web minimal : deux classes de CPGE (MP1 et PC2), une
+	classe de seconde ignorée par l'import et un groupe GMP commun aux
+	deux classes de CPGE.
+	"""
+	individus = "".join('<INDIVIDU ID="{}"><NOM_USAGE>{}</NOM_USAGE>'
+		'<PRENOM>{}</PRENOM><SEXE>{}</SEXE><FONCTION>ENS</FONCTION>'
+		'<DISCIPLINES><DISCIPLINE CODE="{}"><LIBELLE_COURT>{}'
+		'</LIBELLE_COURT><NB_HEURES>10</NB_HEURES></DISCIPLINE>'
+		'</DISCIPLINES></INDIVIDU>'.format(*individu) for individu in (
+			(101, "DUPONT", "JEAN", 1, "L1300", "MATHS"),
+			(102, "MARTIN", "ANNE", 2, "L1500", "PHYSIQUE"),
+			(103, "DURAND", "LUC", 1, "L1300", "MATHS"),
+			(104, "PETIT", "EVE", 2, "L0422", "ANGLAIS")))
+
+	def division(code, mef, *services):
+		return ('<DIVISION CODE="{}"><LIBELLE_LONG>{}</LIBELLE_LONG>'
+			'<MEFS_APPARTENANCE><MEF_APPARTENANCE CODE="{}"/>'
+			'</MEFS_APPARTENANCE><SERVICES>{}</SERVICES>'
+			'</DIVISION>').format(code, code, mef, "".join(
+				'<SERVICE CODE_MATIERE="{}" CODE_MOD_COURS="{}">'
+				'<ENSEIGNANTS><ENSEIGNANT ID="{}"/></ENSEIGNANTS>'
+				'</SERVICE>'.format(*service) for service in services))
+
+	return """<?xml version="1.0" encoding="ISO-8859-15"?>
+<STS_EDT>
+<PARAMETRES>
+	<UAJ CODE="0021593W"><ACADEMIE><CODE>1</CODE></ACADEMIE></UAJ>
+	<ANNEE_SCOLAIRE ANNEE="2026"><DATE_DEBUT>2026-09-01</DATE_DEBUT>
+		<DATE_FIN>2027-07-05</DATE_FIN></ANNEE_SCOLAIRE>
+	<HORODATAGE>01/09/2026 10:00:00</HORODATAGE>
+</PARAMETRES>
+<NOMENCLATURES><MEFS>
+	<MEF CODE="30111018210"><LIBELLE_EDITION>Mpsi</LIBELLE_EDITION></MEF>
+	<MEF CODE="30111032220"><LIBELLE_EDITION>Pc</LIBELLE_EDITION></MEF>
+	<MEF CODE="20010010110"><LIBELLE_EDITION>Seconde</LIBELLE_EDITION></MEF>
+</MEFS></NOMENCLATURES>
+<DONNEES>
+	<INDIVIDUS>{}
+		<INDIVIDU ID="900"><NOM_USAGE>CHEF</NOM_USAGE><PRENOM>PAUL</PRENOM>
+			<SEXE>1</SEXE><FONCTION>DIR</FONCTION></INDIVIDU>
+	</INDIVIDUS>
+	<STRUCTURE>
+	<DIVISIONS>{}</DIVISIONS>
+	<GROUPES>
+		<GROUPE CODE="GMP"><EFFECTIF_PREVU>30</EFFECTIF_PREVU>
+		<DIVISIONS_APPARTENANCE>
+			<DIVISION_APPARTENANCE CODE="MP1"/>
+			<DIVISION_APPARTENANCE CODE="PC2"/>
+		</DIVISIONS_APPARTENANCE>
+		<SERVICES><SERVICE CODE_MATIERE="030201" CODE_MOD_COURS="CG">
+			<ENSEIGNANTS><ENSEIGNANT ID="104"/></ENSEIGNANTS>
+		</SERVICE></SERVICES>
+		</GROUPE>
+	</GROUPES>
+	</STRUCTURE>
+</DONNEES>
+</STS_EDT>
+""".format(individus, "".join((
+		division("MP1", "30111018210", ("061300", "CG", 101),
+			("065700", "CG", 102), ("065700", "TP", 103)),
+		division("PC2", "30111032220", ("061300", "CG", 103)),
+		division("2NDE1", "20010010110", ("061300", "CG", 104)),
+	))).encode('iso-8859-15')
+
+def xml_nomenclatures_bee():
+	"""
+	Nomenclatures SIECLE minimales pour les MEF de xml_sts_bee.
+	"""
+	matieres = (("061300", "Mathematiques"), ("065700", "Physique-chimie"),
+		("030201", "Anglais LV1"), ("030101", "Allemand LV1"))
+	programmes = (("30111018210", "061300", "S"),
+		("30111018210", "065700", "S"), ("30111018210", "030201", "O"),
+		("30111018210", "030101", "O"), ("30111032220", "061300", "S"),
+		("30111032220", "030201", "S"), ("20010010110", "061300", "S"))
+	return """<?xml version="1.0" encoding="ISO-8859-15"?>
+<BEE_NOMENCLATURES VERSION="3.1">
+<PARAMETRES><UAJ>0021593W</UAJ><ANNEE_SCOLAIRE>2026</ANNEE_SCOLAIRE>
+	<HORODATAGE>02/09/2026 11:00:00</HORODATAGE></PARAMETRES>
+<DONNEES>
+	<MATIERES>{}</MATIERES>
+	<OPTIONS_OBLIGATOIRES>
+		<OPTION_OBLIGATOIRE><CODE_MEF>30111018210</CODE_MEF>
+			<CODE_MATIERE>030201</CODE_MATIERE>
+			<RANG_OPTION>1</RANG_OPTION></OPTION_OBLIGATOIRE>
+		<OPTION_OBLIGATOIRE><CODE_MEF>30111018210</CODE_MEF>
+			<CODE_MATIERE>030101</CODE_MATIERE>
+			<RANG_OPTION>1</RANG_OPTION></OPTION_OBLIGATOIRE>
+	</OPTIONS_OBLIGATOIRES>
+	<PROGRAMMES>{}</PROGRAMMES>
+</DONNEES>
+</BEE_NOMENCLATURES>
+""".format("".join('<MATIERE CODE_MATIERE="{}"><LIBELLE_EDITION>{}'
+			'</LIBELLE_EDITION></MATIERE>'.format(*matiere)
+			for matiere in matieres),
+		"".join('<PROGRAMME><CODE_MEF>{}</CODE_MEF><CODE_MATIERE>{}'
+			'</CODE_MATIERE><CODE_MODALITE_ELECT>{}</CODE_MODALITE_ELECT>'
+			'</PROGRAMME>'.format(*programme)
+			for programme in programmes)
+	).encode('iso-8859-15')
+
+def xml_structures_bee():
+	"""
+	Structures SIECLE minimales : le libellé de la classe MP1.
+	"""
+	return """<?xml version="1.0" encoding="ISO-8859-15"?>
+<BEE_STRUCTURES VERSION="2.0">
+<PARAMETRES><UAJ>0021593W</UAJ><ANNEE_SCOLAIRE>2026</ANNEE_SCOLAIRE>
+	<HORODATAGE>03/09/2026 12:00:00</HORODATAGE></PARAMETRES>
+<DONNEES><DIVISIONS>
+	<DIVISION CODE_STRUCTURE="MP1"><LIBELLE_LONG>MPSI 1</LIBELLE_LONG>
+		<MEFS_APPARTENANCE><MEF_APPARTENANCE><CODE_MEF>30111018210</CODE_MEF>
+		</MEF_APPARTENANCE></MEFS_APPARTENANCE></DIVISION>
+</DIVISIONS></DONNEES>
+</BEE_STRUCTURES>
+""".encode('iso-8859-15')
+
+def xml_eleves_bee(classes=None):
+	"""
+	Base élèves SIECLE minimale. Le dictionnaire classes associe à
+	chaque numéro SIECLE la division de l'élève : par défaut, quatre
+	étudiants de CPGE répartis entre MP1 et PC2, ainsi qu'un élève de
+	seconde ignoré par l'import.
+	"""
+	if classes is None:
+		classes = {'1000': "MP1", '1001': "PC2", '1002': "MP1",
+			'1003': "PC2", '1004': "2NDE1"}
+
+	eleves = options = structures = ""
+	for numero, division in classes.items():
+		eleves += ('<ELEVE ELEVE_ID="{0}" ELENOET="{0}">'
+			'<ID_NATIONAL>INE{0}</ID_NATIONAL>'
+			'<NOM_DE_FAMILLE>NOM{0}</NOM_DE_FAMILLE>'
+			'<PRENOM>PRENOM{0}</PRENOM><DATE_NAISS>01/05/2005</DATE_NAISS>'
+			'<CODE_SEXE>1</CODE_SEXE><DATE_ENTREE>01/09/2026</DATE_ENTREE>'
+			'<MEL>e{0}@example.com</MEL></ELEVE>').format(numero)
+		structures += ('<STRUCTURES_ELEVE ELEVE_ID="{0}" ELENOET="{0}">'
+			'<STRUCTURE><CODE_STRUCTURE>GMP</CODE_STRUCTURE>'
+			'<TYPE_STRUCTURE>G</TYPE_STRUCTURE></STRUCTURE>'
+			'<STRUCTURE><CODE_STRUCTURE>{1}</CODE_STRUCTURE>'
+			'<TYPE_STRUCTURE>D</TYPE_STRUCTURE></STRUCTURE>'
+			'</STRUCTURES_ELEVE>').format(numero, division)
+		if division == "MP1":
+			options += ('<OPTION ELEVE_ID="{0}" ELENOET="{0}">'
+				'<OPTIONS_ELEVE><NUM_OPTION>1</NUM_OPTION>'
+				'<CODE_MODALITE_ELECT>O</CODE_MODALITE_ELECT>'
+				'<CODE_MATIERE>030201</CODE_MATIERE></OPTIONS_ELEVE>'
+				'</OPTION>').format(numero)
+
+	return """<?xml version="1.0" encoding="ISO-8859-15"?>
+<BEE_ELEVES VERSION="3.0">
+<PARAMETRES><UAJ>0021593W</UAJ><ANNEE_SCOLAIRE>2026</ANNEE_SCOLAIRE>
+	<HORODATAGE>04/09/2026 13:00:00</HORODATAGE></PARAMETRES>
+<DONNEES>
+	<ELEVES>{}</ELEVES>
+	<OPTIONS>{}</OPTIONS>
+	<STRUCTURES>{}</STRUCTURES>
+</DONNEES>
+</BEE_ELEVES>
+""".format(eleves, options, structures).encode('iso-8859-15')
+
+@override_settings(PYKOL_UAI_DEFAUT="0021593W")
+class BEETestCase(TestCase):
+	def setUp(self):
+		creer_etablissement(self)
+
+	def fichiers(self, structures=None, **kwargs):
+		"""
+		Renvoie les fichiers XML de test, ouverts, dans l'ordre de
+		ImportBee.fichiers() complété par la nomenclature des colles.
+		Le contenu du fichier Structures peut être remplacé par
+		structures.
+		"""
+		return [io.BytesIO(xml_sts_bee()),
+			io.BytesIO(xml_nomenclatures_bee()),
+			io.BytesIO(structures or xml_structures_bee()),
+			io.BytesIO(xml_eleves_bee(**kwargs)),
+			open(bee.NOMENCLATURE_COLLES, 'rb')]
+
+	def lecteur(self, *supplements, **kwargs):
+		fichiers = self.fichiers(**kwargs)
+		try:
+			return bee.BEEImporter(*fichiers, *supplements)
+		finally:
+			fichiers[-1].close()
+
+	def importer(self, *supplements, forcer=False, **kwargs):
+		importer = self.lecteur(*supplements, **kwargs)
+		importer.full_import(forcer=forcer)
+		return importer
+
+class BEELectureTests(BEETestCase):
+	def test_import_complet(self):
+		self.importer()
+
+		# Le libellé lu dans STS l'emporte sur celui de Structures.
+		self.assertEqual(sorted(Classe.objects.values_list(
+			'code_structure', 'nom', 'mef__code_mef')),
+			[("MP1", "MP1", "30111018210"),
+				("PC2", "PC2", "30111032220")])
+		gmp = Groupe.objects.get(code_structure="GMP")
+		self.assertEqual(sorted(gmp.groupeeffectif_set.values_list(
+			'classe__code_structure', flat=True)), ["MP1", "PC2"])
+
+		self.assertEqual(sorted(Etudiant.objects.values_list(
+			'numero_siecle', 'classe__code_structure', 'ine')),
+			[('1000', "MP1", "INE1000"), ('1001', "PC2", "INE1001"),
+				('1002', "MP1", "INE1002"), ('1003', "PC2", "INE1003")])
+		self.assertEqual(sorted(OptionEtudiant.objects.values_list(
+			'etudiant__numero_siecle', 'matiere__code_matiere')),
+			[('1000', "030201"), ('1002', "030201")])
+
+		# Seuls les cours généraux des classes de CPGE donnent un
+		# service. Le service du groupe GMP est rattaché à chacune de
+		# ses classes.
+		self.assertEqual(sorted(Service.objects.values_list(
+			'enseignement__classe__code_structure',
+			'enseignement__groupe__code_structure',
+			'enseignement__matiere__code_matiere',
+			'professeur__last_name')),
+			[("MP1", "GMP", "030201", "Petit"),
+				("MP1", "MP1", "030201", "Petit"),
+				("MP1", "MP1", "061300", "Dupont"),
+				("MP1", "MP1", "065700", "Martin"),
+				("PC2", "GMP", "030201", "Petit"),
+				("PC2", "PC2", "030201", "Petit"),
+				("PC2", "PC2", "061300", "Durand")])
+
+	def test_fichier_zip(self):
+		contenu = io.BytesIO()
+		with zipfile.ZipFile(contenu, 'w') as fzip:
+			fzip.writestr('ElevesSansAdresses.xml', xml_eleves_bee())
+		contenu.seek(0)
+
+		importer = bee.BEEImporter(bee.ouvrir_fichier_bee(contenu))
+		self.assertEqual(importer.eleves.parametres['annee'], '2026')
+		self.assertEqual(sorted(eleve.elenoet for eleve in
+			importer.eleves['eleves']),
+			['1000', '1001', '1002', '1003', '1004'])
+
+		xml = io.BytesIO(xml_eleves_bee())
+		self.assertIs(bee.ouvrir_fichier_bee(xml), xml)
+
+	def test_type_inconnu(self):
+		with self.assertRaises(ValueError) as erreur:
+			bee.BEEImporter(io.BytesIO(b'<AUTRE/>'))
+		self.assertEqual(erreur.exception.args[0], 'type-inconnu')
+
+		with self.assertRaises(ValueError) as erreur:
+			bee.BEEImporter(io.BytesIO(b'<BEE_ELEVES>'))
+		self.assertEqual(erreur.exception.args[0], 'xml-invalide')
+
+class BEEMiseAJourTests(BEETestCase):
+	def test_second_import_sans_ecriture(self):
+		self.importer()
+
+		importer = self.lecteur()
+		for etape, _ in ETAPES_IMPORT_BEE:
+			with CaptureQueriesContext(connection) as requetes:
+				importer.executer_etape(etape, forcer=True)
+			if etape not in ('import_professeurs', 'import_services',
+					'import_etudiants'):
+				continue
+			ecritures = [requete['sql'] for requete in requetes
+				if requete['sql'].split()[0] in ('INSERT', 'UPDATE',
+					'DELETE')]
+			self.assertEqual(ecritures, [], etape)
+
+	def test_changement_classe(self):
+		self.importer()
+		mp1 = Classe.objects.get(code_structure="MP1")
+		pc2 = Classe.objects.get(code_structure="PC2")
+
+		self.importer(classes={'1000': "PC2", '1001': "PC2",
+			'1002': "MP1", '1003': "PC2", '1004': "2NDE1"})
+
+		etudiant = Etudiant.objects.get(numero_siecle='1000')
+		self.assertEqual(etudiant.classe, pc2)
+		self.assertEqual(sorted(mp1.etudiants.values_list(
+			'numero_siecle', flat=True)), ['1002'])
+		self.assertEqual(sorted(pc2.etudiants.values_list(
+			'numero_siecle', flat=True)), ['1000', '1001', '1003'])
+		self.assertEqual(Groupe.etudiants.through.objects.filter(
+			etudiant=etudiant, groupe__in=(mp1, pc2)).count(), 1)
+
+class BEEImportTacheTests(BEETestCase):
+	def envois(self, **kwargs):
+		"""
+		Fichiers envoyés au formulaire, indexés par champ de ImportBee.
+		"""
+		return {
+			'fichier_sts': SimpleUploadedFile('sts.xml', xml_sts_bee()),
+			'fichier_nomenclatures': SimpleUploadedFile(
+				'nomenclatures.xml', xml_nomenclatures_bee()),
+			'fichier_structures': SimpleUploadedFile('structures.xml',
+				xml_structures_bee()),
+			'fichier_eleves': SimpleUploadedFile('eleves.xml',
+				xml_eleves_bee(**kwargs)),
+		}
+
+	def lancer(self, forcer=False, **kwargs):
+		import_bee = bee.lancer_import(None, self.envois(**kwargs),
+				forcer=forcer)
+		for fichier in import_bee.fichiers():
+			self.addCleanup(fichier.delete, save=False)
+		return import_bee
+
+	def test_formulaire(self):
+		archive = io.BytesIO()
+		with zipfile.ZipFile(archive, 'w') as fzip:
+			fzip.writestr('eleves.xml', xml_eleves_bee())
+
+		form = ImportBEEForm({}, {
+			'eleves': SimpleUploadedFile('eleves.zip', archive.getvalue()),
+			'stsemp': SimpleUploadedFile('sts.xml', xml_sts_bee()),
+		})
+		self.assertTrue(form.is_valid(), form.errors)
+		self.assertEqual(form.cleaned_data['eleves'].read(),
+			archive.getvalue())
+
+		form = ImportBEEForm({}, {
+			'eleves': SimpleUploadedFile('eleves.xml',
+				xml_structures_bee()),
+			'structure': SimpleUploadedFile('structures.xml',
+				xml_structures_bee()[:-20]),
+			'nomenclature': SimpleUploadedFile('texte.xml', b'texte'),
+		})
+		self.assertFalse(form.is_valid())
+		self.assertTrue(form.has_error('eleves', 'type-inconnu'))
+		self.assertTrue(form.has_error('structure', 'xml-invalide'))
+		self.assertTrue(form.has_error('nomenclature', 'xml-invalide'))
+
+	def test_vue_fichier_invalide(self):
+		direction = User.objects.create(email="direction@example.org")
+		direction.user_permissions.add(Permission.objects.get(
+			codename='direction'))
+		self.client.force_login(direction)
+
+		reponse = self.client.post(reverse('import_bee'), {
+			'eleves': SimpleUploadedFile('eleves.xml', b'<BEE_ELEVES>'),
+		})
+		self.assertEqual(reponse.status_code, 200)
+		self.assertTrue(reponse.context['form'].has_error('eleves'))
+		self.assertFalse(ImportBee.objects.exists())
+
+	def test_reprise_etape_en_erreur(self):
+		import_bee = self.lancer()
+		with mock.patch.object(bee.BEEImporter, 'import_groupes',
+				side_effect=RuntimeError("panne")):
+			import_bee = bee.executer_import(import_bee.pk)
+
+		self.assertEqual(import_bee.etat, ImportBee.ETAT_ERREUR)
+		self.assertEqual(import_bee.etape, 'import_groupes')
+		self.assertEqual(import_bee.erreur, "panne")
+		etapes = [etape for etape, _ in ETAPES_IMPORT_BEE]
+		terminees = etapes[:etapes.index('import_groupes')]
+		self.assertEqual(sorted(import_bee.etapes.values_list('etape',
+			flat=True)), sorted(terminees))
+		self.assertFalse(Groupe.objects.filter(
+			code_structure="GMP").exists())
+
+		# Les étapes terminées ne sont pas exécutées de nouveau.
+		with mock.patch.multiple(bee.BEEImporter, **{etape:
+				mock.DEFAULT for etape in terminees}) as deja_faites:
+			import_bee = bee.executer_import(import_bee.pk)
+		self.assertEqual(import_bee.etat, ImportBee.ETAT_TERMINE,
+			import_bee.erreur)
+		for etape in terminees:
+			deja_faites[etape].assert_not_called()
+
+		self.assertEqual(import_bee.etapes.count(), len(etapes))
+		self.assertTrue(Groupe.objects.filter(
+			code_structure="GMP").exists())
+		self.assertEqual(Etudiant.objects.count(), 4)
+		self.assertEqual(Service.objects.count(), 7)
+
+class BEEEtapesTests(BEETestCase):
+	# Étapes toujours exécutées, quels que soient les fichiers
+	toujours = {'import_etablissement', 'import_annee', 'log_imports'}
+
+	def setUp(self):
+		super().setUp()
+		self.importer()
+
+	def test_import_inchange(self):
+		importer = self.importer()
+		self.assertEqual(importer.etapes_executees, self.toujours)
+
+	def test_eleves_modifies(self):
+		importer = self.importer(classes={'1000': "PC2", '1001': "PC2",
+			'1002': "MP1", '1003': "PC2", '1004': "2NDE1"})
+		self.assertEqual(importer.etapes_executees, self.toujours | {
+			'import_etudiants', 'import_options_etudiants'})
+		self.assertEqual(Etudiant.objects.get(
+			numero_siecle='1000').classe.code_structure, "PC2")
+
+	def test_forcer(self):
+		importer = self.importer(forcer=True)
+		self.assertEqual(importer.etapes_executees,
+			set(etape for etape, _ in ETAPES_IMPORT_BEE))
+
+	def test_propagation_dependances(self):
+		# Le fichier Structures n'est lu que par import_divisions, mais
+		# les étapes qui en dépendent, directement ou non, sont aussi
+		# exécutées.
+		importer = self.importer(structures=xml_structures_bee().replace(
+			b"MPSI 1", b"MPSI un"))
+		self.assertEqual(importer.etapes_executees, self.toujours | {
+			'import_divisions', 'import_groupes', 'import_services',
+			'import_etudiants', 'import_options_etudiants',
+			'import_colles'})
+
+		importer = self.lecteur()
+		importer.executer_etape('import_etablissement')
+		importer.executer_etape('import_annee')
+		importer.etapes_executees = {'import_mefs'}
+		self.assertTrue(importer.etape_necessaire('import_programmes'))
+		self.assertFalse(importer.etape_necessaire('import_professeurs'))
+
+	def test_edt_sts_toujours_importe(self):
+		edt_sts = io.BytesIO("""<?xml version="1.0" encoding="UTF-8"?>
+<EDT_STS>
+<PARAMETRES><UAJ>0021593W</UAJ><ANNEE_SCOLAIRE>2026</ANNEE_SCOLAIRE>
+	</PARAMETRES>
+<DONNEES><STRUCTURE><DIVISIONS>
+	<DIVISION CODE="MP1"><SERVICES>
+		<SERVICE CODE_MATIERE="061300" CODE_MOD_COURS="CG">
+		<ENSEIGNANTS><ENSEIGNANT ID="101"/></ENSEIGNANTS></SERVICE>
+	</SERVICES></DIVISION>
+</DIVISIONS></STRUCTURE></DONNEES>
+</EDT_STS>
+""".encode())
+		importer = self.importer(edt_sts)
+		self.assertEqual(importer.etapes_executees, self.toujours | {
+			'import_groupes', 'import_services', 'import_colles'})
+
+		edt_sts.seek(0)
+		importer = self.importer(edt_sts)
+		self.assertEqual(importer.etapes_executees, self.toujours | {
+			'import_groupes', 'import_services', 'import_colles'})
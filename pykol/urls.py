@@ -51,6 +51,7 @@ colloscopes_urlpatterns = [
 
 direction_urlpatterns = [
 	path('import_bee/', views.direction.import_bee, name='import_bee'),
+	path('import_bee/<int:pk>/reprendre/', views.direction.import_bee_reprendre, name='import_bee_reprendre'),
 	path('import_colleurs/', views.direction.import_colleurs_odf, name='import_colleurs'),
 	path('creneaux/', views.direction.creneau_list, name='creneau_list_direction'),
 	path('reservations_ponctuelles/', views.direction.reservations_ponctuelles, name='reservations_ponctuelles'),
@@ -107,6 +108,8 @@ ects_urlpatterns = [
 	path('<int:pk>/resultat/', views.ects.jury_toutes_attestations_resultats, name='ects_jury_resultat'),
 	path('<int:pk>/resultat/<int:etu_pk>/', views.ects.jury_attestation_etudiant, name='ects_jury_attestation_etudiant'),
 	path('<int:pk>/attestation/', views.ects.jury_toutes_attestations_parcours, name='ects_jury_attestation'),
+	path('<int:pk>/lot/<int:type_attestation>/generer/', views.ects.jury_lot_generer, name='ects_jury_lot_generer'),
+	path('<int:pk>/lot/<int:lot_pk>/', views.ects.jury_lot_telecharger, name='ects_jury_lot_telecharger'),
 	path('<int:pk>/detail/<int:etu_pk>/', views.ects.jury_detail_etudiant, name='ects_jury_detail_etudiant'),
 	path('<int:pk>/retirer_etudiant/<int:etu_pk>/', views.ects.jury_retirer_etudiant, name='ects_jury_retirer_etudiant'),
 	path('charger_grilles/', views.ects.grilles_charger, name='ects_grilles_charger'),
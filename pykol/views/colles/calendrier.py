@@ -16,79 +16,221 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+"""
+Flux iCalendar des colles d'un colleur ou d'un étudiant.
+
+Les clients de calendrier interrogent ce flux très fréquemment. Pour
+leur éviter de télécharger un flux inchangé, la réponse porte un ETag
+et une date de dernière modification, calculés à partir d'une version
+propre à chaque utilisateur, conservée dans le cache et invalidée par
+les signaux dès que l'une de ses colles change. Les blocs VEVENT sont
+par ailleurs conservés dans le cache de Django, sous une clé formée de
+la clé primaire de la colle et de sa propre version.
+
+Le flux est restreint aux colles comprises entre les dates données par
+les paramètres debut et fin (au format AAAA-MM-JJ). Par défaut, il
+commence au début de l'année scolaire en cours.
+"""
+
+from datetime import timedelta
+import hashlib
+
 from zoneinfo import ZoneInfo
 import vobject
 
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date, quote_etag
 
-from pykol.models.base import Etudiant
+from pykol.models.base import Annee
 from pykol.models.colles import Colle
 from pykol.models.base import JetonAcces
+from pykol.lib.cache import cle_cache, version, versions, TOUS
+
+# Durée maximale de conservation d'un événement dans le cache, en
+# secondes
+DUREE_CACHE = 7 * 24 * 3600
+
+def fenetre(request):
+	"""
+	Renvoie le couple (debut, fin) des dates des colles à inclure dans
+	le flux. La date de fin vaut None lorsqu'elle n'est pas limitée.
+
+	Lève une ValueError si l'une des dates est mal formée.
+	"""
+	debut = request.GET.get('debut')
+	if debut:
+		debut = parse_date(debut)
+		if debut is None:
+			raise ValueError("date de début invalide")
+	else:
+		annee = Annee.objects.get_actuelle()
+		debut = annee.debut if annee is not None else \
+			timezone.localdate() - timedelta(days=365)
+
+	fin = request.GET.get('fin')
+	if fin:
+		fin = parse_date(fin)
+		if fin is None:
+			raise ValueError("date de fin invalide")
+	else:
+		fin = None
+
+	return debut, fin
+
+def marqueur_modification(jeton, *parametres):
+	"""
+	Renvoie le couple (etag, date de dernière modification) du flux.
+
+	L'ETag résume la version des colles du propriétaire du jeton, la
+	version commune des flux, qui change avec les noms affichés dans
+	les événements, et les paramètres de la requête. Aucune requête sur
+	les colles n'est donc nécessaire. La date de modification est celle
+	à laquelle cet ETag a été observé pour la première fois.
+	"""
+	etag = hashlib.sha1(repr((
+		version('calendrier_utilisateur', jeton.owner_id),
+		version('calendrier', TOUS), parametres)).encode('utf-8')
+		).hexdigest()
+
+	cle = cle_cache('calendrier', 'modification', jeton.pk)
+	marqueur = cache.get(cle)
+	if marqueur is None or marqueur[0] != etag:
+		marqueur = (etag, timezone.now().replace(microsecond=0))
+		cache.set(cle, marqueur, DUREE_CACHE)
+	return marqueur
+
+def donnees_evenement(request, colle, professeur):
+	"""
+	Renvoie le tuple des données affichées dans l'événement d'une colle.
+	"""
+	utc_zone = ZoneInfo('UTC')
+	details = colle.details
+	colleur = details.colleur
+
+	if professeur:
+		summary = "Colle en {classe}".format(classe=colle.classe)
+		colleur_cn = str(colleur)
+	else:
+		summary = "Colle de {matiere}".format(matiere=colle.matiere)
+		colleur_cn = str(colleur.short_name_civilite())
+
+	if colle.etat == Colle.ETAT_BROUILLON:
+		status = 'TENTATIVE'
+	elif colle.etat == Colle.ETAT_ANNULEE:
+		status = 'CANCELLED'
+	else:
+		status = 'CONFIRMED'
+
+	etudiants = tuple((str(etudiant),
+		'MAILTO:{email}'.format(email=etudiant.email)
+		if etudiant.email else
+		request.build_absolute_uri(etudiant.get_absolute_url()))
+		for etudiant in details.eleves.all())
+
+	return ('colle-{pk}@{host}'.format(pk=colle.pk,
+			host=request.get_host()),
+		summary,
+		details.horaire.astimezone(utc_zone),
+		(details.horaire + colle.duree).astimezone(utc_zone),
+		details.salle,
+		status,
+		colleur_cn,
+		'MAILTO:{email}'.format(email=colleur.email),
+		etudiants)
+
+def vevent(donnees):
+	"""
+	Produit le bloc VEVENT correspondant aux données d'un événement.
+	"""
+	uid, summary, dtstart, dtend, location, status, colleur_cn, \
+		colleur_uri, etudiants = donnees
+
+	vevent = vobject.iCalendar().add('vevent')
+	vevent.add('uid').value = uid
+	vevent.add('summary').value = summary
+	vevent.add('dtstart').value = dtstart
+	vevent.add('dtend').value = dtend
+	vevent.add('location').value = location
+	vevent.add('status').value = status
+
+	prof_att = vevent.add('attendee')
+	prof_att.role_param = 'CHAIR'
+	prof_att.cn_param = colleur_cn
+	prof_att.value = colleur_uri
+	prof_att.partstat_param = 'ACCEPTED'
+
+	for cn, uri in etudiants:
+		att = vevent.add('attendee')
+		att.role_param = 'REQ-PARTICIPANT'
+		att.cn_param = cn
+		att.partstat_param = 'ACCEPTED'
+		att.value = uri
+
+	return vevent.serialize()
 
 def calendrier(request, uuid):
 	jeton = get_object_or_404(JetonAcces, uuid=uuid, scope='colles_icalendar')
 	utilisateur = jeton.owner
 
-	cal = vobject.iCalendar()
-	utc_zone = ZoneInfo('UTC')
+	try:
+		debut, fin = fenetre(request)
+	except ValueError as e:
+		return HttpResponseBadRequest(str(e))
 
 	if hasattr(jeton.owner, 'professeur'):
-		colles = Colle.objects.filter(colledetails__actif=True,
-			colledetails__colleur=utilisateur)
+		colles = Colle.objects.filter(detail_actif__colleur=utilisateur)
 		professeur = True
 	elif hasattr(jeton.owner, 'etudiant'):
-		colles = Colle.objects.filter(colledetails__actif=True,
-			colledetails__eleves=utilisateur)
+		colles = Colle.objects.filter(detail_actif__eleves=utilisateur)
 		professeur = False
 	else:
 		colles = Colle.objects.none()
 		professeur = False
 
-	for colle in colles:
-		vevent = cal.add('vevent')
-		vevent.add('uid').value = 'colle-{pk}@{host}'.format(
-				pk=colle.pk, host=request.get_host())
-
-		if professeur:
-			vevent.add('summary').value = \
-				"Colle en {classe}".format(classe=colle.classe)
-		else:
-			vevent.add('summary').value = \
-				"Colle de {matiere}".format(matiere=colle.matiere)
-
-		vevent.add('dtstart').value = colle.details.horaire.astimezone(utc_zone)
-		vevent.add('dtend').value   = (colle.details.horaire + colle.duree).astimezone(utc_zone)
-		vevent.add('location').value = colle.details.salle
-		if colle.etat == Colle.ETAT_BROUILLON:
-			vevent.add('status').value = 'TENTATIVE'
-		elif colle.etat == Colle.ETAT_ANNULEE:
-			vevent.add('status').value = 'CANCELLED'
-		else:
-			vevent.add('status').value = 'CONFIRMED'
-
-		prof_att = vevent.add('attendee')
-		prof_att.role_param = 'CHAIR'
-
-		if professeur:
-			prof_att.cn_param = str(colle.colleur)
-		else:
-			prof_att.cn_param = str(colle.colleur.short_name_civilite())
-
-		prof_att.value = 'MAILTO:{email}'.format(email=colle.colleur.email)
-		prof_att.partstat_param = 'ACCEPTED'
-
-		for etudiant in colle.details.eleves.all():
-			att = vevent.add('attendee')
-			att.role_param = 'REQ-PARTICIPANT'
-			att.cn_param = str(etudiant)
-			att.partstat_param = 'ACCEPTED'
-			if etudiant.email:
-				att.value = 'MAILTO:{email}'.format(email=etudiant.email)
-			else:
-				att.value = request.build_absolute_uri(etudiant.get_absolute_url())
-
-	response = HttpResponse(cal.serialize(),
-			content_type='text/calendar')
+	colles = colles.filter(detail_actif__horaire__date__gte=debut)
+	if fin is not None:
+		colles = colles.filter(detail_actif__horaire__date__lte=fin)
+
+	etag, derniere_modification = marqueur_modification(jeton,
+			professeur, debut, fin, request.scheme, request.get_host())
+	reponse = get_conditional_response(request, etag=quote_etag(etag),
+			last_modified=int(derniere_modification.timestamp()))
+	if reponse is not None:
+		return reponse
+
+	# Les versions sont lues avant le contenu des colles, afin qu'un
+	# événement produit à partir de données modifiées entre temps ne
+	# soit pas conservé sous la nouvelle version. Une colle supprimée
+	# entre les deux lectures est omise.
+	colles_pks = list(colles.order_by('pk').values_list('pk', flat=True))
+	numeros = versions('calendrier_colle', colles_pks)
+	commun = version('calendrier', TOUS)
+	cles = {pk: cle_cache('calendrier', 'vevent', pk, numeros[pk], commun,
+		professeur, request.scheme, request.get_host())
+		for pk in colles_pks}
+
+	# Seuls les événements absents du cache sont produits
+	en_cache = cache.get_many(cles.values())
+	manquantes = [pk for pk, cle in cles.items() if cle not in en_cache]
+	if manquantes:
+		nouveaux = {cles[colle.pk]: vevent(donnees_evenement(request,
+				colle, professeur))
+			for colle in colles.filter(pk__in=manquantes).with_details()}
+		cache.set_many(nouveaux, DUREE_CACHE)
+		en_cache.update(nouveaux)
+
+	entete, pied = vobject.iCalendar().serialize().split('END:VCALENDAR')
+	contenu = ''.join([entete] + [en_cache[cles[pk]] for pk in colles_pks
+		if cles[pk] in en_cache] + ['END:VCALENDAR', pied])
+
+	response = HttpResponse(contenu, content_type='text/calendar')
 	response['Content-Disposition'] = 'attachment; filename="planning.ics"'
+	response['ETag'] = quote_etag(etag)
+	response['Last-Modified'] = http_date(
+		derniere_modification.timestamp())
 	return response
@@ -216,10 +216,10 @@ class ProfesseurColleListView(LoginRequiredMixin, generic.ListView):
 	template_name = 'pykol/colles/colle_list_passe.html'
 
 	def get_queryset(self):
-		return Colle.objects.filter(
-			colledetails__colleur=self.request.user,
-			colledetails__actif=True).order_by('colledetails__horaire').annotate(
-				a_noter=Func(F('colledetails__horaire'),
+		return Colle.objects.with_details().filter(
+			detail_actif__colleur=self.request.user).order_by(
+				'detail_actif__horaire').annotate(
+				a_noter=Func(F('detail_actif__horaire'),
 					timezone.localtime(), arity=2, arg_joiner='<',
 					function='')
 				)
@@ -233,8 +233,8 @@ class ProfesseurColleListView(LoginRequiredMixin, generic.ListView):
 		# de page.
 		limite_futur = timezone.localtime() - timedelta(days=3)
 		colle_list = self.get_queryset()
-		context['colles_futures'] = colle_list.filter(colledetails__actif=True, colledetails__horaire__gte=limite_futur)
-		context['colles_passees'] = colle_list.filter(colledetails__actif=True, colledetails__horaire__lt=limite_futur)
+		context['colles_futures'] = colle_list.filter(detail_actif__horaire__gte=limite_futur)
+		context['colles_passees'] = colle_list.filter(detail_actif__horaire__lt=limite_futur)
 
 		# Ajout d'un lien vers la version iCalendar du planning des
 		# colles. Si nécessaire, on crée automatiquement le jeton
@@ -258,20 +258,20 @@ class EtudiantColleListView(LoginRequiredMixin, generic.ListView):
 	template_name = 'pykol/colles/colle_list_passe_etudiant.html'
 
 	def get_queryset(self):
-		return Colle.objects.filter(
-			colledetails__eleves=self.request.user,
-			colledetails__actif=True).order_by('colledetails__horaire')
+		return Colle.objects.with_details().filter(
+			detail_actif__eleves=self.request.user).order_by(
+				'detail_actif__horaire')
 
 	def get_limite_futur(self):
 		return timezone.localtime() - timedelta(days=3)
 
 	def get_queryset_futures(self):
-		return self.get_queryset().filter(colledetails__actif=True,
-				colledetails__horaire__gte=self.get_limite_futur())
+		return self.get_queryset().filter(
+				detail_actif__horaire__gte=self.get_limite_futur())
 
 	def get_queryset_passees(self):
-		return self.get_queryset().filter(colledetails__actif=True,
-				colledetails__horaire__lt=self.get_limite_futur())
+		return self.get_queryset().filter(
+				detail_actif__horaire__lt=self.get_limite_futur())
 
 	def get_context_data(self, **kwargs):
 		context = super().get_context_data(**kwargs)
@@ -316,8 +316,7 @@ class ColleANoterListView(ProfesseurColleListView):
 
 	def get_queryset(self):
 		return super().get_queryset().filter(etat=Colle.ETAT_PREVUE,
-				colledetails__horaire__lte=timezone.localtime(),
-				colledetails__actif=True,
+				detail_actif__horaire__lte=timezone.localtime(),
 				classe__annee=Annee.objects.get_actuelle())
 
 	def get_context_data(self, **kwargs):
@@ -83,9 +83,8 @@ class CalendrierMatiereColleurView(PermissionColloscopeMixin,
 
 	def get_initial(self):
 		initial = []
-		for colle in Colle.objects.filter(
-				colledetails__actif=True,
-				colledetails__colleur=self.get_object(),
+		for colle in Colle.objects.with_details().filter(
+				detail_actif__colleur=self.get_object(),
 				enseignement=self.get_enseignement()).order_by('pk'):
 			initial.append({
 				'colle': colle.pk,
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from .import_bee import import_bee
+from .import_bee import import_bee, import_bee_reprendre
 from .annee import *
 from .releve import *
 from .permissions import *
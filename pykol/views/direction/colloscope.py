@@ -20,81 +20,61 @@ from django.contrib.auth.decorators import login_required, permission_required
 from django.shortcuts import render
 from django.views.generic.base import View
 
-from odf.opendocument import OpenDocumentSpreadsheet
-from odf.table import Table, TableColumn, TableRow, TableCell, \
-		CoveredTableCell, TableHeaderRows
-from odf.text import P
 from odf.style import Style, TableColumnProperties, TextProperties
 
 from pykol.models.base import Annee
 from pykol.models.colles import Creneau
 from pykol.forms.colloscope import CreneauSalleFormSet
-from pykol.views.generic import OdfResponse
+from pykol.lib.odftools import StreamingSpreadsheet, StreamingTable, \
+		Column, Cell
+from pykol.views.generic import StreamingOdfResponse
 
 class CreneauOdfView(View):
 	"""
 	Liste de créneaux de colles au format OpenDocument
 	"""
 	def get(self, request, queryset, annee=None):
-		creneaux_ods = OpenDocumentSpreadsheet()
+		creneaux_ods = StreamingSpreadsheet()
 
 		# Styles
-		style_entete = Style(parent=creneaux_ods.automaticstyles,
-				name='cell_entete', family='table-cell')
+		style_entete = creneaux_ods.add_style(Style(name='cell_entete',
+			family='table-cell'))
 		TextProperties(parent=style_entete, fontweight='bold')
-		style_col_colleur = Style(parent=creneaux_ods.automaticstyles,
-				name='col_colleur', family='table-column')
+		style_col_colleur = creneaux_ods.add_style(Style(name='col_colleur',
+			family='table-column'))
 		TableColumnProperties(parent=style_col_colleur, columnwidth='5cm')
-		style_col_matiere = Style(parent=creneaux_ods.automaticstyles,
-				name='col_matiere', family='table-column')
+		style_col_matiere = creneaux_ods.add_style(Style(name='col_matiere',
+			family='table-column'))
 		TableColumnProperties(parent=style_col_matiere, columnwidth='5cm')
-		style_col_standard = Style(parent=creneaux_ods.automaticstyles,
-				name='col_standard', family='table-column')
+		style_col_standard = creneaux_ods.add_style(Style(name='col_standard',
+			family='table-column'))
 		TableColumnProperties(parent=style_col_standard, columnwidth='2cm')
 
-		table = Table(name="Créneaux de colles",
-				parent=creneaux_ods.spreadsheet)
-
 		# Définition des colonnes
-		table.addElement(TableColumn(stylename=style_col_colleur)) # Colleur
-		table.addElement(TableColumn(stylename=style_col_standard)) # Classe
-		table.addElement(TableColumn(stylename=style_col_matiere)) # Matière
-		table.addElement(TableColumn(stylename=style_col_standard)) # Jour
-		table.addElement(TableColumn(stylename=style_col_standard)) # Début
-		table.addElement(TableColumn(stylename=style_col_standard)) # Fin
-		table.addElement(TableColumn(stylename=style_col_standard)) # Salle
-
-		# En-tête de tableau
-		# Container pour les lignes d'en-tête
-		th = TableHeaderRows(parent=table)
+		colonnes = (
+			Column(style_col_colleur), # Colleur
+			Column(style_col_standard), # Classe
+			Column(style_col_matiere), # Matière
+			Column(style_col_standard, repeated=4), # Jour, début, fin, salle
+		)
+
 		# Ligne d'en-tête
-		tr = TableRow(parent=th)
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Colleur")
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Classe")
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Matière")
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Jour")
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Début")
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Fin")
-		P(parent=TableCell(parent=tr, valuetype='string',
-			stylename=style_entete), text="Salle")
-
-		for creneau in queryset:
-			tr = TableRow(parent=table)
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.colleur))
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.classe))
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.matiere))
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.get_jour_display()))
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.debut))
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.fin))
-			P(parent=TableCell(parent=tr, valuetype='string'), text=str(creneau.salle))
-
-		return OdfResponse(creneaux_ods,
+		entete = [Cell(titre, style=style_entete) for titre in
+			("Colleur", "Classe", "Matière", "Jour", "Début", "Fin",
+				"Salle")]
+
+		def lignes():
+			for creneau in queryset.select_related('colleur', 'classe',
+					'enseignement__matiere').iterator():
+				yield [str(creneau.colleur), str(creneau.classe),
+					str(creneau.matiere), str(creneau.get_jour_display()),
+					str(creneau.debut), str(creneau.fin),
+					str(creneau.salle)]
+
+		creneaux_ods.add_table(StreamingTable("Créneaux de colles",
+			columns=colonnes, header_rows=(entete,), rows=lignes()))
+
+		return StreamingOdfResponse(creneaux_ods,
 			filename="creneaux-{annee}.ods".format(annee=annee))
 
 @login_required
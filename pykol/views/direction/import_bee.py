@@ -16,19 +16,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
-
-import zipfile
-
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
-from django.conf import settings
 from django.db.models import Max
+from django.views.decorators.http import require_POST
 
 from pykol.forms.import_bee import ImportBEEForm
-from pykol.models.base import Annee, ImportBeeLog
-from pykol.lib.bee import BEEImporter
+from pykol.models.base import Annee, ImportBeeLog, ImportBee
+from pykol.lib.bee import lancer_import, reprendre_import
+from pykol.lib.taches import marquer_abandonnees
+
+# Champ de ImportBee qui reçoit chacun des fichiers du formulaire
+CHAMPS_FICHIERS = (
+	('stsemp', 'fichier_sts'),
+	('structure', 'fichier_structures'),
+	('nomenclature', 'fichier_nomenclatures'),
+	('eleves', 'fichier_eleves'),
+)
+
+def _import_en_cours():
+	# Un import interrompu (par exemple par le redémarrage du serveur)
+	# est marqué en erreur : il ne bloque plus les nouveaux imports et
+	# peut être repris.
+	marquer_abandonnees(ImportBee.objects.all())
+	return ImportBee.objects.filter(etat__in=(ImportBee.ETAT_ATTENTE,
+		ImportBee.ETAT_EN_COURS)).exists()
 
 @login_required
 @permission_required('pykol.direction')
@@ -36,29 +49,22 @@ def import_bee(request):
 	if request.method == 'POST':
 		form = ImportBEEForm(request.POST, request.FILES)
 		if form.is_valid():
-			xml_list = []
-
-			for fpart in ('stsemp', 'structure', 'nomenclature',
-					'eleves'):
-				if form.cleaned_data[fpart]:
-					try:
-						fzip = zipfile.ZipFile(request.FILES[fpart])
-						fxml_name = fzip.namelist()[0]
-						fxml = fzip.open(fxml_name)
-					except zipfile.BadZipFile:
-						request.FILES[fpart].seek(0)
-						fxml = request.FILES[fpart]
-
-					xml_list.append(fxml)
+			if _import_en_cours():
+				messages.error(request, "Un import est déjà en cours. "
+						"Attendez qu'il soit terminé avant d'en lancer un "
+						"nouveau.")
+				return redirect('import_bee')
 
-			# Import des données des colles
-			nomcolles_file = os.path.join(settings.BASE_DIR, 'pykol/data/NomenclatureColles.xml')
-			xml_list.append(open(nomcolles_file, encoding="utf-8"))
-
-			importer = BEEImporter(*xml_list)
-			importer.full_import()
+			# Les fichiers sont conservés, et l'import (complété par les
+			# données des colles) est réalisé en tâche de fond.
+			lancer_import(request.user, dict(
+				(champ, form.cleaned_data[fpart])
+				for fpart, champ in CHAMPS_FICHIERS
+				if form.cleaned_data[fpart]),
+				forcer=form.cleaned_data['forcer'])
 			messages.success(request,
-					"L'import des données a été effectué avec succès.")
+					"L'import des données a été lancé. Son avancement "
+					"est affiché sur cette page.")
 
 			return redirect('import_bee')
 
@@ -75,9 +81,31 @@ def import_bee(request):
 	for horodatage in horodatages:
 		horodatage['import_fichier'] = bee_types[horodatage['import_type']]
 
+	marquer_abandonnees(ImportBee.objects.all())
+	imports = ImportBee.objects.prefetch_related('etapes')[:5]
+
 	return render(request, 'pykol/import_bee.html', context={
 		'form': form,
 		'annee_scolaire_none': not(Annee.objects.all()),
 		'horodatages': horodatages,
 		'annee': annee_actuelle,
+		'imports': imports,
+		'imports_en_cours': any(i.en_cours() for i in imports),
 	})
+
+@login_required
+@permission_required('pykol.direction')
+@require_POST
+def import_bee_reprendre(request, pk):
+	"""
+	Reprend un import en erreur à partir de l'étape qui a échoué.
+	"""
+	import_bee = get_object_or_404(ImportBee, pk=pk,
+			etat=ImportBee.ETAT_ERREUR)
+	if _import_en_cours():
+		messages.error(request, "Un import est déjà en cours.")
+	else:
+		reprendre_import(import_bee)
+		messages.success(request, "L'import a été relancé à l'étape "
+				"{}.".format(import_bee.get_etape_display()))
+	return redirect('import_bee')
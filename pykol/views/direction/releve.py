@@ -23,6 +23,7 @@ from django.views import generic, View
 from django.contrib.auth.mixins import LoginRequiredMixin, \
 	PermissionRequiredMixin
 from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib import messages
 from django.utils.timezone import localtime
 from django.db import transaction
 from django.db.models import F
@@ -42,17 +43,24 @@ def releve_creer(request):
 	# Création d'un nouveau relevé
 	releve = ColleReleve(date=localtime(),
 			etablissement=Etablissement.objects.get(pk=settings.PYKOL_UAI_DEFAUT))
-	releve.save()
 
-	# On attache à ce relevé toutes les colles qui sont notées mais qui
-	# n'ont pas encore été payées
-	colles_faites = Colle.objects.filter(etat__in=(Colle.ETAT_NOTEE,
-		Colle.ETAT_EFFECTUEE), releve__isnull=True)
+	try:
+		# Le relevé n'est conservé que si toutes les colles ont pu lui
+		# être ajoutées.
+		with transaction.atomic():
+			releve.save()
 
-	for colle in colles_faites:
-		releve.ajout_colle(colle)
-	
-	releve.comptabiliser()
+			# On attache à ce relevé toutes les colles qui sont notées
+			# mais qui n'ont pas encore été payées
+			colles_faites = Colle.objects.filter(etat__in=(Colle.ETAT_NOTEE,
+				Colle.ETAT_EFFECTUEE), releve__isnull=True)
+			releve.ajout_colles(colles_faites)
+
+			releve.comptabiliser()
+	except ValueError as e:
+		messages.error(request, "Le relevé n'a pas pu être créé : "
+				"{}".format(e))
+		return redirect('releve_list')
 
 	# On redirige ensuite vers la vue qui affiche le détail de ce relevé
 	return redirect('releve_detail', pk=releve.pk)
@@ -124,9 +132,10 @@ def releve_prof_detail(request):
 		'releve__date', 'releve', 'taux')
 
 	futures_lignes = {}
-	futures_colles = Colle.objects.filter(etat__in=(Colle.ETAT_NOTEE,
-		Colle.ETAT_EFFECTUEE), releve__isnull=True,
-		colledetails__colleur=request.user, colledetails__actif=True)
+	futures_colles = Colle.objects.with_details().filter(
+		etat__in=(Colle.ETAT_NOTEE, Colle.ETAT_EFFECTUEE),
+		releve__isnull=True, detail_actif__colleur=request.user
+		).prefetch_related('collenote_set')
 	for colle in futures_colles:
 		taux = ColleReleveLigne.taux_colle(colle.classe)
 		ligne = futures_lignes.setdefault(taux, {
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from itertools import islice
+
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, \
@@ -27,12 +29,9 @@ from django.contrib.auth import get_user_model
 from django.db.models import Q
 from django.db.models.functions import Lower
 
-from odf.opendocument import OpenDocumentSpreadsheet, load
-from odf.table import Table, TableColumn, TableRow, TableCell
-
 from pykol.forms.user import FullUserForm, ColleursImportForm
 from pykol.forms.permissions import ColloscopePermFormSet
-from pykol.lib.odftools import tablecell_to_text
+from pykol.lib.odftools import iter_rows
 from pykol.models.base import Professeur
 User = get_user_model()
 
@@ -123,33 +122,23 @@ def import_colleurs_odf(request):
 		form = ColleursImportForm(request.POST, request.FILES)
 
 		if form.is_valid():
-			colleurs_ods = load(request.FILES['colleurs'])
-			table = colleurs_ods.spreadsheet.getElementsByType(Table)[0]
-			lignes = table.getElementsByType(TableRow)
-			for ligne in lignes[1:]:
-				cells = ligne.getElementsByType(TableCell)
-
+			lignes = iter_rows(request.FILES['colleurs'], max_columns=4)
+			for cells in islice(lignes, 1, None):
 				colleur_data = {}
 
-				if tablecell_to_text(cells[0]).strip() == "M.":
+				if cells[0].text.strip() == "M.":
 					colleur_data['sexe'] = Professeur.SEXE_HOMME
 				else:
 					colleur_data['sexe'] = Professeur.SEXE_FEMME
 
-				try:
-					colleur_data['last_name'] = tablecell_to_text(cells[1]).strip().title()
-					colleur_data['first_name'] = tablecell_to_text(cells[2]).strip().title()
-				except:
-					continue
+				colleur_data['last_name'] = cells[1].text.strip().title()
+				colleur_data['first_name'] = cells[2].text.strip().title()
 
 				if not (colleur_data['last_name'] and
 						colleur_data['first_name']):
 					continue
 
-				try:
-					colleur_data['email'] = tablecell_to_text(cells[3]).strip() or None
-				except:
-					colleur_data['email'] = None
+				colleur_data['email'] = cells[3].text.strip() or None
 				colleur_data['corps'] = Professeur.CORPS_AUTRE
 
 				# On ne peut pas utiliser ici
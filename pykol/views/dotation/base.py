@@ -24,6 +24,7 @@ from django.views.generic.detail import DetailView
 from django.views.generic.edit import FormView
 
 from pykol.models.base import Classe
+from pykol.models.comptabilite import CompteSolde
 
 class BaseView(TemplateView):
 	template_name = 'pykol/dotation/base.html'
@@ -41,7 +42,11 @@ class ClasseDetailView(DetailView):
 
 		# Calcul des dotations théoriques pour les classes et des heures
 		# prévues aux colloscopes.
-		colles_ens = classe.collesenseignement_set.all()
+		colles_ens = classe.collesenseignement_set.select_related(
+				'compte_colles')
+		soldes = CompteSolde.objects.soldes_sous_arbres(
+				[ligne.compte_colles for ligne in colles_ens] +
+				[classe.compte_colles], classe.annee)
 		dotations = []
 		total_heures = timedelta()
 		total_heures_colloscopes = timedelta()
@@ -54,14 +59,14 @@ class ClasseDetailView(DetailView):
 				'matiere': ligne,
 				'heures': heures,
 				'heures_colloscope': heures_colloscope,
-				'heures_restantes': ligne.compte_colles.solde(classe.annee)['duree'],
+				'heures_restantes': soldes[ligne.compte_colles_id]['duree'],
 				})
 			total_heures += heures
 			total_heures_colloscopes += heures_colloscope
 
 		context['heures_theoriques'] = total_heures
 		context['heures_utilisees'] = total_heures_colloscopes
-		context['heures_restantes'] = classe.compte_colles.solde(classe.annee)['duree']
+		context['heures_restantes'] = soldes[classe.compte_colles_id]['duree']
 		context['dotations'] = dotations
 
 		return context
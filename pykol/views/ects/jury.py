@@ -18,7 +18,7 @@
 
 from collections import OrderedDict
 
-from django.db.models import Count, Q, Sum, F
+from django.db.models import Count, Q, Sum, F, Min
 from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import login_required, \
 		permission_required
@@ -27,11 +27,12 @@ from django.core.exceptions import PermissionDenied
 from django.forms import modelformset_factory
 from django.views.decorators.http import require_POST
 
-from pykol.models.ects import Jury, Mention
+from pykol.models.ects import Jury, Mention, AttestationsLot, GrilleLigne
 from pykol.models.base import Etudiant, Enseignement, Annee
 from pykol.forms.ects import MentionFormSet, JuryForm, JuryDateForm, \
 		MentionGlobaleForm, JuryTerminerForm
 from pykol.lib.shortcuts import redirect_next
+from pykol.lib.taches import marquer_abandonnees
 
 def jury_list_direction(request):
 	"""
@@ -171,38 +172,62 @@ def jury_detail_direction(request, jury):
 	for mention_form in mention_formset:
 		etudiants[mention_form['etudiant'].initial].mention_globale_form = mention_form
 
+	# Dernier lot d'attestations produit pour chaque type, afin
+	# d'afficher l'avancement des lots en cours. Les lots interrompus
+	# sont d'abord marqués en erreur pour pouvoir être relancés.
+	marquer_abandonnees(jury.lots_attestations.all())
+	lots = [(type_attestation, libelle,
+		jury.lots_attestations.filter(
+			type_attestation=type_attestation).first())
+		for type_attestation, libelle in AttestationsLot.TYPE_CHOICES]
+
 	return render(request, 'pykol/ects/jury_detail_direction.html',
 		context={
 			'form': form,
 			'jury': jury,
 			'etudiants': etudiants.values(),
 			'mention_formset': mention_formset,
+			'lots': lots,
+			'lots_en_cours': any(lot is not None and lot.en_cours()
+				for _, _, lot in lots),
 		})
 
 def jury_saisie_mentions(request, jury, mention_qs):
+	# Toutes les mentions sont chargées en une seule requête, avec leur
+	# étudiant, leur enseignement et la clé de leur première ligne de
+	# grille (celle que renverrait grille_lignes.first()).
+	mentions = list(mention_qs.select_related('etudiant',
+		'enseignement__matiere').annotate(
+			premiere_ligne_pk=Min('grille_lignes__pk')).order_by('pk'))
+	lignes = GrilleLigne.objects.in_bulk({mention.premiere_ligne_pk
+		for mention in mentions if mention.premiere_ligne_pk is not None})
+	for mention in mentions:
+		mention.premiere_ligne = lignes.get(mention.premiere_ligne_pk)
+
 	if request.method == 'POST' and jury.etat != Jury.ETAT_TERMINE:
 		formset = MentionFormSet(request.POST, instance=jury,
-				queryset=mention_qs)
+				queryset=mention_qs, mentions=mentions)
 		if formset.is_valid():
-			formset.save()
+			formset.save(commit=False)
+			Mention.objects.bulk_update([mention
+				for mention, _ in formset.changed_objects], ['mention'])
 			return redirect('ects_jury_detail', jury.pk)
 	else:
 		formset = MentionFormSet(instance=jury,
-			queryset=mention_qs)
+			queryset=mention_qs, mentions=mentions)
 
 	# On réarrange le formset pour présenter un étudiant par ligne, une
 	# matière par colonne.
 	enseignements = set()
-	for mention in mention_qs:
-		enseignements.add((mention.enseignement,
-			mention.grille_lignes.first()))
+	for mention in mentions:
+		enseignements.add((mention.enseignement, mention.premiere_ligne))
 	enseignements = sorted(enseignements,
 		key=lambda x: (x[0].periode,
 			-x[1].credits if x[1] is not None else 0,
 			x[0].pk))
 
-	etudiants = Etudiant.objects.filter(
-		mention__in=mention_qs).order_by('last_name', 'first_name')
+	etudiants = sorted({mention.etudiant for mention in mentions},
+		key=lambda etudiant: (etudiant.last_name, etudiant.first_name))
 
 	formsettab = OrderedDict()
 	for etudiant in etudiants:
@@ -212,7 +237,7 @@ def jury_saisie_mentions(request, jury, mention_qs):
 	for form in formset:
 		try:
 			formsettab[form.instance.etudiant][(form.instance.enseignement,
-				form.instance.grille_lignes.first())] = form
+				form.instance.premiere_ligne)] = form
 		except:
 			pass
 	formsettab.management_form = formset.management_form
@@ -19,7 +19,7 @@
 import io
 from django.views.generic.base import ContextMixin
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
 from pykol.models.comptabilite import CompteDecouvert
 
@@ -53,3 +53,15 @@ class OdfResponse(HttpResponse):
 		super().__init__(**kwargs)
 		if self.filename is not None:
 			self['Content-Disposition'] = 'attachment; filename="{}"'.format(self.filename)
+
+class StreamingOdfResponse(StreamingHttpResponse):
+	"""
+	Réponse qui envoie par morceaux un classeur OpenDocument écrit en
+	flux (voir pykol.lib.odftools.StreamingSpreadsheet).
+	"""
+	def __init__(self, spreadsheet, **kwargs):
+		self.filename = kwargs.pop('filename', None)
+		kwargs.setdefault('content_type', spreadsheet.mimetype)
+		super().__init__(streaming_content=spreadsheet, **kwargs)
+		if self.filename is not None:
+			self['Content-Disposition'] = 'attachment; filename="{}"'.format(self.filename)